@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Benchmarks the write throughput of the content-defined chunking adapter
+
+Times finding the chunk boundaries of random data on its own, then writing
+the given number of values directly to an in-memory datastore and through
+the chunking adapter, once one after another and once concurrently. Since
+the boundaries are found in pure Python while holding the GIL, writing
+concurrently is expected to be no faster than writing sequentially.
+
+Usage: PYTHONPATH=. python benchmarks/chunk_throughput.py [values=8] [MiB/value=16]
+"""
+import os
+import sys
+import time
+
+import trio
+
+import datastore
+import datastore.adapter.chunk
+from datastore.adapter.chunk import _find_cut
+
+
+def find_cuts(data: bytearray, adapter: datastore.adapter.chunk.BinaryAdapter) -> float:
+	start = time.perf_counter()
+	offset = 0
+	while offset < len(data):
+		offset += _find_cut(data[offset:(offset + adapter.max_size)],
+		                    adapter.min_size, adapter.max_size, adapter._mask)
+	return time.perf_counter() - start
+
+
+async def put_all(store: datastore.abc.BinaryDatastore, prefix: str,
+                  values: list, concurrent: bool) -> float:
+	start = time.perf_counter()
+	async with trio.open_nursery() as nursery:
+		for idx, value in enumerate(values):
+			key = datastore.Key(f"/{prefix}/{idx}")
+			if concurrent:
+				nursery.start_soon(store.put, key, value)
+			else:
+				await store.put(key, value)
+	return time.perf_counter() - start
+
+
+async def main(count: int, size_mib: int) -> None:
+	# Every value is different, so that no chunk is deduplicated
+	values = [os.urandom(size_mib * 1024 * 1024) for _ in range(count)]
+	total_mib = count * size_mib
+	
+	async with datastore.BinaryDictDatastore() as store, \
+	           datastore.adapter.chunk.BinaryAdapter(datastore.BinaryDictDatastore()) as adapter:
+		elapsed = find_cuts(bytearray(values[0]), adapter)
+		print(f"{'boundaries':<22} {size_mib / elapsed:8.1f} MiB/s")
+		
+		for concurrent in (False, True):
+			mode = "concurrent" if concurrent else "sequential"
+			elapsed = await put_all(store, mode, values, concurrent)
+			print(f"{'direct ' + mode:<22} {total_mib / elapsed:8.1f} MiB/s")
+			elapsed = await put_all(adapter, mode, values, concurrent)
+			print(f"{'chunked ' + mode:<22} {total_mib / elapsed:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+	count    = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+	size_mib = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+	trio.run(main, count, size_mib)
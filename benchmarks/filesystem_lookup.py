@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Benchmarks random key lookups in a large, deeply nested filesystem datastore
+
+Populates a directory tree with the given number of (tiny) objects below
+nested keys of the form ``/<a>/<b>/<c>/<n>`` and then times random `stat`,
+`get_all` and `get` calls with and without the directory file descriptor
+cache enabled.
+
+Usage: PYTHONPATH=. python benchmarks/filesystem_lookup.py [objects=1000000] [lookups=100000] [path]
+
+Populating a million objects takes a while (and about 4 GiB of inodes on
+most filesystems), pass a previously used *path* to skip that step.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import trio
+
+import datastore
+from datastore.filesystem import FileSystemDatastore
+
+
+FANOUT = 32
+
+
+def key_for(idx: int) -> datastore.Key:
+	a, rest = divmod(idx, FANOUT * FANOUT * FANOUT)
+	b, rest = divmod(rest, FANOUT * FANOUT)
+	c, d = divmod(rest, FANOUT)
+	return datastore.Key(f"/{a:04x}/{b:02x}/{c:02x}/{idx:08x}")
+
+
+async def populate(path: str, count: int) -> None:
+	marker = os.path.join(path, ".populated")
+	if os.path.exists(marker) and int(open(marker).read()) >= count:
+		return
+	
+	async with FileSystemDatastore.create(path, dir_cache_size=1024) as fs:
+		limiter = trio.CapacityLimiter(64)
+		
+		async def put(idx: int) -> None:
+			async with limiter:
+				await fs.put(key_for(idx), b"x" * 16)
+		
+		start = time.perf_counter()
+		for base in range(0, count, 10_000):
+			async with trio.open_nursery() as nursery:
+				for idx in range(base, min(base + 10_000, count)):
+					nursery.start_soon(put, idx)
+			print(f"\rPopulated {min(base + 10_000, count)}/{count} objects", end="", flush=True)
+		print(f" ({time.perf_counter() - start:.1f}s)")
+	
+	with open(marker, "w") as file:
+		file.write(str(count))
+
+
+async def bench(path: str, count: int, lookups: int, dir_cache_size: int) -> None:
+	rng = random.Random(42)
+	keys = [key_for(rng.randrange(count)) for _ in range(lookups)]
+	
+	async with FileSystemDatastore.create(path, dir_cache_size=dir_cache_size) as fs:
+		for name in ("stat", "get_all", "get"):
+			start = time.perf_counter()
+			for key in keys:
+				if name == "stat":
+					await fs.stat(key)
+				elif name == "get_all":
+					await fs.get_all(key)
+				else:
+					async with await fs.get(key) as stream:
+						await stream.collect()
+			elapsed = time.perf_counter() - start
+			print(f"dir_cache_size={dir_cache_size:<5} {name:<8} "
+			      f"{lookups / elapsed:10.0f} ops/s  ({elapsed * 1_000_000 / lookups:.1f} µs/op)")
+
+
+async def main(count: int, lookups: int, path: str) -> None:
+	await populate(path, count)
+	for dir_cache_size in (0, 16, 1024):
+		await bench(path, count, lookups, dir_cache_size)
+
+
+if __name__ == "__main__":
+	count   = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+	lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+	if len(sys.argv) > 3:
+		trio.run(main, count, lookups, sys.argv[3])
+	else:
+		with tempfile.TemporaryDirectory() as path:
+			trio.run(main, count, lookups, path)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Benchmarks sequential read throughput of objects stored in a filesystem datastore
+
+Stores the given number of large objects twice: once from `bytes` values
+(size known in advance, so the datastore preallocates the file using
+``posix_fallocate``) and once from a stream of unknown size (file grows chunk
+by chunk), then reads all of them back sequentially. The difference is most
+pronounced on ext4/XFS volumes with concurrent writers where growing files
+become fragmented; on tmpfs both variants perform the same.
+
+Note that the objects will usually still be in the page cache when they are
+read back; drop it between the phases (``echo 3 > /proc/sys/vm/drop_caches``)
+for cold-cache numbers.
+
+Usage: PYTHONPATH=. python benchmarks/filesystem_read_throughput.py \
+       [objects=16] [MiB/object=64] [path]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import trio
+
+import datastore
+from datastore.filesystem import FileSystemDatastore
+
+
+CHUNK = 1024 * 1024
+
+
+async def unsized(data: bytes) -> datastore.abc.ReceiveStream:
+	async def chunks():
+		for offset in range(0, len(data), CHUNK):
+			yield data[offset:(offset + CHUNK)]
+	return datastore.util.receive_stream_from(chunks())
+
+
+async def write_all(fs: FileSystemDatastore, prefix: str, count: int, data: bytes,
+                    sized: bool) -> float:
+	start = time.perf_counter()
+	async with trio.open_nursery() as nursery:
+		for idx in range(count):
+			value = data if sized else await unsized(data)
+			nursery.start_soon(fs.put, datastore.Key(f"/{prefix}/{idx}"), value)
+	return time.perf_counter() - start
+
+
+async def read_all(fs: FileSystemDatastore, prefix: str, count: int) -> float:
+	start = time.perf_counter()
+	for idx in range(count):
+		async with await fs.get(datastore.Key(f"/{prefix}/{idx}"), access="sequential") as stream:
+			while await stream.receive_some():
+				pass
+	return time.perf_counter() - start
+
+
+async def main(count: int, size_mib: int, path: str) -> None:
+	data = os.urandom(size_mib * 1024 * 1024)
+	total_mib = count * size_mib
+	
+	async with FileSystemDatastore.create(path) as fs:
+		for prefix, sized in (("preallocated", True), ("growing", False)):
+			elapsed = await write_all(fs, prefix, count, data, sized)
+			print(f"{prefix:<12} write {total_mib / elapsed:8.1f} MiB/s")
+			elapsed = await read_all(fs, prefix, count)
+			print(f"{prefix:<12} read  {total_mib / elapsed:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+	count    = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+	size_mib = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+	if len(sys.argv) > 3:
+		trio.run(main, count, size_mib, sys.argv[3])
+	else:
+		with tempfile.TemporaryDirectory() as path:
+			trio.run(main, count, size_mib, path)
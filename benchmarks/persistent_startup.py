@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Benchmarks the startup time of the persistent dict datastore
+
+Writes a log file containing the given number of entries (14-byte keys,
+32-byte values) and times opening the datastore from it, which replays every
+record of the log. It then times writing a snapshot of all entries and opening
+the datastore again from that snapshot alone. The peak memory use reported at
+the end is that of the whole process, which holds all entries at least once.
+
+Usage: PYTHONPATH=. python benchmarks/persistent_startup.py [entries=10000000] [path]
+"""
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import trio
+
+from datastore.persistent import PersistentDictDatastore
+from datastore.persistent.persistent import encode_record, LOG_SUFFIX, RECORD_PUT
+
+
+BATCH = 100_000
+
+
+def write_log(path: str, count: int) -> int:
+	size = 0
+	with open(os.path.join(path, f"{0:016x}{LOG_SUFFIX}"), "wb") as file:
+		for start in range(0, count, BATCH):
+			data = b"".join(
+				encode_record(RECORD_PUT, f"/{idx:013d}".encode("ascii"), b"%032d" % idx)
+				for idx in range(start, min(start + BATCH, count))
+			)
+			file.write(data)
+			size += len(data)
+	return size
+
+
+def directory_size(path: str) -> int:
+	return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+async def main(count: int, path: str) -> None:
+	size = write_log(path, count)
+	print(f"{'log size':<18} {size / 1024 / 1024:8.1f} MiB")
+	
+	start = time.perf_counter()
+	async with PersistentDictDatastore.create(path) as store:
+		print(f"{'log replay':<18} {time.perf_counter() - start:8.1f} s")
+		
+		start = time.perf_counter()
+		await store.snapshot()
+		print(f"{'snapshot write':<18} {time.perf_counter() - start:8.1f} s")
+	
+	print(f"{'snapshot size':<18} {directory_size(path) / 1024 / 1024:8.1f} MiB")
+	
+	start = time.perf_counter()
+	async with PersistentDictDatastore.create(path) as store:
+		print(f"{'snapshot load':<18} {time.perf_counter() - start:8.1f} s")
+	
+	# `ru_maxrss` is in KiB on Linux
+	max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	print(f"{'max RSS':<18} {max_rss / 1024:8.1f} MiB")
+
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+	if len(sys.argv) > 2:
+		trio.run(main, count, sys.argv[2])
+	else:
+		with tempfile.TemporaryDirectory() as path:
+			trio.run(main, count, path)
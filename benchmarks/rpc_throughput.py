@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Benchmarks accessing a datastore over RPC compared to accessing it in-process
+
+Writes and then reads back the given number of values, once directly to an
+in-memory datastore and once through a remote datastore connected to an
+in-memory datastore served by a separate process over a Unix domain socket.
+Each variant runs once one request after another (bounded by the round-trip
+latency) and once with all requests in flight concurrently (pipelined over
+the pool of connections). Finally, all values are read back from the remote
+datastore using batch requests.
+
+Usage: PYTHONPATH=. python benchmarks/rpc_throughput.py [values=10000] [bytes/value=1024]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import trio
+
+import datastore
+from datastore.rpc import DatastoreServer, RemoteDatastore
+
+
+async def serve(path: str) -> None:
+	async with datastore.BinaryDictDatastore() as store:
+		await DatastoreServer(store).serve_unix(path)
+
+
+async def run_all(store: datastore.abc.BinaryDatastore, func, keys: list,
+                  concurrent: bool) -> float:
+	start = time.perf_counter()
+	async with trio.open_nursery() as nursery:
+		for key in keys:
+			if concurrent:
+				nursery.start_soon(func, store, key)
+			else:
+				await func(store, key)
+	return time.perf_counter() - start
+
+
+async def main(count: int, size: int, path: str) -> None:
+	value = os.urandom(size)
+	
+	async def put(store: datastore.abc.BinaryDatastore, key: datastore.Key) -> None:
+		await store.put(key, value)
+	
+	async def get(store: datastore.abc.BinaryDatastore, key: datastore.Key) -> None:
+		assert await store.get_all(key) == value
+	
+	# Wait for the server process to create its socket
+	while not os.path.exists(path):
+		await trio.sleep(0.01)
+	
+	async with datastore.BinaryDictDatastore() as local, RemoteDatastore.create(path) as remote:
+		for name, store in (("in-process", local), ("rpc", remote)):
+			for concurrent in (False, True):
+				mode = "concurrent" if concurrent else "sequential"
+				keys = [datastore.Key(f"/{mode}/{idx}") for idx in range(count)]
+				for op_name, func in (("put", put), ("get", get)):
+					elapsed = await run_all(store, func, keys, concurrent)
+					label = f"{name} {op_name} {mode}"
+					print(f"{label:<28} {count / elapsed:10.0f} ops/s")
+		
+		# Batch requests are only supported by the remote datastore
+		start = time.perf_counter()
+		assert await remote.get_many(keys) == [value] * count
+		print(f"{'rpc get_many':<28} {count / (time.perf_counter() - start):10.0f} ops/s")
+
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+	size  = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+	with tempfile.TemporaryDirectory() as temp_path:
+		path = os.path.join(temp_path, "socket")
+		server = multiprocessing.Process(target=trio.run, args=(serve, path), daemon=True)
+		server.start()
+		try:
+			trio.run(main, count, size, path)
+		finally:
+			server.terminate()
+			server.join()
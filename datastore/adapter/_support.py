@@ -1,3 +1,4 @@
+import contextlib
 import typing
 
 import trio
@@ -110,3 +111,129 @@ class DatastoreCollectionMixin(typing.Generic[DS]):
 		
 		# Ensure cancellation is propagated
 		await trio.sleep(0)
+
+
+class KeyLocks:
+	"""Per-key locks that are only kept around while in use
+	
+	Calling an instance with some keys returns an async context manager that
+	holds the locks of all of these keys, acquired in a fixed order so that
+	concurrent callers locking overlapping sets of keys cannot deadlock.
+	"""
+	__slots__ = ("_locks",)
+	
+	_locks: typing.Dict[datastore.Key, typing.List[typing.Any]]
+	
+	def __init__(self) -> None:
+		self._locks = {}
+	
+	@contextlib.asynccontextmanager
+	async def __call__(self, *keys: datastore.Key) -> typing.AsyncIterator[None]:
+		keys = tuple(sorted(set(keys)))
+		for key in keys:
+			self._locks.setdefault(key, [trio.Lock(), 0])[1] += 1
+		try:
+			async with contextlib.AsyncExitStack() as stack:
+				for key in keys:
+					await stack.enter_async_context(self._locks[key][0])
+				yield
+		finally:
+			for key in keys:
+				entry = self._locks[key]
+				entry[1] -= 1
+				if entry[1] == 0:
+					del self._locks[key]
+
+
+class PrefixedReceiveStream(datastore.abc.ReceiveStream):
+	"""Returns *prefix* followed by the remaining data of *source*"""
+	__slots__ = ("_source", "_prefix")
+	
+	_source: datastore.abc.ReceiveStream
+	_prefix: bytes
+	
+	def __init__(self, source: datastore.abc.ReceiveStream, prefix: bytes):
+		super().__init__(atime=source.atime, mtime=source.mtime, btime=source.btime,
+		                 size=source.size)
+		
+		self._source = source
+		self._prefix = prefix
+	
+	
+	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
+		if self._prefix:
+			if max_bytes is None or max_bytes >= len(self._prefix):
+				chunk, self._prefix = self._prefix, b""
+			else:
+				chunk, self._prefix = self._prefix[:max_bytes], self._prefix[max_bytes:]
+			return chunk
+		return typing.cast(bytes, await self._source.receive_some(max_bytes))
+	
+	
+	async def aclose(self) -> None:
+		self._prefix = b""
+		await self._source.aclose()
+
+
+async def read_up_to(source: trio.abc.ReceiveStream, buffer: bytearray, size: int) -> bool:
+	"""Reads from *source* into *buffer* until it holds at least *size* bytes
+	
+	Returns `False` if the stream ended before that.
+	"""
+	while len(buffer) < size:
+		chunk = await source.receive_some(size - len(buffer))
+		if len(chunk) < 1:
+			return False
+		buffer += chunk
+	return True
+
+
+# Reference counted content, as stored by the deduplication and chunking
+# adapters: Each piece of content is stored once at *content_key*, with the
+# number of values referencing it stored at *refs_key*
+
+
+async def get_refcount(store: datastore.abc.BinaryDatastore, refs_key: datastore.Key) -> int:
+	try:
+		return int(await store.get_all(refs_key))
+	except KeyError:
+		return 0
+
+
+async def incref(store: datastore.abc.BinaryDatastore, lock_keys: KeyLocks,
+                 content_key: datastore.Key, refs_key: datastore.Key,
+                 content: typing.Union[bytes, datastore.Key]) -> None:
+	"""Adds a reference to the content at *content_key*, storing the
+	*content* (a value or a temporary key holding it) first if it is new"""
+	async with lock_keys(content_key):
+		count = await get_refcount(store, refs_key)
+		if count < 1 and isinstance(content, bytes):
+			await store.put(content_key, content)
+		elif count < 1:
+			try:
+				await store.rename(content, content_key)
+			except KeyError:
+				# Some datastores (such as `FileSystemDatastore`) cannot
+				# rename keys into namespaces that do not exist yet
+				await store.put(content_key, await store.get(content))
+				await store.delete(content)
+		elif isinstance(content, datastore.Key):
+			# Already known – drop the spooled copy again
+			await store.delete(content)
+		await store.put(refs_key, str(count + 1).encode())
+
+
+async def decref(store: datastore.abc.BinaryDatastore, lock_keys: KeyLocks,
+                 content_key: datastore.Key, refs_key: datastore.Key) -> None:
+	"""Removes a reference to the content at *content_key*, deleting the
+	content once it is no longer referenced"""
+	async with lock_keys(content_key):
+		count = await get_refcount(store, refs_key)
+		if count > 1:
+			await store.put(refs_key, str(count - 1).encode())
+			return
+		
+		with contextlib.suppress(KeyError):
+			await store.delete(refs_key)
+		with contextlib.suppress(KeyError):
+			await store.delete(content_key)
@@ -0,0 +1,352 @@
+"""Answers lookups of missing keys without asking the wrapped datastore
+
+The adapters in this module keep a counting Bloom filter of all keys present
+in the wrapped datastore in memory. Lookups of keys that the filter reports
+as absent fail right away with :exc:`KeyError`, saving the (potentially
+expensive) round trip to the wrapped datastore – or, when used in front of a
+:mod:`tiered <datastore.adapter.tiered>` datastore, to every one of its tiers.
+
+The filter is only updated for changes made through the adapter: Other
+processes or adapters modifying the wrapped datastore directly will cause
+keys that they add to be reported as missing until the filter is rebuilt.
+
+Filters may be persisted across runs by passing *persist_path* to
+:meth:`~_Adapter.create`. Much like the stats restore file of
+:class:`~datastore.filesystem.FileSystemDatastore`, the file is consumed
+when loading it and only written again when the adapter is closed, so that
+a filter that may have missed some changes (because of a crash) is never
+loaded but rebuilt from a listing of the wrapped datastore instead.
+"""
+import os
+import pathlib
+import typing
+
+import trio
+
+import datastore
+import datastore.core.util.bloom
+
+from . import _support
+from ._support import DS, MD, RT, RV, T_co
+
+__all__ = (
+	"BinaryAdapter",
+	"ObjectAdapter",
+)
+
+
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+DEFAULT_CAPACITY   = 100000
+DEFAULT_ERROR_RATE = 0.01
+
+KEYS_T = typing.Union[typing.Iterable[datastore.Key], typing.AsyncIterable[datastore.Key]]
+
+
+class _Adapter(typing.Generic[DS, MD, RT, RV]):
+	"""Represents a datastore adapter that keeps track of which keys exist in
+	the wrapped datastore using a counting Bloom filter
+	
+	Semantics:
+	
+		* get      : raises `KeyError` if the key is definitely missing, else forwards
+		* put      : forwards and adds the key to the filter
+		* delete   : forwards and removes the key from the filter
+		* contains : returns `False` if the key is definitely missing, else forwards
+		* stat     : raises `KeyError` if the key is definitely missing, else forwards
+		* rename   : forwards and updates the filter for both keys
+	"""
+	__slots__ = ()
+	
+	FORWARD_CONTAINS = True
+	FORWARD_GET_ALL  = True
+	FORWARD_PUT_NEW  = True
+	FORWARD_RENAME   = True
+	FORWARD_STAT     = True
+	
+	filter: datastore.core.util.bloom.CountingBloomFilter
+	persist_path: typing.Optional[pathlib.PurePath]
+	
+	_capacity: int
+	_error_rate: float
+	# Serializes changes to keys, so that the filter is updated in the same
+	# order as the wrapped datastore
+	_lock_keys: _support.KeyLocks
+	_rebuilding: typing.Optional[datastore.core.util.bloom.CountingBloomFilter]
+	
+	
+	def __init__(self, *args: typing.Any, capacity: int = DEFAULT_CAPACITY,
+	             error_rate: float = DEFAULT_ERROR_RATE, **kwargs: typing.Any):
+		"""Wraps a datastore with an empty filter
+		
+		Use :meth:`create` instead, unless the wrapped datastore is empty.
+		
+		Arguments
+		---------
+		capacity
+			The number of keys the filter should be sized for
+		error_rate
+			The rate of lookups of missing keys that are still forwarded to
+			the wrapped datastore (once it holds *capacity* keys)
+		"""
+		self.filter       = datastore.core.util.bloom.CountingBloomFilter(capacity, error_rate)
+		self.persist_path = None
+		
+		self._capacity   = capacity
+		self._error_rate = error_rate
+		self._lock_keys  = _support.KeyLocks()
+		self._rebuilding = None
+		super().__init__(*args, **kwargs)  # type: ignore[call-arg]
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, child_datastore: DS, *,
+	                 persist_path: typing.Optional[typing.Union[os_PathLike_str, str]] = None,
+	                 keys: typing.Optional[KEYS_T] = None, **kwargs: typing.Any) -> typing.Any:
+		"""Wraps *child_datastore* with a filter of the keys it contains
+		
+		Arguments
+		---------
+		child_datastore
+			The datastore to wrap
+		persist_path
+			Path of the file to load the filter from, or to rebuild and later
+			store the filter to if missing (see the module documentation)
+		keys
+			All keys present in *child_datastore*, used to rebuild the filter
+			(see :meth:`rebuild`)
+		capacity
+			The number of keys the filter should be sized for
+		error_rate
+			The rate of lookups of missing keys that are still forwarded to
+			the wrapped datastore (once it holds *capacity* keys)
+		"""
+		self = cls(child_datastore, **kwargs)
+		if persist_path is not None:
+			self.persist_path = pathlib.PurePath(persist_path)
+		
+		if not await self._load():
+			await self.rebuild(keys)
+		return self
+	
+	
+	async def _load(self) -> bool:
+		if self.persist_path is None:
+			return False
+		
+		path = trio.Path(self.persist_path)
+		try:
+			data = await path.read_bytes()
+		except FileNotFoundError:
+			return False
+		
+		# Consume the file, it will be written again when closing this adapter
+		await path.unlink()
+		
+		try:
+			self.filter = datastore.core.util.bloom.CountingBloomFilter.from_bytes(data)
+		except ValueError:
+			return False
+		return True
+	
+	
+	async def rebuild(self, keys: typing.Optional[KEYS_T] = None) -> None:
+		"""Replaces the filter with a new one created from a listing of all
+		keys in the wrapped datastore
+		
+		Changes made while the filter is rebuilt are taken into account, but
+		keys removed in the meantime will keep being forwarded until the next
+		rebuild.
+		
+		Arguments
+		---------
+		keys
+			All keys present in the wrapped datastore; if omitted they are
+			listed using the ``keys()`` method of the wrapped datastore (such
+			as :meth:`datastore.filesystem.FileSystemDatastore.keys`)
+		
+		Raises
+		------
+		NotImplementedError
+			*keys* was omitted, but the wrapped datastore cannot list its keys
+		"""
+		if keys is None:
+			list_keys = getattr(self.child_datastore, "keys", None)  # type: ignore[attr-defined]
+			if list_keys is None:
+				raise NotImplementedError(
+					f"Cannot list keys of {type(self.child_datastore).__name__}, "  # type: ignore[attr-defined]
+					f"pass them explicitly"
+				)
+			keys = list_keys()
+		
+		self._rebuilding = datastore.core.util.bloom.CountingBloomFilter(
+			self._capacity, self._error_rate
+		)
+		try:
+			if isinstance(keys, typing.AsyncIterable):
+				async for key in keys:
+					self._rebuilding.add(str(key))
+			else:
+				for key in keys:
+					self._rebuilding.add(str(key))
+					await trio.sleep(0)
+			
+			self.filter = self._rebuilding
+		finally:
+			self._rebuilding = None
+	
+	
+	def _add(self, key: datastore.Key) -> None:
+		self.filter.add(str(key))
+		if self._rebuilding is not None:
+			self._rebuilding.add(str(key))
+	
+	
+	def _remove(self, key: datastore.Key) -> None:
+		# Removals are not applied to a filter that is being rebuilt, as the
+		# key may or may not have been listed yet
+		self.filter.remove(str(key))
+	
+	
+	def _may_contain(self, key: datastore.Key) -> bool:
+		return str(key) in self.filter
+	
+	
+	async def _exists(self, key: datastore.Key) -> bool:
+		return self._may_contain(key) and await super().contains(key)  # type: ignore[misc]
+	
+	
+	async def get(self, key: datastore.Key) -> RT:
+		"""Returns the data named by *key* or raises `KeyError` right away if
+		the filter reports it as missing"""
+		if not self._may_contain(key):
+			raise KeyError(key)
+		return await super().get(key)  # type: ignore[misc, no-any-return]
+	
+	
+	async def get_all(self, key: datastore.Key) -> RV:
+		"""Returns all data named by *key* or raises `KeyError` right away if
+		the filter reports it as missing"""
+		if not self._may_contain(key):
+			raise KeyError(key)
+		return await super().get_all(key)  # type: ignore[misc, no-any-return]
+	
+	
+	async def _put(self, key: datastore.Key, value: RT, **kwargs: typing.Any) -> None:
+		"""Stores *value* at name *key* and adds *key* to the filter"""
+		async with self._lock_keys(key):
+			existed = await self._exists(key)
+			
+			# Add the key before storing the value, so that it will never be
+			# reported as missing while it is being stored
+			if not existed:
+				self._add(key)
+			try:
+				await super()._put(key, value, **kwargs)  # type: ignore[misc]
+			except BaseException:
+				if not existed:
+					self._remove(key)
+				raise
+	
+	
+	async def _put_new(self, prefix: datastore.Key, value: RT, **kwargs: typing.Any) -> datastore.Key:
+		"""Stores *value* below name *prefix* and adds the created key to the
+		filter"""
+		key: datastore.Key = await super()._put_new(prefix, value, **kwargs)  # type: ignore[misc]
+		self._add(key)
+		return key
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key, **kwargs: typing.Any) \
+	      -> typing.Tuple[datastore.Key, typing.Callable[[RT], typing.Awaitable[None]]]:
+		"""Stores the value passed to the returned callback below name *prefix*
+		and adds the created key to the filter"""
+		key, callback = await super()._put_new_indirect(prefix, **kwargs)  # type: ignore[misc]
+		self._add(key)
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the data named by *key* and removes *key* from the filter"""
+		if not self._may_contain(key):
+			raise KeyError(key)
+		
+		async with self._lock_keys(key):
+			await super().delete(key)  # type: ignore[misc]
+			self._remove(key)
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by *key* exists, without asking the
+		wrapped datastore if the filter reports it as missing"""
+		return await self._exists(key)
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Renames item *key1* to *key2* and updates the filter for both keys"""
+		if not self._may_contain(key1):
+			raise KeyError(key1)
+		if key1 == key2:
+			await super().rename(key1, key2, replace=replace)  # type: ignore[misc]
+			return
+		
+		async with self._lock_keys(key1, key2):
+			existed = await self._exists(key2)
+			if not existed:
+				self._add(key2)
+			try:
+				await super().rename(key1, key2, replace=replace)  # type: ignore[misc]
+			except BaseException:
+				if not existed:
+					self._remove(key2)
+				raise
+			self._remove(key1)
+	
+	
+	async def stat(self, key: datastore.Key) -> MD:
+		"""Returns the metadata of the data named by *key* or raises
+		`KeyError` right away if the filter reports it as missing"""
+		if not self._may_contain(key):
+			raise KeyError(key)
+		return await super().stat(key)  # type: ignore[misc, no-any-return]
+	
+	
+	async def aclose(self) -> None:
+		"""Persists the filter (if enabled) and closes the wrapped datastore"""
+		try:
+			if self.persist_path is not None:
+				temp_path = trio.Path(f"{self.persist_path}.tmp")
+				await temp_path.write_bytes(self.filter.to_bytes())
+				await temp_path.replace(self.persist_path)
+		finally:
+			await super().aclose()  # type: ignore[misc]
+
+
+class BinaryAdapter(
+		_Adapter[
+			datastore.abc.BinaryDatastore,
+			datastore.util.StreamMetadata,
+			datastore.abc.ReceiveStream,
+			bytes
+		],
+		datastore.abc.BinaryAdapter
+):
+	__slots__ = ("filter", "persist_path", "_capacity", "_error_rate", "_lock_keys", "_rebuilding")
+
+
+class ObjectAdapter(
+		typing.Generic[T_co],
+		_Adapter[
+			datastore.abc.ObjectDatastore[T_co],
+			datastore.util.ChannelMetadata,
+			datastore.abc.ReceiveChannel[T_co],
+			typing.List[T_co]
+		],
+		datastore.abc.ObjectAdapter[T_co, T_co]
+):
+	__slots__ = ("filter", "persist_path", "_capacity", "_error_rate", "_lock_keys", "_rebuilding")
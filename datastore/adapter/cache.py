@@ -0,0 +1,715 @@
+"""Size-bounded in-memory datastores for use as cache tiers
+
+Unlike :class:`datastore.BinaryDictDatastore` and
+:class:`datastore.ObjectDictDatastore`, the datastores in this module never
+grow beyond their configured capacity: Once it is exceeded, entries are
+evicted according to one of the following policies:
+
+ * ``"lru"``: Evict the least-recently used entry
+ * ``"lfu"``: Evict the least-frequently used entry (or the least-recently
+   used one of several equally frequently used entries)
+ * ``"tinylfu"``: W-TinyLFU – New entries enter a small LRU window and entries
+   leaving that window are only admitted to the main (segmented LRU) area if
+   they were requested more frequently than the entry they would displace;
+   request frequencies are estimated using a compact, periodically aged
+   count-min sketch that also remembers keys not currently cached
+
+Since these datastores may drop any entry at any time, they are meant to be
+used as the first datastore(s) of a :class:`datastore.adapter.tiered.BinaryAdapter`
+or :class:`datastore.adapter.tiered.ObjectAdapter`, whose last datastore
+retains the complete data::
+
+	async with datastore.adapter.tiered.BinaryAdapter([
+		datastore.adapter.cache.BinaryDatastore(64 * 1024 * 1024, policy="tinylfu"),
+		await datastore.filesystem.FileSystemDatastore.create(path),
+	]) as ds:
+		...
+
+The number of cache hits, misses and evictions is reported by
+:meth:`~_Datastore.datastore_stats` as :class:`datastore.util.CacheMetadata`.
+"""
+import abc
+import collections
+import typing
+import uuid
+
+import datastore
+import datastore.abc
+
+from ._support import MD, RT, RV, T_co
+
+__all__ = ("BinaryDatastore", "ObjectDatastore")
+
+
+if typing.TYPE_CHECKING:
+	from typing_extensions import Literal as typing_Literal
+elif hasattr(typing, "Literal"):  #PY38+
+	from typing import Literal as typing_Literal
+else:  #PY37-
+	from typing import Union as typing_Literal
+
+policy_t = typing_Literal["lru", "lfu", "tinylfu"]
+
+
+class _Policy(metaclass=abc.ABCMeta):
+	"""Decides which cache entry to evict next
+	
+	Entries are tracked by key together with their weight, which only some
+	policies make use of.
+	"""
+	__slots__ = ()
+	
+	def __init__(self, capacity: int):
+		pass
+	
+	@abc.abstractmethod
+	def hit(self, key: datastore.Key) -> None:
+		"""Records a successful lookup of the entry named by *key*"""
+	
+	def miss(self, key: datastore.Key) -> None:
+		"""Records a lookup of *key*, which was not cached"""
+	
+	@abc.abstractmethod
+	def insert(self, key: datastore.Key, weight: int) -> None:
+		"""Starts tracking a new entry or records an update to an existing one"""
+	
+	@abc.abstractmethod
+	def remove(self, key: datastore.Key) -> None:
+		"""Stops tracking the entry named by *key*"""
+	
+	@abc.abstractmethod
+	def victim(self) -> datastore.Key:
+		"""Returns the key of the entry that should be evicted next
+		
+		Only called while at least one entry is being tracked.
+		"""
+
+
+class _LRUPolicy(_Policy):
+	__slots__ = ("_order",)
+	
+	_order: 'collections.OrderedDict[datastore.Key, None]'
+	
+	def __init__(self, capacity: int):
+		self._order = collections.OrderedDict()
+	
+	def hit(self, key: datastore.Key) -> None:
+		self._order.move_to_end(key)
+	
+	def insert(self, key: datastore.Key, weight: int) -> None:
+		self._order[key] = None
+		self._order.move_to_end(key)
+	
+	def remove(self, key: datastore.Key) -> None:
+		del self._order[key]
+	
+	def victim(self) -> datastore.Key:
+		return next(iter(self._order))
+
+
+class _LFUPolicy(_Policy):
+	__slots__ = ("_buckets", "_counts", "_min_count")
+	
+	# Keys grouped by their use count, each group ordered by recency
+	_buckets: typing.Dict[int, 'collections.OrderedDict[datastore.Key, None]']
+	_counts: typing.Dict[datastore.Key, int]
+	_min_count: int
+	
+	def __init__(self, capacity: int):
+		self._buckets   = {}
+		self._counts    = {}
+		self._min_count = 0
+	
+	def _unlink(self, key: datastore.Key, count: int) -> None:
+		bucket = self._buckets[count]
+		del bucket[key]
+		if not bucket:
+			del self._buckets[count]
+	
+	def hit(self, key: datastore.Key) -> None:
+		count = self._counts[key]
+		self._unlink(key, count)
+		if self._min_count == count and count not in self._buckets:
+			self._min_count = count + 1
+		
+		self._counts[key] = count + 1
+		self._buckets.setdefault(count + 1, collections.OrderedDict())[key] = None
+	
+	def insert(self, key: datastore.Key, weight: int) -> None:
+		if key in self._counts:
+			self.hit(key)
+			return
+		
+		self._counts[key] = 1
+		self._buckets.setdefault(1, collections.OrderedDict())[key] = None
+		self._min_count = 1
+	
+	def remove(self, key: datastore.Key) -> None:
+		count = self._counts.pop(key)
+		self._unlink(key, count)
+		if self._min_count == count and count not in self._buckets:
+			self._min_count = min(self._buckets) if self._buckets else 0
+	
+	def victim(self) -> datastore.Key:
+		return next(iter(self._buckets[self._min_count]))
+
+
+class _FrequencySketch:
+	"""Count-min sketch of 4-bit counters estimating how often each key was
+	requested recently
+	
+	All counters are halved once the number of recorded requests reaches ten
+	times the sketch width, so that keys that stopped being popular are
+	eventually forgotten.
+	"""
+	__slots__ = ("_mask", "_samples", "_table")
+	
+	_SEEDS = (0x97CB3127, 0xB7A5E1D3, 0xC3A5C85C, 0x9AE16A3B)
+	
+	_mask: int
+	_samples: int
+	_table: bytearray
+	
+	def __init__(self, size: int = 0):
+		self._reset(size)
+	
+	def _reset(self, size: int) -> None:
+		# Use 16 counters per key to keep the error due to collisions low
+		width = 16 << max(size - 1, 15).bit_length()
+		self._mask    = width - 1
+		self._samples = 0
+		self._table   = bytearray(width)
+	
+	def _indexes(self, key: datastore.Key) -> typing.Iterator[int]:
+		h = hash(key) & 0xFFFFFFFFFFFFFFFF
+		for seed in self._SEEDS:
+			h2 = ((h ^ seed) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+			yield (h2 >> 32) & self._mask
+	
+	def ensure_capacity(self, size: int) -> None:
+		"""Grows the sketch (discarding all counts) if it cannot track
+		*size* keys accurately"""
+		if size * 16 > len(self._table):
+			self._reset(size)
+	
+	def increment(self, key: datastore.Key) -> None:
+		table = self._table
+		for idx in self._indexes(key):
+			if table[idx] < 15:
+				table[idx] += 1
+		
+		self._samples += 1
+		if self._samples >= 10 * len(table):
+			self._table    = table.translate(bytes(count >> 1 for count in range(256)))
+			self._samples //= 2
+	
+	def frequency(self, key: datastore.Key) -> int:
+		return min(self._table[idx] for idx in self._indexes(key))
+
+
+class _TinyLFUPolicy(_Policy):
+	__slots__ = ("_main_max", "_main_weight", "_probation", "_protected", "_protected_max",
+	             "_protected_weight", "_sketch", "_weights", "_window", "_window_max",
+	             "_window_weight")
+	
+	_sketch: _FrequencySketch
+	_weights: typing.Dict[datastore.Key, int]
+	
+	# Admission window (1% of capacity)
+	_window: 'collections.OrderedDict[datastore.Key, None]'
+	_window_max: int
+	_window_weight: int
+	
+	# Main area (segmented LRU), of which 80% are reserved for entries that
+	# were requested at least once since being admitted
+	_probation: 'collections.OrderedDict[datastore.Key, None]'
+	_protected: 'collections.OrderedDict[datastore.Key, None]'
+	_main_max: int
+	_main_weight: int
+	_protected_max: int
+	_protected_weight: int
+	
+	def __init__(self, capacity: int):
+		# The capacity is only an upper bound for the number of entries if
+		# every entry weighs at least 1, the sketch will grow as needed
+		self._sketch  = _FrequencySketch(min(capacity, 1 << 14))
+		self._weights = {}
+		
+		self._window        = collections.OrderedDict()
+		self._window_max    = max(capacity // 100, 1)
+		self._window_weight = 0
+		
+		self._probation        = collections.OrderedDict()
+		self._protected        = collections.OrderedDict()
+		self._main_max         = max(capacity - self._window_max, 0)
+		self._main_weight      = 0
+		self._protected_max    = self._main_max * 4 // 5
+		self._protected_weight = 0
+	
+	def hit(self, key: datastore.Key) -> None:
+		self._sketch.increment(key)
+		if key in self._window:
+			self._window.move_to_end(key)
+		elif key in self._protected:
+			self._protected.move_to_end(key)
+		else:
+			# Promote entry from probation to the protected segment, demoting
+			# the least-recently used protected entries back to probation if
+			# it overflows
+			del self._probation[key]
+			self._protected[key] = None
+			self._protected_weight += self._weights[key]
+			while self._protected_weight > self._protected_max and len(self._protected) > 1:
+				demoted, _ = self._protected.popitem(last=False)
+				self._protected_weight -= self._weights[demoted]
+				self._probation[demoted] = None
+	
+	def miss(self, key: datastore.Key) -> None:
+		self._sketch.increment(key)
+	
+	def insert(self, key: datastore.Key, weight: int) -> None:
+		old_weight = self._weights.get(key)
+		self._weights[key] = weight
+		if old_weight is not None:
+			if key in self._window:
+				self._window_weight += weight - old_weight
+			else:
+				self._main_weight += weight - old_weight
+				if key in self._protected:
+					self._protected_weight += weight - old_weight
+			self.hit(key)
+			return
+		
+		self._sketch.increment(key)
+		self._sketch.ensure_capacity(len(self._weights))
+		self._window[key] = None
+		self._window_weight += weight
+	
+	def remove(self, key: datastore.Key) -> None:
+		weight = self._weights.pop(key)
+		if key in self._window:
+			del self._window[key]
+			self._window_weight -= weight
+		else:
+			self._main_weight -= weight
+			if key in self._protected:
+				del self._protected[key]
+				self._protected_weight -= weight
+			else:
+				del self._probation[key]
+	
+	def victim(self) -> datastore.Key:
+		# Victims are requested before the new entry is added to the window,
+		# so make room for it there first
+		while self._window and self._window_weight >= self._window_max:
+			candidate = next(iter(self._window))
+			
+			if self._probation:
+				victim = next(iter(self._probation))
+			elif self._protected:
+				victim = next(iter(self._protected))
+			else:
+				victim = None
+			
+			# Move entries leaving the window to probation for as long as
+			# there is room in the main area, otherwise only admit them if
+			# they are more popular than the main area's next victim
+			if victim is not None and self._main_weight + self._weights[candidate] > self._main_max:
+				if self._sketch.frequency(candidate) <= self._sketch.frequency(victim):
+					return candidate
+				self._admit(candidate)
+				return victim
+			self._admit(candidate)
+		
+		if self._probation:
+			return next(iter(self._probation))
+		elif self._protected:
+			return next(iter(self._protected))
+		return next(iter(self._window))
+	
+	def _admit(self, key: datastore.Key) -> None:
+		del self._window[key]
+		self._window_weight -= self._weights[key]
+		self._probation[key] = None
+		self._main_weight += self._weights[key]
+
+
+_POLICIES: typing.Dict[str, typing.Type[_Policy]] = {
+	"lru":     _LRUPolicy,
+	"lfu":     _LFUPolicy,
+	"tinylfu": _TinyLFUPolicy,
+}
+
+
+class _Datastore(typing.Generic[MD, RT, RV]):
+	"""A bounded in-memory datastore that evicts entries once its capacity
+	is exceeded
+	
+	Semantics:
+	
+		* get      : returns cached value (counted as hit or miss)
+		* put      : caches value, evicting other entries as necessary; values
+		             that are larger than the entire capacity are not cached at all
+		* delete   : drops cached value
+		* contains : returns whether the value is cached (not counted)
+		* stat     : returns metadata of cached value (counted as hit or miss)
+	"""
+	__slots__ = ()
+	
+	_entries: typing.Dict[datastore.Key, RV]
+	_policy: _Policy
+	_policy_cls: typing.Type[_Policy]
+	_capacity: int
+	_max_count: typing.Optional[int]
+	_weight: int
+	
+	_hits: int
+	_misses: int
+	_evictions: int
+	
+	
+	def _init(self, capacity: int, max_count: typing.Optional[int], policy: policy_t) -> None:
+		if policy not in _POLICIES:
+			raise ValueError(f"Unknown cache policy {policy!r}")
+		
+		self._entries    = {}
+		self._policy_cls = _POLICIES[policy]
+		self._policy     = self._policy_cls(capacity)
+		self._capacity   = capacity
+		self._max_count  = max_count
+		self._weight     = 0
+		
+		self._hits      = 0
+		self._misses    = 0
+		self._evictions = 0
+	
+	
+	def _weigh(self, value: RV) -> int:
+		raise NotImplementedError()
+	
+	
+	def _lookup(self, key: datastore.Key) -> RV:
+		try:
+			value = self._entries[key]
+		except KeyError:
+			self._misses += 1
+			self._policy.miss(key)
+			raise
+		
+		self._hits += 1
+		self._policy.hit(key)
+		return value
+	
+	
+	def _store(self, key: datastore.Key, value: RV) -> None:
+		weight = self._weigh(value)
+		if weight > self._capacity:
+			# Caching this would evict everything else
+			self._discard(key)
+			return
+		
+		# Make room for the new value before inserting it, so that it cannot
+		# be chosen for eviction right away
+		while True:
+			old_weight = self._weigh(self._entries[key]) if key in self._entries else 0
+			new_count  = len(self._entries) + (0 if key in self._entries else 1)
+			if self._weight - old_weight + weight <= self._capacity \
+			   and (self._max_count is None or new_count <= self._max_count):
+				break
+			
+			self._discard(self._policy.victim())
+			self._evictions += 1
+		
+		self._entries[key] = value
+		self._weight += weight - old_weight
+		self._policy.insert(key, weight)
+	
+	
+	def _discard(self, key: datastore.Key) -> None:
+		if key not in self._entries:
+			return
+		
+		self._weight -= self._weigh(self._entries.pop(key))
+		self._policy.remove(key)
+	
+	
+	async def get(self, key: datastore.Key) -> RT:
+		"""Returns the cached value named by `key` or raises `KeyError`
+		
+		Arguments
+		---------
+		key
+			Key naming the value to retrieve
+		"""
+		value = self._lookup(key)
+		if isinstance(self, datastore.abc.BinaryDatastore):
+			return datastore.util.receive_stream_from(value)  # type: ignore[return-value, arg-type]
+		elif isinstance(self, datastore.abc.ObjectDatastore):
+			return datastore.util.receive_channel_from(value)  # type: ignore[return-value, arg-type]
+		else:
+			assert False
+	
+	
+	async def get_all(self, key: datastore.Key) -> RV:
+		"""Returns the cached value named by `key` or raises `KeyError`
+		
+		Arguments
+		---------
+		key
+			Key naming the value to retrieve
+		"""
+		return self._lookup(key)
+	
+	
+	async def _put(self, key: datastore.Key, value: RT, *, create: bool, replace: bool) -> None:
+		"""Caches `value` under the name `key`
+		
+		Arguments
+		---------
+		key
+			Key naming `value`
+		value
+			The value to cache
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		"""
+		if not create and key not in self._entries:
+			raise KeyError(key)
+		if not replace and key in self._entries:
+			raise KeyError(key)
+		self._store(key, await value.collect())  # type: ignore[arg-type]
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key) \
+	      -> typing.Tuple[datastore.Key, typing.Callable[[RT], typing.Awaitable[None]]]:
+		"""Caches the value passed to the returned callback in a new key below *prefix*
+		
+		Arguments
+		---------
+		prefix
+			Key below which to store the given value
+		"""
+		while True:
+			key = prefix.child(str(uuid.uuid4()))
+			if key not in self._entries:
+				break
+		
+		async def callback(value: RT) -> None:
+			self._store(key, await value.collect())  # type: ignore[arg-type]
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Drops the value named by `key` or raises `KeyError` if it was not cached
+		
+		Arguments
+		---------
+		key
+			Key naming the value to remove
+		"""
+		if key not in self._entries:
+			raise KeyError(key)
+		self._discard(key)
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether the value named by `key` is cached
+		
+		Unlike :meth:`get` this is neither counted as cache hit nor as cache
+		miss and does not affect which entries are evicted next.
+		
+		Arguments
+		---------
+		key
+			Key naming the value to check
+		"""
+		return key in self._entries
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves the cached value at name *key1* to *key2*
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		"""
+		if key1 == key2:
+			return
+		
+		if key1 not in self._entries:
+			raise KeyError(key1)
+		if not replace and key2 in self._entries:
+			raise KeyError(key2)
+		
+		value = self._entries[key1]
+		self._discard(key1)
+		self._store(key2, value)
+	
+	
+	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
+	    -> datastore.util.CacheMetadata:
+		"""Returns the cache hit, miss and eviction counts of this datastore
+		
+		Arguments
+		---------
+		selector
+			Ignored by backing datastores
+		"""
+		return datastore.util.CacheMetadata(
+			hits      = self._hits,
+			misses    = self._misses,
+			evictions = self._evictions,
+		)
+	
+	
+	def __len__(self) -> int:
+		return len(self._entries)
+	
+	
+	async def aclose(self) -> None:
+		"""Drops all cached values"""
+		self._entries.clear()
+		self._policy = self._policy_cls(self._capacity)
+		self._weight = 0
+
+
+class BinaryDatastore(
+		_Datastore[datastore.util.StreamMetadata, datastore.abc.ReceiveStream, bytes],
+		datastore.abc.BinaryDatastore
+):
+	__slots__ = ("_capacity", "_entries", "_evictions", "_hits", "_max_count", "_misses",
+	             "_policy", "_policy_cls", "_weight")
+	
+	def __init__(self, max_size: int, *, policy: policy_t = "lru"):
+		"""
+		Arguments
+		---------
+		max_size
+			The maximum total number of bytes to cache
+		policy
+			The policy to use for selecting the values to evict (``"lru"``,
+			``"lfu"`` or ``"tinylfu"``)
+		"""
+		self._init(max_size, None, policy)
+	
+	
+	def _weigh(self, value: bytes) -> int:
+		return len(value)
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the length of the cached byte sequence named by `key`
+		
+		Arguments
+		---------
+		key
+			Key naming a byte sequence
+		"""
+		return datastore.util.StreamMetadata(size=len(self._lookup(key)))
+	
+	
+	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
+	    -> datastore.util.CacheMetadata:
+		"""Returns the number of bytes cached as well as the cache hit, miss
+		and eviction counts of this datastore
+		
+		Arguments
+		---------
+		selector
+			Ignored by backing datastores
+		"""
+		return datastore.util.CacheMetadata(
+			size          = self._weight,
+			size_accuracy = "exact",
+			hits          = self._hits,
+			misses        = self._misses,
+			evictions     = self._evictions,
+		)
+
+
+class ObjectDatastore(
+		typing.Generic[T_co],
+		_Datastore[datastore.util.ChannelMetadata, datastore.abc.ReceiveChannel[T_co],
+		           typing.List[T_co]],
+		datastore.abc.ObjectDatastore[T_co]
+):
+	__slots__ = ("_capacity", "_entries", "_evictions", "_hits", "_max_count", "_misses",
+	             "_policy", "_policy_cls", "_weigher", "_weight")
+	
+	_weigher: typing.Optional[typing.Callable[[typing.List[T_co]], int]]
+	
+	def __init__(self, max_count: typing.Optional[int] = None, *,
+	             max_weight: typing.Optional[int] = None,
+	             weigher: typing.Optional[typing.Callable[[typing.List[T_co]], int]] = None,
+	             policy: policy_t = "lru"):
+		"""
+		Arguments
+		---------
+		max_count
+			The maximum number of values (object lists) to cache
+		max_weight
+			The maximum total weight of all values to cache
+		weigher
+			Function returning the weight of some value, only used together
+			with *max_weight*; defaults to the number of objects in the value
+		policy
+			The policy to use for selecting the values to evict (``"lru"``,
+			``"lfu"`` or ``"tinylfu"``)
+		
+		Raises
+		------
+		ValueError
+			Neither *max_count* nor *max_weight* was given
+		"""
+		if max_count is None and max_weight is None:
+			raise ValueError("At least one of max_count and max_weight must be given")
+		
+		self._weigher = None
+		if max_weight is not None:
+			self._weigher = weigher if weigher is not None else len
+			self._init(max_weight, max_count, policy)
+		else:
+			assert max_count is not None
+			self._init(max_count, None, policy)
+	
+	
+	def _weigh(self, value: typing.List[T_co]) -> int:
+		# Without a weight limit every value counts as one entry
+		return self._weigher(value) if self._weigher is not None else 1
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.ChannelMetadata:
+		"""Returns the number of objects in the cached list named by `key`
+		
+		Arguments
+		---------
+		key
+			Key naming an object list
+		"""
+		return datastore.util.ChannelMetadata(count=len(self._lookup(key)))
+	
+	
+	async def query(self, query: datastore.Query) -> datastore.Cursor:
+		"""Returns an iterable of the cached objects matching criteria expressed
+		in `query`
+		
+		Only considers the values currently cached, so the last datastore of
+		a tiered adapter should be queried instead.
+		
+		Arguments
+		---------
+		query
+			Query object describing the objects to return.
+		"""
+		return query([  # type: ignore[no-any-return]
+			value for key, value in self._entries.items() if key.path == query.key
+		])
@@ -0,0 +1,462 @@
+"""Splits large values into content-defined chunks
+
+The adapter in this module splits every value written through it into
+chunks of *min_size* to *max_size* bytes (1 – 4 MiB by default) and stores
+each of them as a separate entry of the wrapped datastore, together with a
+small manifest listing the chunks of the value at the value's own key. The
+chunk boundaries are chosen by a rolling hash (“Gear” hash, as used by
+FastCDC) over the value's content rather than at fixed offsets, so that
+inserting or removing some bytes only changes the chunks around the edit.
+
+Chunks are named after the hash of their content and reference counted, so
+that rewriting a partially modified value only writes the chunks that
+actually changed and identical chunks of different values are stored only
+once. The wrapped datastore ends up with the following entries:
+
+ * ``<key>``: The manifest of the value
+ * ``<prefix>/chunks/<hh>/<hash>``: The content of each distinct chunk
+ * ``<prefix>/refs/<hh>/<hash>``: The number of manifests referencing that chunk
+
+The keys below *prefix* (``/_chunks`` by default) are reserved for the
+adapter and must not be used otherwise. Reads fetch several chunks at once
+and support reading only parts of a value (see :meth:`BinaryAdapter.get`)
+without fetching the chunks outside of the requested range.
+
+Note that the chunk boundaries are found byte by byte in pure Python, which
+limits the write throughput of the adapter to about 5 – 10 MiB/s per process
+(see ``benchmarks/chunk_throughput.py``). This runs in a worker thread to
+keep the event loop responsive, but holds the GIL, so concurrent writes are
+no faster. To use several CPU cores, wrap the shards of a
+:mod:`datastore.adapter.processsharded` adapter in this adapter instead.
+"""
+import bisect
+import functools
+import hashlib
+import itertools
+import struct
+import typing
+
+import trio
+
+import datastore
+
+from . import _support
+
+__all__ = ("BinaryAdapter",)
+
+
+DEFAULT_PREFIX      = datastore.Key("/_chunks")
+DEFAULT_MIN_SIZE    = 1 * 1024 * 1024
+DEFAULT_AVG_SIZE    = 2 * 1024 * 1024
+DEFAULT_MAX_SIZE    = 4 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+
+_MAGIC  = b"\x89DSCDC\r\n"
+_HEADER = struct.Struct("<8sI")
+_ENTRY  = struct.Struct("<32sI")
+
+# Gear hash table: A pseudo-random 64-bit value for each possible byte value
+_GEAR = tuple(
+	int.from_bytes(hashlib.blake2b(bytes((idx,)), digest_size=8).digest(), "little")
+	for idx in range(256)
+)
+_GEAR_WINDOW = 64
+
+entries_t = typing.List[typing.Tuple[bytes, int]]
+
+
+def _find_cut(data: bytearray, min_size: int, max_size: int, mask: int) -> int:
+	"""Returns the length of the chunk at the start of *data*"""
+	end = min(len(data), max_size)
+	if end <= min_size:
+		return end
+	
+	# Only the most recent 64 bytes ever affect the value of the hash, so
+	# start hashing just before the minimum chunk size
+	gear = _GEAR
+	hash = 0
+	for idx in range(max(min_size - _GEAR_WINDOW, 0), min_size):
+		hash = ((hash << 1) + gear[data[idx]]) & 0xFFFFFFFFFFFFFFFF
+	for idx in range(min_size, end):
+		hash = ((hash << 1) + gear[data[idx]]) & 0xFFFFFFFFFFFFFFFF
+		if not (hash & mask):
+			return idx + 1
+	return end
+
+
+def _hash_chunk(data: bytes) -> bytes:
+	return hashlib.blake2b(data, digest_size=32).digest()
+
+
+class _ChunkedReceiveStream(datastore.abc.ReceiveStream):
+	"""Fetches the chunks listed in a manifest, several at once, and returns
+	their data in order"""
+	__slots__ = ("_adapter", "_entries", "_index", "_skip", "_remaining", "_pending")
+	
+	_adapter: 'BinaryAdapter'
+	_entries: entries_t
+	_index: int
+	_skip: int
+	_remaining: int
+	_pending: typing.List[bytes]
+	
+	
+	def __init__(self, adapter: 'BinaryAdapter', entries: entries_t, *, offset: int,
+	             length: typing.Optional[int], **kwargs: typing.Any):
+		# Find the chunk containing the first requested byte
+		ends = list(itertools.accumulate(size for _, size in entries))
+		total = ends[-1] if ends else 0
+		offset = min(max(offset, 0), total)
+		remaining = total - offset if length is None else min(length, total - offset)
+		super().__init__(size=remaining, **kwargs)
+		
+		self._adapter   = adapter
+		self._entries   = entries
+		self._index     = bisect.bisect_right(ends, offset)
+		self._skip      = offset - (ends[self._index - 1] if self._index > 0 else 0)
+		self._remaining = remaining
+		self._pending   = []
+	
+	
+	async def _fetch(self) -> None:
+		"""Fetches the next few chunks of the requested range concurrently"""
+		batch: entries_t = []
+		needed = self._skip + self._remaining
+		for digest, size in self._entries[self._index:(self._index + self._adapter.concurrency)]:
+			if needed < 1:
+				break
+			batch.append((digest, size))
+			needed -= size
+		
+		results: typing.List[bytes] = [b""] * len(batch)
+		
+		async def fetch(idx: int, digest: bytes, size: int) -> None:
+			try:
+				data = await self._adapter.child_datastore.get_all(
+					self._adapter._chunk_key(digest)
+				)
+			except KeyError as exc:
+				raise RuntimeError(f"Chunk {digest.hex()} of value is missing") from exc
+			if len(data) != size:
+				raise RuntimeError(f"Chunk {digest.hex()} of value has the wrong size")
+			results[idx] = data
+		
+		async with trio.open_nursery() as nursery:
+			for idx, (digest, size) in enumerate(batch):
+				nursery.start_soon(fetch, idx, digest, size)
+		
+		self._index += len(batch)
+		for data in results:
+			data = data[self._skip:(self._skip + self._remaining)]
+			self._skip = 0
+			self._remaining -= len(data)
+			if data:
+				self._pending.append(data)
+		self._pending.reverse()  # Served from the end
+	
+	
+	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
+		while not self._pending:
+			if self._remaining < 1 or self._index >= len(self._entries):
+				await self.aclose()
+				return b""
+			await self._fetch()
+		
+		data = self._pending.pop()
+		if max_bytes is not None and len(data) > max_bytes:
+			self._pending.append(data[max_bytes:])
+			data = data[:max_bytes]
+		return data
+	
+	
+	async def aclose(self) -> None:
+		self._pending.clear()
+		self._remaining = 0
+
+
+class BinaryAdapter(datastore.abc.BinaryAdapter):
+	"""Stores the values written to the wrapped datastore as content-defined
+	chunks
+	
+	Semantics:
+	
+		* get      : reassembles the value from its chunks (optionally only a part of it)
+		* put      : splits the value into chunks, writes the chunks that are new and
+		             the manifest at *key*
+		* delete   : deletes the manifest at *key* and any chunks no longer referenced
+		* contains : forwarded
+		* stat     : returns the metadata of the manifest with the size of the value
+		* rename   : renames the manifest
+	"""
+	__slots__ = ("prefix", "min_size", "max_size", "concurrency", "_mask", "_lock_keys")
+	
+	FORWARD_CONTAINS = True
+	FORWARD_GET_ALL  = False
+	FORWARD_PUT_NEW  = False
+	FORWARD_RENAME   = False
+	FORWARD_STAT     = False
+	
+	prefix: datastore.Key
+	min_size: int
+	max_size: int
+	concurrency: int
+	
+	_mask: int
+	_lock_keys: _support.KeyLocks
+	
+	
+	def __init__(self, *args: typing.Any, prefix: datastore.Key = DEFAULT_PREFIX,
+	             min_size: int = DEFAULT_MIN_SIZE, avg_size: int = DEFAULT_AVG_SIZE,
+	             max_size: int = DEFAULT_MAX_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+	             **kwargs: typing.Any):
+		"""
+		Arguments
+		---------
+		prefix
+			Key below which to store the chunks and their reference counts
+		min_size
+			Minimum size of each chunk (except for the last one of a value)
+		avg_size
+			Approximate average size of the chunks
+		max_size
+			Maximum size of each chunk
+		concurrency
+			Number of chunks written or fetched at once
+		"""
+		if not (0 < min_size < avg_size < max_size < 2**32):
+			raise ValueError("Chunk sizes must satisfy 0 < min_size < avg_size < max_size < 2³²")
+		
+		self.prefix      = prefix
+		self.min_size    = min_size
+		self.max_size    = max_size
+		self.concurrency = concurrency
+		self._lock_keys  = _support.KeyLocks()
+		
+		# Cut once the topmost bits of the hash are all zero, since the lower
+		# bits only depend on the last few bytes hashed
+		bits = max((avg_size - min_size).bit_length() - 1, 1)
+		self._mask = ((1 << bits) - 1) << (64 - bits)
+		super().__init__(*args, **kwargs)
+	
+	
+	def _chunk_key(self, digest: bytes) -> datastore.Key:
+		return self.prefix.child("chunks").child(digest.hex()[:2]).child(digest.hex())
+	
+	
+	def _refs_key(self, digest: bytes) -> datastore.Key:
+		return self.prefix.child("refs").child(digest.hex()[:2]).child(digest.hex())
+	
+	
+	# Manifests
+	
+	
+	@staticmethod
+	def _encode_manifest(entries: entries_t) -> bytes:
+		return _HEADER.pack(_MAGIC, len(entries)) \
+		       + b"".join(_ENTRY.pack(digest, size) for digest, size in entries)
+	
+	
+	async def _open_manifest(self, key: datastore.Key) \
+	      -> typing.Tuple[typing.Optional[entries_t], datastore.abc.ReceiveStream]:
+		"""Returns the chunks listed in the manifest at *key* (or `None` if it
+		holds a value stored without this adapter) and a stream of the value
+		stored at *key* itself"""
+		source = await self.child_datastore.get(key)
+		buffer = bytearray()
+		try:
+			if await _support.read_up_to(source, buffer, _HEADER.size):
+				magic, count = _HEADER.unpack_from(buffer)
+				if magic == _MAGIC:
+					end = _HEADER.size + count * _ENTRY.size
+					if not await _support.read_up_to(source, buffer, end):
+						raise RuntimeError(f"Manifest at {key} is truncated")
+					entries = [
+						_ENTRY.unpack_from(buffer, offset)
+						for offset in range(_HEADER.size, end, _ENTRY.size)
+					]
+					return entries, source
+		except BaseException:
+			await source.aclose()
+			raise
+		
+		# Not written by us – pass through the original data unchanged
+		return None, _support.PrefixedReceiveStream(source, bytes(buffer))
+	
+	
+	async def _read_manifest(self, key: datastore.Key) -> typing.Optional[entries_t]:
+		try:
+			entries, stream = await self._open_manifest(key)
+		except KeyError:
+			return None
+		await stream.aclose()
+		return entries
+	
+	
+	# Reference counting
+	
+	
+	async def _incref(self, digest: bytes, data: bytes) -> None:
+		await _support.incref(self.child_datastore, self._lock_keys, self._chunk_key(digest),
+		                      self._refs_key(digest), data)
+	
+	
+	async def _decref(self, entries: entries_t) -> None:
+		for digest, _ in entries:
+			await _support.decref(self.child_datastore, self._lock_keys, self._chunk_key(digest),
+			                      self._refs_key(digest))
+	
+	
+	async def _store_chunks(self, value: datastore.abc.ReceiveStream) -> entries_t:
+		"""Splits *value* into chunks and stores them, returning the list of
+		chunks (with one reference to each already added)"""
+		entries: typing.List[typing.Optional[typing.Tuple[bytes, int]]] = []
+		# Bounds the number of chunks held in memory at once
+		in_flight = trio.Semaphore(self.concurrency)
+		
+		async def store(idx: int, data: bytes) -> None:
+			try:
+				digest = await trio.to_thread.run_sync(_hash_chunk, data)
+				await self._incref(digest, data)
+				entries[idx] = (digest, len(data))
+			finally:
+				in_flight.release()
+		
+		try:
+			async with value, trio.open_nursery() as nursery:
+				buffer = bytearray()
+				more = True
+				while True:
+					if more:
+						more = await _support.read_up_to(value, buffer, self.max_size)
+					if not buffer:
+						break
+					
+					cut = await trio.to_thread.run_sync(
+						_find_cut, buffer, self.min_size, self.max_size, self._mask
+					)
+					data = bytes(buffer[:cut])
+					del buffer[:cut]
+					
+					await in_flight.acquire()
+					entries.append(None)
+					nursery.start_soon(store, len(entries) - 1, data)
+		except BaseException:
+			with trio.CancelScope(shield=True):
+				await self._decref([entry for entry in entries if entry is not None])
+			raise
+		return typing.cast(entries_t, entries)
+	
+	
+	async def _put_manifest(self, key: datastore.Key, value: datastore.abc.ReceiveStream,
+	                        write: typing.Callable[[datastore.abc.ReceiveStream],
+	                                               typing.Awaitable[None]]) -> None:
+		entries = await self._store_chunks(value)
+		try:
+			async with self._lock_keys(key):
+				previous = await self._read_manifest(key)
+				await write(datastore.util.receive_stream_from(self._encode_manifest(entries)))
+		except BaseException:
+			with trio.CancelScope(shield=True):
+				await self._decref(entries)
+			raise
+		
+		# Chunks shared with the previous version were referenced again above
+		# and therefore stay
+		if previous is not None:
+			await self._decref(previous)
+	
+	
+	async def get(self, key: datastore.Key, *,  # type: ignore[override]
+	              offset: int = 0, length: typing.Optional[int] = None) \
+	      -> datastore.abc.ReceiveStream:
+		"""Returns a stream of the value named by *key*, reassembled from its
+		chunks
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		offset
+			Number of bytes to skip at the start of the value; chunks before
+			that offset are not fetched at all
+		length
+			Maximum number of bytes to return, ``None`` to read up to the end
+			of the value
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		RuntimeError
+			Some chunk of the value is missing
+		"""
+		entries, stream = await self._open_manifest(key)
+		if entries is None:
+			if offset == 0 and length is None:
+				return stream
+			# Ranged reads of values stored without this adapter
+			data = await stream.collect()
+			end = offset + length if length is not None else len(data)
+			return datastore.util.receive_stream_from(data[offset:end])
+		
+		metadata = {"atime": stream.atime, "mtime": stream.mtime, "btime": stream.btime}
+		await stream.aclose()
+		return _ChunkedReceiveStream(self, entries, offset=offset, length=length, **metadata)
+	
+	
+	async def _put(self, key: datastore.Key, value: datastore.abc.ReceiveStream, *,
+	               create: bool, replace: bool, **kwargs: typing.Any) -> None:
+		"""Stores the chunks of *value* that are new and its manifest at name
+		*key*"""
+		await self._put_manifest(key, value, functools.partial(
+			self.child_datastore._put, key, create=create, replace=replace, **kwargs
+		))
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key, **kwargs: typing.Any) \
+	      -> datastore.abc.BinaryDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores the chunks of the stream passed to the returned callback and
+		its manifest below *prefix*"""
+		key, callback = await self.child_datastore._put_new_indirect(prefix, **kwargs)
+		
+		async def callback_wrapper(value: datastore.abc.ReceiveStream) -> None:
+			await self._put_manifest(key, value, callback)
+		return key, callback_wrapper
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the manifest at *key* and any of its chunks that are no
+		longer referenced by other manifests"""
+		async with self._lock_keys(key):
+			entries = await self._read_manifest(key)
+			await self.child_datastore.delete(key)
+		
+		if entries is not None:
+			await self._decref(entries)
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves the manifest at *key1* to *key2*"""
+		async with self._lock_keys(key1, key2):
+			previous = await self._read_manifest(key2) if key1 != key2 else None
+			await self.child_datastore.rename(key1, key2, replace=replace)
+		
+		if previous is not None:
+			await self._decref(previous)
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the metadata of the manifest at *key*, with the size of the
+		entire value"""
+		metadata = await self.child_datastore.stat(key)
+		entries = await self._read_manifest(key)
+		if entries is None:
+			return metadata
+		
+		return datastore.util.StreamMetadata(
+			atime = metadata.atime,
+			mtime = metadata.mtime,
+			btime = metadata.btime,
+			size  = sum(size for _, size in entries),
+		)
@@ -0,0 +1,202 @@
+"""Coalesces concurrent lookups of the same key into a single request
+
+When many tasks request the same key at once (for instance right after it
+was evicted from some cache), the adapters in this module only forward the
+first of these requests to the wrapped datastore and hand its result to all
+other tasks that asked for the same key while it was still in flight
+(“single-flight”). Placed in front of a :mod:`tiered <datastore.adapter.tiered>`
+datastore, this also means that the value is only copied to the upper tiers
+once.
+
+To do this, the value returned by :meth:`~_Adapter.get` is read into memory
+in its entirety and each caller receives its own stream over that (shared,
+immutable) buffer. Only wrap datastores with values that comfortably fit
+into memory.
+"""
+import copy
+import typing
+
+import trio
+
+import datastore
+
+from ._support import DS, MD, RT, RV, T_co
+
+__all__ = (
+	"BinaryAdapter",
+	"ObjectAdapter",
+)
+
+
+T = typing.TypeVar("T")
+
+
+class _Flight(typing.Generic[T]):
+	"""A request to the wrapped datastore that other tasks may wait for"""
+	__slots__ = ("done", "error", "value")
+	
+	done: trio.Event
+	error: typing.Optional[BaseException]
+	value: typing.Optional[T]
+	
+	def __init__(self) -> None:
+		self.done  = trio.Event()
+		self.error = None
+		self.value = None
+
+
+class _Adapter(typing.Generic[DS, MD, RT, RV]):
+	"""Represents a datastore adapter that shares the results of concurrent
+	lookups of the same key
+	
+	Semantics:
+	
+		* get      : shares the value with concurrent get/get_all calls
+		* get_all  : shares the value with concurrent get/get_all calls
+		* contains : shares the result with concurrent contains calls
+		* stat     : shares the result with concurrent stat calls
+		* put, delete, rename : forwarded; lookups started afterwards will
+		                        not share results with lookups started before
+	
+	If the task that forwarded a lookup is cancelled, one of the tasks waiting
+	for its result will retry the lookup instead.
+	"""
+	__slots__ = ()
+	
+	FORWARD_CONTAINS = True
+	FORWARD_GET_ALL  = True
+	FORWARD_PUT_NEW  = True
+	FORWARD_RENAME   = True
+	FORWARD_STAT     = True
+	
+	_flights: typing.Dict[typing.Tuple[str, datastore.Key], _Flight[typing.Any]]
+	
+	
+	def __init__(self, *args: typing.Any, **kwargs: typing.Any):
+		self._flights = {}
+		super().__init__(*args, **kwargs)  # type: ignore[call-arg]
+	
+	
+	async def _coalesce(self, op: str, key: datastore.Key,
+	                    func: typing.Callable[[datastore.Key], typing.Awaitable[T]]) -> T:
+		while True:
+			flight: typing.Optional[_Flight[T]] = self._flights.get((op, key))
+			if flight is None:
+				flight = self._flights[(op, key)] = _Flight()
+				try:
+					flight.value = await func(key)
+					return flight.value
+				except BaseException as exc:
+					flight.error = exc
+					raise
+				finally:
+					if self._flights.get((op, key)) is flight:
+						del self._flights[(op, key)]
+					flight.done.set()
+			
+			await flight.done.wait()
+			if flight.error is None:
+				return flight.value  # type: ignore[return-value]
+			elif not isinstance(flight.error, trio.Cancelled):
+				# Raise a copy of the error, since raising the same exception
+				# object from several tasks mangles its traceback
+				raise copy.copy(flight.error) from flight.error
+			# Retry if the task doing the lookup for us was cancelled
+	
+	
+	def _detach(self, *keys: datastore.Key) -> None:
+		"""Ensures that lookups of the given keys that are still in flight are
+		not shared with any further callers"""
+		for key in keys:
+			for op in ("value", "contains", "stat"):
+				self._flights.pop((op, key), None)
+	
+	
+	async def _get_value(self, key: datastore.Key) -> RV:
+		value: RV = await super().get_all(key)  # type: ignore[misc]
+		if isinstance(value, list):
+			value = tuple(value)  # type: ignore[assignment]  # Make it immutable
+		return value
+	
+	
+	async def get(self, key: datastore.Key) -> RT:
+		"""Returns a stream of the data named by *key*, sharing the lookup with
+		concurrent calls of :meth:`get` and :meth:`get_all`"""
+		value: RV = await self._coalesce("value", key, self._get_value)
+		if isinstance(self, datastore.abc.BinaryDatastore):
+			return datastore.util.receive_stream_from(value)  # type: ignore[return-value, arg-type]
+		elif isinstance(self, datastore.abc.ObjectDatastore):
+			return datastore.util.receive_channel_from(value)  # type: ignore[return-value, arg-type]
+		else:
+			assert False
+	
+	
+	async def get_all(self, key: datastore.Key) -> RV:
+		"""Returns the data named by *key*, sharing the lookup with concurrent
+		calls of :meth:`get` and :meth:`get_all`"""
+		value: RV = await self._coalesce("value", key, self._get_value)
+		if isinstance(value, tuple):
+			return list(value)  # type: ignore[return-value]
+		return value
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by *key* exists, sharing the lookup
+		with concurrent calls"""
+		return await self._coalesce("contains", key, super().contains)  # type: ignore[misc]
+	
+	
+	async def stat(self, key: datastore.Key) -> MD:
+		"""Returns the metadata of the data named by *key*, sharing the lookup
+		with concurrent calls"""
+		return await self._coalesce("stat", key, super().stat)  # type: ignore[misc]
+	
+	
+	async def _put(self, key: datastore.Key, value: RT, **kwargs: typing.Any) -> None:
+		"""Stores *value* at name *key*"""
+		try:
+			await super()._put(key, value, **kwargs)  # type: ignore[misc]
+		finally:
+			self._detach(key)
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the data named by *key*"""
+		try:
+			await super().delete(key)  # type: ignore[misc]
+		finally:
+			self._detach(key)
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Renames item *key1* to *key2*"""
+		try:
+			await super().rename(key1, key2, replace=replace)  # type: ignore[misc]
+		finally:
+			self._detach(key1, key2)
+
+
+class BinaryAdapter(
+		_Adapter[
+			datastore.abc.BinaryDatastore,
+			datastore.util.StreamMetadata,
+			datastore.abc.ReceiveStream,
+			bytes
+		],
+		datastore.abc.BinaryAdapter
+):
+	__slots__ = ("_flights",)
+
+
+class ObjectAdapter(
+		typing.Generic[T_co],
+		_Adapter[
+			datastore.abc.ObjectDatastore[T_co],
+			datastore.util.ChannelMetadata,
+			datastore.abc.ReceiveChannel[T_co],
+			typing.List[T_co]
+		],
+		datastore.abc.ObjectAdapter[T_co, T_co]
+):
+	__slots__ = ("_flights",)
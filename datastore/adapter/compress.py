@@ -0,0 +1,461 @@
+"""Transparently compresses the values stored in the wrapped datastore
+
+Values are split into frames of a fixed uncompressed size (*frame_size*)
+which are compressed independently of each other using one of the codecs of
+the standard library (``"zlib"``, ``"bz2"`` or ``"lzma"``). All of these
+release the GIL while working, so the frames of a value are compressed in
+several worker threads at once. Every frame is preceded by a small header
+stating the codec used and its compressed and uncompressed size, allowing
+ranged reads (see :meth:`BinaryAdapter.get`) to skip over frames without
+decompressing them.
+
+Data that does not compress well (such as already compressed media) is
+detected by sampling the compression ratio of every 16th frame: the frames
+following a sample that did not shrink by at least 5 % are stored
+uncompressed. Values stored before wrapping the datastore with this adapter
+(i.e. ones lacking the header added by it) are returned unchanged.
+
+The stored format is::
+
+	value  := header frame*
+	header := magic:8s  size:u64le  (size is 2⁶⁴-1 if unknown when writing)
+	frame  := codec:u8  raw_size:u32le  data_size:u32le  data:bytes[data_size]
+"""
+import bz2
+import functools
+import lzma
+import os
+import struct
+import typing
+import zlib
+
+import trio
+
+import datastore
+
+__all__ = ("BinaryAdapter",)
+
+
+if typing.TYPE_CHECKING:
+	from typing_extensions import Literal as typing_Literal
+elif hasattr(typing, "Literal"):  #PY38+
+	from typing import Literal as typing_Literal
+else:  #PY37-
+	from typing import Union as typing_Literal
+
+codec_t = typing_Literal["zlib", "bz2", "lzma"]
+
+
+DEFAULT_FRAME_SIZE = 256 * 1024
+
+#: Compressed/uncompressed size ratio above which a frame counts as incompressible
+INCOMPRESSIBLE_RATIO = 0.95
+#: Number of frames after which compression is attempted again
+SAMPLE_INTERVAL = 16
+
+_MAGIC        = b"\x89DSZFR\r\n"
+_HEADER       = struct.Struct("<8sQ")
+_FRAME_HEADER = struct.Struct("<BII")
+_UNKNOWN_SIZE = 2**64 - 1
+
+_CODEC_STORED = 0
+_CODECS: typing.Dict[str, int] = {
+	"zlib": 1,
+	"bz2":  2,
+	"lzma": 3,
+}
+
+
+def _compress(codec: int, level: typing.Optional[int], data: bytes) -> bytes:
+	if codec == _CODECS["zlib"]:
+		return zlib.compress(data, level if level is not None else zlib.Z_DEFAULT_COMPRESSION)
+	elif codec == _CODECS["bz2"]:
+		return bz2.compress(data, level if level is not None else 9)
+	elif codec == _CODECS["lzma"]:
+		return lzma.compress(data, preset=level)
+	else:
+		assert False
+
+
+def _decompress(codec: int, data: bytes) -> bytes:
+	if codec == _CODECS["zlib"]:
+		return zlib.decompress(data)
+	elif codec == _CODECS["bz2"]:
+		return bz2.decompress(data)
+	elif codec == _CODECS["lzma"]:
+		return lzma.decompress(data)
+	else:
+		raise RuntimeError(f"Unknown compression codec {codec} in stored value")
+
+
+class _Frame:
+	"""A frame being compressed in some worker thread"""
+	__slots__ = ("done", "codec", "raw_size", "data")
+	
+	done: trio.Event
+	codec: int
+	raw_size: int
+	data: bytes
+	
+	def __init__(self, raw_size: int) -> None:
+		self.done     = trio.Event()
+		self.codec    = _CODEC_STORED
+		self.raw_size = raw_size
+		self.data     = b""
+
+
+async def _read_frame(source: trio.abc.ReceiveStream, buffer: bytearray, size: int) -> bytes:
+	"""Reads up to *size* bytes from *source* (after the ones in *buffer*)"""
+	while len(buffer) < size:
+		chunk = await source.receive_some(size - len(buffer))
+		if len(chunk) < 1:
+			break
+		buffer += chunk
+	
+	result = bytes(buffer[:size])
+	del buffer[:size]
+	return result
+
+
+class _DecompressingReceiveStream(datastore.abc.ReceiveStream):
+	__slots__ = ("_source", "_buffer", "_framed", "_limiter", "_skip", "_remaining", "_pending")
+	
+	_source: datastore.abc.ReceiveStream
+	_buffer: bytearray
+	_framed: bool
+	_limiter: trio.CapacityLimiter
+	_skip: int
+	_remaining: typing.Optional[int]
+	_pending: bytes
+	
+	
+	def __init__(self, source: datastore.abc.ReceiveStream, buffer: bytearray, framed: bool,
+	             limiter: trio.CapacityLimiter, *, offset: int, length: typing.Optional[int],
+	             size: typing.Optional[int]):
+		super().__init__(atime=source.atime, mtime=source.mtime, btime=source.btime, size=size)
+		
+		self._source    = source
+		self._buffer    = buffer
+		self._framed    = framed
+		self._limiter   = limiter
+		self._skip      = offset
+		self._remaining = length
+		self._pending   = b""
+	
+	
+	@classmethod
+	async def open(cls, source: datastore.abc.ReceiveStream, limiter: trio.CapacityLimiter, *,
+	               offset: int, length: typing.Optional[int]) -> '_DecompressingReceiveStream':
+		"""Reads the header of the value in *source* and returns a stream of its
+		decompressed data"""
+		buffer = bytearray()
+		try:
+			header = await _read_frame(source, buffer, _HEADER.size)
+		except BaseException:
+			await source.aclose()
+			raise
+		
+		framed = False
+		magic, size = _HEADER.unpack(header) if len(header) == _HEADER.size else (None, 0)
+		if magic == _MAGIC:
+			framed = True
+		else:
+			# Not written by us – pass through the original data unchanged
+			buffer[0:0] = header
+			size = source.size if source.size is not None else _UNKNOWN_SIZE
+		
+		if size == _UNKNOWN_SIZE:
+			size = None
+		else:
+			size = max(size - offset, 0)
+			if length is not None:
+				size = min(size, length)
+		return cls(source, buffer, framed, limiter, offset=offset, length=length, size=size)
+	
+	
+	async def _receive_raw(self) -> bytes:
+		if self._buffer:
+			chunk = bytes(self._buffer)
+			self._buffer.clear()
+			return chunk
+		return typing.cast(bytes, await self._source.receive_some())
+	
+	
+	async def _receive_frame(self) -> typing.Optional[bytes]:
+		"""Returns the data of the next frame not skipped, or `None` at the end"""
+		while True:
+			if not self._framed:
+				chunk = await self._receive_raw()
+				if len(chunk) < 1:
+					return None
+				elif self._skip >= len(chunk):
+					self._skip -= len(chunk)
+					continue
+				return chunk
+			
+			header = await _read_frame(self._source, self._buffer, _FRAME_HEADER.size)
+			if len(header) < 1:
+				return None
+			elif len(header) < _FRAME_HEADER.size:
+				raise RuntimeError("Stored compressed value is truncated")
+			codec, raw_size, data_size = _FRAME_HEADER.unpack(header)
+			
+			data = await _read_frame(self._source, self._buffer, data_size)
+			if len(data) < data_size:
+				raise RuntimeError("Stored compressed value is truncated")
+			elif self._skip >= raw_size:
+				# Skip frames before the requested range without decompressing them
+				self._skip -= raw_size
+				continue
+			
+			if codec == _CODEC_STORED:
+				return data
+			return await trio.to_thread.run_sync(_decompress, codec, data, limiter=self._limiter)
+	
+	
+	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
+		while len(self._pending) < 1:
+			chunk = None
+			if self._remaining is None or self._remaining > 0:
+				chunk = await self._receive_frame()
+			if chunk is None:
+				await self.aclose()
+				return b""
+			
+			chunk = chunk[self._skip:]
+			self._skip = 0
+			if self._remaining is not None:
+				chunk = chunk[:self._remaining]
+				self._remaining -= len(chunk)
+			self._pending = chunk
+		
+		if max_bytes is None or max_bytes >= len(self._pending):
+			result, self._pending = self._pending, b""
+		else:
+			result, self._pending = self._pending[:max_bytes], self._pending[max_bytes:]
+		return result
+	
+	
+	async def _scan_size(self) -> int:
+		"""Determines the uncompressed size of the value from its frame headers"""
+		assert self._skip == 0
+		size = 0
+		while not self._framed:
+			chunk = await self._receive_raw()
+			if len(chunk) < 1:
+				return size
+			size += len(chunk)
+		
+		while True:
+			header = await _read_frame(self._source, self._buffer, _FRAME_HEADER.size)
+			if len(header) < _FRAME_HEADER.size:
+				return size
+			_, raw_size, data_size = _FRAME_HEADER.unpack(header)
+			size += raw_size
+			
+			# Discard the frame data in small pieces
+			while data_size > 0:
+				chunk = await _read_frame(self._source, self._buffer,
+				                          min(data_size, DEFAULT_FRAME_SIZE))
+				if len(chunk) < 1:
+					raise RuntimeError("Stored compressed value is truncated")
+				data_size -= len(chunk)
+	
+	
+	async def aclose(self) -> None:
+		self._buffer.clear()
+		self._pending = b""
+		await self._source.aclose()
+
+
+class BinaryAdapter(datastore.abc.BinaryAdapter):
+	"""Compresses all values written to the wrapped datastore and decompresses
+	them again when read
+	
+	Semantics:
+	
+		* get      : decompresses the stored value (optionally only a part of it)
+		* put      : compresses the value in frames using several worker threads
+		* stat     : reports the uncompressed size of the value
+		* datastore_stats : forwarded (reports the compressed sizes)
+	"""
+	__slots__ = ("codec", "level", "frame_size", "_limiter")
+	
+	FORWARD_CONTAINS = True
+	FORWARD_GET_ALL  = False
+	FORWARD_PUT_NEW  = False
+	FORWARD_RENAME   = True
+	FORWARD_STAT     = False
+	
+	codec: codec_t
+	level: typing.Optional[int]
+	frame_size: int
+	
+	_limiter: trio.CapacityLimiter
+	
+	
+	def __init__(self, *args: typing.Any, codec: codec_t = "zlib",
+	             level: typing.Optional[int] = None, frame_size: int = DEFAULT_FRAME_SIZE,
+	             threads: typing.Optional[int] = None, **kwargs: typing.Any):
+		"""
+		Arguments
+		---------
+		codec
+			The compression algorithm used for new values
+		level
+			The compression level (or preset for ``"lzma"``) passed to the
+			codec, ``None`` to use the codec's default
+		frame_size
+			The uncompressed size of the independently compressed frames
+			values are split into; larger frames compress better, but make
+			ranged reads more expensive
+		threads
+			The maximum number of frames compressed or decompressed at once
+			(defaults to the number of CPUs)
+		"""
+		if codec not in _CODECS:
+			raise ValueError(f"Unsupported compression codec {codec!r}")
+		if not (0 < frame_size < 2**32):
+			raise ValueError("frame_size must be between 1 and 2³²-1")
+		
+		self.codec      = codec
+		self.level      = level
+		self.frame_size = frame_size
+		self._limiter   = trio.CapacityLimiter(threads if threads is not None
+		                                       else (os.cpu_count() or 1))
+		super().__init__(*args, **kwargs)
+	
+	
+	async def get(self, key: datastore.Key, *,  # type: ignore[override]
+	              offset: int = 0, length: typing.Optional[int] = None) \
+	      -> datastore.abc.ReceiveStream:
+		"""Returns a stream of the decompressed data named by *key*
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		offset
+			Number of bytes to skip at the start of the value; entire frames
+			before that offset are skipped without decompressing them
+		length
+			Maximum number of bytes to return, ``None`` to read up to the end
+			of the value
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		RuntimeError
+			The stored value is corrupt
+		"""
+		return await _DecompressingReceiveStream.open(await super().get(key), self._limiter,
+		                                              offset=offset, length=length)
+	
+	
+	async def _compress_frames(self, value: datastore.abc.ReceiveStream,
+	                           frames: trio.abc.SendChannel[_Frame]) -> None:
+		codec = _CODECS[self.codec]
+		
+		async def compress(frame: _Frame, data: bytes) -> None:
+			nonlocal skip
+			compressed = await trio.to_thread.run_sync(
+				_compress, codec, self.level, data, limiter=self._limiter
+			)
+			if len(compressed) > len(data) * INCOMPRESSIBLE_RATIO:
+				skip = SAMPLE_INTERVAL - 1
+			if len(compressed) < len(data):
+				frame.codec, frame.data = codec, compressed
+			else:
+				frame.data = data
+			frame.done.set()
+		
+		skip = 0
+		buffer = bytearray()
+		async with frames, trio.open_nursery() as nursery:
+			while True:
+				data = await _read_frame(value, buffer, self.frame_size)
+				if len(data) < 1:
+					break
+				
+				frame = _Frame(len(data))
+				if skip > 0:
+					# Recently sampled data did not compress well – store as-is
+					skip -= 1
+					frame.data = data
+					frame.done.set()
+				else:
+					nursery.start_soon(compress, frame, data)
+				
+				try:
+					await frames.send(frame)
+				except trio.BrokenResourceError:
+					nursery.cancel_scope.cancel()
+					break
+	
+	
+	async def _put_compressed(self, value: datastore.abc.ReceiveStream,
+	                          write: typing.Callable[[datastore.abc.ReceiveStream],
+	                                                 typing.Awaitable[None]]) -> None:
+		size = getattr(value, "size", None)
+		
+		async def receive_frames(frames: trio.abc.ReceiveChannel[_Frame]) \
+		      -> typing.AsyncIterator[bytes]:
+			yield _HEADER.pack(_MAGIC, size if size is not None else _UNKNOWN_SIZE)
+			
+			total = 0
+			async for frame in frames:
+				await frame.done.wait()
+				total += frame.raw_size
+				yield _FRAME_HEADER.pack(frame.codec, frame.raw_size, len(frame.data))
+				yield frame.data
+			
+			if size is not None and total != size:
+				raise RuntimeError(f"Value stream was {total} bytes long, but declared a "
+				                   f"size of {size} bytes")
+		
+		# Allow each compression thread to work ahead by one frame
+		send_channel, receive_channel = trio.open_memory_channel(self._limiter.total_tokens)
+		async with trio.open_nursery() as nursery:
+			nursery.start_soon(self._compress_frames, value, send_channel)
+			async with receive_channel:
+				await write(datastore.util.receive_stream_from(receive_frames(receive_channel)))
+	
+	
+	async def _put(self, key: datastore.Key, value: datastore.abc.ReceiveStream,
+	               **kwargs: typing.Any) -> None:
+		"""Stores the compressed data from *value* at name *key*"""
+		await self._put_compressed(value, functools.partial(super()._put, key, **kwargs))
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key, **kwargs: typing.Any) \
+	      -> datastore.abc.BinaryDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores the compressed data from the stream passed to the returned
+		callback below *prefix*"""
+		key, callback = await self.child_datastore._put_new_indirect(prefix, **kwargs)
+		
+		async def callback_wrapper(value: datastore.abc.ReceiveStream) -> None:
+			await self._put_compressed(value, callback)
+		return key, callback_wrapper
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the metadata of the data named by *key*, including its
+		uncompressed size
+		
+		If the uncompressed size was unknown when storing the value, this
+		needs to read the entire (compressed) value.
+		"""
+		metadata = await self.child_datastore.stat(key)
+		
+		async with await self.get(key) as stream:
+			size = stream.size
+			if size is None:
+				size = await typing.cast(_DecompressingReceiveStream, stream)._scan_size()
+		
+		return datastore.util.StreamMetadata(
+			atime = metadata.atime,
+			mtime = metadata.mtime,
+			btime = metadata.btime,
+			size  = size,
+		)
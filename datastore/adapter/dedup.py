@@ -0,0 +1,309 @@
+"""Stores identical values only once
+
+The adapter in this module hashes every value written through it and stores
+its content only once per distinct hash, no matter how many keys it is
+written to. The wrapped datastore ends up with the following entries:
+
+ * ``<key>``: A small reference record naming the hash of the value
+ * ``<prefix>/content/<hh>/<hash>``: The content of each distinct value
+ * ``<prefix>/refs/<hh>/<hash>``: The number of keys referencing that content
+
+Content is deleted once the last key referencing it is deleted or replaced.
+The keys below *prefix* (``/_dedup`` by default) are reserved for the
+adapter and must not be used otherwise.
+
+Values of up to *spool_size* bytes are hashed in memory, so no content is
+written at all if a value turns out to be known already. Larger values are
+streamed to a temporary key while being hashed and only moved into place if
+their content is new, so values are never buffered in memory entirely.
+
+Changes are ordered such that a crash may leak content, but never leaves a
+key referencing content that does not exist. Reference counts are only
+coordinated between the tasks of a single adapter instance: Do not write to
+the same wrapped datastore through several adapters at once.
+"""
+import contextlib
+import functools
+import hashlib
+import struct
+import typing
+import uuid
+
+import trio
+
+import datastore
+
+from . import _support
+
+__all__ = ("BinaryAdapter",)
+
+
+DEFAULT_ALGORITHM  = "sha256"
+DEFAULT_PREFIX     = datastore.Key("/_dedup")
+DEFAULT_SPOOL_SIZE = 64 * 1024
+
+_MAGIC  = b"\x89DSDDUP\n"
+_HEADER = struct.Struct("<8sB")
+
+
+class _HashingReceiveStream(datastore.abc.ReceiveStream):
+	"""Passes through the data of *source* while feeding it to *hash*"""
+	__slots__ = ("_source", "_prefix", "hash")
+	
+	_source: datastore.abc.ReceiveStream
+	_prefix: bytes
+	hash: typing.Any  # hashlib._Hash
+	
+	def __init__(self, source: datastore.abc.ReceiveStream, prefix: bytes, hash: typing.Any):
+		super().__init__(size=source.size)
+		
+		self._source = source
+		self._prefix = prefix
+		self.hash    = hash
+	
+	
+	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
+		if self._prefix:
+			chunk, self._prefix = self._prefix, b""
+		else:
+			chunk = await self._source.receive_some(max_bytes)
+		self.hash.update(chunk)
+		return chunk
+	
+	
+	async def aclose(self) -> None:
+		await self._source.aclose()
+
+
+class BinaryAdapter(datastore.abc.BinaryAdapter):
+	"""Stores the content of values written to the wrapped datastore only once
+	per distinct hash
+	
+	Semantics:
+	
+		* get      : resolves the reference stored at *key* to the content
+		* put      : hashes the value, stores its content if new and a reference to it at *key*
+		* delete   : deletes the reference at *key* and the content if no longer referenced
+		* contains : forwarded
+		* stat     : returns the metadata of the content (with the reference's times)
+		* rename   : renames the reference
+	"""
+	__slots__ = ("algorithm", "prefix", "spool_size", "_lock_keys")
+	
+	FORWARD_CONTAINS = True
+	FORWARD_GET_ALL  = False
+	FORWARD_PUT_NEW  = False
+	FORWARD_RENAME   = False
+	FORWARD_STAT     = False
+	
+	algorithm: str
+	prefix: datastore.Key
+	spool_size: int
+	
+	_lock_keys: _support.KeyLocks
+	
+	
+	def __init__(self, *args: typing.Any, algorithm: str = DEFAULT_ALGORITHM,
+	             prefix: datastore.Key = DEFAULT_PREFIX,
+	             spool_size: int = DEFAULT_SPOOL_SIZE, **kwargs: typing.Any):
+		"""
+		Arguments
+		---------
+		algorithm
+			Name of the :mod:`hashlib` algorithm used to identify content;
+			must not be changed once the wrapped datastore holds any data
+		prefix
+			Key below which to store the content and reference counts
+		spool_size
+			Size up to which values are hashed in memory before storing them
+		"""
+		hashlib.new(algorithm)  # Raises `ValueError` for unknown algorithms
+		
+		self.algorithm  = algorithm
+		self.prefix     = prefix
+		self.spool_size = spool_size
+		self._lock_keys = _support.KeyLocks()
+		super().__init__(*args, **kwargs)
+	
+	
+	def _content_key(self, digest: str) -> datastore.Key:
+		return self.prefix.child("content").child(digest[:2]).child(digest)
+	
+	
+	def _refs_key(self, digest: str) -> datastore.Key:
+		return self.prefix.child("refs").child(digest[:2]).child(digest)
+	
+	
+	# Reference records
+	
+	
+	def _encode_ref(self, digest: str) -> bytes:
+		name = f"{self.algorithm}:{digest}".encode("ascii")
+		return _HEADER.pack(_MAGIC, len(name)) + name
+	
+	
+	async def _open_ref(self, key: datastore.Key) \
+	      -> typing.Tuple[typing.Optional[str], datastore.abc.ReceiveStream]:
+		"""Returns the content hash referenced by *key* (or `None` if it holds
+		a value stored without this adapter) and a stream of the value stored
+		at *key* itself"""
+		source = await self.child_datastore.get(key)
+		buffer = bytearray()
+		try:
+			if await _support.read_up_to(source, buffer, _HEADER.size):
+				magic, length = _HEADER.unpack_from(buffer)
+				if magic == _MAGIC:
+					end = _HEADER.size + length
+					await _support.read_up_to(source, buffer, end)
+					algorithm, _, digest = buffer[_HEADER.size:end].decode("ascii").partition(":")
+					if algorithm != self.algorithm:
+						raise RuntimeError(f"Value at {key} was stored using hash algorithm "
+						                   f"{algorithm}, not {self.algorithm}")
+					return digest, source
+		except BaseException:
+			await source.aclose()
+			raise
+		
+		# Not written by us – pass through the original data unchanged
+		return None, _support.PrefixedReceiveStream(source, bytes(buffer))
+	
+	
+	async def _read_ref(self, key: datastore.Key) -> typing.Optional[str]:
+		try:
+			digest, stream = await self._open_ref(key)
+		except KeyError:
+			return None
+		await stream.aclose()
+		return digest
+	
+	
+	# Reference counting
+	
+	
+	async def _incref(self, digest: str, content: typing.Union[bytes, datastore.Key]) -> None:
+		await _support.incref(self.child_datastore, self._lock_keys, self._content_key(digest),
+		                      self._refs_key(digest), content)
+	
+	
+	async def _decref(self, digest: str) -> None:
+		await _support.decref(self.child_datastore, self._lock_keys, self._content_key(digest),
+		                      self._refs_key(digest))
+	
+	
+	async def _store_content(self, value: datastore.abc.ReceiveStream) -> str:
+		"""Hashes and stores the content of *value*, returning its hash (with
+		one reference to it already added)"""
+		async with value:
+			hash = hashlib.new(self.algorithm)
+			buffer = bytearray()
+			if not await _support.read_up_to(value, buffer, self.spool_size + 1):
+				spooled = bytes(buffer)
+				hash.update(spooled)
+				digest = hash.hexdigest()
+				await self._incref(digest, spooled)
+				return digest
+			
+			# Too large to hash in memory – spool it to a temporary key instead
+			temp_key = self.prefix.child("tmp").child(uuid.uuid4().hex)
+			stream = _HashingReceiveStream(value, bytes(buffer), hash)
+			await self.child_datastore._put(temp_key, stream, create=True, replace=True)
+		try:
+			digest = stream.hash.hexdigest()
+			await self._incref(digest, temp_key)
+		except BaseException:
+			with trio.CancelScope(shield=True), contextlib.suppress(KeyError):
+				await self.child_datastore.delete(temp_key)
+			raise
+		return digest
+	
+	
+	async def _put_ref(self, key: datastore.Key, value: datastore.abc.ReceiveStream,
+	                   write: typing.Callable[[datastore.abc.ReceiveStream],
+	                                          typing.Awaitable[None]]) -> None:
+		digest = await self._store_content(value)
+		try:
+			async with self._lock_keys(key):
+				previous = await self._read_ref(key)
+				await write(datastore.util.receive_stream_from(self._encode_ref(digest)))
+		except BaseException:
+			with trio.CancelScope(shield=True):
+				await self._decref(digest)
+			raise
+		
+		if previous is not None:
+			await self._decref(previous)
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns a stream of the content referenced by *key*"""
+		async with self._lock_keys(key):
+			digest, stream = await self._open_ref(key)
+			if digest is None:
+				return stream
+			await stream.aclose()
+			
+			try:
+				content: datastore.abc.ReceiveStream = \
+					await self.child_datastore.get(self._content_key(digest))
+			except KeyError as exc:
+				raise RuntimeError(f"Content {digest} referenced by {key} is missing") from exc
+		return content
+	
+	
+	async def _put(self, key: datastore.Key, value: datastore.abc.ReceiveStream, *,
+	               create: bool, replace: bool, **kwargs: typing.Any) -> None:
+		"""Stores the content of *value* (if new) and a reference to it at
+		name *key*"""
+		await self._put_ref(key, value, functools.partial(
+			self.child_datastore._put, key, create=create, replace=replace, **kwargs
+		))
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key, **kwargs: typing.Any) \
+	      -> datastore.abc.BinaryDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores a reference to the content of the stream passed to the
+		returned callback below *prefix*"""
+		key, callback = await self.child_datastore._put_new_indirect(prefix, **kwargs)
+		
+		async def callback_wrapper(value: datastore.abc.ReceiveStream) -> None:
+			await self._put_ref(key, value, callback)
+		return key, callback_wrapper
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the reference at *key* and the content it referenced if it
+		is no longer referenced by any other key"""
+		async with self._lock_keys(key):
+			digest = await self._read_ref(key)
+			await self.child_datastore.delete(key)
+		
+		if digest is not None:
+			await self._decref(digest)
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves the reference at *key1* to *key2*"""
+		async with self._lock_keys(key1, key2):
+			previous = await self._read_ref(key2) if key1 != key2 else None
+			await self.child_datastore.rename(key1, key2, replace=replace)
+		
+		if previous is not None:
+			await self._decref(previous)
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the metadata of the content referenced by *key*, with the
+		times of the reference"""
+		metadata = await self.child_datastore.stat(key)
+		digest = await self._read_ref(key)
+		if digest is None:
+			return metadata
+		
+		content = await self.child_datastore.stat(self._content_key(digest))
+		return datastore.util.StreamMetadata(
+			atime = metadata.atime,
+			mtime = metadata.mtime,
+			btime = metadata.btime,
+			size  = content.size,
+		)
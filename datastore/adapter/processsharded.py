@@ -0,0 +1,410 @@
+"""Sharding across worker processes
+
+:mod:`datastore.adapter.sharded` distributes keys over several datastores,
+but all of them still run on a single core. :class:`BinaryAdapter` instead
+spawns one worker process per shard, each of which builds its own datastore
+stack by calling a factory function and serves it using
+:class:`~datastore.rpc.DatastoreServer`, so that CPU-heavy layers such as
+compression or hashing run in parallel::
+
+	async def open_shard(index: int) -> datastore.abc.BinaryDatastore:
+		return datastore.adapter.compress.BinaryAdapter(
+			await datastore.filesystem.FileSystemDatastore.create(f"/srv/data/{index}")
+		)
+	
+	async with datastore.adapter.processsharded.BinaryAdapter.create(open_shard, 4) as ds:
+		...
+
+The factory is called in the worker process, hence it must be a function
+that can be imported from a module (not a lambda or nested function). Keys
+are routed to shards by the parent process just like in the `sharded`
+adapter, and requests are forwarded over Unix domain socket pairs, sending
+requests of concurrent tasks in a single write and the values passed to
+:meth:`BinaryAdapter.get_many` and :meth:`BinaryAdapter.put_many` in batch
+requests.
+
+Worker processes that exit unexpectedly are restarted, while requests in
+progress on them fail with `RuntimeError`. Workers exit and close their
+datastores once the adapter is closed or the parent process exits.
+"""
+import inspect
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import typing
+
+import trio
+
+import datastore
+import datastore.abc
+
+from . import sharded
+from .. import rpc
+
+__all__ = ("BinaryAdapter",)
+
+
+factory_t = typing.Callable[[int], typing.Union[
+	datastore.abc.BinaryDatastore, typing.Awaitable[datastore.abc.BinaryDatastore]
+]]
+
+# Delay before restarting a crashed worker, doubled after each worker that
+# crashes again shortly after being started up to the maximum delay
+RESTART_DELAY = 0.1
+MAX_RESTART_DELAY = 10.0
+
+# Time given to workers for closing their datastores before they are killed
+STOP_TIMEOUT = 30.0
+
+
+def _run_worker(factory: factory_t, index: int, path: str,
+                control: 'multiprocessing.connection.Connection') -> None:
+	# Interrupts are sent to the whole process group, but workers must only
+	# exit once the parent is done with them
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	trio.run(_serve_worker, factory, index, path, control)
+
+
+async def _serve_worker(factory: factory_t, index: int, path: str,
+                        control: 'multiprocessing.connection.Connection') -> None:
+	try:
+		store = factory(index)
+		if inspect.isawaitable(store):
+			store = await store
+	except BaseException as exc:
+		control.send(f"{type(exc).__name__}: {exc}")
+		raise
+	
+	async with typing.cast(datastore.abc.BinaryDatastore, store), trio.open_nursery() as nursery:
+		await nursery.start(rpc.DatastoreServer(store).serve_unix, path)
+		control.send(None)
+		
+		# The control connection becomes readable once the parent closes it
+		# (or exits)
+		await trio.lowlevel.wait_readable(control.fileno())
+		nursery.cancel_scope.cancel()
+
+
+class _WorkerDatastore(rpc.RemoteDatastore):
+	"""Client of a shard's worker process, which also restarts the worker
+	whenever it exits"""
+	__slots__ = ("index", "restarts", "_context", "_control", "_error", "_factory", "_process",
+	             "_running", "_stopped")
+	
+	index: int
+	restarts: int
+	
+	_context: typing.Any
+	_factory: factory_t
+	_process: typing.Optional[multiprocessing.process.BaseProcess]
+	_control: typing.Optional['multiprocessing.connection.Connection']
+	_error: typing.Optional[BaseException]
+	_running: trio.Event
+	_stopped: typing.Optional[trio.Event]
+	
+	def __init__(self, factory: factory_t, index: int, path: str, *, connections: int,
+	             _create_call: bool = False):
+		super().__init__(path, connections=connections, _create_call=_create_call)
+		self.index    = index
+		self.restarts = 0
+		
+		self._context = multiprocessing.get_context("spawn")
+		self._factory = factory
+		self._process = None
+		self._control = None
+		self._error   = None
+		self._running = trio.Event()
+		self._stopped = None
+	
+	
+	async def _spawn(self) -> None:
+		"""Starts the worker process and waits for it to serve its datastore
+		
+		Raises
+		------
+		RuntimeError
+			The worker exited before serving its datastore
+		"""
+		control, child_control = self._context.Pipe()
+		try:
+			process = self._context.Process(
+				target=_run_worker, args=(self._factory, self.index, self.address, child_control),
+				name=f"datastore-shard-{self.index}", daemon=True,
+			)
+			process.start()
+		except BaseException:
+			control.close()
+			raise
+		finally:
+			child_control.close()
+		self._process = process
+		
+		try:
+			await trio.lowlevel.wait_readable(control.fileno())
+			try:
+				error = control.recv()
+			except EOFError:
+				error = f"Exited with code {process.exitcode}"
+			if error is not None:
+				raise RuntimeError(f"Worker process of shard {self.index} failed to start: {error}")
+		except BaseException:
+			control.close()
+			with trio.CancelScope(shield=True):
+				process.kill()
+				await trio.to_thread.run_sync(process.join)
+			process.close()
+			self._process = None
+			raise
+		
+		self._control = control
+		self._running.set()
+	
+	
+	async def _supervise(self) -> None:
+		"""Restarts the worker process whenever it exits until the datastore
+		is closed"""
+		assert self._stopped is not None
+		try:
+			delay = RESTART_DELAY
+			while self._process is not None:
+				started = trio.current_time()
+				await trio.lowlevel.wait_readable(self._process.sentinel)
+				self._process.join()
+				self._process.close()
+				self._process = None
+				self._stop()
+				if self._closed:
+					break
+				
+				# Back off while the worker keeps crashing right after starting
+				self._running = trio.Event()
+				if trio.current_time() - started > MAX_RESTART_DELAY:
+					delay = RESTART_DELAY
+				while not self._closed:
+					await trio.sleep(delay)
+					delay = min(delay * 2, MAX_RESTART_DELAY)
+					if self._closed:
+						break
+					
+					self.restarts += 1
+					try:
+						await self._spawn()
+					except (OSError, RuntimeError):
+						continue
+					
+					if self._closed:
+						self._stop()
+					else:
+						try:
+							await self.refresh_stats()
+						except (OSError, RuntimeError):
+							pass
+					break
+		except Exception as exc:
+			self._error = exc
+		finally:
+			self._running.set()
+			self._stopped.set()
+	
+	
+	def _stop(self) -> None:
+		"""Asks the worker process to close its datastore and exit"""
+		if self._control is not None:
+			self._control.close()
+			self._control = None
+	
+	
+	async def _connect(self) -> 'rpc.client._Connection':
+		# Wait for the worker to be restarted rather than failing requests
+		# sent while it is down
+		await self._running.wait()
+		if self._closed:
+			raise RuntimeError("Datastore has been closed")
+		return await super()._connect()
+	
+	
+	async def aclose(self) -> None:
+		"""Closes all connections and waits for the worker process to close
+		its datastore and exit, killing it if it does not do so in time
+		
+		Raises
+		------
+		Exception
+			Supervising the worker process failed
+		"""
+		await super().aclose()
+		self._stop()
+		
+		if self._stopped is not None:
+			with trio.move_on_after(STOP_TIMEOUT) as cancel_scope:
+				cancel_scope.shield = True
+				await self._stopped.wait()
+			if cancel_scope.cancelled_caught:
+				if self._process is not None:
+					self._process.kill()
+				with trio.CancelScope(shield=True):
+					await self._stopped.wait()
+		
+		if self._error is not None:
+			raise self._error
+
+
+class BinaryAdapter(sharded.BinaryAdapter):
+	"""Distributes keys over datastores served by one worker process per
+	shard
+	
+	Since :meth:`datastore_stats` cannot wait for the workers, it returns the
+	sum of the statistics retrieved when (re)starting them or by the last call
+	to :meth:`refresh_stats`.
+	
+	Caution
+	-------
+	The number of shards and the sharding function must not change between
+	runs if the workers' datastores are persistent.
+	"""
+	__slots__ = ("_directory",)
+	
+	_directory: typing.Optional[str]
+	
+	def __init__(self, stores: typing.Collection[datastore.abc.BinaryDatastore] = [],
+	             sharding_fn: typing.Callable[[datastore.Key], int] = hash, *,
+	             _create_call: bool = False):
+		assert _create_call, "Use processsharded.BinaryAdapter.create(…) for instance creation"
+		super().__init__(stores, sharding_fn)
+		self._directory = None
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, factory: factory_t, shards: int, *,
+	                 sharding_fn: typing.Callable[[datastore.Key], int] = hash,
+	                 connections: int = 1) -> 'BinaryAdapter':
+		"""Starts a worker process for each of the given number of shards
+		
+		Arguments
+		---------
+		factory
+			Function called with the shard index in each worker process that
+			returns the shard's datastore (or an awaitable resolving to it),
+			which is closed when the worker exits
+		shards
+			The number of shards and worker processes
+		sharding_fn
+			Function mapping keys to integers, of which the shard index is
+			the remainder of the division by the number of shards
+		connections
+			The number of connections opened to each worker
+		
+		Raises
+		------
+		RuntimeError
+			A worker process failed to start
+		"""
+		if shards < 1:
+			raise ValueError("At least one shard is required")
+		
+		self = cls(sharding_fn=sharding_fn, _create_call=True)
+		try:
+			self._directory = tempfile.mkdtemp(prefix="datastore-shards-")
+			for index in range(shards):
+				path = os.path.join(self._directory, f"{index}.sock")
+				self.append_datastore(_WorkerDatastore(factory, index, path, connections=connections,
+				                                       _create_call=True))
+			
+			async with trio.open_nursery() as nursery:
+				for store in self._stores:
+					nursery.start_soon(self._start_worker, store)
+		except BaseException:
+			with trio.CancelScope(shield=True):
+				await self.aclose()
+			raise
+		return self
+	
+	
+	@staticmethod
+	async def _start_worker(store: _WorkerDatastore) -> None:
+		await store._spawn()
+		store._stopped = trio.Event()
+		trio.lowlevel.spawn_system_task(store._supervise)
+		await store.refresh_stats()
+	
+	
+	@property
+	def restarts(self) -> int:
+		"""The number of times worker processes were restarted"""
+		return sum(typing.cast(_WorkerDatastore, store).restarts for store in self._stores)
+	
+	
+	async def get_many(self, keys: typing.Iterable[datastore.Key]) \
+	      -> typing.List[typing.Optional[bytes]]:
+		"""Retrieves the values of all given keys, sending one batch request to
+		each shard concurrently
+		
+		Returns the values in the order of the given keys, with `None` in place
+		of values that do not exist.
+		
+		Arguments
+		---------
+		keys
+			The keys naming the values to retrieve
+		"""
+		keys = list(keys)
+		results: typing.List[typing.Optional[bytes]] = [None] * len(keys)
+		
+		async def run(store: rpc.RemoteDatastore, indices: typing.List[int]) -> None:
+			values = await store.get_many(keys[idx] for idx in indices)
+			for idx, value in zip(indices, values):
+				results[idx] = value
+		
+		async with trio.open_nursery() as nursery:
+			for store_idx, indices in self._group_by_shard(keys).items():
+				nursery.start_soon(run, self._stores[store_idx], indices)
+		return results
+	
+	
+	async def put_many(self, items: typing.Iterable[typing.Tuple[datastore.Key, bytes]]) -> None:
+		"""Stores all given values, sending one batch request to each shard
+		concurrently
+		
+		Arguments
+		---------
+		items
+			Pairs of keys and the values to store under them
+		"""
+		items = list(items)
+		async with trio.open_nursery() as nursery:
+			for store_idx, indices in self._group_by_shard(key for key, _ in items).items():
+				nursery.start_soon(typing.cast(rpc.RemoteDatastore, self._stores[store_idx]).put_many,
+				                   [items[idx] for idx in indices])
+	
+	
+	def _group_by_shard(self, keys: typing.Iterable[datastore.Key]) \
+	    -> typing.Dict[int, typing.List[int]]:
+		groups: typing.Dict[int, typing.List[int]] = {}
+		for idx, key in enumerate(keys):
+			groups.setdefault(self.shard(key), []).append(idx)
+		return groups
+	
+	
+	async def refresh_stats(self) -> datastore.util.DatastoreMetadata:
+		"""Retrieves the current statistics of all workers' datastores, whose
+		sum is returned by :meth:`datastore_stats` from then on"""
+		async with trio.open_nursery() as nursery:
+			for store in self._stores:
+				nursery.start_soon(typing.cast(rpc.RemoteDatastore, store).refresh_stats)
+		return self.datastore_stats()
+	
+	
+	async def aclose(self) -> None:
+		"""Stops all worker processes after they closed their datastores"""
+		# Let all workers close their datastores at the same time
+		for store in self._stores:
+			typing.cast(_WorkerDatastore, store)._stop()
+		try:
+			await super().aclose()
+		finally:
+			if self._directory is not None:
+				shutil.rmtree(self._directory, ignore_errors=True)
+				self._directory = None
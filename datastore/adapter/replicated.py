@@ -0,0 +1,455 @@
+"""Replication across several datastores with configurable quorums
+
+Every value is written to each of the *N* replicas, but only the first *W*
+successful writes (the write quorum) are waited for, while the remaining
+ones complete in the background. Reads ask *R* replicas (the read quorum)
+and return the freshest of the values found, according to their
+modification time, then copy it to replicas that returned an older value
+or none at all (read repair). With *R + W > N*, every read includes at
+least one replica that acknowledged the latest write.
+
+Lowering *W* or *R* trades durability and consistency for tail latency,
+which is further reduced by hedging: Once enough reads have been timed, a
+read still waiting for replies after the configured latency percentile is
+sent to another replica as well, and the first *R* replies are used.
+"""
+import collections
+import math
+import typing
+
+import trio
+
+import datastore
+import datastore.abc
+
+from . import _support
+from ._support import DS, MD, RT, RV, T_co
+
+__all__ = ("BinaryAdapter", "ObjectAdapter")
+
+
+T = typing.TypeVar("T")
+
+DEFAULT_HEDGE_PERCENTILE = 0.95
+
+# Number of recent read latencies that the hedging delay is derived from
+# and the number required before reads are hedged at all
+LATENCY_SAMPLES = 1000
+MIN_LATENCY_SAMPLES = 20
+
+# Number of reads after which the hedging delay is recalculated
+HEDGE_UPDATE_INTERVAL = 64
+
+
+def _mtime(metadata: typing.Any) -> float:
+	if metadata is None or metadata.mtime is None:
+		return -math.inf
+	return metadata.mtime
+
+
+def _lock_key(store: typing.Any, key: datastore.Key) -> datastore.Key:
+	"""Returns the key whose lock orders the writes of *key* to *store*"""
+	return datastore.Key(f"/{id(store)}{key}")
+
+
+class _Adapter(_support.DatastoreCollectionMixin[DS], typing.Generic[DS, MD, RT, RV]):
+	"""Represents a set of datastores that each hold a copy of every value
+	
+	Semantics:
+	
+		* get      : returns the freshest value of *R* replicas, then repairs
+		             the other replicas in the background
+		* put      : writes to all replicas, returns after *W* succeeded
+		* delete   : deletes from all replicas, returns after *W* succeeded
+		* contains : returns whether any of *R* replicas has the value
+		* stat     : returns the freshest metadata of *R* replicas
+		* rename   : renames on all replicas, returns after *W* succeeded
+	
+	Values are compared by their ``mtime``, so the clocks of the replicas'
+	hosts must be synchronized. Values without modification time are
+	considered equally fresh, in which case the first reply is used.
+	
+	Writes and read repairs of the same key are applied to each replica one
+	after another, and read repair skips replicas whose value has become
+	newer than the one it copies since it was read. A repair delayed until
+	after a later write therefore does not replace the value of that write.
+	
+	Caution
+	-------
+	Replicas that missed a deletion may bring the value back through read
+	repair, as there is no newer value left to compare against. Values that
+	are written are held in memory until all replicas stored them.
+	"""
+	__slots__ = ()
+	
+	_write_quorum: typing.Optional[int]
+	_read_quorum: typing.Optional[int]
+	_hedge_percentile: typing.Optional[float]
+	_hedge_delay: float
+	_latencies: typing.Deque[float]
+	_reads: int
+	_next: int
+	_background: int
+	_idle: trio.Event
+	_lock_keys: _support.KeyLocks
+	
+	def __init__(self, stores: typing.Collection[DS] = [], *,
+	             write_quorum: typing.Optional[int] = None,
+	             read_quorum: typing.Optional[int] = None,
+	             hedge_percentile: typing.Optional[float] = DEFAULT_HEDGE_PERCENTILE):
+		"""
+		Arguments
+		---------
+		stores
+			The replicas
+		write_quorum
+			The number of replicas that must have stored a value before
+			writes return (a majority by default)
+		read_quorum
+			The number of replicas consulted by reads (a majority by default)
+		hedge_percentile
+			The percentile of recent read latencies after which reads are sent
+			to another replica, or `None` to never hedge reads
+		
+		Raises
+		------
+		ValueError
+			A quorum or the percentile is out of range
+		"""
+		_support.DatastoreCollectionMixin.__init__(self, stores)
+		for quorum in (write_quorum, read_quorum):
+			if quorum is not None and not 1 <= quorum <= max(len(self._stores), 1):
+				raise ValueError("Quorums must be between 1 and the number of replicas")
+		if hedge_percentile is not None and not 0 < hedge_percentile < 1:
+			raise ValueError("Hedging percentile must be between 0 and 1")
+		
+		self._write_quorum     = write_quorum
+		self._read_quorum      = read_quorum
+		self._hedge_percentile = hedge_percentile
+		self._hedge_delay      = math.inf
+		self._latencies        = collections.deque(maxlen=LATENCY_SAMPLES)
+		self._reads            = 0
+		self._next             = 0
+		self._background       = 0
+		self._idle             = trio.Event()
+		self._idle.set()
+		self._lock_keys        = _support.KeyLocks()
+	
+	
+	def _quorum(self, quorum: typing.Optional[int]) -> int:
+		if quorum is None:
+			return len(self._stores) // 2 + 1
+		if quorum > len(self._stores):
+			raise RuntimeError(f"Quorum of {quorum} cannot be reached "
+			                   f"with {len(self._stores)} replicas")
+		return quorum
+	
+	
+	def _spawn(self, async_fn: typing.Callable[..., typing.Awaitable[None]],
+	           *args: typing.Any) -> None:
+		"""Runs *async_fn* in the background, ignoring any errors (they are
+		corrected by read repair)"""
+		async def run() -> None:
+			try:
+				await async_fn(*args)
+			except Exception:
+				pass
+			finally:
+				self._background -= 1
+				if self._background == 0:
+					self._idle.set()
+		
+		if self._background == 0:
+			self._idle = trio.Event()
+		self._background += 1
+		trio.lowlevel.spawn_system_task(run)
+	
+	
+	async def wait_idle(self) -> None:
+		"""Waits for writes still in progress after reaching their quorum and
+		for read repairs to complete"""
+		await self._idle.wait()
+	
+	
+	def _record_latency(self, latency: float) -> None:
+		self._latencies.append(latency)
+		self._reads += 1
+		if self._hedge_percentile is not None and len(self._latencies) >= MIN_LATENCY_SAMPLES \
+		   and (self._reads % HEDGE_UPDATE_INTERVAL == 0 or math.isinf(self._hedge_delay)):
+			latencies = sorted(self._latencies)
+			self._hedge_delay = latencies[int(self._hedge_percentile * (len(latencies) - 1))]
+	
+	
+	async def _read(self, key: datastore.Key, operation: typing.Callable[[DS], typing.Awaitable[T]],
+	                release: typing.Optional[typing.Callable[[T], typing.Awaitable[None]]] = None) \
+	      -> typing.List[typing.Tuple[DS, typing.Optional[T]]]:
+		"""Runs *operation* on *R* replicas and returns their results, or
+		`None` for each replica that raised `KeyError`
+		
+		Replicas are chosen in round-robin order. Another replica is asked
+		whenever one fails or, if hedging is enabled, the replies take longer
+		than the hedging delay. Results that arrive after *R* others are
+		passed to *release*.
+		
+		Raises
+		------
+		RuntimeError
+			Fewer than *R* replicas replied without error
+		"""
+		quorum = self._quorum(self._read_quorum)
+		start = self._next
+		self._next = (start + 1) % len(self._stores)
+		stores = self._stores[start:] + self._stores[:start]
+		
+		results: typing.List[typing.Tuple[DS, typing.Optional[T]]] = []
+		errors: typing.List[Exception] = []
+		send_channel, receive_channel = trio.open_memory_channel(math.inf)
+		
+		async def run(store: DS) -> None:
+			started = trio.current_time()
+			try:
+				result: typing.Union[typing.Optional[T], Exception] = await operation(store)
+			except KeyError:
+				result = None
+			except Exception as exc:
+				result = exc
+			if not isinstance(result, Exception):
+				self._record_latency(trio.current_time() - started)
+			send_channel.send_nowait((store, result))
+		
+		async with trio.open_nursery() as nursery:
+			for store in stores[:quorum]:
+				nursery.start_soon(run, store)
+			launched = quorum
+			
+			while len(results) < quorum:
+				if launched - len(errors) < quorum:
+					if launched >= len(stores):
+						nursery.cancel_scope.cancel()
+						raise RuntimeError(f"Read quorum of {quorum} replicas not reached") from errors[-1]
+					nursery.start_soon(run, stores[launched])
+					launched += 1
+				
+				with trio.move_on_after(self._hedge_delay if launched < len(stores) else math.inf):
+					store, result = await receive_channel.receive()
+					if isinstance(result, Exception):
+						errors.append(result)
+					else:
+						results.append((store, result))
+					continue
+				
+				# Hedge a read that takes unusually long
+				nursery.start_soon(run, stores[launched])
+				launched += 1
+			
+			nursery.cancel_scope.cancel()
+		
+		# Release results of hedged reads that arrived too late
+		while True:
+			try:
+				_, result = receive_channel.receive_nowait()
+			except trio.WouldBlock:
+				break
+			if release is not None and result is not None and not isinstance(result, Exception):
+				await release(result)
+		return results
+	
+	
+	async def _write(self, key: datastore.Key,
+	                 operation: typing.Callable[[DS], typing.Awaitable[None]], *,
+	                 missing_ok: bool = False,
+	                 other_key: typing.Optional[datastore.Key] = None) -> bool:
+		"""Runs *operation* on all replicas and waits for *W* of them to
+		succeed, returning whether any of them did not raise `KeyError`
+		
+		On each replica, *operation* holds the locks of *key* and *other_key*
+		(if given) to order it against read repairs.
+		
+		Raises
+		------
+		KeyError
+			The write quorum was not reached because replicas raised
+			`KeyError` (counted as success if *missing_ok* is set)
+		RuntimeError
+			The write quorum was not reached because of other errors
+		"""
+		quorum = self._quorum(self._write_quorum)
+		send_channel, receive_channel = trio.open_memory_channel(math.inf)
+		
+		lock_keys = [key] if other_key is None else [key, other_key]
+		
+		async def run(store: DS) -> None:
+			try:
+				async with self._lock_keys(*(_lock_key(store, k) for k in lock_keys)):
+					await operation(store)
+			except Exception as exc:
+				result: typing.Optional[Exception] = exc
+			else:
+				result = None
+			try:
+				send_channel.send_nowait(result)
+			except trio.BrokenResourceError:
+				pass
+		
+		# The writes continue after reaching the quorum, so they cannot be
+		# part of the caller's nursery
+		for store in self._stores:
+			self._spawn(run, store)
+		
+		found = False
+		acks = 0
+		errors: typing.List[Exception] = []
+		key_errors = 0
+		with receive_channel:
+			while acks < quorum:
+				result = await receive_channel.receive()
+				if result is None:
+					found = True
+					acks += 1
+				elif missing_ok and isinstance(result, KeyError):
+					acks += 1
+				else:
+					errors.append(result)
+					key_errors += isinstance(result, KeyError)
+					if len(errors) > len(self._stores) - quorum:
+						break
+			else:
+				return found
+			
+			# Wait for the remaining replicas to report whether the quorum was
+			# missed because of the key (not) existing or because of failures
+			while key_errors <= len(self._stores) - quorum and acks + len(errors) < len(self._stores):
+				result = await receive_channel.receive()
+				if isinstance(result, Exception):
+					errors.append(result)
+					key_errors += isinstance(result, KeyError)
+				else:
+					acks += 1
+		
+		if key_errors > len(self._stores) - quorum:
+			raise KeyError(key)
+		error = next(error for error in errors if not isinstance(error, KeyError))
+		raise RuntimeError(f"Write quorum of {quorum} replicas not reached") from error
+	
+	
+	async def _repair(self, key: datastore.Key, source: DS, mtime: float,
+	                  stale: typing.List[DS]) -> None:
+		"""Copies the value of *source*, which had the modification time
+		*mtime* when it was read, to the *stale* replicas"""
+		value = await source.get_all(key)
+		async with trio.open_nursery() as nursery:
+			for store in stale:
+				nursery.start_soon(self._repair_replica, store, key, value, mtime)
+	
+	
+	async def _repair_replica(self, store: DS, key: datastore.Key, value: RV, mtime: float) -> None:
+		try:
+			async with self._lock_keys(_lock_key(store, key)):
+				# Do not replace a value written since the read
+				try:
+					if _mtime(await store.stat(key)) >= mtime:
+						return
+				except KeyError:
+					pass
+				await store.put(key, value)  # type: ignore[arg-type]
+		except Exception:
+			pass
+	
+	
+	async def get(self, key: datastore.Key) -> RT:
+		"""Returns the freshest value named by `key` found in *R* replicas"""
+		async def release(value: RT) -> None:
+			await value.aclose()
+		
+		results = await self._read(key, lambda store: store.get(key), release)  # type: ignore
+		found = [(store, value) for store, value in results if value is not None]
+		if not found:
+			raise KeyError(key)
+		
+		fresh_store, fresh_value = max(found, key=lambda item: _mtime(item[1]))
+		for _, value in found:
+			if value is not fresh_value:
+				await value.aclose()
+		
+		stale = [store for store, value in results
+		         if value is None or _mtime(value) < _mtime(fresh_value)]
+		if stale:
+			self._spawn(self._repair, key, fresh_store, _mtime(fresh_value), stale)
+		return fresh_value  # type: ignore[return-value]
+	
+	
+	async def get_all(self, key: datastore.Key) -> RV:
+		"""Returns the freshest value named by `key` found in *R* replicas"""
+		return await (await self.get(key)).collect()  # type: ignore[return-value]
+	
+	
+	async def _put(self, key: datastore.Key, value: RT, **kwargs: typing.Any) -> None:
+		"""Stores the object in all replicas, returning once *W* of them
+		succeeded"""
+		data = await value.collect()
+		await self._write(key, lambda store: store.put(key, data, **kwargs))
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the object from all replicas, returning once *W* of them
+		succeeded"""
+		if not await self._write(key, lambda store: store.delete(key), missing_ok=True):
+			raise KeyError(key)
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any of *R* replicas has the object"""
+		results = await self._read(key, lambda store: store.contains(key))
+		return any(result for _, result in results)
+	
+	
+	async def stat(self, key: datastore.Key) -> MD:
+		"""Returns the freshest metadata of the object named by `key` found
+		in *R* replicas"""
+		results = await self._read(key, lambda store: store.stat(key))
+		found = [metadata for _, metadata in results if metadata is not None]
+		if not found:
+			raise KeyError(key)
+		return max(found, key=_mtime)  # type: ignore[no-any-return]
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Renames item *key1* to *key2* on all replicas, returning once *W* of
+		them succeeded"""
+		await self._write(key1, lambda store: store.rename(key1, key2, replace=replace),
+		                  other_key=key2)
+	
+	
+	async def aclose(self) -> None:
+		"""Waits for writes and read repairs in progress, then closes and
+		removes all added datastores"""
+		await self.wait_idle()
+		await self._stores_cleanup()
+
+
+class BinaryAdapter(
+		_Adapter[
+			datastore.abc.BinaryDatastore,
+			datastore.util.StreamMetadata,
+			datastore.abc.ReceiveStream,
+			bytes
+		],
+		datastore.abc.BinaryAdapter
+):
+	__slots__ = ("_stores", "_write_quorum", "_read_quorum", "_hedge_percentile", "_hedge_delay",
+	             "_latencies", "_reads", "_next", "_background", "_idle", "_lock_keys")
+
+
+class ObjectAdapter(
+		typing.Generic[T_co],
+		_Adapter[
+			datastore.abc.ObjectDatastore[T_co],
+			datastore.util.ChannelMetadata,
+			datastore.abc.ReceiveChannel[T_co],
+			typing.List[T_co]
+		],
+		datastore.abc.ObjectAdapter[T_co, T_co]
+):
+	__slots__ = ("_stores", "_write_quorum", "_read_quorum", "_hedge_percentile", "_hedge_delay",
+	             "_latencies", "_reads", "_next", "_background", "_idle", "_lock_keys")
@@ -1,11 +1,132 @@
+import contextlib
+import functools
+import heapq
+import itertools
+import math
 import typing
 
+import trio
+
 import datastore
 
 from . import _support
 from ._support import DS, MD, RT, RV, T_co
+from ..core.query import Order
+
+if typing.TYPE_CHECKING:
+	from typing_extensions import Literal as typing_Literal
+else:
+	if hasattr(typing, "Literal"):
+		from typing import Literal as typing_Literal
+	else:
+		from typing import Union as typing_Literal
+
+__all__ = ("BinaryAdapter", "ObjectAdapter", "jump_hash", "rendezvous_hash")
+
+
+placement_t = typing_Literal["modulo", "jump", "rendezvous"]
+
+_U64_MASK = (1 << 64) - 1
+
+# Number of locks that keys are spread over while rebalancing
+REBALANCE_LOCKS = 64
+
+
+def _mix64(value: int) -> int:
+	"""Scrambles the bits of a 64-bit integer (SplitMix64 finalizer)"""
+	value = (value + 0x9E3779B97F4A7C15) & _U64_MASK
+	value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _U64_MASK
+	value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _U64_MASK
+	return value ^ (value >> 31)
+
+
+def jump_hash(key_hash: int, buckets: int) -> int:
+	"""Maps *key_hash* to one of *buckets* buckets using jump consistent
+	hashing (Lamping & Veach, 2014)
+	
+	Increasing the number of buckets from *n* to *n + 1* only moves about a
+	*1 / (n + 1)* fraction of all keys, all of which move to the new bucket.
+	Buckets can only be added or removed at the end, however.
+	"""
+	key_hash &= _U64_MASK
+	bucket, next_bucket = -1, 0
+	while next_bucket < buckets:
+		bucket = next_bucket
+		key_hash = (key_hash * 2862933555777941757 + 1) & _U64_MASK
+		next_bucket = int((bucket + 1) * ((1 << 31) / ((key_hash >> 33) + 1)))
+	return bucket
+
+
+def rendezvous_hash(key_hash: int, nodes: typing.Sequence[typing.Tuple[int, float]]) -> int:
+	"""Returns the index of the node in *nodes* that *key_hash* maps to
+	using weighted rendezvous (highest random weight) hashing
+	
+	Each node is given as a pair of its ID, which must not change while the
+	node is in use, and its weight. Every key is assigned to the node with
+	the highest score ``-weight / ln(h(key, node))`` (where *h* is uniform in
+	*(0, 1)*), so that each node receives a share of the keys proportional
+	to its weight and adding or removing a node only moves the keys assigned
+	to it.
+	"""
+	key_hash &= _U64_MASK
+	best_idx, best_score = -1, -1.0
+	for idx, (node_id, weight) in enumerate(nodes):
+		value = ((_mix64(key_hash ^ _mix64(node_id)) >> 11) + 0.5) / (1 << 53)
+		score = weight / -math.log(value)
+		if score > best_score:
+			best_idx, best_score = idx, score
+	return best_idx
+
+
+class _Layout:
+	"""Maps key hashes to the index of their shard for a given list of shards"""
+	__slots__ = ("placement", "size", "_buckets", "_nodes")
+	
+	placement: placement_t
+	size: int
+	
+	_buckets: typing.List[int]
+	_nodes: typing.List[typing.Tuple[int, float]]
+	
+	def __init__(self, placement: placement_t, ids: typing.Sequence[int],
+	             weights: typing.Sequence[float], virtual_nodes: int):
+		self.placement = placement
+		self.size      = len(ids)
+		
+		# Jump hashing has no notion of weights, so each shard is given a
+		# number of buckets (virtual nodes) proportional to its weight instead
+		self._buckets = []
+		if placement == "jump":
+			for idx, weight in enumerate(weights):
+				self._buckets.extend([idx] * max(round(weight * virtual_nodes), 1))
+		self._nodes = list(zip(ids, weights))
+	
+	
+	def shard(self, key_hash: int) -> int:
+		if self.placement == "jump":
+			return self._buckets[jump_hash(key_hash, len(self._buckets))]
+		elif self.placement == "rendezvous":
+			return rendezvous_hash(key_hash, self._nodes)
+		return key_hash % self.size
 
-__all__ = ("BinaryAdapter", "ObjectAdapter")
+
+class _Rebalance:
+	"""State of moving keys to the shards they were assigned to after a
+	datastore was appended"""
+	__slots__ = ("layout", "locks", "cancel_scope", "done", "error")
+	
+	layout: _Layout
+	locks: typing.List[trio.Lock]
+	cancel_scope: trio.CancelScope
+	done: trio.Event
+	error: typing.Optional[Exception]
+	
+	def __init__(self, layout: _Layout):
+		self.layout       = layout
+		self.locks        = [trio.Lock() for _ in range(REBALANCE_LOCKS)]
+		self.cancel_scope = trio.CancelScope()
+		self.done         = trio.Event()
+		self.error        = None
 
 
 
@@ -15,28 +136,222 @@ class _Adapter(_support.DatastoreCollectionMixin[DS], typing.Generic[DS, MD, RT,
 	A datastore is selected based on a sharding function.
 	Sharding functions should take a Key and return an integer.
 	
+	How the integer selects the shard depends on the *placement* chosen:
+	
+		* ``"modulo"``     : the remainder of dividing it by the number of
+		                     shards (adding or removing a shard moves almost
+		                     all keys)
+		* ``"jump"``       : jump consistent hashing, which only moves the keys
+		                     assigned to the new shard when appending one, with
+		                     each shard represented by ``weight * virtual_nodes``
+		                     buckets
+		* ``"rendezvous"`` : weighted rendezvous hashing, which only moves the
+		                     keys assigned to the shard added or removed, no
+		                     matter its position
+	
+	If *rebalance* is set, keys are moved to their new shard in the background
+	after a datastore was appended (see :meth:`append_datastore`).
+	
 	Caution
 	-------
-	Adding or removing datastores while mid-use may severely affect consistency.
-	Also ensure the order is correct upon initialization. While this is not as
-	important for caches, it is crucial for persistent datastores.
+	Adding or removing datastores while mid-use may severely affect consistency
+	unless rebalancing is enabled. Also ensure the order and weights are correct
+	upon initialization. While this is not as important for caches, it is
+	crucial for persistent datastores.
 	"""
 	
 	__slots__ = ()
 	
 	_shardingfn: _support.FunctionProperty[typing.Callable[[datastore.Key], int]]
+	_placement: placement_t
+	_virtual_nodes: int
+	_ids: typing.List[int]
+	_weights: typing.List[float]
+	_layout: _Layout
+	_auto_rebalance: bool
+	_rebalance: typing.Optional[_Rebalance]
 	
 	
 	def __init__(self, stores: typing.Collection[DS] = [],
-	             sharding_fn: typing.Callable[[datastore.Key], int] = hash):
-		"""Initialize the datastore with any provided datastore."""
+	             sharding_fn: typing.Callable[[datastore.Key], int] = hash, *,
+	             placement: placement_t = "modulo",
+	             weights: typing.Optional[typing.Sequence[float]] = None,
+	             virtual_nodes: int = 1, rebalance: bool = False):
+		"""Initialize the datastore with any provided datastore.
+		
+		Arguments
+		---------
+		stores
+			The datastores to use as shards
+		sharding_fn
+			Function mapping keys to integers
+		placement
+			How the integers returned by *sharding_fn* are mapped to shards
+			(see above)
+		weights
+			The relative share of keys assigned to each shard (only supported
+			by the ``"jump"`` and ``"rendezvous"`` placements)
+		virtual_nodes
+			Number of jump hashing buckets per unit of weight
+		rebalance
+			Move affected keys to their new shard after appending a datastore?
+		
+		Raises
+		------
+		ValueError
+			Invalid placement or weights
+		"""
 		_support.DatastoreCollectionMixin.__init__(self, stores)
-		self._shardingfn = sharding_fn
+		if placement not in ("modulo", "jump", "rendezvous"):
+			raise ValueError(f"Unknown placement {placement!r}")
+		if weights is not None:
+			if placement == "modulo":
+				raise ValueError("Modulo placement does not support weights")
+			if len(weights) != len(self._stores):
+				raise ValueError("Number of weights does not match number of datastores")
+		if virtual_nodes < 1:
+			raise ValueError("At least one virtual node per unit of weight is required")
+		
+		self._shardingfn     = sharding_fn
+		self._placement      = placement
+		self._virtual_nodes  = virtual_nodes
+		self._ids            = list(range(len(self._stores)))
+		self._weights        = list(weights) if weights is not None else [1.0] * len(self._stores)
+		self._auto_rebalance = rebalance
+		self._rebalance      = None
+		self._update_layout()
+	
+	
+	def _update_layout(self) -> None:
+		self._layout = _Layout(self._placement, self._ids, self._weights, self._virtual_nodes)
+	
+	
+	def append_datastore(self, store: DS, weight: float = 1.0) -> None:
+		"""Appends datastore `store` to the shards
+		
+		If rebalancing is enabled, the keys now assigned to the new shard are
+		moved there by a background task (see :meth:`wait_rebalanced`), while
+		lookups check the old shard of each key before the new one.
+		
+		Raises
+		------
+		RuntimeError
+			The previous rebalance did not finish yet (or failed)
+		NotImplementedError
+			Rebalancing is enabled, but a shard cannot list its keys
+		"""
+		if self._rebalance is not None:
+			raise RuntimeError("Cannot add a datastore while rebalancing")
+		if self._auto_rebalance and not all(hasattr(child, "keys") for child in self._stores):
+			raise NotImplementedError("Rebalancing requires datastores that can list their keys")
+		
+		layout = self._layout
+		super().append_datastore(store)
+		self._ids.append(max(self._ids, default=-1) + 1)
+		self._weights.append(weight)
+		self._update_layout()
+		
+		if self._auto_rebalance and layout.size > 0:
+			self._rebalance = _Rebalance(layout)
+			trio.lowlevel.spawn_system_task(self._run_rebalance, self._rebalance)
+	
+	
+	def remove_datastore(self, store: DS) -> None:
+		"""Removes datastore `store` from the shards (without moving its keys)"""
+		if self._rebalance is not None:
+			raise RuntimeError("Cannot remove a datastore while rebalancing")
+		idx = self._stores.index(store)
+		super().remove_datastore(store)
+		del self._ids[idx]
+		del self._weights[idx]
+		self._update_layout()
+	
+	
+	def insert_datastore(self, index: int, store: DS, weight: float = 1.0) -> None:
+		"""Inserts datastore `store` into the shards at `index` (without moving
+		any keys)"""
+		if self._rebalance is not None:
+			raise RuntimeError("Cannot add a datastore while rebalancing")
+		super().insert_datastore(index, store)
+		self._ids.insert(index, max(self._ids, default=-1) + 1)
+		self._weights.insert(index, weight)
+		self._update_layout()
+	
+	
+	@property
+	def rebalancing(self) -> bool:
+		"""Whether keys are being moved to their new shards"""
+		return self._rebalance is not None
+	
+	
+	async def wait_rebalanced(self) -> None:
+		"""Waits for keys to have been moved to their new shards
+		
+		Raises
+		------
+		Exception
+			Moving the keys failed (lookups keep checking their previous
+			shards in this case)
+		"""
+		rebalance = self._rebalance
+		if rebalance is not None:
+			await rebalance.done.wait()
+			if rebalance.error is not None:
+				raise rebalance.error
+		await trio.lowlevel.checkpoint()
+	
+	
+	async def _run_rebalance(self, rebalance: _Rebalance) -> None:
+		try:
+			with rebalance.cancel_scope:
+				for idx in range(rebalance.layout.size):
+					store = self._stores[idx]
+					
+					# Collect the keys to move first, as not every datastore
+					# supports modifications while listing its keys
+					moving = []
+					async for key in store.keys():  # type: ignore[attr-defined]
+						if self._layout.shard(self._shardingfn(key)) != idx:
+							moving.append(key)
+					
+					for key in moving:
+						key_hash = self._shardingfn(key)
+						async with rebalance.locks[key_hash % len(rebalance.locks)]:
+							await self._move_key(key, store, self._stores[self._layout.shard(key_hash)])
+			
+			if not rebalance.cancel_scope.cancelled_caught:
+				self._rebalance = None
+		except Exception as exc:
+			rebalance.error = exc
+		finally:
+			rebalance.done.set()
+	
+	
+	@staticmethod
+	async def _move_key(key: datastore.Key, source: DS, target: DS) -> None:
+		try:
+			value = await source.get_all(key)
+		except KeyError:
+			return
+		
+		# Never replace values stored in the target shard already
+		try:
+			await target.put(key, value, replace=False)  # type: ignore[arg-type]
+		except KeyError:
+			pass
+		except NotImplementedError:
+			if not await target.contains(key):
+				await target.put(key, value)  # type: ignore[arg-type]
+		
+		try:
+			await source.delete(key)
+		except KeyError:
+			pass
 	
 	
 	def shard(self, key: datastore.Key) -> int:
 		"""Returns the shard index to handle `key`, according to sharding fn."""
-		return self._shardingfn(key) % len(self._stores)
+		return self._layout.shard(self._shardingfn(key))
 	
 	
 	def get_sharded_datastore(self, key: datastore.Key) -> DS:
@@ -44,34 +359,87 @@ class _Adapter(_support.DatastoreCollectionMixin[DS], typing.Generic[DS, MD, RT,
 		return self.get_datastore_at(self.shard(key))
 	
 	
+	def _lookup_datastores(self, key: datastore.Key) -> typing.List[DS]:
+		"""Returns the shards to look for `key` in, which includes its
+		previous shard while rebalancing"""
+		key_hash = self._shardingfn(key)
+		idx = self._layout.shard(key_hash)
+		if self._rebalance is not None:
+			old_idx = self._rebalance.layout.shard(key_hash)
+			if old_idx != idx:
+				return [self._stores[old_idx], self._stores[idx]]
+		return [self._stores[idx]]
+	
+	
+	@contextlib.asynccontextmanager
+	async def _settled_datastore(self, key: datastore.Key) -> typing.AsyncIterator[DS]:
+		"""Returns the shard to modify `key` in, moving it there first if
+		it is still stored in its previous shard"""
+		rebalance = self._rebalance
+		if rebalance is None:
+			yield self.get_sharded_datastore(key)
+			return
+		
+		key_hash = self._shardingfn(key)
+		async with rebalance.locks[key_hash % len(rebalance.locks)]:
+			old_idx = rebalance.layout.shard(key_hash)
+			idx = self._layout.shard(key_hash)
+			if old_idx != idx:
+				await self._move_key(key, self._stores[old_idx], self._stores[idx])
+			yield self._stores[idx]
+	
+	
 	async def get(self, key: datastore.Key) -> RT:
 		"""Return the object named by key from the corresponding datastore."""
-		return await self.get_sharded_datastore(key).get(key)  # type: ignore[return-value]
+		*previous, store = self._lookup_datastores(key)
+		for old_store in previous:
+			try:
+				return await old_store.get(key)  # type: ignore[return-value]
+			except KeyError:
+				pass
+		return await store.get(key)  # type: ignore[return-value]
 	
 	
 	async def get_all(self, key: datastore.Key) -> RV:
 		"""Return the object named by key from the corresponding datastore."""
-		return await self.get_sharded_datastore(key).get_all(key)  # type: ignore[return-value]
+		*previous, store = self._lookup_datastores(key)
+		for old_store in previous:
+			try:
+				return await old_store.get_all(key)  # type: ignore[return-value]
+			except KeyError:
+				pass
+		return await store.get_all(key)  # type: ignore[return-value]
 	
 	
 	async def _put(self, key: datastore.Key, value: RT, **kwargs: typing.Any) -> None:
 		"""Stores the object to the corresponding datastore."""
-		await self.get_sharded_datastore(key).put(key, value, **kwargs)
+		async with self._settled_datastore(key) as store:
+			await store.put(key, value, **kwargs)
 	
 	
 	async def delete(self, key: datastore.Key) -> None:
 		"""Removes the object from the corresponding datastore."""
-		await self.get_sharded_datastore(key).delete(key)
+		async with self._settled_datastore(key) as store:
+			await store.delete(key)
 	
 	
 	async def contains(self, key: datastore.Key) -> bool:
 		"""Returns whether the object is in this datastore."""
-		return await self.get_sharded_datastore(key).contains(key)
+		for store in self._lookup_datastores(key):
+			if await store.contains(key):
+				return True
+		return False
 	
 	
 	async def stat(self, key: datastore.Key) -> MD:
 		"""Returns the metadata of the object named by key from the corresponding datastore"""
-		return await self.get_sharded_datastore(key).stat(key)  # type: ignore[return-value]
+		*previous, store = self._lookup_datastores(key)
+		for old_store in previous:
+			try:
+				return await old_store.stat(key)  # type: ignore[return-value]
+			except KeyError:
+				pass
+		return await store.stat(key)  # type: ignore[return-value]
 	
 	
 	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
@@ -97,33 +465,51 @@ class _Adapter(_support.DatastoreCollectionMixin[DS], typing.Generic[DS, MD, RT,
 	
 	
 	async def query(self, query: datastore.Query) -> datastore.Cursor:
-		"""Returns a sequence of objects matching criteria expressed in `query`"""
-		cursor = datastore.Cursor(query, self._shard_query_generator(query))
-		cursor.apply_order()  # ordering sharded queries is expensive (no generator)
-		return cursor
-	
-	
-	def _shard_query_generator(self, query):  # type: ignore  #FIXME: broken
-		"""A generator that queries each shard in sequence."""
+		"""Returns a sequence of objects matching criteria expressed in `query`
+		
+		All shards are queried concurrently for their first ``offset + limit``
+		results, which are then merged lazily according to the query's orders
+		(or concatenated in shard order if it has none), so that only the
+		results needed are taken from each shard's cursor.
+		"""
 		shard_query = query.copy()
+		shard_query.offset = 0
+		if query.limit is not None:
+			shard_query.limit = query.offset + query.limit
 		
-		for shard in self._stores:
-			# yield all items matching within this shard
-			cursor = shard.query(shard_query)
-			for item in cursor:
-				yield item
-			
-			# update query with results of first query
-			shard_query.offset = max(shard_query.offset - cursor.skipped, 0)
-			if shard_query.limit:
-				shard_query.limit = max(shard_query.limit - cursor.returned, 0)
-				
-				if shard_query.limit <= 0:
-					break  # we're already done!
+		cursors: typing.List[datastore.Cursor] = [None] * len(self._stores)  # type: ignore[list-item]
+		
+		async def run_query(idx: int, store: DS) -> None:
+			cursors[idx] = await store.query(shard_query)  # type: ignore[attr-defined]
+		
+		async with trio.open_nursery() as nursery:
+			for idx, store in enumerate(self._stores):
+				nursery.start_soon(run_query, idx, store)
+		
+		results: typing.Iterable[typing.Any]
+		if query.orders:
+			# Cursors refuse being passed to `iter` more than once, which the
+			# merge does for the last remaining input
+			sort_key = functools.cmp_to_key(Order.multiple_order_comparison(query.orders))
+			results = heapq.merge(*((item for item in cursor) for cursor in cursors), key=sort_key)
+		else:
+			results = itertools.chain.from_iterable(cursors)
+		
+		cursor = datastore.Cursor(query, results)
+		cursor.apply_offset()
+		cursor.apply_limit()
+		return cursor
 	
 	
 	async def aclose(self) -> None:
-		"""Closes and removes all added datastores"""
+		"""Stops rebalancing, then closes and removes all added datastores
+		
+		Keys that were not moved to their new shard yet remain in their
+		previous one.
+		"""
+		if self._rebalance is not None:
+			self._rebalance.cancel_scope.cancel()
+			await self._rebalance.done.wait()
 		await self._stores_cleanup()
 
 
@@ -137,7 +523,8 @@ class BinaryAdapter(
 		],
 		datastore.abc.BinaryAdapter
 ):
-	__slots__ = ("_shardingfn", "_stores")
+	__slots__ = ("_shardingfn", "_stores", "_placement", "_virtual_nodes", "_ids", "_weights",
+	             "_layout", "_auto_rebalance", "_rebalance")
 
 
 class ObjectAdapter(
@@ -150,4 +537,5 @@ class ObjectAdapter(
 		],
 		datastore.abc.ObjectAdapter[T_co, T_co]
 ):
-	__slots__ = ("_shardingfn", "_stores")
+	__slots__ = ("_shardingfn", "_stores", "_placement", "_virtual_nodes", "_ids", "_weights",
+	             "_layout", "_auto_rebalance", "_rebalance")
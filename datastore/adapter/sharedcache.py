@@ -0,0 +1,683 @@
+"""Size-bounded binary cache tier shared by all processes on the local machine
+
+While :mod:`datastore.adapter.cache` keeps a separate cache in each process,
+:class:`BinaryDatastore` stores its entries in a named block of shared memory
+(see :mod:`multiprocessing.shared_memory`) that every process opening a
+datastore of the same name attaches to. Each value is therefore cached only
+once, no matter how many worker processes serve it::
+
+	async with datastore.adapter.tiered.BinaryAdapter([
+		datastore.adapter.sharedcache.BinaryDatastore("app-cache", 256 * 1024 * 1024),
+		await datastore.filesystem.FileSystemDatastore.create(path),
+	]) as ds:
+		...
+
+The shared memory block is divided into a number of stripes, each of which
+holds an open-addressing hash table and an arena of fixed-size slabs that
+entries (key and value) are stored in as chains. A stripe is modified only
+while holding a byte-range lock on a lock file, while lookups read without
+locking and check the stripe's sequence number afterwards, retrying if it
+was modified concurrently (seqlock). Entries are evicted using the CLOCK
+approximation of LRU.
+"""
+import contextlib
+import hashlib
+import os
+import struct
+import tempfile
+import typing
+import uuid
+
+import datastore
+import datastore.abc
+
+try:
+	import fcntl
+except ImportError:  #PY: Windows
+	fcntl = None  # type: ignore[assignment]
+
+try:
+	from multiprocessing import resource_tracker
+	from multiprocessing import shared_memory
+except ImportError:  #PY37-
+	shared_memory = None  # type: ignore[assignment]
+
+__all__ = ("BinaryDatastore",)
+
+
+MAGIC = b"\x89DSSHM\r\n"
+VERSION = 1
+
+# magic, version, stripe count, buckets per stripe, slabs per stripe, slab size
+_HEADER = struct.Struct("<8sIIIII4x")
+
+# sequence number (odd while being modified), bytes of cached values, entry
+# count, CLOCK hand, first free slab, number of free slabs
+_STRIPE = struct.Struct("<QQQIII4x")
+_STRIPE_SEQ = struct.Struct("<Q")
+
+# key hash (0 if unused), first slab, value size, key size, flags
+_BUCKET = struct.Struct("<QIIHBx")
+_BUCKET_FLAGS_OFFSET = 18
+FLAG_REFERENCED = 0x01
+
+# Index of the next slab of a chain, followed by the slab's payload
+_SLAB_NEXT = struct.Struct("<I")
+NO_SLAB = 0xFFFFFFFF
+
+DEFAULT_SLAB_SIZE = 256
+DEFAULT_STRIPES = 64
+
+# Number of times a lookup is retried without locking before waiting for
+# the writer to finish
+SEQLOCK_RETRIES = 8
+
+
+class _TornRead(Exception):
+	"""Raised when data read without locking was modified concurrently"""
+
+
+def hash_key(key: bytes) -> int:
+	# Must be the same in every process, so the builtin `hash` cannot be used
+	value = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+	return value or 1
+
+
+class BinaryDatastore(datastore.abc.BinaryDatastore):
+	"""A bounded binary datastore in shared memory that evicts entries once
+	its capacity is exceeded
+	
+	Semantics:
+	
+		* get      : returns cached value (counted as hit or miss)
+		* put      : caches value, evicting other entries of the same stripe as
+		             necessary; values larger than the capacity of one stripe
+		             (*max_size* / *stripes*) are not cached at all
+		* delete   : drops cached value
+		* contains : returns whether the value is cached (not counted)
+		* stat     : returns metadata of cached value (counted as hit or miss)
+		* rename   : caches the value under its new name, then drops the old
+		             name (other processes may briefly see both)
+	
+	The hit, miss and eviction counts reported by :meth:`datastore_stats` are
+	those of the current process, while its size is that of the shared cache.
+	"""
+	__slots__ = ("name", "_buf", "_buckets_offset", "_buckets_per_stripe", "_evictions",
+	             "_hits", "_lock_fd", "_misses", "_payload_size", "_shm", "_slab_size",
+	             "_slabs_offset", "_slabs_per_stripe", "_stripes")
+	
+	name: str
+	
+	_shm: typing.Any
+	_buf: memoryview
+	_lock_fd: int
+	
+	_stripes: int
+	_buckets_per_stripe: int
+	_slabs_per_stripe: int
+	_slab_size: int
+	_payload_size: int
+	_buckets_offset: int
+	_slabs_offset: int
+	
+	_hits: int
+	_misses: int
+	_evictions: int
+	
+	def __init__(self, name: str, max_size: int, *, slab_size: int = DEFAULT_SLAB_SIZE,
+	             stripes: int = DEFAULT_STRIPES):
+		"""
+		Opens the shared cache called *name*, creating it if no process on
+		this machine has done so yet
+		
+		Arguments
+		---------
+		name
+			The name of the shared memory block, which all processes sharing
+			the cache must agree on
+		max_size
+			The number of bytes to reserve for cached keys and values (only
+			used when creating the cache)
+		slab_size
+			The size of the units of memory that entries are stored in (only
+			used when creating the cache); each entry takes up at least one
+			slab, so this should roughly match the size of small values
+		stripes
+			The number of independently locked parts to divide the cache into
+			(only used when creating the cache)
+		
+		Raises
+		------
+		NotImplementedError
+			Shared memory or file locking is not available on this platform
+		ValueError
+			The existing shared memory block called *name* is not a cache or
+			the given sizes are too small
+		"""
+		if shared_memory is None or fcntl is None:
+			raise NotImplementedError("Shared memory caches are not supported on this platform")
+		if slab_size < 2 * _SLAB_NEXT.size or stripes < 1 or max_size < slab_size * stripes:
+			raise ValueError("Shared memory cache must have at least one slab of at least "
+			                 f"{2 * _SLAB_NEXT.size} bytes per stripe")
+		
+		self.name = name
+		self._hits      = 0
+		self._misses    = 0
+		self._evictions = 0
+		
+		# Stripe I is locked by locking byte I of the lock file, while
+		# creating or attaching to the shared memory block is serialized
+		# using a byte far beyond the last stripe (index -1)
+		self._lock_fd = os.open(self._lock_path(name), os.O_RDWR | os.O_CREAT, 0o666)
+		try:
+			with self._file_lock(-1, shared=False):
+				self._shm = self._attach_or_create(max_size, slab_size, stripes)
+		except BaseException:
+			os.close(self._lock_fd)
+			raise
+	
+	
+	def _attach_or_create(self, max_size: int, slab_size: int, stripes: int) -> typing.Any:
+		try:
+			shm = shared_memory.SharedMemory(self.name)
+		except FileNotFoundError:
+			slabs_per_stripe = max_size // slab_size // stripes
+			self._set_layout(stripes, 2 * slabs_per_stripe, slabs_per_stripe, slab_size)
+			shm = shared_memory.SharedMemory(
+				self.name, create=True,
+				size=self._slabs_offset + stripes * slabs_per_stripe * slab_size
+			)
+			self._untrack(shm)
+			self._buf = shm.buf
+			for stripe in range(stripes):
+				self._reset_stripe(stripe)
+			_HEADER.pack_into(self._buf, 0, MAGIC, VERSION, stripes, 2 * slabs_per_stripe,
+			                  slabs_per_stripe, slab_size)
+			return shm
+		
+		self._untrack(shm)
+		self._buf = shm.buf
+		try:
+			magic, version, *layout = _HEADER.unpack_from(self._buf)
+			if magic != MAGIC or version != VERSION:
+				raise ValueError(f"Shared memory block {self.name!r} is not a datastore cache")
+			self._set_layout(*layout)
+		except BaseException:
+			del self._buf
+			shm.close()
+			raise
+		return shm
+	
+	
+	@staticmethod
+	def _lock_path(name: str) -> str:
+		return os.path.join(tempfile.gettempdir(), f"datastore-{name}.lock")
+	
+	
+	@staticmethod
+	def _untrack(shm: typing.Any) -> None:
+		# The cache is meant to outlive the process that created it, so
+		# prevent Python from unlinking it when this process exits (which
+		# it even does for processes only attaching to it before 3.13)
+		resource_tracker.unregister(shm._name, "shared_memory")
+	
+	
+	def _set_layout(self, stripes: int, buckets_per_stripe: int, slabs_per_stripe: int,
+	                slab_size: int) -> None:
+		self._stripes            = stripes
+		self._buckets_per_stripe = buckets_per_stripe
+		self._slabs_per_stripe   = slabs_per_stripe
+		self._slab_size          = slab_size
+		self._payload_size       = slab_size - _SLAB_NEXT.size
+		self._buckets_offset     = _HEADER.size + stripes * _STRIPE.size
+		buckets_end = self._buckets_offset + stripes * buckets_per_stripe * _BUCKET.size
+		self._slabs_offset       = (buckets_end + 63) // 64 * 64
+	
+	
+	@contextlib.contextmanager
+	def _file_lock(self, index: int, *, shared: bool) -> typing.Iterator[None]:
+		# Byte-range locks belong to the process rather than the file
+		# descriptor, which is fine as long as the lock is never held while
+		# yielding to other tasks
+		offset = index if index >= 0 else (1 << 31)
+		fcntl.lockf(self._lock_fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, 1, offset)
+		try:
+			yield
+		finally:
+			fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, offset)
+	
+	
+	@contextlib.contextmanager
+	def _modify(self, stripe: int) -> typing.Iterator[None]:
+		"""Locks *stripe* and marks it as being modified"""
+		offset = _HEADER.size + stripe * _STRIPE.size
+		with self._file_lock(stripe, shared=False):
+			seq, = _STRIPE_SEQ.unpack_from(self._buf, offset)
+			if seq % 2:
+				# Some process died while modifying the stripe, so its contents
+				# cannot be trusted anymore
+				self._reset_stripe(stripe)
+				seq, = _STRIPE_SEQ.unpack_from(self._buf, offset)
+			
+			_STRIPE_SEQ.pack_into(self._buf, offset, seq + 1)
+			try:
+				yield
+			finally:
+				_STRIPE_SEQ.pack_into(self._buf, offset, seq + 2)
+	
+	
+	def _reset_stripe(self, stripe: int) -> None:
+		"""Drops all entries of *stripe* and links all of its slabs into its
+		free list"""
+		offset = _HEADER.size + stripe * _STRIPE.size
+		seq, *_ = _STRIPE.unpack_from(self._buf, offset)
+		
+		start = self._bucket_offset(stripe, 0)
+		end   = self._bucket_offset(stripe, self._buckets_per_stripe)
+		self._buf[start:end] = bytes(end - start)
+		for slab in range(self._slabs_per_stripe):
+			next_slab = slab + 1 if slab + 1 < self._slabs_per_stripe else NO_SLAB
+			_SLAB_NEXT.pack_into(self._buf, self._slab_offset(stripe, slab), next_slab)
+		
+		_STRIPE.pack_into(self._buf, offset, seq + seq % 2, 0, 0, 0, 0, self._slabs_per_stripe)
+	
+	
+	def _bucket_offset(self, stripe: int, bucket: int) -> int:
+		return self._buckets_offset + (stripe * self._buckets_per_stripe + bucket) * _BUCKET.size
+	
+	
+	def _slab_offset(self, stripe: int, slab: int) -> int:
+		return self._slabs_offset + (stripe * self._slabs_per_stripe + slab) * self._slab_size
+	
+	
+	def _locate(self, key: datastore.Key) -> typing.Tuple[bytes, int, int, int]:
+		"""Returns the encoded *key*, its hash, stripe and preferred bucket"""
+		key_bytes = str(key).encode("utf-8")
+		h = hash_key(key_bytes)
+		return key_bytes, h, h % self._stripes, (h // self._stripes) % self._buckets_per_stripe
+	
+	
+	def _read_chain(self, stripe: int, slab: int, start: int, size: int) -> bytes:
+		"""Reads *size* bytes starting at offset *start* of the entry data
+		stored in the chain beginning at *slab*"""
+		buf = self._buf
+		payload_size = self._payload_size
+		chunks = []
+		position = 0
+		for _ in range(self._slabs_per_stripe):
+			if slab >= self._slabs_per_stripe:
+				raise _TornRead()
+			
+			offset = self._slab_offset(stripe, slab)
+			if position + payload_size > start:
+				begin = max(start - position, 0)
+				end = min(start + size - position, payload_size)
+				chunks.append(buf[(offset + _SLAB_NEXT.size + begin):(offset + _SLAB_NEXT.size + end)])
+			position += payload_size
+			if position >= start + size:
+				return b"".join(chunks)
+			slab, = _SLAB_NEXT.unpack_from(buf, offset)
+		raise _TornRead()
+	
+	
+	def _find(self, key_bytes: bytes, h: int, stripe: int, home: int) \
+	    -> typing.Optional[typing.Tuple[int, int, int]]:
+		"""Returns the bucket, first slab and value size of the entry for
+		*key_bytes* in *stripe* if there is one"""
+		for probe in range(self._buckets_per_stripe):
+			bucket = (home + probe) % self._buckets_per_stripe
+			bucket_h, slab, size, key_size, flags = \
+				_BUCKET.unpack_from(self._buf, self._bucket_offset(stripe, bucket))
+			if bucket_h == 0:
+				return None
+			if bucket_h == h and key_size == len(key_bytes) \
+			   and self._read_chain(stripe, slab, 0, key_size) == key_bytes:
+				return bucket, slab, size
+		return None
+	
+	
+	def _lookup(self, key: datastore.Key, *, value: bool, count: bool) \
+	    -> typing.Optional[typing.Tuple[int, bytes]]:
+		"""Returns the size and (if *value* is set) the contents of the value
+		cached for *key*, counting it as a hit or miss if *count* is set"""
+		key_bytes, h, stripe, home = self._locate(key)
+		seq_offset = _HEADER.size + stripe * _STRIPE.size
+		
+		result: typing.Optional[typing.Tuple[int, bytes]] = None
+		for attempt in range(SEQLOCK_RETRIES + 1):
+			locked = attempt == SEQLOCK_RETRIES
+			with self._file_lock(stripe, shared=True) if locked else contextlib.nullcontext():
+				result = None
+				seq, = _STRIPE_SEQ.unpack_from(self._buf, seq_offset)
+				if seq % 2:
+					# Being modified or, if locked, abandoned by a process that
+					# died while modifying it
+					if locked:
+						break
+					continue
+				
+				try:
+					entry = self._find(key_bytes, h, stripe, home)
+					if entry is not None:
+						bucket, slab, size = entry
+						data = self._read_chain(stripe, slab, len(key_bytes), size) if value else b""
+						result = (size, data)
+				except (_TornRead, ValueError, IndexError):
+					if locked:
+						raise
+					continue
+				
+				if locked or _STRIPE_SEQ.unpack_from(self._buf, seq_offset)[0] == seq:
+					break
+		
+		if result is None:
+			if count:
+				self._misses += 1
+			return None
+		
+		if count:
+			self._hits += 1
+			# Setting the flag without holding the lock may at worst mark some
+			# other entry that just took this bucket as recently used
+			flags_offset = self._bucket_offset(stripe, bucket) + _BUCKET_FLAGS_OFFSET
+			self._buf[flags_offset] |= FLAG_REFERENCED
+		return result
+	
+	
+	def _alloc_slab(self, stripe: int) -> int:
+		offset = _HEADER.size + stripe * _STRIPE.size
+		seq, used, count, hand, free_head, free_count = _STRIPE.unpack_from(self._buf, offset)
+		assert free_head != NO_SLAB
+		next_slab, = _SLAB_NEXT.unpack_from(self._buf, self._slab_offset(stripe, free_head))
+		_STRIPE.pack_into(self._buf, offset, seq, used, count, hand, next_slab, free_count - 1)
+		return free_head
+	
+	
+	def _remove_bucket(self, stripe: int, bucket: int) -> None:
+		"""Frees the entry in *bucket* of the locked *stripe*, moving entries
+		of the same probe sequence back to keep lookups working"""
+		buf = self._buf
+		_, slab, size, key_size, _ = _BUCKET.unpack_from(buf, self._bucket_offset(stripe, bucket))
+		
+		# Prepend the entry's slabs to the free list
+		offset = _HEADER.size + stripe * _STRIPE.size
+		seq, used, count, hand, free_head, free_count = _STRIPE.unpack_from(buf, offset)
+		needed = max(-(-(key_size + size) // self._payload_size), 1)
+		last = slab
+		for _ in range(needed - 1):
+			last, = _SLAB_NEXT.unpack_from(buf, self._slab_offset(stripe, last))
+		_SLAB_NEXT.pack_into(buf, self._slab_offset(stripe, last), free_head)
+		_STRIPE.pack_into(buf, offset, seq, used - size, count - 1, hand, slab,
+		                  free_count + needed)
+		
+		# Backward shift deletion
+		buckets = self._buckets_per_stripe
+		hole = bucket
+		current = bucket
+		while True:
+			current = (current + 1) % buckets
+			current_offset = self._bucket_offset(stripe, current)
+			current_h = _BUCKET.unpack_from(buf, current_offset)[0]
+			if current_h == 0:
+				break
+			home = (current_h // self._stripes) % buckets
+			if (current - home) % buckets >= (current - hole) % buckets:
+				hole_offset = self._bucket_offset(stripe, hole)
+				buf[hole_offset:(hole_offset + _BUCKET.size)] = \
+					buf[current_offset:(current_offset + _BUCKET.size)]
+				hole = current
+		hole_offset = self._bucket_offset(stripe, hole)
+		buf[hole_offset:(hole_offset + _BUCKET.size)] = bytes(_BUCKET.size)
+	
+	
+	def _evict(self, stripe: int) -> None:
+		"""Evicts the next entry of the locked *stripe* chosen by the CLOCK hand"""
+		buf = self._buf
+		offset = _HEADER.size + stripe * _STRIPE.size
+		seq, used, count, hand, free_head, free_count = _STRIPE.unpack_from(buf, offset)
+		assert count > 0
+		while True:
+			bucket_offset = self._bucket_offset(stripe, hand)
+			bucket_h, _, _, _, flags = _BUCKET.unpack_from(buf, bucket_offset)
+			if bucket_h != 0 and not flags & FLAG_REFERENCED:
+				break
+			# Lookups may set the flag on unused buckets, so occupancy is only
+			# determined by the hash
+			buf[bucket_offset + _BUCKET_FLAGS_OFFSET] = flags & ~FLAG_REFERENCED
+			hand = (hand + 1) % self._buckets_per_stripe
+		
+		_STRIPE.pack_into(buf, offset, seq, used, count, hand, free_head, free_count)
+		self._remove_bucket(stripe, hand)
+		self._evictions += 1
+	
+	
+	def _store(self, key: datastore.Key, value: bytes) -> None:
+		key_bytes, h, stripe, home = self._locate(key)
+		data = key_bytes + value
+		needed = max(-(-len(data) // self._payload_size), 1)
+		with self._modify(stripe):
+			entry = self._find(key_bytes, h, stripe, home)
+			if entry is not None:
+				self._remove_bucket(stripe, entry[0])
+			if needed > self._slabs_per_stripe or len(key_bytes) > 0xFFFF:
+				# Caching this would evict everything else
+				return
+			
+			offset = _HEADER.size + stripe * _STRIPE.size
+			while _STRIPE.unpack_from(self._buf, offset)[5] < needed:
+				self._evict(stripe)
+			
+			# Write the entry to a new chain of slabs (last slab first)
+			payload_size = self._payload_size
+			slab = NO_SLAB
+			for idx in reversed(range(needed)):
+				next_slab, slab = slab, self._alloc_slab(stripe)
+				slab_offset = self._slab_offset(stripe, slab)
+				_SLAB_NEXT.pack_into(self._buf, slab_offset, next_slab)
+				chunk = data[(idx * payload_size):((idx + 1) * payload_size)]
+				self._buf[(slab_offset + _SLAB_NEXT.size):(slab_offset + _SLAB_NEXT.size + len(chunk))] = chunk
+			
+			bucket = home
+			while _BUCKET.unpack_from(self._buf, self._bucket_offset(stripe, bucket))[0] != 0:
+				bucket = (bucket + 1) % self._buckets_per_stripe
+			_BUCKET.pack_into(self._buf, self._bucket_offset(stripe, bucket),
+			                  h, slab, len(value), len(key_bytes), 0)
+			
+			seq, used, count, hand, free_head, free_count = _STRIPE.unpack_from(self._buf, offset)
+			_STRIPE.pack_into(self._buf, offset, seq, used + len(value), count + 1, hand,
+			                  free_head, free_count)
+	
+	
+	def _discard(self, key: datastore.Key) -> bool:
+		key_bytes, h, stripe, home = self._locate(key)
+		with self._modify(stripe):
+			entry = self._find(key_bytes, h, stripe, home)
+			if entry is None:
+				return False
+			self._remove_bucket(stripe, entry[0])
+			return True
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns the cached value named by `key` or raises `KeyError`
+		
+		Arguments
+		---------
+		key
+			Key naming the value to retrieve
+		"""
+		return datastore.util.receive_stream_from(await self.get_all(key))
+	
+	
+	async def get_all(self, key: datastore.Key) -> bytes:
+		"""Returns the cached value named by `key` or raises `KeyError`
+		
+		Arguments
+		---------
+		key
+			Key naming the value to retrieve
+		"""
+		result = self._lookup(key, value=True, count=True)
+		if result is None:
+			raise KeyError(key)
+		return result[1]
+	
+	
+	async def _put(self, key: datastore.Key, value: datastore.abc.ReceiveStream, *,
+	               create: bool, replace: bool) -> None:
+		"""Caches `value` under the name `key`
+		
+		Arguments
+		---------
+		key
+			Key naming `value`
+		value
+			The value to cache
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		"""
+		if not create and not await self.contains(key):
+			raise KeyError(key)
+		if not replace and await self.contains(key):
+			raise KeyError(key)
+		self._store(key, await value.collect())
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key) \
+	      -> typing.Tuple[datastore.Key, typing.Callable[[datastore.abc.ReceiveStream],
+	                                                     typing.Awaitable[None]]]:
+		"""Caches the value passed to the returned callback in a new key below *prefix*
+		
+		Arguments
+		---------
+		prefix
+			Key below which to store the given value
+		"""
+		key = prefix.child(str(uuid.uuid4()))
+		
+		async def callback(value: datastore.abc.ReceiveStream) -> None:
+			self._store(key, await value.collect())
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Drops the value named by `key` or raises `KeyError` if it was not cached
+		
+		Arguments
+		---------
+		key
+			Key naming the value to remove
+		"""
+		if not self._discard(key):
+			raise KeyError(key)
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether the value named by `key` is cached
+		
+		Unlike :meth:`get` this is neither counted as cache hit nor as cache
+		miss and does not affect which entries are evicted next.
+		
+		Arguments
+		---------
+		key
+			Key naming the value to check
+		"""
+		return self._lookup(key, value=False, count=False) is not None
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the length of the cached byte sequence named by `key`
+		
+		Arguments
+		---------
+		key
+			Key naming a byte sequence
+		"""
+		result = self._lookup(key, value=False, count=True)
+		if result is None:
+			raise KeyError(key)
+		return datastore.util.StreamMetadata(size=result[0])
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves the cached value at name *key1* to *key2*
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		"""
+		if key1 == key2:
+			return
+		
+		result = self._lookup(key1, value=True, count=False)
+		if result is None:
+			raise KeyError(key1)
+		if not replace and await self.contains(key2):
+			raise KeyError(key2)
+		
+		self._store(key2, result[1])
+		self._discard(key1)
+	
+	
+	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
+	    -> datastore.util.CacheMetadata:
+		"""Returns the number of bytes cached by all processes as well as the
+		cache hit, miss and eviction counts of this process
+		
+		Arguments
+		---------
+		selector
+			Ignored by backing datastores
+		"""
+		size = 0
+		for stripe in range(self._stripes):
+			size += _STRIPE.unpack_from(self._buf, _HEADER.size + stripe * _STRIPE.size)[1]
+		
+		return datastore.util.CacheMetadata(
+			size          = size,
+			size_accuracy = "approximate",
+			hits          = self._hits,
+			misses        = self._misses,
+			evictions     = self._evictions,
+		)
+	
+	
+	def __len__(self) -> int:
+		return sum(
+			_STRIPE.unpack_from(self._buf, _HEADER.size + stripe * _STRIPE.size)[2]
+			for stripe in range(self._stripes)
+		)
+	
+	
+	def unlink(self) -> None:
+		"""Removes the shared memory block and its lock file, so that the next
+		datastore opened with the same name starts out empty
+		
+		Processes that have already attached to it may continue using it.
+		"""
+		# Undo `_untrack`, as unlinking also unregisters the block
+		resource_tracker.register(self._shm._name, "shared_memory")
+		self._shm.unlink()
+		os.unlink(self._lock_path(self.name))
+	
+	
+	async def aclose(self) -> None:
+		"""Detaches from the shared cache, leaving its contents to the other
+		processes (see :meth:`unlink`)"""
+		if self._lock_fd < 0:
+			return
+		
+		del self._buf
+		self._shm.close()
+		os.close(self._lock_fd)
+		self._lock_fd = -1
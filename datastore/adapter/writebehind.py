@@ -0,0 +1,388 @@
+"""Acknowledges writes before they reach the wrapped datastore
+
+The adapters in this module store the values passed to :meth:`~_Adapter.put`
+in a bounded in-memory buffer and return right away, while a background task
+writes the buffered values to the wrapped datastore in batches (“write-behind”).
+A batch is written once the buffered values exceed *flush_size* or once the
+oldest buffered value has waited for *flush_interval* seconds, whichever
+happens first. Repeated writes to the same key while it is still buffered
+only cause the latest value to be written.
+
+If the wrapped datastore has a ``put_many`` method, it is passed each batch
+as a list of ``(key, value)`` pairs, allowing it to write the entire batch at
+once (in a single transaction for instance). Otherwise the values of each
+batch are written using concurrent calls to ``put``.
+
+Lookups through the adapter always observe buffered values, but other users
+of the wrapped datastore will only see them once they have been written.
+Call :meth:`~_Adapter.flush` to wait for all buffered values to be written
+and make sure to close the adapter, since values still buffered when the
+Trio event loop exits are lost.
+
+If writing a batch fails, its values stay buffered and are retried after
+*flush_interval*. The error is raised in all tasks waiting for that batch,
+i.e. from :meth:`~_Adapter.flush`, :meth:`~_Adapter.aclose` or from
+:meth:`~_Adapter.put` if it was waiting for space in the buffer.
+"""
+import copy
+import typing
+
+import trio
+
+import datastore
+
+from ._support import DS, MD, RT, RV, T_co
+
+__all__ = (
+	"BinaryAdapter",
+	"ObjectAdapter",
+)
+
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+FLUSH_CONCURRENCY      = 16
+
+
+class _Batch:
+	"""The values buffered until some point that are written together"""
+	__slots__ = ("done", "error")
+	
+	done: trio.Event
+	error: typing.Optional[BaseException]
+	
+	def __init__(self) -> None:
+		self.done  = trio.Event()
+		self.error = None
+
+
+class _Adapter(typing.Generic[DS, MD, RT, RV]):
+	"""Represents a datastore adapter that buffers writes in memory and writes
+	them to the wrapped datastore in the background
+	
+	Semantics:
+	
+		* get      : returns the buffered value if present, else forwards
+		* put      : buffers the value, waiting for space in the buffer if it is full
+		             (values larger than the entire buffer, puts with *create* or
+		             *replace* set to `False` and puts with extra arguments are
+		             forwarded after flushing the buffer instead)
+		* delete   : flushes the buffer, then forwards
+		* contains : returns `True` if a value is buffered, else forwards
+		* stat     : returns the metadata of the buffered value if present, else forwards
+		* rename   : flushes the buffer, then forwards
+		* put_new  : forwarded
+	"""
+	__slots__ = ()
+	
+	FORWARD_CONTAINS = True
+	FORWARD_GET_ALL  = True
+	FORWARD_PUT_NEW  = True
+	FORWARD_RENAME   = True
+	FORWARD_STAT     = True
+	
+	DEFAULT_MAX_SIZE: int
+	
+	max_size: int
+	flush_size: int
+	flush_interval: float
+	
+	_pending: typing.Dict[datastore.Key, RV]
+	_flushing: typing.Dict[datastore.Key, RV]
+	_size: int
+	_batch: _Batch
+	_writing: typing.Optional[_Batch]
+	_deadline: float
+	_wakeup: trio.Event
+	_flush_requested: trio.Event
+	_flusher_scope: typing.Optional[trio.CancelScope]
+	
+	
+	def __init__(self, *args: typing.Any, max_size: typing.Optional[int] = None,
+	             flush_size: typing.Optional[int] = None,
+	             flush_interval: float = DEFAULT_FLUSH_INTERVAL, **kwargs: typing.Any):
+		"""
+		Arguments
+		---------
+		max_size
+			The maximum total size of all buffered values (in bytes for
+			binary datastores, in objects for object datastores); once
+			reached, puts wait for buffered values to be written
+		flush_size
+			The total size of all buffered values at which they are written
+			to the wrapped datastore right away (defaults to half of
+			*max_size*)
+		flush_interval
+			The maximum number of seconds a value stays buffered before
+			being written to the wrapped datastore
+		"""
+		self.max_size       = max_size if max_size is not None else self.DEFAULT_MAX_SIZE
+		self.flush_size     = flush_size if flush_size is not None else self.max_size // 2
+		self.flush_interval = flush_interval
+		
+		self._pending  = {}
+		self._flushing = {}
+		self._size     = 0
+		self._batch    = _Batch()
+		self._writing  = None
+		self._deadline = 0.0
+		self._wakeup   = trio.Event()
+		self._flush_requested = trio.Event()
+		self._flusher_scope   = None
+		super().__init__(*args, **kwargs)  # type: ignore[call-arg]
+	
+	
+	def _lookup(self, key: datastore.Key) -> typing.Optional[RV]:
+		value = self._pending.get(key)
+		if value is None:
+			value = self._flushing.get(key)
+		return value
+	
+	
+	def _request_flush(self) -> None:
+		self._flush_requested.set()
+		self._wakeup.set()
+	
+	
+	async def _run_flusher(self, cancel_scope: trio.CancelScope) -> None:
+		with cancel_scope:
+			while True:
+				await self._wakeup.wait()
+				with trio.move_on_at(self._deadline):
+					await self._flush_requested.wait()
+				self._flush_requested = trio.Event()
+				
+				if not self._pending:
+					self._wakeup = trio.Event()
+					continue
+				await self._write_batch()
+	
+	
+	async def _write_batch(self) -> None:
+		batch, self._batch = self._batch, _Batch()
+		self._flushing, self._pending = self._pending, {}
+		self._writing = batch
+		try:
+			await self._write_values(list(self._flushing.items()))
+		except Exception as exc:
+			batch.error = exc
+			
+			# Keep the values (that were not replaced in the meantime) buffered
+			# and retry writing them later
+			for key, value in self._flushing.items():
+				if key in self._pending:
+					self._size -= len(value)
+				else:
+					self._pending[key] = value
+			self._deadline = trio.current_time() + self.flush_interval
+		else:
+			self._size -= sum(len(value) for value in self._flushing.values())
+			if self._pending:
+				self._deadline = trio.current_time() + self.flush_interval
+		finally:
+			self._flushing = {}
+			self._writing  = None
+			batch.done.set()
+	
+	
+	async def _write_values(self, items: typing.List[typing.Tuple[datastore.Key, RV]]) -> None:
+		put_many = getattr(self.child_datastore, "put_many", None)  # type: ignore[attr-defined]
+		if put_many is not None:
+			await put_many(items)
+			return
+		
+		limiter = trio.CapacityLimiter(FLUSH_CONCURRENCY)
+		
+		async def write_value(key: datastore.Key, value: RV) -> None:
+			async with limiter:
+				await self.child_datastore.put(key, value)  # type: ignore[attr-defined]
+		
+		async with trio.open_nursery() as nursery:
+			for key, value in items:
+				nursery.start_soon(write_value, key, value)
+	
+	
+	async def _wait_batch(self) -> bool:
+		"""Waits for the next batch of buffered values to be written
+		
+		Returns `False` if there are no buffered values left.
+		"""
+		if self._pending:
+			batch = self._batch
+			self._request_flush()
+		elif self._writing is not None:
+			batch = self._writing
+		else:
+			return False
+		
+		await batch.done.wait()
+		if batch.error is not None:
+			# Raise a copy of the error, since raising the same exception
+			# object from several tasks mangles its traceback
+			raise copy.copy(batch.error) from batch.error
+		return True
+	
+	
+	async def flush(self) -> None:
+		"""Waits for all values buffered so far to be written to the wrapped
+		datastore
+		
+		Raises
+		------
+		RuntimeError
+			An internal error occurred while writing some buffered value
+		"""
+		while await self._wait_batch():
+			pass
+	
+	
+	async def get(self, key: datastore.Key) -> RT:
+		"""Returns a stream of the buffered value named by *key* or the one
+		returned by the wrapped datastore"""
+		value = self._lookup(key)
+		if value is None:
+			return await super().get(key)  # type: ignore[misc, no-any-return]
+		elif isinstance(self, datastore.abc.BinaryDatastore):
+			return datastore.util.receive_stream_from(value)  # type: ignore[return-value, arg-type]
+		elif isinstance(self, datastore.abc.ObjectDatastore):
+			return datastore.util.receive_channel_from(list(value))  # type: ignore[return-value]
+		else:
+			assert False
+	
+	
+	async def get_all(self, key: datastore.Key) -> RV:
+		"""Returns the buffered value named by *key* or the one returned by the
+		wrapped datastore"""
+		value = self._lookup(key)
+		if value is None:
+			return await super().get_all(key)  # type: ignore[misc, no-any-return]
+		elif isinstance(value, list):
+			return value.copy()  # type: ignore[return-value]
+		return value
+	
+	
+	async def _put(self, key: datastore.Key, value: RT, *, create: bool, replace: bool,
+	               **kwargs: typing.Any) -> None:
+		"""Buffers *value* until it is written to the wrapped datastore"""
+		if not create or not replace or kwargs:
+			# Whether the key exists can only be decided by the wrapped
+			# datastore once it has received all previous writes
+			await self.flush()
+			await super()._put(key, value, create=create, replace=replace,  # type: ignore[misc]
+			                   **kwargs)
+			return
+		
+		data: RV = await value.collect()  # type: ignore[attr-defined]
+		if len(data) > self.max_size:
+			await self.flush()
+			await super()._put(  # type: ignore[misc]
+				key, datastore.util.receive_stream_from(data)
+				     if isinstance(data, bytes) else datastore.util.receive_channel_from(data),
+				create=create, replace=replace
+			)
+			return
+		
+		# Wait for enough space in the buffer (backpressure)
+		while True:
+			previous = self._pending.get(key)
+			size = self._size + len(data) - (len(previous) if previous is not None else 0)
+			if size <= self.max_size:
+				break
+			await self._wait_batch()
+		
+		if self._flusher_scope is None:
+			self._flusher_scope = trio.CancelScope()
+			trio.lowlevel.spawn_system_task(self._run_flusher, self._flusher_scope)
+		if not self._pending:
+			self._deadline = trio.current_time() + self.flush_interval
+		
+		self._pending[key] = data
+		self._size = size
+		self._wakeup.set()
+		if self._size >= self.flush_size:
+			self._flush_requested.set()
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the data named by *key* after flushing the buffer"""
+		await self.flush()
+		await super().delete(key)  # type: ignore[misc]
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether a value named by *key* is buffered or exists in the
+		wrapped datastore"""
+		if self._lookup(key) is not None:
+			return True
+		return await super().contains(key)  # type: ignore[misc, no-any-return]
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Renames item *key1* to *key2* after flushing the buffer"""
+		await self.flush()
+		await super().rename(key1, key2, replace=replace)  # type: ignore[misc]
+	
+	
+	async def stat(self, key: datastore.Key) -> MD:
+		"""Returns the metadata of the buffered value named by *key* or the one
+		returned by the wrapped datastore"""
+		value = self._lookup(key)
+		if value is None:
+			return await super().stat(key)  # type: ignore[misc, no-any-return]
+		elif isinstance(value, bytes):
+			return datastore.util.StreamMetadata(size=len(value))  # type: ignore[return-value]
+		else:
+			return datastore.util.ChannelMetadata(count=len(value))  # type: ignore[return-value]
+	
+	
+	async def aclose(self) -> None:
+		"""Writes all buffered values to the wrapped datastore, then closes it
+		
+		The wrapped datastore is closed even if writing the buffered values
+		fails, in which case they are lost.
+		"""
+		try:
+			await self.flush()
+		finally:
+			if self._flusher_scope is not None:
+				self._flusher_scope.cancel()
+			await super().aclose()  # type: ignore[misc]
+
+
+class BinaryAdapter(
+		_Adapter[
+			datastore.abc.BinaryDatastore,
+			datastore.util.StreamMetadata,
+			datastore.abc.ReceiveStream,
+			bytes
+		],
+		datastore.abc.BinaryAdapter
+):
+	__slots__ = ("max_size", "flush_size", "flush_interval",
+	             "_pending", "_flushing", "_size", "_batch", "_writing", "_deadline",
+	             "_wakeup", "_flush_requested", "_flusher_scope")
+	
+	DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+
+class ObjectAdapter(
+		typing.Generic[T_co],
+		_Adapter[
+			datastore.abc.ObjectDatastore[T_co],
+			datastore.util.ChannelMetadata,
+			datastore.abc.ReceiveChannel[T_co],
+			typing.List[T_co]
+		],
+		datastore.abc.ObjectAdapter[T_co, T_co]
+):
+	__slots__ = ("max_size", "flush_size", "flush_interval",
+	             "_pending", "_flushing", "_size", "_batch", "_writing", "_deadline",
+	             "_wakeup", "_flush_requested", "_flusher_scope")
+	
+	DEFAULT_MAX_SIZE = 64 * 1024
+	
+	
+	async def query(self, query: datastore.Query) -> datastore.Cursor:
+		"""Returns the objects matching *query* after flushing the buffer"""
+		await self.flush()
+		return await super().query(query)
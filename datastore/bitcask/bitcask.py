@@ -0,0 +1,1029 @@
+import copy
+import itertools
+import os
+import pathlib
+import struct
+import time
+import typing
+import uuid
+import zlib
+
+import trio
+
+import datastore
+import datastore.abc
+import datastore.util
+from datastore.core.util.fileio import fdatasync, fsync_dir, pwrite_all, run_blocking_nointr
+
+try:
+	import fcntl
+except ImportError:  #PY: Windows
+	fcntl = None  # type: ignore[assignment]
+
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+
+DEFAULT_MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+DEFAULT_COMPACT_RATIO    = 0.5
+
+# Amount of data copied at once while compacting segments
+COPY_BUFFER_SIZE = 1024 * 1024
+
+LOCK_NAME = "LOCK"
+
+# Each record consists of this header, followed by the key and the value:
+#  * CRC32 of everything following the CRC field itself
+#  * sequence number (decides which record wins when loading)
+#  * modification time
+#  * value size (`TOMBSTONE` for records marking the key as deleted)
+#  * key size
+_RECORD = struct.Struct("<IQdIH")
+
+# Each hint file entry consists of this header, followed by the key:
+#  * sequence number
+#  * modification time
+#  * record offset within the segment file
+#  * value size (`TOMBSTONE` for records marking the key as deleted)
+#  * key size
+#
+# The entries are followed by a CRC32 of all entries.
+_HINT = struct.Struct("<QdQIH")
+_HINT_CRC = struct.Struct("<I")
+
+TOMBSTONE = 0xFFFFFFFF
+MAX_KEY_SIZE   = 0xFFFF
+MAX_VALUE_SIZE = TOMBSTONE - 1
+
+
+
+def iter_hints(hints: bytes) -> typing.Iterator[typing.Tuple[int, float, int, int, bytes]]:
+	"""Yields the ``(seq, mtime, offset, size, key)`` tuples of the given
+	hint entries"""
+	pos = 0
+	while pos < len(hints):
+		seq, mtime, offset, size, key_size = _HINT.unpack_from(hints, pos)
+		pos += _HINT.size
+		yield seq, mtime, offset, size, hints[pos:(pos + key_size)]
+		pos += key_size
+
+
+def scan_records(data: bytes) -> typing.Tuple[bytearray, int]:
+	"""Returns the hint entries of all valid records in the segment *data* and
+	the offset at which the valid records end
+	
+	Scanning stops at the first record that is truncated or whose checksum
+	does not match, since this is what an interrupted append looks like.
+	"""
+	hints = bytearray()
+	pos = 0
+	while pos + _RECORD.size <= len(data):
+		crc, seq, mtime, size, key_size = _RECORD.unpack_from(data, pos)
+		end = pos + _RECORD.size + key_size + (size if size != TOMBSTONE else 0)
+		if end > len(data) or zlib.crc32(data[(pos + 4):end]) != crc:
+			break
+		
+		key = data[(pos + _RECORD.size):(pos + _RECORD.size + key_size)]
+		hints += _HINT.pack(seq, mtime, pos, size, key_size) + key
+		pos = end
+	return hints, pos
+
+
+class _Aborted(Exception):
+	"""Raised when the datastore is closed during compaction"""
+
+
+class _Entry(typing.NamedTuple):
+	"""Location of the current record of some key"""
+	segment: int
+	offset: int
+	size: int
+	mtime: float
+
+
+class _Segment:
+	"""An open segment file and the number of bytes of its live records"""
+	__slots__ = ("id", "fd", "size", "live", "refs", "retired")
+	
+	id: int
+	fd: int
+	size: int
+	live: int
+	refs: int
+	retired: bool
+	
+	def __init__(self, id: int, fd: int, size: int = 0) -> None:
+		self.id      = id
+		self.fd      = fd
+		self.size    = size
+		self.live    = 0
+		self.refs    = 0
+		self.retired = False
+
+
+class _Write:
+	"""A single put, delete or rename waiting to be appended"""
+	__slots__ = ("key", "value", "source", "create", "replace", "done", "error")
+	
+	key: datastore.Key
+	value: typing.Optional[bytes]
+	source: typing.Optional[datastore.Key]
+	create: bool
+	replace: bool
+	done: bool
+	error: typing.Optional[BaseException]
+	
+	def __init__(self, key: datastore.Key, value: typing.Optional[bytes], *,
+	             source: typing.Optional[datastore.Key] = None,
+	             create: bool = True, replace: bool = True) -> None:
+		self.key     = key
+		self.value   = value
+		self.source  = source
+		self.create  = create
+		self.replace = replace
+		self.done    = False
+		self.error   = None
+
+
+# The value of a record to append: its data, the location (and key size) of
+# the existing record to copy it from or `None` for deletion records
+_value_t = typing.Union[bytes, typing.Tuple[_Segment, _Entry, int], None]
+
+
+class BitcaskDatastore(datastore.abc.BinaryDatastore):
+	"""Log-structured datastore for large numbers of small values
+	
+	All values are appended to a series of segment files below *root*, as
+	records prefixed with their key, while an in-memory hash index maps each
+	key to the location of its latest record. This makes storing a value cost
+	a single (shared) ``write(2)``, reading it a single ``pread(2)`` and
+	checking for it or its metadata no system call at all, rather than the
+	inode, directory entry and handful of system calls each value costs with
+	:class:`~datastore.filesystem.FileSystemDatastore`. The price is that all
+	keys must fit into memory and that each value is read and written as a
+	whole.
+	
+	Writes issued while another batch of writes is being appended are
+	combined into a single append (“group commit”); use :meth:`put_many` to
+	explicitly append several values at once.
+	
+	Once the active segment file exceeds *max_segment_size* it is closed, a
+	hint file listing its records is written next to it (allowing the index
+	to be rebuilt on startup without reading the values) and a new segment
+	file is started. Overwritten and deleted values keep taking up space
+	until the closed segment files are compacted by copying their live
+	records into new segment files; this happens in the background once the
+	dead records make up more than *compact_ratio* of the closed segments or
+	when :meth:`compact` is called.
+	
+	Each record carries a checksum, and a trailing record that was only
+	partially written (because of a crash for instance) is discarded when
+	the datastore is opened again. Writes are only guaranteed to be durable
+	after :meth:`flush` or if *sync* is enabled however.
+	"""
+	
+	root_path: pathlib.PurePath
+	max_segment_size: int
+	compact_ratio: typing.Optional[float]
+	sync: bool
+	
+	_index: typing.Dict[datastore.Key, _Entry]
+	_segments: typing.Dict[int, _Segment]
+	_segment_ids: typing.Iterator[int]
+	_active: _Segment
+	_hints: bytearray
+	_next_seq: int
+	_lock_fd: typing.Optional[int]
+	
+	_queue: typing.List[_Write]
+	_write_lock: trio.Lock
+	_compact_lock: trio.Lock
+	_compacting: bool
+	_compact_error: typing.Optional[BaseException]
+	_closed: bool
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, root: typing.Union[os_PathLike_str, str], *,
+	                 max_segment_size: int = DEFAULT_MAX_SEGMENT_SIZE,
+	                 compact_ratio: typing.Optional[float] = DEFAULT_COMPACT_RATIO,
+	                 sync: bool = False) -> 'BitcaskDatastore':
+		"""Opens the datastore stored in the directory *root*, creating it if
+		it does not exist yet
+		
+		Arguments
+		---------
+		root
+			A path at which to store the segment files of this datastore
+		max_segment_size
+			The size (in bytes) after which the active segment file is closed
+			and a new one is started
+		compact_ratio
+			The fraction of dead records in the closed segment files at which
+			they are compacted in the background (``None`` to only compact
+			them when calling :meth:`compact`)
+		sync
+			Call ``fdatasync(2)`` after each append, so that values are durable
+			once :meth:`put` returns
+		
+		Raises
+		------
+		RuntimeError
+			The datastore at *root* is already opened by another process
+		"""
+		if not root:
+			raise ValueError('root path must not be empty (use \'.\' for current directory)')
+		
+		# Ensure target directory exists
+		await trio.Path(root).mkdir(parents=True, exist_ok=True)
+		
+		# Create instance
+		self = cls(_create_call=True)
+		
+		# Do the usual constructor stuff
+		self.root_path        = pathlib.PurePath(root)
+		self.max_segment_size = max_segment_size
+		self.compact_ratio    = compact_ratio
+		self.sync             = bool(sync)
+		
+		self._index    = {}
+		self._segments = {}
+		self._hints    = bytearray()
+		self._next_seq = 0
+		self._lock_fd  = None
+		
+		self._queue         = []
+		self._write_lock    = trio.Lock()
+		self._compact_lock  = trio.Lock()
+		self._compacting    = False
+		self._compact_error = None
+		self._closed        = False
+		
+		try:
+			await run_blocking_nointr(self._load_sync)
+		except BaseException:
+			self._close_sync()
+			raise
+		
+		self._maybe_compact()
+		return self
+	
+	
+	def __init__(self, *, _create_call: bool = False):
+		assert _create_call, "Use BitcaskDatastore.create(…) for instance creation"
+	
+	
+	# segment files
+	
+	
+	def _segment_path(self, id: int, suffix: str = ".log") -> str:
+		return os.fspath(self.root_path / f"{id:016x}{suffix}")
+	
+	
+	def _load_sync(self) -> None:
+		"""Locks the datastore directory and rebuilds the index from the hint
+		files, or the segment files themselves where they are missing"""
+		self._lock_fd = os.open(self.root_path / LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o666)
+		if fcntl is not None:
+			try:
+				fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError as exc:
+				raise RuntimeError(f"Datastore at \"{self.root_path}\" is already in use") from exc
+		
+		ids: typing.List[int] = []
+		for name in os.listdir(self.root_path):
+			if name.endswith(".tmp"):
+				# Left behind by an interrupted compaction or hint file write
+				os.unlink(self.root_path / name)
+			elif name.endswith(".log"):
+				ids.append(int(name[:-len(".log")], 16))
+		ids.sort()
+		
+		# Replay all segments, with the record of the highest sequence
+		# number winning for each key (compacted segment files may contain
+		# records that are older than those of segment files with lower IDs)
+		seqs: typing.Dict[datastore.Key, int] = {}
+		for id in ids:
+			fd = os.open(self._segment_path(id), os.O_RDWR)
+			segment = _Segment(id, fd, os.fstat(fd).st_size)
+			self._segments[id] = segment
+			
+			hints = self._read_hints_sync(id)
+			if hints is None:
+				data = os.pread(fd, segment.size, 0)
+				hints, end = scan_records(data)
+				if end < segment.size:
+					os.ftruncate(fd, end)
+					segment.size = end
+				self._write_hints_sync(id, hints)
+			
+			for seq, mtime, offset, size, key_bytes in iter_hints(hints):
+				key = datastore.Key(key_bytes.decode("utf-8"))
+				if seqs.get(key, -1) > seq:
+					continue
+				seqs[key] = seq
+				self._next_seq = max(self._next_seq, seq + 1)
+				
+				if size == TOMBSTONE:
+					self._index.pop(key, None)
+				else:
+					self._index[key] = _Entry(id, offset, size, mtime)
+		
+		for key, entry in self._index.items():
+			self._segments[entry.segment].live += _RECORD.size + len(str(key).encode("utf-8")) + entry.size
+		
+		self._segment_ids = itertools.count(ids[-1] + 1 if ids else 0)
+		self._active = self._open_segment_sync()
+		self._segments[self._active.id] = self._active
+	
+	
+	def _read_hints_sync(self, id: int) -> typing.Optional[bytes]:
+		"""Returns the entries of the hint file of segment *id*, or `None` if
+		it is missing or damaged"""
+		try:
+			with open(self._segment_path(id, ".hint"), "rb") as file:
+				data = file.read()
+		except FileNotFoundError:
+			return None
+		
+		if len(data) < _HINT_CRC.size:
+			return None
+		hints = data[:-_HINT_CRC.size]
+		if _HINT_CRC.unpack(data[-_HINT_CRC.size:])[0] != zlib.crc32(hints):
+			return None
+		return hints
+	
+	
+	def _write_hints_sync(self, id: int, hints: bytes) -> None:
+		path = self._segment_path(id, ".hint")
+		with open(path + ".tmp", "wb") as file:
+			file.write(hints)
+			file.write(_HINT_CRC.pack(zlib.crc32(hints)))
+		os.replace(path + ".tmp", path)
+	
+	
+	def _open_segment_sync(self, suffix: str = ".log") -> _Segment:
+		id = next(self._segment_ids)
+		fd = os.open(self._segment_path(id, suffix), os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+		return _Segment(id, fd)
+	
+	
+	def _rotate_sync(self, hints: bytes) -> _Segment:
+		"""Writes the hint file of the active segment and starts a new one"""
+		if self.sync:
+			fdatasync(self._active.fd)
+		self._write_hints_sync(self._active.id, hints)
+		return self._open_segment_sync()
+	
+	
+	def _remove_segments_sync(self, ids: typing.List[int]) -> None:
+		for id in ids:
+			for suffix in (".hint", ".log"):
+				try:
+					os.unlink(self._segment_path(id, suffix))
+				except FileNotFoundError:
+					pass
+	
+	
+	def _close_sync(self) -> None:
+		for segment in self._segments.values():
+			os.close(segment.fd)
+		self._segments.clear()
+		if self._lock_fd is not None:
+			os.close(self._lock_fd)
+			self._lock_fd = None
+	
+	
+	def _release(self, segment: _Segment) -> None:
+		segment.refs -= 1
+		if segment.retired and segment.refs == 0:
+			os.close(segment.fd)
+	
+	
+	def _retire(self, segment: _Segment) -> None:
+		del self._segments[segment.id]
+		segment.retired = True
+		if segment.refs == 0:
+			os.close(segment.fd)
+	
+	
+	# records
+	
+	
+	@staticmethod
+	def _read_sync(segment: _Segment, entry: _Entry, key_size: int) -> bytes:
+		"""Returns the entire record at *entry* after verifying its checksum"""
+		length = _RECORD.size + key_size + entry.size
+		record = os.pread(segment.fd, length, entry.offset)
+		if len(record) != length or zlib.crc32(memoryview(record)[4:]) != _RECORD.unpack_from(record)[0]:
+			raise RuntimeError(f"Record at offset {entry.offset} of segment {segment.id:016x} is corrupted")
+		return record
+	
+	
+	def _append_sync(self, segment: _Segment, offset: int,
+	                 records: typing.List[typing.Tuple[int, float, bytes, _value_t]]) -> None:
+		"""Writes the given ``(seq, mtime, key, value)`` records to *segment*
+		starting at *offset*"""
+		buffer = bytearray()
+		for seq, mtime, key_bytes, value in records:
+			if isinstance(value, tuple):
+				source, entry, key_size = value
+				value = self._read_sync(source, entry, key_size)[-entry.size:] if entry.size else b""
+			
+			size = len(value) if value is not None else TOMBSTONE
+			header = _RECORD.pack(0, seq, mtime, size, len(key_bytes))
+			crc = zlib.crc32(header[4:])
+			crc = zlib.crc32(key_bytes, crc)
+			if value is not None:
+				crc = zlib.crc32(value, crc)
+			
+			buffer += _RECORD.pack(crc, seq, mtime, size, len(key_bytes))
+			buffer += key_bytes
+			if value is not None:
+				buffer += value
+		
+		try:
+			pwrite_all(segment.fd, buffer, offset)
+			if self.sync:
+				fdatasync(segment.fd)
+		except BaseException:
+			# Do not leave a partial record behind
+			os.ftruncate(segment.fd, segment.size)
+			raise
+	
+	
+	async def _commit(self, writes: typing.List[_Write]) -> None:
+		"""Appends the records of the given writes, together with those of
+		any other writes queued in the meantime"""
+		self._queue.extend(writes)
+		try:
+			async with self._write_lock:
+				if not writes[0].done:
+					batch, self._queue = self._queue, []
+					await self._write_batch(batch)
+		except BaseException:
+			# Withdraw the writes if they have not been picked up yet
+			if writes[0] in self._queue:
+				self._queue = [write for write in self._queue if write not in writes]
+			raise
+		
+		for write in writes:
+			if write.error is not None:
+				raise write.error
+	
+	
+	async def _write_batch(self, batch: typing.List[_Write]) -> None:
+		"""Appends the records of all given writes that may be applied,
+		setting the error of all others"""
+		if self._closed:
+			for write in batch:
+				write.done  = True
+				write.error = RuntimeError("Datastore has been closed")
+			return
+		
+		# Decide which writes may be applied (in order) and turn them into records
+		records: typing.List[typing.Tuple[datastore.Key, bytes, float, _value_t]] = []
+		pending: typing.Dict[datastore.Key, typing.Tuple[float, _value_t]] = {}
+		held: typing.List[_Segment] = []
+		
+		def lookup(key: datastore.Key) -> typing.Tuple[float, _value_t]:
+			if key in pending:
+				return pending[key]
+			entry = self._index.get(key)
+			if entry is None:
+				return 0.0, None
+			return entry.mtime, (self._segments[entry.segment], entry, len(str(key).encode("utf-8")))
+		
+		mtime = time.time()
+		for write in batch:
+			write.done = True
+			if write.source is not None:
+				source_mtime, value = lookup(write.source)
+				if value is None:
+					write.error = KeyError(write.source)
+					continue
+				if write.source == write.key:
+					continue
+				if not write.replace and lookup(write.key)[1] is not None:
+					write.error = KeyError(write.key)
+					continue
+				if isinstance(value, tuple):
+					value[0].refs += 1
+					held.append(value[0])
+				
+				records.append((write.key, str(write.key).encode("utf-8"), source_mtime, value))
+				records.append((write.source, str(write.source).encode("utf-8"), mtime, None))
+				pending[write.key]    = (source_mtime, value)
+				pending[write.source] = (mtime, None)
+			else:
+				exists = lookup(write.key)[1] is not None
+				if (exists and not write.replace) or (not exists and not write.create):
+					write.error = KeyError(write.key)
+					continue
+				
+				records.append((write.key, str(write.key).encode("utf-8"), mtime, write.value))
+				pending[write.key] = (mtime, write.value)
+		
+		try:
+			if not records:
+				return
+			
+			lengths = [
+				_RECORD.size + len(key_bytes) + (
+					len(value) if isinstance(value, bytes) else value[1].size if value is not None else 0
+				)
+				for _, key_bytes, _, value in records
+			]
+			total = sum(lengths)
+			
+			seqs = range(self._next_seq, self._next_seq + len(records))
+			self._next_seq += len(records)
+			try:
+				if self._active.size > 0 and self._active.size + total > self.max_segment_size:
+					segment = await run_blocking_nointr(self._rotate_sync, bytes(self._hints))
+					self._segments[segment.id] = segment
+					self._active = segment
+					self._hints  = bytearray()
+				
+				segment = self._active
+				await run_blocking_nointr(self._append_sync, segment, segment.size, [
+					(seq, mtime, key_bytes, value)
+					for seq, (_, key_bytes, mtime, value) in zip(seqs, records)
+				])
+			except Exception as exc:
+				# Raise a copy of the error in each task, since raising the
+				# same exception object from several tasks mangles its traceback
+				for write in batch:
+					if write.error is None:
+						write.error = copy.copy(exc)
+						write.error.__cause__ = exc
+				return
+			
+			# Update the index to point to the appended records
+			offset = segment.size
+			for seq, (key, key_bytes, mtime, value), length in zip(seqs, records, lengths):
+				previous = self._index.get(key)
+				if previous is not None:
+					self._segments[previous.segment].live -= \
+						_RECORD.size + len(key_bytes) + previous.size
+				
+				if value is None:
+					size = TOMBSTONE
+					self._index.pop(key, None)
+				else:
+					size = length - _RECORD.size - len(key_bytes)
+					self._index[key] = _Entry(segment.id, offset, size, mtime)
+					segment.live += length
+				
+				self._hints += _HINT.pack(seq, mtime, offset, size, len(key_bytes))
+				self._hints += key_bytes
+				offset += length
+			segment.size = offset
+		finally:
+			for held_segment in held:
+				self._release(held_segment)
+		
+		self._maybe_compact()
+	
+	
+	# compaction
+	
+	
+	def _compaction_due(self) -> bool:
+		if self.compact_ratio is None:
+			return False
+		
+		dead = total = 0
+		for segment in self._segments.values():
+			if segment is not self._active:
+				dead  += segment.size - segment.live
+				total += segment.size
+		return dead > 0 and dead >= total * self.compact_ratio
+	
+	
+	def _maybe_compact(self) -> None:
+		if self._compacting or self._closed or self._compact_error is not None:
+			return
+		if not self._compaction_due():
+			return
+		
+		self._compacting = True
+		trio.lowlevel.spawn_system_task(self._run_compaction)
+	
+	
+	async def _run_compaction(self) -> None:
+		try:
+			await self.compact()
+		except Exception as exc:
+			# Do not retry automatically, the error is raised from `aclose`
+			self._compact_error = exc
+		finally:
+			self._compacting = False
+	
+	
+	def _compact_sync(self, sources: typing.Dict[int, _Segment]) -> typing.Optional[typing.Tuple[
+			typing.List[typing.Tuple[_Segment, bytearray]],
+			typing.List[typing.Tuple[datastore.Key, _Entry, _Entry, int]]
+	]]:
+		"""Copies the live records of the *sources* segments into new segment
+		files
+		
+		Returns the new segments with their hint entries and the
+		``(key, old entry, new entry, record length)`` of each copied record,
+		or `None` if the datastore was closed in the meantime.
+		"""
+		# Copying the index is atomic, so this is safe to do from a thread
+		items = [(key, entry) for key, entry in list(self._index.items()) if entry.segment in sources]
+		items.sort(key=lambda item: (item[1].segment, item[1].offset))
+		
+		outputs: typing.List[typing.Tuple[_Segment, bytearray]] = []
+		moves: typing.List[typing.Tuple[datastore.Key, _Entry, _Entry, int]] = []
+		buffer = bytearray()
+		
+		def write_buffer() -> None:
+			segment = outputs[-1][0]
+			pwrite_all(segment.fd, buffer, segment.size)
+			segment.size += len(buffer)
+			buffer.clear()
+		
+		try:
+			for key, entry in items:
+				if self._closed:
+					raise _Aborted()
+				
+				key_bytes = str(key).encode("utf-8")
+				record = self._read_sync(sources[entry.segment], entry, len(key_bytes))
+				
+				if not outputs or outputs[-1][0].size + len(buffer) + len(record) > self.max_segment_size:
+					if outputs:
+						write_buffer()
+					outputs.append((self._open_segment_sync(".log.tmp"), bytearray()))
+				segment, hints = outputs[-1]
+				
+				offset = segment.size + len(buffer)
+				hints += _HINT.pack(_RECORD.unpack_from(record)[1], entry.mtime,
+				                    offset, entry.size, len(key_bytes))
+				hints += key_bytes
+				buffer += record
+				moves.append((key, entry, _Entry(segment.id, offset, entry.size, entry.mtime), len(record)))
+				
+				if len(buffer) >= COPY_BUFFER_SIZE:
+					write_buffer()
+			if outputs:
+				write_buffer()
+			
+			# Make the new segments durable before the caller removes the old ones
+			for segment, hints in outputs:
+				os.fsync(segment.fd)
+				os.rename(self._segment_path(segment.id, ".log.tmp"), self._segment_path(segment.id))
+				self._write_hints_sync(segment.id, hints)
+			fsync_dir(self.root_path)
+		except BaseException as exc:
+			for segment, _ in outputs:
+				os.close(segment.fd)
+				for suffix in (".log.tmp", ".log", ".hint"):
+					try:
+						os.unlink(self._segment_path(segment.id, suffix))
+					except FileNotFoundError:
+						pass
+			if isinstance(exc, _Aborted):
+				return None
+			raise
+		return outputs, moves
+	
+	
+	async def compact(self) -> None:
+		"""Copies the live records of all closed segment files into new
+		segment files and removes the old ones, reclaiming the space taken up
+		by overwritten and deleted values
+		
+		This runs automatically in the background once the dead records
+		exceed *compact_ratio* of the closed segment files.
+		
+		Raises
+		------
+		RuntimeError
+			A record that was to be copied was found to be corrupted
+		"""
+		async with self._compact_lock:
+			self._compact_error = None
+			if self._closed:
+				return
+			
+			sources = {id: segment for id, segment in self._segments.items()
+			           if segment is not self._active}
+			if not any(segment.size > segment.live for segment in sources.values()):
+				return
+			
+			for segment in sources.values():
+				segment.refs += 1
+			try:
+				result = await run_blocking_nointr(self._compact_sync, sources)
+			finally:
+				for segment in sources.values():
+					self._release(segment)
+			if result is None:
+				return
+			outputs, moves = result
+			
+			# Point all keys that were not written to in the meantime to their
+			# copied records (the others are dead in the new segments already)
+			for segment, _ in outputs:
+				self._segments[segment.id] = segment
+			for key, old_entry, new_entry, length in moves:
+				if self._index.get(key) is old_entry:
+					self._index[key] = new_entry
+					self._segments[new_entry.segment].live += length
+			
+			for segment in sources.values():
+				self._retire(segment)
+			with trio.CancelScope(shield=True):
+				await run_blocking_nointr(self._remove_segments_sync, list(sources))
+	
+	
+	# datastore interface
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns the data named by *key* or raises `KeyError` otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		RuntimeError
+			The record of the given object was found to be corrupted
+		"""
+		return datastore.util.receive_stream_from(await self.get_all(key))
+	
+	
+	async def get_all(self, key: datastore.Key) -> bytes:
+		"""Returns all the data named by *key* at once or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		RuntimeError
+			The record of the given object was found to be corrupted
+		"""
+		entry = self._index[key]
+		if entry.size == 0:
+			return b""
+		
+		segment = self._segments[entry.segment]
+		segment.refs += 1
+		try:
+			record = await run_blocking_nointr(
+				self._read_sync, segment, entry, len(str(key).encode("utf-8"))
+			)
+		finally:
+			self._release(segment)
+		return record[-entry.size:]
+	
+	
+	async def _put(self, key: datastore.Key,  # type: ignore[override]
+	               value: datastore.abc.ReceiveStream, *, create: bool, replace: bool) -> None:
+		"""Stores or replaces the data named by *key* with *value*
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to store at
+		value
+			Some stream yielding the data to store
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		
+		Raises
+		------
+		KeyError
+			The given *key* doesn't exist and *create* is not ``True``.
+		KeyError
+			The given *key* already exists and *replace* is not ``True``.
+		ValueError
+			The given *key* or *value* is too large to be stored
+		"""
+		assert create or replace
+		
+		if len(str(key).encode("utf-8")) > MAX_KEY_SIZE:
+			raise ValueError(f"Key \"{key}\" is longer than {MAX_KEY_SIZE} bytes")
+		data = await value.collect()
+		if len(data) > MAX_VALUE_SIZE:
+			raise ValueError(f"Value of key \"{key}\" is larger than {MAX_VALUE_SIZE} bytes")
+		
+		await self._commit([_Write(key, data, create=create, replace=replace)])
+	
+	
+	async def put_many(self, items: typing.Iterable[typing.Tuple[datastore.Key, bytes]]) -> None:
+		"""Stores or replaces the data of each of the given ``(key, value)``
+		pairs using a single append
+		
+		Arguments
+		---------
+		items
+			The keys and values to store, later items replace earlier ones of
+			the same key
+		
+		Raises
+		------
+		ValueError
+			One of the given keys or values is too large to be stored
+		"""
+		writes = []
+		for key, value in items:
+			if len(str(key).encode("utf-8")) > MAX_KEY_SIZE:
+				raise ValueError(f"Key \"{key}\" is longer than {MAX_KEY_SIZE} bytes")
+			if len(value) > MAX_VALUE_SIZE:
+				raise ValueError(f"Value of key \"{key}\" is larger than {MAX_VALUE_SIZE} bytes")
+			writes.append(_Write(key, bytes(value)))
+		
+		if writes:
+			await self._commit(writes)
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key  # type: ignore[override]
+	) -> datastore.abc.BinaryDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores the data passed to the returned callback in a new key below *prefix*
+		
+		Arguments
+		---------
+		prefix
+			Key below which to store the given data
+		"""
+		while True:
+			key = prefix.child(str(uuid.uuid4()))
+			if key not in self._index:
+				break
+		
+		async def callback(value: datastore.abc.ReceiveStream) -> None:
+			await self._put(key, value, create=True, replace=False)
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the data named by *key*
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to remove
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		await self._commit([_Write(key, None, create=False)])
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by *key* exists
+		
+		This only consults the in-memory index.
+		
+		Arguments
+		---------
+		key
+			Key naming the object to check.
+		"""
+		return key in self._index
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves key *key1* to *key2*
+		
+		The value is copied to a new record of *key2* without passing through
+		the event loop.
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		
+		Raises
+		------
+		KeyError
+			Key *key1* did not exist in this datastore
+		KeyError
+			Key *key2* already exists in this datastore, but *replace* was not ``True``
+		"""
+		await self._commit([_Write(key2, None, source=key1, replace=replace)])
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the metadata of the data named by *key*, or raises `KeyError`
+		otherwise
+		
+		This only consults the in-memory index.
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		entry = self._index[key]
+		return datastore.util.StreamMetadata(size=entry.size, mtime=entry.mtime)
+	
+	
+	async def keys(self, prefix: datastore.Key = datastore.Key("/")) \
+	      -> typing.AsyncIterator[datastore.Key]:
+		"""Yields the keys of all values stored below *prefix*, in no
+		particular order
+		
+		Values added or removed while iterating may or may not be reported.
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		"""
+		for key in list(self._index):
+			if key.is_descendant_of(prefix) or str(prefix) == "/":
+				yield key
+				await trio.lowlevel.checkpoint()
+	
+	
+	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
+	    -> datastore.util.LogMetadata:
+		"""Returns the exact number of bytes taken up by live and by dead
+		records in the segment files
+		
+		Arguments
+		---------
+		selector
+			Ignored by backing datastores
+		"""
+		live = dead = 0
+		for segment in self._segments.values():
+			live += segment.live
+			dead += segment.size - segment.live
+		return datastore.util.LogMetadata(size=live, size_accuracy="exact", dead_size=dead)
+	
+	
+	def __len__(self) -> int:
+		return len(self._index)
+	
+	
+	async def flush(self) -> None:
+		"""Waits for all values written so far to be durably stored on disk"""
+		async with self._write_lock:
+			segment = self._active
+			segment.refs += 1
+			try:
+				await run_blocking_nointr(fdatasync, segment.fd)
+			finally:
+				self._release(segment)
+	
+	
+	async def aclose(self) -> None:
+		"""Waits for running writes and compactions, then writes the hint file
+		of the active segment and closes all segment files
+		
+		Raises
+		------
+		RuntimeError
+			The last background compaction failed
+		"""
+		if self._closed:
+			return
+		self._closed = True
+		
+		with trio.CancelScope(shield=True):
+			async with self._write_lock:
+				async with self._compact_lock:
+					if self._active.size > 0:
+						await run_blocking_nointr(self._write_hints_sync, self._active.id, bytes(self._hints))
+					else:
+						await run_blocking_nointr(self._remove_segments_sync, [self._active.id])
+					self._close_sync()
+		
+		if self._compact_error is not None:
+			raise self._compact_error
@@ -0,0 +1,1120 @@
+import bisect
+import mmap
+import os
+import struct
+import typing
+import uuid
+import zlib
+
+import trio
+
+import datastore
+import datastore.abc
+import datastore.util
+from datastore.core.util.fileio import fdatasync, pwrite_all, run_blocking_nointr
+
+try:
+	import fcntl
+except ImportError:  #PY: Windows
+	fcntl = None  # type: ignore[assignment]
+
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+
+# The file is divided into pages of this size, the first two of which hold
+# alternating copies of the meta record; the valid one with the highest
+# transaction ID describes the current state of the tree
+PAGE_SIZE = 4096
+MAGIC = b"\x89DSBTR\r\n"
+VERSION = 1
+
+# Meta record: magic, version, page size, transaction ID, root page, number of
+# pages, first free list page, number of values, total size of all values;
+# followed by its CRC32 checksum
+_META = struct.Struct("<8sIIQQQQQQ")
+_CHECKSUM = struct.Struct("<I")
+
+PAGE_LEAF     = 1
+PAGE_BRANCH   = 2
+PAGE_OVERFLOW = 3
+PAGE_FREELIST = 4
+
+# Tree pages start with their type and number of entries, followed by the
+# offset of each entry within the page and the entries themselves
+_NODE_HEADER = struct.Struct("<BxH")
+_OFFSET = struct.Struct("<H")
+NODE_CAPACITY = PAGE_SIZE - _NODE_HEADER.size
+
+# Leaf entries consist of the key size, flags and value size, followed by the
+# key and either the value or the number of its first overflow page
+_LEAF_ENTRY = struct.Struct("<HBI")
+FLAG_OVERFLOW = 0x01
+
+# Branch entries consist of the key size and child page number, followed by
+# the key, below which all keys of the child are sorted
+_BRANCH_ENTRY = struct.Struct("<HQ")
+_PAGE_REF = struct.Struct("<Q")
+
+# Overflow and free list pages form chains, each page starting with its type,
+# the size of its data and the number of the next page (zero for the last)
+_CHAIN_HEADER = struct.Struct("<B3xIQ")
+CHAIN_CAPACITY = PAGE_SIZE - _CHAIN_HEADER.size
+
+# Entries are limited to a quarter of a page (so that each page holds at
+# least four of them), larger values are moved to overflow pages
+MAX_ENTRY_SIZE = NODE_CAPACITY // 4 - _OFFSET.size
+MAX_KEY_SIZE   = MAX_ENTRY_SIZE - _LEAF_ENTRY.size - _PAGE_REF.size
+MAX_VALUE_SIZE = 0xFFFFFFFF
+
+# Pages that are less than this full are merged with one of their siblings
+MERGE_THRESHOLD = NODE_CAPACITY // 4
+
+# The file is grown in steps of at least this size to avoid remapping it on
+# every commit
+GROW_SIZE = 1024 * 1024
+
+# Number of bytes returned by each read from a value stream by default
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+
+def encode_key(key: datastore.Key) -> bytes:
+	"""Returns the on-disk representation of *key*
+	
+	Namespace separators are replaced by NUL bytes, so that comparing the
+	encoded keys bytewise yields the same order as comparing the keys
+	themselves (:class:`datastore.Key` compares its list of namespaces).
+	"""
+	return str(key).replace("/", "\x00").encode("utf-8")
+
+
+def decode_key(data: bytes) -> datastore.Key:
+	"""Returns the key represented by the on-disk *data*"""
+	return datastore.Key(data.decode("utf-8").replace("\x00", "/"))
+
+
+def key_range(prefix: datastore.Key, start: typing.Optional[datastore.Key],
+              stop: typing.Optional[datastore.Key]) -> typing.Tuple[bytes, bytes]:
+	"""Returns the range of encoded keys below *prefix* that are at least
+	*start* and less than *stop*"""
+	if str(prefix) == "/":
+		lower, upper = b"", b"\xff"
+	else:
+		lower = encode_key(prefix) + b"\x00"
+		upper = encode_key(prefix) + b"\x01"
+	if start is not None:
+		lower = max(lower, encode_key(start))
+	if stop is not None:
+		upper = min(upper, encode_key(stop))
+	return lower, upper
+
+
+class _Meta(typing.NamedTuple):
+	txn: int
+	root: int
+	page_count: int
+	freelist: int
+	count: int
+	size: int
+	
+	def encode(self) -> bytes:
+		data = _META.pack(MAGIC, VERSION, PAGE_SIZE, *self)
+		return data + _CHECKSUM.pack(zlib.crc32(data))
+	
+	
+	@classmethod
+	def decode(cls, data: bytes) -> typing.Optional['_Meta']:
+		"""Returns the meta record stored in *data*, or `None` if it is damaged"""
+		magic, version, page_size, *fields = _META.unpack_from(data)
+		checksum, = _CHECKSUM.unpack_from(data, _META.size)
+		if magic != MAGIC or version != VERSION or page_size != PAGE_SIZE \
+		   or zlib.crc32(data[:_META.size]) != checksum:
+			return None
+		return cls(*fields)
+
+
+# Something from which pages may be read: either a snapshot of the committed
+# tree or a running transaction
+_PageSource = typing.Union['_Snapshot', '_Transaction']
+
+# Values are either stored inline (as bytes) or in a chain of overflow pages
+# (given by the number of its first page)
+_Payload = typing.Union[bytes, int]
+
+
+class _Snapshot:
+	"""A committed state of the tree, together with a mapping of the file that
+	covers all of its pages"""
+	__slots__ = ("map", "meta")
+	
+	map: mmap.mmap
+	meta: _Meta
+	
+	def __init__(self, map: mmap.mmap, meta: _Meta):
+		self.map  = map
+		self.meta = meta
+	
+	
+	def page(self, page: int) -> typing.Tuple[typing.Union[bytes, mmap.mmap], int]:
+		return self.map, page * PAGE_SIZE
+
+
+class _Transaction:
+	"""The pages written and freed by a write transaction that was not
+	committed yet"""
+	__slots__ = ("map", "root", "page_count", "count", "size",
+	             "pages", "recycled", "freed", "taken")
+	
+	map: mmap.mmap
+	root: int
+	page_count: int
+	count: int
+	size: int
+	
+	# The contents of the pages allocated by this transaction
+	pages: typing.Dict[int, bytes]
+	# Pages allocated and freed again by this transaction, which may be reused
+	# right away
+	recycled: typing.List[int]
+	# Pages of the previous state freed by this transaction
+	freed: typing.List[int]
+	# Pages taken from the datastore's list of free pages
+	taken: typing.List[int]
+	
+	def __init__(self, snapshot: _Snapshot):
+		self.map        = snapshot.map
+		self.root       = snapshot.meta.root
+		self.page_count = snapshot.meta.page_count
+		self.count      = snapshot.meta.count
+		self.size       = snapshot.meta.size
+		self.pages      = {}
+		self.recycled   = []
+		self.freed      = []
+		self.taken      = []
+	
+	
+	def page(self, page: int) -> typing.Tuple[typing.Union[bytes, mmap.mmap], int]:
+		data = self.pages.get(page)
+		if data is not None:
+			return data, 0
+		return self.map, page * PAGE_SIZE
+
+
+def _node_key(buf: typing.Union[bytes, mmap.mmap], base: int, kind: int, idx: int) -> bytes:
+	"""Returns the key of entry *idx* of the tree page at *base*"""
+	offset, = _OFFSET.unpack_from(buf, base + _NODE_HEADER.size + idx * _OFFSET.size)
+	key_size, = _OFFSET.unpack_from(buf, base + offset)
+	start = base + offset + (_LEAF_ENTRY.size if kind == PAGE_LEAF else _BRANCH_ENTRY.size)
+	return buf[start:(start + key_size)]
+
+
+def _node_bisect(buf: typing.Union[bytes, mmap.mmap], base: int, kind: int, count: int,
+                 key: bytes) -> int:
+	"""Returns the index of the first leaf entry whose key is at least *key*,
+	or the index of the branch entry whose child may contain *key*"""
+	lo, hi = 0, count
+	if kind == PAGE_LEAF:
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if _node_key(buf, base, kind, mid) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+	else:
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if _node_key(buf, base, kind, mid) <= key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return max(lo - 1, 0)
+
+
+def _branch_child(buf: typing.Union[bytes, mmap.mmap], base: int, idx: int) -> int:
+	offset, = _OFFSET.unpack_from(buf, base + _NODE_HEADER.size + idx * _OFFSET.size)
+	return typing.cast(int, _BRANCH_ENTRY.unpack_from(buf, base + offset)[1])
+
+
+def _leaf_value(buf: typing.Union[bytes, mmap.mmap], base: int, idx: int) \
+    -> typing.Tuple[int, _Payload]:
+	"""Returns the size and payload of the value of leaf entry *idx*"""
+	offset, = _OFFSET.unpack_from(buf, base + _NODE_HEADER.size + idx * _OFFSET.size)
+	key_size, flags, size = _LEAF_ENTRY.unpack_from(buf, base + offset)
+	start = base + offset + _LEAF_ENTRY.size + key_size
+	if flags & FLAG_OVERFLOW:
+		return size, typing.cast(int, _PAGE_REF.unpack_from(buf, start)[0])
+	return size, buf[start:(start + size)]
+
+
+def _find(source: _PageSource, root: int, key: bytes) \
+    -> typing.Optional[typing.Tuple[int, _Payload]]:
+	"""Returns the size and payload of the value named by the encoded *key* in
+	the tree starting at page *root*, or `None` if there is no such value"""
+	page = root
+	while page:
+		buf, base = source.page(page)
+		kind, count = _NODE_HEADER.unpack_from(buf, base)
+		idx = _node_bisect(buf, base, kind, count, key)
+		if kind == PAGE_BRANCH:
+			page = _branch_child(buf, base, idx)
+		elif idx < count and _node_key(buf, base, kind, idx) == key:
+			return _leaf_value(buf, base, idx)
+		else:
+			return None
+	return None
+
+
+def _chain(source: _PageSource, page: int) -> typing.Iterator[typing.Tuple[int, bytes]]:
+	"""Yields the number and data of each page of the chain starting at *page*"""
+	while page:
+		buf, base = source.page(page)
+		_, size, next = _CHAIN_HEADER.unpack_from(buf, base)
+		start = base + _CHAIN_HEADER.size
+		yield page, buf[start:(start + size)]
+		page = next
+
+
+def _read_value(source: _PageSource, size: int, payload: _Payload) -> bytes:
+	if isinstance(payload, bytes):
+		return payload
+	value = bytearray()
+	for _, data in _chain(source, payload):
+		value += data
+	return bytes(value)
+
+
+def _encode_node(kind: int, entries: typing.List[typing.Tuple[bytes, bytes]]) -> bytes:
+	offset = _NODE_HEADER.size + len(entries) * _OFFSET.size
+	header = [_NODE_HEADER.pack(kind, len(entries))]
+	for _, entry in entries:
+		header.append(_OFFSET.pack(offset))
+		offset += len(entry)
+	return b"".join(header + [entry for _, entry in entries]).ljust(PAGE_SIZE, b"\0")
+
+
+def _decode_node(buf: typing.Union[bytes, mmap.mmap], base: int) \
+    -> typing.Tuple[int, typing.List[typing.Tuple[bytes, bytes]]]:
+	"""Returns the type and the ``(key, entry)`` pairs of the tree page at *base*"""
+	kind, count = _NODE_HEADER.unpack_from(buf, base)
+	entries = []
+	for idx in range(count):
+		offset, = _OFFSET.unpack_from(buf, base + _NODE_HEADER.size + idx * _OFFSET.size)
+		start = base + offset
+		if kind == PAGE_LEAF:
+			key_size, flags, size = _LEAF_ENTRY.unpack_from(buf, start)
+			key_start = start + _LEAF_ENTRY.size
+			end = key_start + key_size + (_PAGE_REF.size if flags & FLAG_OVERFLOW else size)
+		else:
+			key_size, _ = _BRANCH_ENTRY.unpack_from(buf, start)
+			key_start = start + _BRANCH_ENTRY.size
+			end = key_start + key_size
+		entries.append((buf[key_start:(key_start + key_size)], buf[start:end]))
+	return kind, entries
+
+
+def _branch_entry(key: bytes, child: int) -> typing.Tuple[bytes, bytes]:
+	return key, _BRANCH_ENTRY.pack(len(key), child) + key
+
+
+def _entry_cost(entry: typing.Tuple[bytes, bytes]) -> int:
+	return _OFFSET.size + len(entry[1])
+
+
+def _split_node(entries: typing.List[typing.Tuple[bytes, bytes]]) \
+    -> typing.List[typing.List[typing.Tuple[bytes, bytes]]]:
+	"""Distributes the given entries evenly across as few pages as possible"""
+	total = sum(map(_entry_cost, entries))
+	target = total / -(-total // NODE_CAPACITY) if total > 0 else 0
+	
+	groups: typing.List[typing.List[typing.Tuple[bytes, bytes]]] = [[]]
+	used = 0
+	for entry in entries:
+		cost = _entry_cost(entry)
+		if groups[-1] and (used + cost > NODE_CAPACITY or used >= target):
+			groups.append([])
+			used = 0
+		groups[-1].append(entry)
+		used += cost
+	return groups
+
+
+class _ValueStream(datastore.abc.ReceiveStream):
+	"""Streams a value out of its chain of overflow pages
+	
+	The snapshot the value was looked up in is kept alive until the stream is
+	closed, so the value is not affected by concurrent writes.
+	"""
+	__slots__ = ("_store", "_snapshot", "_pages", "_buffer")
+	
+	_store: 'BTreeDatastore'
+	_snapshot: typing.Optional[_Snapshot]
+	_pages: typing.Iterator[typing.Tuple[int, bytes]]
+	_buffer: bytes
+	
+	def __init__(self, store: 'BTreeDatastore', snapshot: _Snapshot, page: int, **kwargs: typing.Any):
+		self._store    = store
+		self._snapshot = snapshot
+		self._pages    = _chain(snapshot, page)
+		self._buffer   = b""
+		
+		store._pin(snapshot)
+		super().__init__(**kwargs)
+	
+	
+	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
+		await trio.lowlevel.checkpoint()
+		if self._snapshot is None:
+			return b""
+		
+		max_bytes = max_bytes or STREAM_CHUNK_SIZE
+		chunks = [self._buffer]
+		length = len(self._buffer)
+		for _, data in self._pages:
+			chunks.append(data)
+			length += len(data)
+			if length >= max_bytes:
+				break
+		buf = b"".join(chunks)
+		buf, self._buffer = buf[:max_bytes], buf[max_bytes:]
+		
+		if len(buf) == 0:
+			await self.aclose()
+		return buf
+	
+	
+	async def aclose(self) -> None:
+		if self._snapshot is not None:
+			snapshot, self._snapshot = self._snapshot, None
+			self._store._unpin(snapshot)
+
+
+class BTreeDatastore(datastore.abc.BinaryDatastore):
+	"""Datastore keeping all keys and values in a single file organized as a
+	copy-on-write B+tree
+	
+	The file is divided into pages: leaf pages hold the sorted keys together
+	with their values (or, for values too large to fit, the first of a chain
+	of overflow pages holding them) and branch pages hold the first key of
+	each of their child pages. Pages are never modified in place; writing a
+	value instead writes new copies of all pages on the path from the changed
+	leaf to the root, after which the transaction is committed by writing
+	the new root page number to whichever of the two meta pages at the start
+	of the file is older. The file is therefore never left in an inconsistent
+	state and opening it only requires reading the meta pages.
+	
+	The file is mapped into memory and lookups are run directly in the
+	calling task rather than on a worker thread. Reads see the state of the
+	last commit, while streams returned by :meth:`get` and the listings of
+	:meth:`keys` and :meth:`items` keep seeing the state at the time they were
+	created: pages that became unused are only reused once no such reader
+	depends on them anymore. (Page faults on parts of the file not cached by
+	the operating system still block.)
+	
+	Keys are stored so that sorting them bytewise yields :class:`datastore.Key`
+	order, allowing values below some prefix to be listed in order. Pages are
+	merged with a sibling when they become less than a quarter full, but the
+	file itself never shrinks; unused pages are reused by later writes.
+	"""
+	
+	path: str
+	sync: bool
+	
+	_fd: int
+	_snapshot: _Snapshot
+	_free: typing.List[int]
+	_pending: typing.List[typing.Tuple[int, typing.List[int]]]
+	_freelist_pages: typing.List[int]
+	_readers: typing.Dict[int, int]
+	_write_lock: trio.Lock
+	_closed: bool
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, path: typing.Union[os_PathLike_str, str], *,
+	                 sync: bool = True) -> 'BTreeDatastore':
+		"""Opens the datastore stored in the file at *path*, creating it if it
+		does not exist yet
+		
+		Arguments
+		---------
+		path
+			The path of the file holding the tree
+		sync
+			Call ``fdatasync(2)`` before and after writing the meta page of each
+			commit, so that values are durable once :meth:`put` returns and the
+			file cannot be damaged by power loss; without it commits are still
+			atomic if the process crashes
+		
+		Raises
+		------
+		RuntimeError
+			The file at *path* is already opened by another process or is not
+			a valid datastore file
+		"""
+		self = cls(_create_call=True)
+		self.path = os.fspath(path)
+		self.sync = bool(sync)
+		
+		self._free           = []
+		self._pending        = []
+		self._freelist_pages = []
+		self._readers        = {}
+		self._write_lock     = trio.Lock()
+		self._closed         = False
+		
+		await run_blocking_nointr(self._open_sync)
+		return self
+	
+	
+	def __init__(self, *, _create_call: bool = False):
+		assert _create_call, "Use BTreeDatastore.create(…) for instance creation"
+	
+	
+	def _open_sync(self) -> None:
+		self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+		try:
+			if fcntl is not None:
+				try:
+					fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except BlockingIOError as exc:
+					raise RuntimeError(f"Datastore file \"{self.path}\" is already in use") from exc
+			
+			size = os.fstat(self._fd).st_size
+			if size == 0:
+				# Start out with an empty tree (the second meta page is left
+				# invalid until the first commit)
+				meta = _Meta(txn=0, root=0, page_count=2, freelist=0, count=0, size=0)
+				pwrite_all(self._fd, meta.encode().ljust(2 * PAGE_SIZE, b"\0"), 0)
+				os.fsync(self._fd)
+				size = 2 * PAGE_SIZE
+			elif size < 2 * PAGE_SIZE:
+				raise RuntimeError(f"File \"{self.path}\" is not a B-tree datastore")
+			
+			map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+			metas = [meta for meta in (_Meta.decode(map[0:PAGE_SIZE]),
+			                           _Meta.decode(map[PAGE_SIZE:(2 * PAGE_SIZE)]))
+			         if meta is not None]
+			if not metas or max(metas).page_count * PAGE_SIZE > len(map):
+				map.close()
+				raise RuntimeError(f"File \"{self.path}\" is not a B-tree datastore")
+			self._snapshot = _Snapshot(map, max(metas))
+			
+			for page, data in _chain(self._snapshot, self._snapshot.meta.freelist):
+				self._freelist_pages.append(page)
+				self._free.extend(free_page for free_page, in _PAGE_REF.iter_unpack(data))
+		except BaseException:
+			os.close(self._fd)
+			raise
+	
+	
+	def _pin(self, snapshot: _Snapshot) -> None:
+		"""Prevents the pages of *snapshot* from being reused until :meth:`_unpin`
+		is called"""
+		self._readers[snapshot.meta.txn] = self._readers.get(snapshot.meta.txn, 0) + 1
+	
+	
+	def _unpin(self, snapshot: _Snapshot) -> None:
+		self._readers[snapshot.meta.txn] -= 1
+		if self._readers[snapshot.meta.txn] < 1:
+			del self._readers[snapshot.meta.txn]
+	
+	
+	def _allocate(self, txn: _Transaction) -> int:
+		"""Returns the number of some page that may be written by *txn*"""
+		if txn.recycled:
+			return txn.recycled.pop()
+		if self._free:
+			page = self._free.pop()
+			txn.taken.append(page)
+			return page
+		txn.page_count += 1
+		return txn.page_count - 1
+	
+	
+	def _free_page(self, txn: _Transaction, page: int) -> None:
+		"""Marks *page* as no longer being used by the tree of *txn*"""
+		if txn.pages.pop(page, None) is not None:
+			txn.recycled.append(page)
+		else:
+			txn.freed.append(page)
+	
+	
+	def _write_node(self, txn: _Transaction, kind: int,
+	                entries: typing.List[typing.Tuple[bytes, bytes]]) \
+	    -> typing.List[typing.Tuple[bytes, int, int]]:
+		"""Writes the given entries to as many new pages as needed and returns
+		the first key, page number and used size of each"""
+		if not entries:
+			return []
+		
+		results = []
+		for group in _split_node(entries):
+			page = self._allocate(txn)
+			txn.pages[page] = _encode_node(kind, group)
+			results.append((group[0][0], page, sum(map(_entry_cost, group))))
+		return results
+	
+	
+	def _write_value(self, txn: _Transaction, key: bytes, value: bytes) -> bytes:
+		"""Returns the leaf entry for *value*, moving it to overflow pages if it is
+		too large to be stored inline"""
+		if _LEAF_ENTRY.size + len(key) + len(value) <= MAX_ENTRY_SIZE:
+			return _LEAF_ENTRY.pack(len(key), 0, len(value)) + key + value
+		
+		pages = [self._allocate(txn) for _ in range(-(-len(value) // CHAIN_CAPACITY))]
+		for idx, page in enumerate(pages):
+			data = value[(idx * CHAIN_CAPACITY):((idx + 1) * CHAIN_CAPACITY)]
+			next = pages[idx + 1] if idx + 1 < len(pages) else 0
+			header = _CHAIN_HEADER.pack(PAGE_OVERFLOW, len(data), next)
+			txn.pages[page] = (header + data).ljust(PAGE_SIZE, b"\0")
+		return _LEAF_ENTRY.pack(len(key), FLAG_OVERFLOW, len(value)) + key + _PAGE_REF.pack(pages[0])
+	
+	
+	def _modify(self, txn: _Transaction, key: bytes,
+	            update: typing.Callable[[typing.Optional[bytes]], typing.Optional[bytes]]) -> None:
+		"""Replaces the leaf entry of *key* in the tree of *txn* by the result
+		of calling *update* with the current entry (or `None`)
+		
+		If *update* returns `None`, the entry is removed. It may raise an
+		exception to abort the change (before allocating any pages).
+		"""
+		if txn.root:
+			results = self._modify_node(txn, txn.root, key, update)
+		else:
+			entry = update(None)
+			results = self._write_node(txn, PAGE_LEAF, [(key, entry)] if entry is not None else [])
+		
+		while len(results) > 1:
+			results = self._write_node(txn, PAGE_BRANCH, [_branch_entry(first_key, page)
+			                                                for first_key, page, _ in results])
+		root = results[0][1] if results else 0
+		
+		# Collapse branch pages with a single child
+		while root:
+			buf, base = txn.page(root)
+			kind, count = _NODE_HEADER.unpack_from(buf, base)
+			if kind != PAGE_BRANCH or count > 1:
+				break
+			child = _branch_child(buf, base, 0)
+			self._free_page(txn, root)
+			root = child
+		txn.root = root
+	
+	
+	def _modify_node(self, txn: _Transaction, page: int, key: bytes,
+	                 update: typing.Callable[[typing.Optional[bytes]], typing.Optional[bytes]]) \
+	    -> typing.List[typing.Tuple[bytes, int, int]]:
+		"""Applies *update* to the subtree at *page* and returns the pages that
+		replace it (see :meth:`_write_node`)"""
+		kind, entries = _decode_node(*txn.page(page))
+		keys = [entry_key for entry_key, _ in entries]
+		
+		if kind == PAGE_LEAF:
+			idx = bisect.bisect_left(keys, key)
+			found = idx < len(keys) and keys[idx] == key
+			entry = update(entries[idx][1] if found else None)
+			if entry is None and found:
+				del entries[idx]
+			elif entry is None:
+				return [(keys[0], page, sum(map(_entry_cost, entries)))]
+			elif found:
+				entries[idx] = (key, entry)
+			else:
+				entries.insert(idx, (key, entry))
+		else:
+			idx = max(bisect.bisect_right(keys, key) - 1, 0)
+			buf, base = txn.page(page)
+			results = self._modify_node(txn, _branch_child(buf, base, idx), key, update)
+			
+			# Merge underfull pages with one of their siblings
+			if len(results) == 1 and results[0][2] < MERGE_THRESHOLD and len(entries) > 1:
+				sibling = idx + 1 if idx + 1 < len(entries) else idx - 1
+				children = {idx: results[0][1], sibling: _branch_child(buf, base, sibling)}
+				merged: typing.List[typing.Tuple[bytes, bytes]] = []
+				for child_idx in sorted(children):
+					child_kind, child_entries = _decode_node(*txn.page(children[child_idx]))
+					if child_kind == PAGE_BRANCH and child_entries:
+						# Keep the separator of the parent for the leftmost child
+						child_entries[0] = _branch_entry(keys[child_idx], _BRANCH_ENTRY.unpack(
+							child_entries[0][1][:_BRANCH_ENTRY.size]
+						)[1])
+					merged.extend(child_entries)
+					self._free_page(txn, children[child_idx])
+				idx = min(children)
+				del entries[idx + 1]
+				del keys[idx + 1]
+				results = self._write_node(txn, child_kind, merged)
+			
+			entries[idx:(idx + 1)] = [_branch_entry(keys[idx] if num == 0 else child_key, child)
+			                          for num, (child_key, child, _) in enumerate(results)]
+		
+		self._free_page(txn, page)
+		return self._write_node(txn, kind, entries)
+	
+	
+	def _free_value(self, txn: _Transaction, entry: bytes) -> None:
+		"""Frees the overflow pages referenced by the given leaf *entry*"""
+		key_size, flags, _ = _LEAF_ENTRY.unpack_from(entry)
+		if flags & FLAG_OVERFLOW:
+			page, = _PAGE_REF.unpack_from(entry, _LEAF_ENTRY.size + key_size)
+			for page, _ in list(_chain(txn, page)):
+				self._free_page(txn, page)
+	
+	
+	def _put_entry(self, txn: _Transaction, key: datastore.Key, value: bytes, *,
+	               create: bool = True, replace: bool = True) -> None:
+		key_bytes = encode_key(key)
+		
+		def update(entry: typing.Optional[bytes]) -> bytes:
+			if entry is None:
+				if not create:
+					raise KeyError(key)
+				txn.count += 1
+			else:
+				if not replace:
+					raise KeyError(key)
+				txn.size -= _LEAF_ENTRY.unpack_from(entry)[2]
+				self._free_value(txn, entry)
+			txn.size += len(value)
+			return self._write_value(txn, key_bytes, value)
+		self._modify(txn, key_bytes, update)
+	
+	
+	async def _write(self, func: typing.Callable[[_Transaction], None]) -> None:
+		"""Runs *func* within a new write transaction and commits its changes"""
+		async with self._write_lock:
+			if self._closed:
+				raise RuntimeError("Datastore has been closed")
+			
+			# Pages freed by past transactions may be reused once all readers
+			# started after them
+			oldest = min(self._readers, default=None)
+			while self._pending and (oldest is None or self._pending[0][0] <= oldest):
+				self._free.extend(self._pending.pop(0)[1])
+			
+			txn = _Transaction(self._snapshot)
+			try:
+				func(txn)
+				await self._commit(txn)
+			except BaseException:
+				self._free.extend(txn.taken)
+				raise
+	
+	
+	async def _commit(self, txn: _Transaction) -> None:
+		if not txn.pages and not txn.freed:
+			return
+		
+		# Write the list of all unused pages to some of those pages (the pages
+		# of the list it replaces in turn become unused)
+		txn.freed.extend(self._freelist_pages)
+		pending = [page for _, pages in self._pending for page in pages]
+		per_page = CHAIN_CAPACITY // _PAGE_REF.size
+		total = len(self._free) + len(txn.recycled) + len(txn.freed) + len(pending)
+		freelist_pages = [self._allocate(txn) for _ in range(-(-total // per_page))]
+		free = sorted(self._free + txn.recycled + txn.freed + pending)
+		for idx, page in enumerate(freelist_pages):
+			data = b"".join(map(_PAGE_REF.pack, free[(idx * per_page):((idx + 1) * per_page)]))
+			next = freelist_pages[idx + 1] if idx + 1 < len(freelist_pages) else 0
+			header = _CHAIN_HEADER.pack(PAGE_FREELIST, len(data), next)
+			txn.pages[page] = (header + data).ljust(PAGE_SIZE, b"\0")
+		
+		meta = _Meta(
+			txn=self._snapshot.meta.txn + 1,
+			root=txn.root,
+			page_count=txn.page_count,
+			freelist=freelist_pages[0] if freelist_pages else 0,
+			count=txn.count,
+			size=txn.size,
+		)
+		new_map = await run_blocking_nointr(self._commit_sync, txn.pages, meta)
+		
+		self._pending.append((meta.txn, txn.freed))
+		self._free.extend(txn.recycled)
+		self._freelist_pages = freelist_pages
+		self._snapshot = _Snapshot(new_map or self._snapshot.map, meta)
+	
+	
+	def _commit_sync(self, pages: typing.Dict[int, bytes], meta: _Meta) -> typing.Optional[mmap.mmap]:
+		"""Writes the given pages followed by the meta page, returning a new
+		mapping of the file if it had to be grown"""
+		size = os.fstat(self._fd).st_size
+		if meta.page_count * PAGE_SIZE > size:
+			size = max(meta.page_count * PAGE_SIZE, size + size // 8)
+			size = -(-size // GROW_SIZE) * GROW_SIZE
+			os.ftruncate(self._fd, size)
+		
+		# Write runs of consecutive pages at once
+		numbers = sorted(pages)
+		start = 0
+		for idx in range(1, len(numbers) + 1):
+			if idx == len(numbers) or numbers[idx] != numbers[idx - 1] + 1:
+				data = b"".join(pages[page] for page in numbers[start:idx])
+				pwrite_all(self._fd, data, numbers[start] * PAGE_SIZE)
+				start = idx
+		
+		if self.sync:
+			fdatasync(self._fd)
+		pwrite_all(self._fd, meta.encode(), (meta.txn % 2) * PAGE_SIZE)
+		if self.sync:
+			fdatasync(self._fd)
+		
+		if size > len(self._snapshot.map):
+			return mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+		return None
+	
+	
+	def _lookup(self, key: datastore.Key) -> typing.Tuple[int, _Payload]:
+		"""Returns the size and payload of the value named by *key* or raises
+		`KeyError` otherwise"""
+		if self._closed:
+			raise RuntimeError("Datastore has been closed")
+		result = _find(self._snapshot, self._snapshot.meta.root, encode_key(key))
+		if result is None:
+			raise KeyError(key)
+		return result
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns the data named by *key* or raises `KeyError` otherwise
+		
+		Values stored in overflow pages are streamed from the state of the file
+		at the time of this call.
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		size, payload = self._lookup(key)
+		if isinstance(payload, bytes):
+			return datastore.util.receive_stream_from(payload)
+		return _ValueStream(self, self._snapshot, payload, size=size)
+	
+	
+	async def get_all(self, key: datastore.Key) -> bytes:
+		"""Returns all the data named by *key* at once or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		return _read_value(self._snapshot, *self._lookup(key))
+	
+	
+	async def _put(self, key: datastore.Key,  # type: ignore[override]
+	               value: datastore.abc.ReceiveStream, *, create: bool, replace: bool) -> None:
+		"""Stores or replaces the data named by *key* with *value*
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to store at
+		value
+			Some stream yielding the data to store
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		
+		Raises
+		------
+		KeyError
+			The given *key* doesn't exist and *create* is not ``True``.
+		KeyError
+			The given *key* already exists and *replace* is not ``True``.
+		ValueError
+			The given *key* or *value* is too large to be stored
+		"""
+		assert create or replace
+		
+		if len(encode_key(key)) > MAX_KEY_SIZE:
+			raise ValueError(f"Key \"{key}\" is longer than {MAX_KEY_SIZE} bytes")
+		data = await value.collect()
+		if len(data) > MAX_VALUE_SIZE:
+			raise ValueError(f"Value of key \"{key}\" is larger than {MAX_VALUE_SIZE} bytes")
+		
+		await self._write(lambda txn: self._put_entry(txn, key, data, create=create, replace=replace))
+	
+	
+	async def put_many(self, items: typing.Iterable[typing.Tuple[datastore.Key, bytes]]) -> None:
+		"""Stores or replaces the data of each of the given ``(key, value)``
+		pairs in a single transaction
+		
+		Arguments
+		---------
+		items
+			The keys and values to store, later items replace earlier ones of
+			the same key
+		
+		Raises
+		------
+		ValueError
+			One of the given keys or values is too large to be stored
+		"""
+		writes = []
+		for key, value in items:
+			if len(encode_key(key)) > MAX_KEY_SIZE:
+				raise ValueError(f"Key \"{key}\" is longer than {MAX_KEY_SIZE} bytes")
+			if len(value) > MAX_VALUE_SIZE:
+				raise ValueError(f"Value of key \"{key}\" is larger than {MAX_VALUE_SIZE} bytes")
+			writes.append((key, bytes(value)))
+		
+		def put_all(txn: _Transaction) -> None:
+			for key, value in writes:
+				self._put_entry(txn, key, value)
+		
+		if writes:
+			await self._write(put_all)
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key  # type: ignore[override]
+	) -> datastore.abc.BinaryDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores the data passed to the returned callback in a new key below *prefix*
+		
+		Arguments
+		---------
+		prefix
+			Key below which to store the given data
+		"""
+		key = prefix.child(str(uuid.uuid4()))
+		
+		async def callback(value: datastore.abc.ReceiveStream) -> None:
+			await self._put(key, value, create=True, replace=False)
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the data named by *key*
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to remove
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		def remove(txn: _Transaction) -> None:
+			def update(entry: typing.Optional[bytes]) -> None:
+				if entry is None:
+					raise KeyError(key)
+				txn.count -= 1
+				txn.size -= _LEAF_ENTRY.unpack_from(entry)[2]
+				self._free_value(txn, entry)
+			self._modify(txn, encode_key(key), update)
+		
+		await self._write(remove)
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by *key* exists
+		
+		Arguments
+		---------
+		key
+			Key naming the object to check.
+		"""
+		try:
+			self._lookup(key)
+			return True
+		except KeyError:
+			return False
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves key *key1* to *key2*
+		
+		Values stored in overflow pages are moved without copying them.
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		
+		Raises
+		------
+		KeyError
+			Key *key1* did not exist in this datastore
+		KeyError
+			Key *key2* already exists in this datastore, but *replace* was not ``True``
+		"""
+		key1_bytes, key2_bytes = encode_key(key1), encode_key(key2)
+		if len(key2_bytes) > MAX_KEY_SIZE:
+			raise ValueError(f"Key \"{key2}\" is longer than {MAX_KEY_SIZE} bytes")
+		
+		def move(txn: _Transaction) -> None:
+			result = _find(txn, txn.root, key1_bytes)
+			if result is None:
+				raise KeyError(key1)
+			if key1_bytes == key2_bytes:
+				return
+			size, payload = result
+			
+			def insert(entry: typing.Optional[bytes]) -> bytes:
+				if entry is not None:
+					if not replace:
+						raise KeyError(key2)
+					txn.count -= 1
+					txn.size -= _LEAF_ENTRY.unpack_from(entry)[2]
+					self._free_value(txn, entry)
+				if isinstance(payload, bytes):
+					return _LEAF_ENTRY.pack(len(key2_bytes), 0, size) + key2_bytes + payload
+				return _LEAF_ENTRY.pack(len(key2_bytes), FLAG_OVERFLOW, size) \
+				       + key2_bytes + _PAGE_REF.pack(payload)
+			self._modify(txn, key2_bytes, insert)
+			self._modify(txn, key1_bytes, lambda entry: None)
+		
+		await self._write(move)
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the metadata of the data named by *key*, or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		size, _ = self._lookup(key)
+		return datastore.util.StreamMetadata(size=size)
+	
+	
+	async def _scan(self, lower: bytes, upper: bytes) \
+	      -> typing.AsyncIterator[typing.Tuple[bytes, _Snapshot, int, _Payload]]:
+		"""Yields the encoded key, snapshot, value size and payload of all values
+		from *lower* (inclusive) to *upper* (exclusive) in the state of the file
+		at the time of the call"""
+		if self._closed:
+			raise RuntimeError("Datastore has been closed")
+		snapshot = self._snapshot
+		self._pin(snapshot)
+		try:
+			stack = [[snapshot.meta.root, -1]] if snapshot.meta.root else []
+			while stack:
+				page, idx = stack[-1]
+				buf, base = snapshot.page(page)
+				kind, count = _NODE_HEADER.unpack_from(buf, base)
+				if idx < 0:
+					idx = _node_bisect(buf, base, kind, count, lower)
+				
+				if kind == PAGE_LEAF:
+					stack.pop()
+					for idx in range(idx, count):
+						key = _node_key(buf, base, kind, idx)
+						if key >= upper:
+							return
+						yield (key, snapshot, *_leaf_value(buf, base, idx))
+					await trio.lowlevel.checkpoint()
+				elif idx >= count:
+					stack.pop()
+				elif idx > 0 and _node_key(buf, base, kind, idx) >= upper:
+					return
+				else:
+					stack[-1][1] = idx + 1
+					stack.append([_branch_child(buf, base, idx), -1])
+		finally:
+			self._unpin(snapshot)
+	
+	
+	async def keys(self, prefix: datastore.Key = datastore.Key("/"), *,
+	               start: typing.Optional[datastore.Key] = None,
+	               stop: typing.Optional[datastore.Key] = None) -> typing.AsyncIterator[datastore.Key]:
+		"""Yields the keys of all values stored below *prefix* in key order
+		
+		The listing reflects the state of the datastore at the time it was
+		started.
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		start
+			Only list keys that sort at or after this key
+		stop
+			Only list keys that sort before this key
+		"""
+		async for key, *_ in self._scan(*key_range(prefix, start, stop)):
+			yield decode_key(key)
+	
+	
+	async def items(self, prefix: datastore.Key = datastore.Key("/"), *,
+	                start: typing.Optional[datastore.Key] = None,
+	                stop: typing.Optional[datastore.Key] = None) \
+	      -> typing.AsyncIterator[typing.Tuple[datastore.Key, bytes]]:
+		"""Yields the keys and values of all values stored below *prefix* in
+		key order
+		
+		The listing reflects the state of the datastore at the time it was
+		started.
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		start
+			Only list keys that sort at or after this key
+		stop
+			Only list keys that sort before this key
+		"""
+		async for key, snapshot, size, payload in self._scan(*key_range(prefix, start, stop)):
+			yield decode_key(key), _read_value(snapshot, size, payload)
+	
+	
+	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
+	    -> datastore.util.DatastoreMetadata:
+		"""Returns the total size of all values stored in the datastore
+		
+		Arguments
+		---------
+		selector
+			Ignored by backing datastores
+		"""
+		return datastore.util.DatastoreMetadata(size=self._snapshot.meta.size, size_accuracy="exact")
+	
+	
+	def __len__(self) -> int:
+		return self._snapshot.meta.count
+	
+	
+	async def aclose(self) -> None:
+		"""Waits for running writes, then unmaps and closes the datastore file"""
+		if self._closed:
+			return
+		
+		with trio.CancelScope(shield=True):
+			async with self._write_lock:
+				self._closed = True
+				self._snapshot.map.close()
+				os.close(self._fd)
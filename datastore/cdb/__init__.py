@@ -0,0 +1,9 @@
+"""Constant database (cdb-style) datastore implementation"""
+__version__ = "1.0"
+__author__ = "Juan Batiz-Benet, Alexander Schlarb"
+__email__ = "juan@benet.ai, alexander@ninetailed.ninja"
+
+__all__ = ("CDBDatastore", "CDBWriter")
+
+from .cdb import CDBDatastore
+from .cdb import CDBWriter
@@ -0,0 +1,423 @@
+import collections.abc
+import hashlib
+import mmap
+import os
+import struct
+import typing
+
+import trio
+
+import datastore
+import datastore.abc
+import datastore.util
+
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+
+# The file starts with a header listing the position and number of slots of
+# each of the 256 hash tables, followed by the records and finally the hash
+# tables themselves (as in D. J. Bernstein's “cdb”, but with 64-bit positions
+# and hashes so that files may grow beyond 4 GiB)
+TABLE_COUNT = 256
+_HEADER_ENTRY = struct.Struct("<QQ")
+HEADER_SIZE = TABLE_COUNT * _HEADER_ENTRY.size
+
+# Each record consists of the key size and value size, followed by the key and
+# the value
+_RECORD = struct.Struct("<II")
+MAX_SIZE = 0xFFFFFFFF
+
+# Each hash table slot holds the full hash of the key and the position of its
+# record (zero for empty slots)
+_SLOT = struct.Struct("<QQ")
+
+# Number of bytes of records collected before handing them to the writer thread
+BUILD_BATCH_SIZE = 1024 * 1024
+
+
+def key_hash(key: bytes) -> int:
+	"""Returns the 64-bit hash of the encoded *key*
+	
+	The lowest byte selects the hash table, the remaining bits the first slot
+	to probe within that table.
+	"""
+	return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class CDBWriter:
+	"""Writes the given key-value pairs to a new constant database file
+	
+	The file is written next to *path* and only moved into place by
+	:meth:`finish`. All methods of this class are blocking.
+	
+	Keys should only be added once, lookups return the first record added for
+	a key.
+	"""
+	__slots__ = ("path", "_file", "_position", "_tables")
+	
+	path: str
+	_file: typing.BinaryIO
+	_position: int
+	_tables: typing.List[typing.List[typing.Tuple[int, int]]]
+	
+	def __init__(self, path: typing.Union[os_PathLike_str, str]):
+		self.path      = os.fspath(path)
+		self._file     = open(self.path + ".tmp", "wb")
+		self._position = HEADER_SIZE
+		self._tables   = [[] for _ in range(TABLE_COUNT)]
+		
+		self._file.seek(HEADER_SIZE)
+	
+	
+	def __enter__(self) -> 'CDBWriter':
+		return self
+	
+	
+	def __exit__(self, exc_type: typing.Optional[typing.Type[BaseException]], *_: typing.Any) -> None:
+		if exc_type is None:
+			self.finish()
+		else:
+			self.abort()
+	
+	
+	def add(self, key: datastore.Key, value: bytes) -> None:
+		"""Appends a record of *value* named by *key*
+		
+		Raises
+		------
+		ValueError
+			The given *key* or *value* is too large to be stored
+		"""
+		key_bytes = str(key).encode("utf-8")
+		if len(key_bytes) > MAX_SIZE or len(value) > MAX_SIZE:
+			raise ValueError(f"Key \"{key}\" or its value is larger than {MAX_SIZE} bytes")
+		
+		hash = key_hash(key_bytes)
+		self._tables[hash & 0xFF].append((hash, self._position))
+		
+		self._file.write(_RECORD.pack(len(key_bytes), len(value)))
+		self._file.write(key_bytes)
+		self._file.write(value)
+		self._position += _RECORD.size + len(key_bytes) + len(value)
+	
+	
+	def finish(self) -> None:
+		"""Writes the hash tables and the header and moves the file into place"""
+		header = bytearray()
+		for entries in self._tables:
+			# Keep the tables at most half full so that probing stays short
+			slot_count = len(entries) * 2
+			slots = [(0, 0)] * slot_count
+			for hash, position in entries:
+				slot = (hash >> 8) % slot_count
+				while slots[slot][1] != 0:
+					slot = (slot + 1) % slot_count
+				slots[slot] = (hash, position)
+			
+			header += _HEADER_ENTRY.pack(self._position, slot_count)
+			self._file.write(b"".join(_SLOT.pack(*slot) for slot in slots))
+			self._position += slot_count * _SLOT.size
+		
+		self._file.seek(0)
+		self._file.write(header)
+		self._file.flush()
+		os.fsync(self._file.fileno())
+		self._file.close()
+		os.replace(self.path + ".tmp", self.path)
+	
+	
+	def abort(self) -> None:
+		"""Discards the file written so far"""
+		self._file.close()
+		os.unlink(self.path + ".tmp")
+
+
+class CDBDatastore(datastore.abc.BinaryDatastore):
+	"""Read-only datastore backed by a constant database file
+	
+	The file, as written by :class:`CDBWriter` (or the :meth:`build` and
+	:meth:`build_from` helpers), is mapped into memory and each lookup hashes
+	the key and probes the slots of one of its hash tables. Lookups run
+	directly in the calling task rather than on a worker thread, which makes
+	this suitable for large static datasets read very often. (Page faults on
+	parts of the file not cached by the operating system still block.)
+	
+	The datastore may be combined with writable datastores using the mount
+	adapter; any attempt to modify it raises `NotImplementedError`.
+	"""
+	
+	path: str
+	_file: typing.BinaryIO
+	_map: mmap.mmap
+	_tables: typing.List[typing.Tuple[int, int]]
+	_mtime: float
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, path: typing.Union[os_PathLike_str, str]) -> 'CDBDatastore':
+		"""Opens the constant database file at *path*
+		
+		Arguments
+		---------
+		path
+			The path of a file written by :class:`CDBWriter`
+		
+		Raises
+		------
+		RuntimeError
+			The file is not a valid constant database
+		"""
+		self = cls(_create_call=True)
+		self.path = os.fspath(path)
+		await trio.to_thread.run_sync(self._open_sync)
+		return self
+	
+	
+	@classmethod
+	async def build(cls, path: typing.Union[os_PathLike_str, str],
+	                items: typing.Union[typing.Iterable[typing.Tuple[datastore.Key, bytes]],
+	                                    typing.AsyncIterable[typing.Tuple[datastore.Key, bytes]]]) \
+	      -> None:
+		"""Writes the given ``(key, value)`` pairs to a new constant database
+		file at *path*, replacing any existing file once done
+		
+		Arguments
+		---------
+		path
+			The path of the file to write
+		items
+			A synchronous or asynchronous iterable of the keys and values to
+			store; each key should only be listed once
+		
+		Raises
+		------
+		ValueError
+			One of the given keys or values is too large to be stored
+		"""
+		async def aiter_items() -> typing.AsyncIterator[typing.Tuple[datastore.Key, bytes]]:
+			if isinstance(items, collections.abc.AsyncIterable):
+				async for item in items:
+					yield item
+			else:
+				for item in items:
+					yield item
+		
+		writer = await trio.to_thread.run_sync(CDBWriter, path)
+		try:
+			def add_all(batch: typing.List[typing.Tuple[datastore.Key, bytes]]) -> None:
+				for key, value in batch:
+					writer.add(key, value)
+			
+			batch: typing.List[typing.Tuple[datastore.Key, bytes]] = []
+			batch_size = 0
+			async for key, value in aiter_items():
+				batch.append((key, value))
+				batch_size += len(value)
+				if batch_size >= BUILD_BATCH_SIZE:
+					await trio.to_thread.run_sync(add_all, batch)
+					batch, batch_size = [], 0
+			await trio.to_thread.run_sync(add_all, batch)
+			
+			await trio.to_thread.run_sync(writer.finish)
+		except BaseException:
+			with trio.CancelScope(shield=True):
+				await trio.to_thread.run_sync(writer.abort)
+			raise
+	
+	
+	@classmethod
+	async def build_from(cls, path: typing.Union[os_PathLike_str, str],
+	                     source: datastore.abc.BinaryDatastore,
+	                     keys: typing.Union[typing.Iterable[datastore.Key],
+	                                        typing.AsyncIterable[datastore.Key]]) -> None:
+		"""Writes the values of the given *keys* in the *source* datastore to a
+		new constant database file at *path*
+		
+		Arguments
+		---------
+		path
+			The path of the file to write
+		source
+			The datastore to copy values from
+		keys
+			A synchronous or asynchronous iterable of the keys to copy, such as
+			the ``keys()`` listing offered by some datastores
+		
+		Raises
+		------
+		KeyError
+			One of the given keys was not present in the *source* datastore
+		"""
+		async def items() -> typing.AsyncIterator[typing.Tuple[datastore.Key, bytes]]:
+			if isinstance(keys, collections.abc.AsyncIterable):
+				async for key in keys:
+					yield key, await source.get_all(key)
+			else:
+				for key in keys:
+					yield key, await source.get_all(key)
+		
+		await cls.build(path, items())
+	
+	
+	def __init__(self, *, _create_call: bool = False):
+		assert _create_call, "Use CDBDatastore.create(…) for instance creation"
+	
+	
+	def _open_sync(self) -> None:
+		self._file = open(self.path, "rb")
+		try:
+			stat = os.fstat(self._file.fileno())
+			if stat.st_size < HEADER_SIZE:
+				raise RuntimeError(f"File \"{self.path}\" is not a constant database")
+			self._mtime = stat.st_mtime
+			self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+			
+			self._tables = [_HEADER_ENTRY.unpack_from(self._map, idx * _HEADER_ENTRY.size)
+			                for idx in range(TABLE_COUNT)]
+			for position, slot_count in self._tables:
+				if position + slot_count * _SLOT.size > len(self._map):
+					self._map.close()
+					raise RuntimeError(f"File \"{self.path}\" is not a constant database")
+		except BaseException:
+			self._file.close()
+			raise
+	
+	
+	def _lookup(self, key: datastore.Key) -> typing.Tuple[int, int]:
+		"""Returns the position and size of the value named by *key* or raises
+		`KeyError` otherwise"""
+		key_bytes = str(key).encode("utf-8")
+		hash = key_hash(key_bytes)
+		
+		position, slot_count = self._tables[hash & 0xFF]
+		if slot_count < 1:
+			raise KeyError(key)
+		
+		slot = (hash >> 8) % slot_count
+		for _ in range(slot_count):
+			slot_hash, record = _SLOT.unpack_from(self._map, position + slot * _SLOT.size)
+			if record == 0:
+				break
+			if slot_hash == hash:
+				key_size, value_size = _RECORD.unpack_from(self._map, record)
+				start = record + _RECORD.size
+				if key_size == len(key_bytes) and self._map[start:(start + key_size)] == key_bytes:
+					return start + key_size, value_size
+			slot = (slot + 1) % slot_count
+		raise KeyError(key)
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns the data named by *key* or raises `KeyError` otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		return datastore.util.receive_stream_from(await self.get_all(key))
+	
+	
+	async def get_all(self, key: datastore.Key) -> bytes:
+		"""Returns all the data named by *key* at once or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		position, size = self._lookup(key)
+		return self._map[position:(position + size)]
+	
+	
+	async def _put(self, key: datastore.Key,  # type: ignore[override]
+	               value: datastore.abc.ReceiveStream, **kwargs: typing.Any) -> None:
+		"""Always raises `NotImplementedError` as this datastore is read-only"""
+		raise NotImplementedError(f"Cannot store key {key}: Constant databases are read-only")
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Always raises `NotImplementedError` as this datastore is read-only"""
+		raise NotImplementedError(f"Cannot delete key {key}: Constant databases are read-only")
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by *key* exists
+		
+		Arguments
+		---------
+		key
+			Key naming the object to check.
+		"""
+		try:
+			self._lookup(key)
+			return True
+		except KeyError:
+			return False
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the size of the data named by *key* and the modification
+		time of the database file, or raises `KeyError` otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		_, size = self._lookup(key)
+		return datastore.util.StreamMetadata(size=size, mtime=self._mtime)
+	
+	
+	async def keys(self, prefix: datastore.Key = datastore.Key("/")) \
+	      -> typing.AsyncIterator[datastore.Key]:
+		"""Yields the keys of all values stored below *prefix* in the order
+		they were written
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		"""
+		# Records end where the first hash table starts
+		end = min(position for position, _ in self._tables)
+		position = HEADER_SIZE
+		while position < end:
+			key_size, value_size = _RECORD.unpack_from(self._map, position)
+			start = position + _RECORD.size
+			key = datastore.Key(self._map[start:(start + key_size)].decode("utf-8"))
+			position = start + key_size + value_size
+			if key.is_descendant_of(prefix) or str(prefix) == "/":
+				yield key
+			await trio.lowlevel.checkpoint()
+	
+	
+	def __len__(self) -> int:
+		return sum(slot_count for _, slot_count in self._tables) // 2
+	
+	
+	async def aclose(self) -> None:
+		"""Unmaps and closes the database file"""
+		if not self._file.closed:
+			self._map.close()
+			self._file.close()
@@ -11,6 +11,7 @@ from . import query as query_
 
 class util:  # noqa
 	from .util import decorator
+	from .util import keyindex
 	from .util import metadata
 	from .util import stream
 
@@ -407,36 +408,60 @@ class NullDatastore(Datastore[T_co], typing.Generic[T_co]):
 
 
 class DictDatastore(Datastore[T_co], typing.Generic[T_co]):
-	"""Simple straw-man in-memory datastore backed by nested dicts."""
+	"""Simple in-memory datastore backed by a flat dict
 	
-	__slots__ = ("_items",)
+	Values are kept in a single dict keyed by the canonical string form of
+	their keys (which :class:`~datastore.Key` already holds), so that looking
+	up missing keys does not allocate anything and no key objects are kept
+	alive.
 	
-	_items: typing.Dict[str, typing.Dict[key_.Key, typing.List[T_co]]]
+	If *indexed* is set, a sorted index of all keys is maintained as well,
+	which allows :meth:`query` and :meth:`keys` to only consider the keys
+	below the given prefix rather than scanning all of them, at the cost of
+	slower insertions and deletions.
+	"""
+	
+	__slots__ = ("_items", "_index")
 	
-	def __init__(self) -> None:
+	_items: typing.Dict[str, typing.List[T_co]]
+	_index: typing.Optional[util.keyindex.KeyIndex]
+	
+	def __init__(self, *, indexed: bool = False) -> None:
 		self._items = dict()
+		self._index = util.keyindex.KeyIndex() if indexed else None
+	
+	
+	def _store(self, key: str, value: typing.List[T_co]) -> None:
+		"""Stores *value* at the canonical *key*, updating the index"""
+		if self._index is not None and key not in self._items:
+			self._index.add(key)
+		self._items[key] = value
+	
+	
+	def _remove(self, key: str) -> typing.List[T_co]:
+		"""Removes the value at the canonical *key*, updating the index"""
+		value = self._items.pop(key)
+		if self._index is not None:
+			self._index.remove(key)
+		return value
 	
 	
-	def _collection(self, key: key_.Key, parent: bool = True) \
-	    -> typing.Dict[key_.Key, typing.List[T_co]]:
-		"""Returns the namespace collection for `key`."""
-		collection = str(key.path if parent else key)
-		if collection not in self._items:
-			self._items[collection] = dict()
-		return self._items[collection]
+	def _prefixed(self, prefix: str) -> typing.List[str]:
+		"""Returns the canonical keys starting with *prefix*"""
+		if self._index is not None:
+			return self._index.prefixed(prefix)
+		return [key for key in self._items if key.startswith(prefix)]
 	
 	
 	async def get(self, key: key_.Key) -> util.stream.ReceiveChannel[T_co]:
 		"""Returns the object named by `key` or raises `KeyError`.
 		
-		Retrieves the object from the collection corresponding to ``key.path``.
-		
 		Arguments
 		---------
 		key
 			Key naming the object to retrieve.
 		"""
-		return util.stream.receive_channel_from(self._collection(key)[key])
+		return util.stream.receive_channel_from(self._items[str(key)])
 	
 	
 	async def get_all(self, key: key_.Key) -> typing.List[T_co]:
@@ -455,15 +480,13 @@ class DictDatastore(Datastore[T_co], typing.Generic[T_co]):
 		RuntimeError
 			An internal error occurred
 		"""
-		return self._collection(key)[key]
+		return self._items[str(key)]
 	
 	
 	async def _put(self, key: key_.Key,  # type: ignore[override]
 	               value: util.stream.ReceiveChannel[T_co], *, create: bool, replace: bool) -> None:
 		"""Stores the object `value` named by `key`.
 		
-		Stores the object in the collection corresponding to ``key.path``.
-		
 		Arguments
 		---------
 		key
@@ -478,20 +501,18 @@ class DictDatastore(Datastore[T_co], typing.Generic[T_co]):
 		# This isn't thread-safe, but that's OK as we don't actually
 		# guarantee that, rather we are only safe with regards to trio's
 		# task scheduling
-		collection = self._collection(key)
-		if not create and key not in collection:
+		key_str = str(key)
+		if not create and key_str not in self._items:
 			raise KeyError(key)
-		if not replace and key in collection:
+		if not replace and key_str in self._items:
 			raise KeyError(key)
-		collection[key] = await value.collect()
+		self._store(key_str, await value.collect())
 	
 	
 	async def _put_new_indirect(self, prefix: key_.Key,  # type: ignore[override]
 	) -> Datastore._PUT_NEW_INDIRECT_RT[T_co]:
 		"""Stores the objects passed to the returned callback in a new key below *prefix*
 		
-		Stores the objects in the collection corresponding to ``key``.
-		
 		Arguments
 		---------
 		prefix
@@ -500,18 +521,17 @@ class DictDatastore(Datastore[T_co], typing.Generic[T_co]):
 		# This isn't thread-safe, but that's OK as we don't actually
 		# guarantee that, rather we are only safe with regards to trio's
 		# task scheduling
-		collection = self._collection(prefix, parent=False)
 		while True:
 			key = prefix.child(str(uuid.uuid4()))
-			if key not in collection:
+			if str(key) not in self._items:
 				break
 		
 		# Reserve key
-		collection[key] = []
+		self._store(str(key), [])
 		
 		# Receive and write data later
 		async def callback(value: util.stream.ReceiveChannel[T_co]) -> None:
-			collection[key] = await value.collect()
+			self._store(str(key), await value.collect())
 		return key, callback
 	
 	
@@ -519,30 +539,26 @@ class DictDatastore(Datastore[T_co], typing.Generic[T_co]):
 		"""Removes the object named by `key` or raises `KeyError` if it did not
 		   exist.
 		
-		Removes the object from the collection corresponding to ``key.path``.
-		
 		Arguments
 		---------
 		key
 			Key naming the object to remove.
 		"""
-		del self._collection(key)[key]
-		
-		if len(self._collection(key)) == 0:
-			del self._items[str(key.path)]
+		try:
+			self._remove(str(key))
+		except KeyError:
+			raise KeyError(key) from None
 	
 	
 	async def contains(self, key: key_.Key) -> bool:
 		"""Returns whether the object named by `key` exists.
 		
-		Checks for the object in the collection corresponding to ``key.path``.
-		
 		Arguments
 		---------
 		key
 			Key naming the object to check.
 		"""
-		return key in self._collection(key)
+		return str(key) in self._items
 	
 	
 	async def rename(self, key1: key_.Key, key2: key_.Key, *, replace: bool = True) -> None:
@@ -561,58 +577,75 @@ class DictDatastore(Datastore[T_co], typing.Generic[T_co]):
 		if key1 == key2:
 			return
 		
-		collection1 = self._collection(key1)
-		collection2 = self._collection(key2)
-		if key1 not in collection1:
+		if str(key1) not in self._items:
 			raise KeyError(key1)
-		if not replace and key2 in collection2:
+		if not replace and str(key2) in self._items:
 			raise KeyError(key2)
-		collection2[key2] = collection1[key1]
-		del collection1[key1]
+		self._store(str(key2), self._remove(str(key1)))
 	
 	
 	async def stat(self, key: key_.Key) -> util.metadata.ChannelMetadata:
 		"""Returns the length of the object list named by `key` if it exists.
 		
-		Checks for the object in the collection corresponding to ``key.path``.
-		
 		Arguments
 		---------
 		key
 			Key naming an object list
 		"""
-		return util.metadata.ChannelMetadata(count=len(self._collection(key)[key]))
+		return util.metadata.ChannelMetadata(count=len(self._items[str(key)]))
+	
+	
+	async def keys(self, prefix: key_.Key = key_.Key("/")) -> typing.AsyncIterator[key_.Key]:
+		"""Yields the keys of all values stored below *prefix*
+		
+		If the datastore is indexed, the keys are listed in the order of their
+		string forms, otherwise in the order they were added.
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		"""
+		for key in self._prefixed("" if str(prefix) == "/" else str(prefix) + "/"):
+			yield key_.Key(key)
 	
 	
 	async def query(self, query: query_.Query) -> query_.Cursor:
 		"""Returns an iterable of objects matching criteria expressed in `query`
 
-		Naively applies the query operations on the objects within the namespaced
-		collection corresponding to ``query.key.path``.
+		Naively applies the query operations on the objects of all keys whose
+		``key.path`` is ``query.key``.
 
 		Arguments
 		---------
 		query
 			Query object describing the objects to return.
 		"""
-		# entire dataset already in memory, so ok to apply query naively
-		if str(query.key) in self._items:
-			return query(self._items[str(query.key)].values())  # type: ignore[no-any-return]
+		# The path of a key is its parent, followed by its type if it has one
+		path = str(query.key)
+		if path == "/":
+			candidates = self._prefixed("/")
 		else:
-			return query([])  # type: ignore[no-any-return]
+			candidates = self._prefixed(path + "/") + self._prefixed(path + ":")
+		
+		# entire dataset already in memory, so ok to apply query naively
+		return query([  # type: ignore[no-any-return]
+			self._items[key] for key in candidates if str(key_.Key(key).path) == path
+		])
 	
 	
 	def __len__(self) -> int:
-		return sum(map(len, self._items.values()))
+		return len(self._items)
 	
 	
 	async def aclose(self) -> None:
 		"""Deletes all items from this datastore"""
 		self._items.clear()
+		if self._index is not None:
+			self._index = util.keyindex.KeyIndex()
 		await super().aclose()
 
 
-
 class Adapter(Datastore[T_co], typing.Generic[T_co, U_co]):
 	"""Represents a non-concrete datastore that adds functionality between the
 	   client and a lower-level datastore.
@@ -0,0 +1,113 @@
+import hashlib
+import math
+import struct
+import typing
+
+
+class CountingBloomFilter:
+	"""A Bloom filter that also supports removing items again
+	
+	Every slot of the filter is an 8-bit counter instead of a single bit. Once
+	a counter reaches its maximum value, it sticks there forever, so that
+	removing items can never produce false negatives.
+	
+	Hashes are computed using BLAKE2b, so that the serialized filter (see
+	:meth:`to_bytes`) remains valid across interpreter runs.
+	"""
+	__slots__ = ("_counters", "_hashes")
+	
+	_HEADER = struct.Struct("<8sII")
+	_MAGIC  = b"DSCBF\x00\x00\x01"
+	
+	_counters: bytearray
+	_hashes: int
+	
+	
+	def __init__(self, capacity: int, error_rate: float = 0.01):
+		"""
+		Arguments
+		---------
+		capacity
+			The number of items this filter is expected to hold at most
+		error_rate
+			The probability of reporting an item as present that was never
+			added once the filter holds *capacity* items
+		"""
+		if not (0 < error_rate < 1):
+			raise ValueError("error_rate must be between 0 and 1 (exclusive)")
+		capacity = max(capacity, 1)
+		
+		size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+		self._counters = bytearray(size)
+		self._hashes   = max(int(round(size / capacity * math.log(2))), 1)
+	
+	
+	def _indexes(self, item: typing.Union[bytes, str]) -> typing.Iterator[int]:
+		if isinstance(item, str):
+			item = item.encode("utf-8")
+		
+		# Derive all indexes from just two hash values (Kirsch-Mitzenmacher)
+		digest = hashlib.blake2b(item, digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], "little")
+		h2 = int.from_bytes(digest[8:], "little") | 1
+		size = len(self._counters)
+		for idx in range(self._hashes):
+			yield (h1 + idx * h2) % size
+	
+	
+	def add(self, item: typing.Union[bytes, str]) -> None:
+		"""Adds *item* to the filter (once more)"""
+		counters = self._counters
+		for idx in self._indexes(item):
+			if counters[idx] < 255:
+				counters[idx] += 1
+	
+	
+	def remove(self, item: typing.Union[bytes, str]) -> None:
+		"""Removes one previous addition of *item* from the filter
+		
+		Removing an item that was never added corrupts the filter.
+		"""
+		counters = self._counters
+		for idx in self._indexes(item):
+			if 0 < counters[idx] < 255:
+				counters[idx] -= 1
+	
+	
+	def __contains__(self, item: typing.Union[bytes, str]) -> bool:
+		"""Returns ``False`` if *item* was definitely not added to this filter"""
+		counters = self._counters
+		return all(counters[idx] for idx in self._indexes(item))
+	
+	
+	def clear(self) -> None:
+		"""Removes all items from this filter"""
+		self._counters[:] = bytes(len(self._counters))
+	
+	
+	def to_bytes(self) -> bytes:
+		"""Serializes this filter for use with :meth:`from_bytes`"""
+		header = self._HEADER.pack(self._MAGIC, self._hashes, len(self._counters))
+		return header + bytes(self._counters)
+	
+	
+	@classmethod
+	def from_bytes(cls, data: bytes) -> 'CountingBloomFilter':
+		"""Recreates a filter previously serialized using :meth:`to_bytes`
+		
+		Raises
+		------
+		ValueError
+			The given data is not a serialized filter
+		"""
+		try:
+			magic, hashes, size = cls._HEADER.unpack_from(data)
+		except struct.error as exc:
+			raise ValueError("Truncated Bloom filter data") from exc
+		if magic != cls._MAGIC or hashes < 1 or len(data) != cls._HEADER.size + size:
+			raise ValueError("Invalid Bloom filter data")
+		
+		self = cls.__new__(cls)
+		self._counters = bytearray(data[cls._HEADER.size:])
+		self._hashes   = hashes
+		return self
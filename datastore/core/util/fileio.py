@@ -0,0 +1,59 @@
+"""Blocking file I/O helpers shared by the on-disk datastores"""
+import os
+import typing
+
+import trio
+
+T = typing.TypeVar("T")
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+
+# Flushes the data of a file, but not necessarily its metadata, to disk
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+async def run_blocking_intr(func: typing.Callable[..., T], *args: typing.Any,
+                            **kwargs: typing.Any) -> T:
+	"""Short form for :func:`trio.to_thread.run_sync` (cancellable)"""
+	def callback() -> T:
+		return func(*args, **kwargs)
+	return typing.cast(T, await trio.to_thread.run_sync(callback, cancellable=True))
+
+
+async def run_blocking_nointr(func: typing.Callable[..., T], *args: typing.Any,
+                              **kwargs: typing.Any) -> T:
+	"""Short form for :func:`trio.to_thread.run_sync` (not cancellable)"""
+	def callback() -> T:
+		return func(*args, **kwargs)
+	return typing.cast(T, await trio.to_thread.run_sync(callback, cancellable=False))
+
+
+def write_all(fd: int, data: typing.Union[bytes, bytearray]) -> None:
+	"""Writes all of *data* to *fd*"""
+	with memoryview(data) as view:
+		written = 0
+		while written < len(data):
+			with view[written:] as rest:
+				written += os.write(fd, rest)
+
+
+def pwrite_all(fd: int, data: typing.Union[bytes, bytearray], offset: int) -> None:
+	"""Writes all of *data* to *fd* starting at *offset*"""
+	written = os.pwrite(fd, data, offset)
+	if written < len(data):
+		with memoryview(data) as view:
+			while written < len(data):
+				with view[written:] as rest:
+					written += os.pwrite(fd, rest, offset + written)
+
+
+def fsync_dir(path: typing.Union[os_PathLike_str, str]) -> None:
+	"""Flushes the directory entries of the directory at *path* to disk"""
+	dir_fd = os.open(path, os.O_RDONLY)
+	try:
+		os.fsync(dir_fd)
+	finally:
+		os.close(dir_fd)
@@ -0,0 +1,47 @@
+import bisect
+import typing
+
+
+class KeyIndex:
+	"""A sorted list of the string forms of a set of keys
+	
+	Allows listing all keys starting with some string without scanning the
+	entire set. The strings are usually shared with the dict holding the
+	values, so that the index only costs one list slot per key. Adding and
+	removing keys takes time linear in the number of keys, but only moves
+	pointers around.
+	"""
+	__slots__ = ("_keys",)
+	
+	_keys: typing.List[str]
+	
+	
+	def __init__(self, keys: typing.Iterable[str] = ()):
+		self._keys = sorted(keys)
+	
+	
+	def add(self, key: str) -> None:
+		"""Adds *key*, which must not be part of the index yet"""
+		bisect.insort(self._keys, key)
+	
+	
+	def remove(self, key: str) -> None:
+		"""Removes *key* or raises `KeyError` if it is not part of the index"""
+		idx = bisect.bisect_left(self._keys, key)
+		if idx >= len(self._keys) or self._keys[idx] != key:
+			raise KeyError(key)
+		del self._keys[idx]
+	
+	
+	def prefixed(self, prefix: str) -> typing.List[str]:
+		"""Returns all keys starting with *prefix* in order"""
+		if not prefix:
+			return self._keys[:]
+		
+		lower = bisect.bisect_left(self._keys, prefix)
+		upper = bisect.bisect_left(self._keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lower)
+		return self._keys[lower:upper]
+	
+	
+	def __len__(self) -> int:
+		return len(self._keys)
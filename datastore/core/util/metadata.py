@@ -143,3 +143,48 @@ class DatastoreMetadata(_DatastoreMetadataBase):
 
 
 DatastoreMetadata.IGNORE = DatastoreMetadata()
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheMetadata(DatastoreMetadata):
+	__doc__ = (DatastoreMetadata.__doc__ or "")[:-1] + """\
+	hits
+		The number of lookups that were answered from the cache
+	misses
+		The number of lookups of keys that were not (or not anymore) cached
+	evictions
+		The number of entries dropped from the cache to make room for others
+	"""
+	
+	hits: int = 0
+	misses: int = 0
+	evictions: int = 0
+	
+	def __add__(self, other: object) -> 'DatastoreMetadata':
+		metadata = super().__add__(other)
+		if not isinstance(metadata, DatastoreMetadata) or other is self.IGNORE:
+			return metadata
+		
+		# Keep the counters when adding up the metadata of several datastores,
+		# only some of which may be caches
+		hits, misses, evictions = self.hits, self.misses, self.evictions
+		if isinstance(other, CacheMetadata):
+			hits      += other.hits
+			misses    += other.misses
+			evictions += other.evictions
+		return CacheMetadata(size=metadata.size, size_accuracy=metadata.size_accuracy,
+		                     hits=hits, misses=misses, evictions=evictions)
+	
+	def __radd__(self, other: object) -> 'DatastoreMetadata':
+		return self.__add__(other)
+
+
+@dataclasses.dataclass(frozen=True)
+class LogMetadata(DatastoreMetadata):
+	__doc__ = (DatastoreMetadata.__doc__ or "")[:-1] + """\
+	dead_size
+		The number of bytes taken up by overwritten or deleted records that
+		have not been reclaimed by compaction yet (not included in ``size``)
+	"""
+	
+	dead_size: int = 0
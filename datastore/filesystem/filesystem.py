@@ -13,8 +13,10 @@ import trio
 import datastore
 import datastore.abc
 import datastore.util
+from datastore.core.util.fileio import run_blocking_intr, run_blocking_nointr
 
-from .util import exchange, rename_noreplace, statx
+from . import watch as watch_
+from .util import dircache, exchange, rename_noreplace, statx
 
 T = typing.TypeVar("T")
 if typing.TYPE_CHECKING:
@@ -41,23 +43,14 @@ else:
 # Make default buffer larger to try to compensate for the thread switching overhead
 DEFAULT_BUFFER_SIZE = io.DEFAULT_BUFFER_SIZE * 10
 
-DEFAULT_STATS_KEY = datastore.Key("diskUsage.cache")
-
-
-async def run_blocking_intr(func: typing.Callable[..., T], *args: typing.Any,
-                            **kwargs: typing.Any) -> T:
-	"""Short form for :func:`trio.run_sync_in_worker_thread`"""
-	def callback() -> T:
-		return func(*args, **kwargs)
-	return typing.cast(T, await trio.to_thread.run_sync(callback, cancellable=True))
+# Buffer size used for streams that are read sequentially from start to end
+SEQUENTIAL_BUFFER_SIZE = DEFAULT_BUFFER_SIZE * 16
 
+DEFAULT_STATS_KEY = datastore.Key("diskUsage.cache")
 
-async def run_blocking_nointr(func: typing.Callable[..., T], *args: typing.Any,
-                              **kwargs: typing.Any) -> T:
-	"""Short form for :func:`trio.run_sync_in_worker_thread`"""
-	def callback() -> T:
-		return func(*args, **kwargs)
-	return typing.cast(T, await trio.to_thread.run_sync(callback, cancellable=False))
+# Number of directory file descriptors to keep open by default (disabled, see
+# :meth:`FileSystemDatastore.create` for why)
+DEFAULT_DIR_CACHE_SIZE = 0
 
 
 def move_to_tempfile_sync(
@@ -65,18 +58,23 @@ def move_to_tempfile_sync(
 		wait_for_src: bool = False,
 		suffix: str = "",
 		prefix: str = "",
-		dir: typing.Optional[typing.Union[os_PathLike_str, str]] = None
+		dir: typing.Optional[typing.Union[os_PathLike_str, str]] = None,
+		src_dir_fd: typing.Optional[int] = None,
+		dir_fd: typing.Optional[int] = None
 ) -> pathlib.Path:
 	"""Moves file to temporary file location
 	
 	Similar to the :func:`tempfile.mkstemp` function, but moves an existing
-	source file rather then creating a new one."""
+	source file rather then creating a new one.
+	
+	If *dir_fd* is given, the returned path is relative to that directory
+	file descriptor (*dir* should then usually be ``""``)."""
 	for _ in range(tempfile.TMP_MAX):
 		tmp = pathlib.Path(tempfile.mktemp(suffix=suffix, prefix=prefix, dir=dir))
 		
 		last_exc: BaseException
 		try:
-			rename_noreplace.rename_noreplace(src, tmp)
+			rename_noreplace.rename_noreplace(src, tmp, src_dir_fd=src_dir_fd, dst_dir_fd=dir_fd)
 			return tmp  # Success
 		except FileExistsError:
 			pass  # Target file was created in the meantime
@@ -113,6 +111,8 @@ async def make_named_tempfile(*args: typing.Any, **kwargs: typing.Any) \
 	)
 
 
+access_t = typing_Literal["sequential", "random", "once"]
+
 stat_result_t = typing.Union[os.stat_result, statx.stat_result]
 stat_kwargs_t = typing_TypedDict("stat_kwargs_t", {
 	"size":  int,
@@ -123,23 +123,48 @@ stat_kwargs_t = typing_TypedDict("stat_kwargs_t", {
 
 
 class FileReader(datastore.abc.ReceiveStream):
-	__slots__ = ("_file")
+	__slots__ = ("_file", "_access", "_buffer_size", "_offset")
 	
 	_file: 'trio._file_io.AsyncIOWrapper'
+	_access: typing.Optional[access_t]
+	_buffer_size: int
+	_offset: int
 	
 	
-	def __init__(self, file: 'trio._file_io.AsyncIOWrapper', **kwargs: typing.Any):
-		self._file = file
+	def __init__(self, file: 'trio._file_io.AsyncIOWrapper', *,
+	             access: typing.Optional[access_t] = None, **kwargs: typing.Any):
+		self._file   = file
+		self._access = access
+		self._offset = 0
 		
 		super().__init__(**kwargs)
+		
+		# Read larger chunks if the file will be read from start to end anyways,
+		# but never more than needed to receive the entire file in one go
+		self._buffer_size = DEFAULT_BUFFER_SIZE
+		if access in ("sequential", "once"):
+			self._buffer_size = SEQUENTIAL_BUFFER_SIZE
+		if self.size is not None:
+			self._buffer_size = max(min(self._buffer_size, self.size), io.DEFAULT_BUFFER_SIZE)
+	
+	
+	def _read_once_sync(self, max_bytes: int) -> bytes:
+		buf = typing.cast(bytes, self._file.wrapped.read(max_bytes))
+		
+		# Drop the pages just read from the page cache again, as nobody is
+		# going to need them anymore
+		if buf:
+			os.posix_fadvise(self._file.fileno(), self._offset, len(buf), os.POSIX_FADV_DONTNEED)
+		self._offset += len(buf)
+		return buf
 	
 	
 	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
 		buf: bytes
-		if max_bytes:
-			buf = await self._file.read(max_bytes)
+		if self._access == "once" and hasattr(os, "posix_fadvise"):
+			buf = await run_blocking_intr(self._read_once_sync, max_bytes or self._buffer_size)
 		else:
-			buf = await self._file.read(DEFAULT_BUFFER_SIZE)
+			buf = await self._file.read(max_bytes or self._buffer_size)
 		
 		if len(buf) == 0:
 			await self.aclose()
@@ -182,16 +207,43 @@ class FileReader(datastore.abc.ReceiveStream):
 	
 	
 	@classmethod
-	async def from_path(cls, filepath: typing.Union[str, bytes, os_PathLike_str]) -> 'FileReader':
+	def from_fd(cls, fd: int, access: typing.Optional[access_t] = None) -> 'FileReader':
+		"""Synchronously wraps the given open file descriptor
+		
+		This performs blocking I/O and should only be called from an I/O
+		thread. The file descriptor is owned by the returned reader on
+		success.
+		
+		Arguments
+		---------
+		fd
+			The file descriptor to read from
+		access
+			How the file is going to be accessed (see :meth:`FileSystemDatastore.get`)
+		"""
+		# Query file stat data
+		stat = statx.stat(fd)
+		if stat_.S_ISDIR(stat.st_mode):
+			raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR))
+		
+		# Tell the kernel how we are going to read the file (affects readahead)
+		if access is not None and hasattr(os, "posix_fadvise"):
+			advice = os.POSIX_FADV_RANDOM if access == "random" else os.POSIX_FADV_SEQUENTIAL
+			os.posix_fadvise(fd, 0, 0, advice)
+		
+		return cls(trio.wrap_file(open(fd, "rb")), access=access,
+		           **cls.stat_result_to_kwargs(stat))
+	
+	
+	@classmethod
+	async def from_path(cls, filepath: typing.Union[str, bytes, os_PathLike_str],
+	                    access: typing.Optional[access_t] = None) -> 'FileReader':
 		# Open file
-		file = await trio.open_file(filepath, "rb")
+		fd = await run_blocking_nointr(os.open, filepath, os.O_RDONLY)
 		try:
-			# Query file stat data
-			stat = await run_blocking_intr(statx.stat, file.fileno())
-			
-			return cls(file, **cls.stat_result_to_kwargs(stat))
+			return await run_blocking_nointr(cls.from_fd, fd, access)
 		except BaseException:
-			await file.aclose()
+			os.close(fd)
 			raise
 
 
@@ -354,6 +406,8 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 	_stats_prev: typing.Optional[Stats] = None
 	_stats_orig: typing.Optional[Stats] = None
 	
+	_dirs: dircache.DirectoryFDCache
+	
 	case_sensitive: bool
 	object_extension: str = ".data"
 	stats_key: datastore.Key
@@ -365,7 +419,8 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 	@datastore.util.awaitable_to_context_manager
 	async def create(cls, root: typing.Union[os_PathLike_str, str], *,
 	                 case_sensitive: bool = True, remove_empty: bool = True,
-	                 stats: bool = False, stats_key: datastore.Key = DEFAULT_STATS_KEY
+	                 stats: bool = False, stats_key: datastore.Key = DEFAULT_STATS_KEY,
+	                 dir_cache_size: int = DEFAULT_DIR_CACHE_SIZE
 	) -> 'FileSystemDatastore':
 		"""Initialize the datastore with given root directory `root`.
 		
@@ -389,6 +444,18 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 			tracked
 		stats_key
 			The key/filepath at which to persist statistics between runs
+		dir_cache_size
+			The maximum number of directory file descriptors to keep open for
+			resolving object paths relative to their containing directory
+			(using the ``*at()`` family of system calls), rather than having
+			the kernel walk the entire path from the root on every access;
+			``0`` (the default) disables this
+			
+			Directories removed by other processes are detected and reopened,
+			but if another process *renames* a directory below *root* while
+			its file descriptor is cached, this datastore will continue to
+			access the directory under its new name. Only enable this if the
+			directory structure below *root* is never rearranged externally.
 		"""
 		if not root:
 			raise ValueError('root path must not be empty (use \'.\' for current directory)')
@@ -404,11 +471,16 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		self.case_sensitive = bool(case_sensitive)
 		self.remove_empty = bool(remove_empty)
 		self.stats_key = datastore.Key(stats_key)
+		self._dirs = await run_blocking_nointr(dircache.DirectoryFDCache, root, dir_cache_size)
 		
-		# Enable stats processing
-		if stats:
-			self._stats_lock = trio.Lock()
-			await self._init_stats()
+		try:
+			# Enable stats processing
+			if stats:
+				self._stats_lock = trio.Lock()
+				await self._init_stats()
+		except BaseException:
+			self._dirs.close()
+			raise
 		
 		return self
 	
@@ -699,7 +771,10 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 	
 	
 	async def aclose(self) -> None:
-		await self._flush_stats(write_restore_file=True)
+		try:
+			await self._flush_stats(write_restore_file=True)
+		finally:
+			self._dirs.close()
 	
 	
 	# object paths
@@ -738,10 +813,143 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		return True
 	
 	
+	# directory file descriptors
+	
+	
+	def _acquire_dir_sync(self, relpath: pathlib.PurePath, *,
+	                      create: bool = False) -> dircache.DirectoryRef:
+		"""Returns a reference to the directory at *relpath*, optionally
+		creating it first
+		
+		Raises
+		------
+		FileNotFoundError
+			The directory does not exist and *create* is not ``True``
+		NotADirectoryError
+			Some item of the given path is a file, not a directory
+		"""
+		# Without directory file descriptors there is no cheaper way to check
+		# whether the directory exists than just trying to create it
+		if not create or self._dirs.enabled:
+			try:
+				return self._dirs.acquire(relpath)
+			except FileNotFoundError:
+				if not create:
+					raise
+		
+		try:
+			os.makedirs(self.root_path / relpath, exist_ok=True)
+		except FileExistsError as exc:
+			raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR),
+			                         str(self.root_path / relpath)) from exc
+		return self._dirs.acquire(relpath)
+	
+	
+	def _run_at_sync(self, relpath: pathlib.PurePath,
+	                 func: typing.Callable[[typing.Optional[int], str], T]) -> T:
+		"""Calls *func* with the directory file descriptor and path that
+		should be passed to the ``*at()`` system calls to access the file at
+		*relpath*
+		
+		If the directory file descriptor turns out to be stale (the directory
+		was removed and possibly recreated since it was cached), the call is
+		retried using a freshly opened one.
+		"""
+		while True:
+			with self._dirs.acquire(relpath.parent) as ref:
+				try:
+					return func(ref.fd, ref.join(relpath.name))
+				except FileNotFoundError:
+					if not ref.is_stale():
+						raise
+	
+	
+	def _open_at_sync(self, relpath: pathlib.PurePath, flags: typing.Optional[int],
+	                  mode: str, *, create_dir: bool
+	) -> typing.Tuple[dircache.DirectoryRef, typing.Optional[typing.BinaryIO]]:
+		"""Opens the file at *relpath* using *flags* and returns it together
+		with a reference to its containing directory
+		
+		If *flags* is ``None`` only the directory reference is returned,
+		likewise if *flags* contains ``O_EXCL`` and the file already exists.
+		The caller must release the returned directory reference.
+		"""
+		while True:
+			ref: typing.Optional[dircache.DirectoryRef] = None
+			try:
+				ref = self._acquire_dir_sync(relpath.parent, create=create_dir)
+				if flags is None:
+					return ref, None
+				
+				try:
+					fd = os.open(ref.join(relpath.name), flags, 0o666, dir_fd=ref.fd)
+				except FileExistsError:
+					return ref, None
+				
+				try:
+					return ref, typing.cast(typing.BinaryIO, open(fd, mode))
+				except BaseException:
+					os.close(fd)
+					raise
+			except FileNotFoundError:
+				# Retry if the directory was removed in the meantime (in path
+				# mode this may only be detected by trying to create it again)
+				if ref is None:
+					if not create_dir:
+						raise
+				else:
+					retry = ref.is_stale() or (create_dir and ref.fd is None)
+					ref.release()
+					if not retry:
+						raise
+			except BaseException:
+				if ref is not None:
+					ref.release()
+				raise
+	
+	
+	@staticmethod
+	def _mkstemp_at_sync(ref: dircache.DirectoryRef, prefix: str) \
+	    -> typing.Tuple[str, typing.BinaryIO]:
+		"""Creates a new temporary file for writing in the given directory
+		
+		Returns the path of the new file (relative to ``ref.fd``) and the
+		opened file object.
+		"""
+		flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+		for _ in range(tempfile.TMP_MAX):
+			name = ref.join(tempfile.mktemp(prefix=prefix, dir=""))
+			try:
+				fd = os.open(name, flags, 0o600, dir_fd=ref.fd)
+			except FileExistsError:
+				continue
+			
+			try:
+				return name, typing.cast(typing.BinaryIO, open(fd, "wb"))
+			except BaseException:
+				os.close(fd)
+				raise
+		
+		raise FileExistsError(errno.EEXIST, "No usable temporary file name found")
+	
+	
 	# Datastore implementation
 	
 	
-	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+	def _open_sync(self, relpath: pathlib.PurePath,
+	               access: typing.Optional[access_t] = None) -> FileReader:
+		def open_at(dir_fd: typing.Optional[int], path: str) -> FileReader:
+			fd = os.open(path, os.O_RDONLY, dir_fd=dir_fd)
+			try:
+				return FileReader.from_fd(fd, access)
+			except BaseException:
+				os.close(fd)
+				raise
+		return self._run_at_sync(relpath, open_at)
+	
+	
+	async def get(self, key: datastore.Key, *,  # type: ignore[override]
+	              access: typing.Optional[access_t] = None) -> datastore.abc.ReceiveStream:
 		"""Returns the data named by key, or raises KeyError otherwise.
 		
 		It is suggested to read larger chunks of the returned stream to reduce
@@ -751,6 +959,16 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		---------
 		key
 			Key naming the data to retrieve
+		access
+			Hint on how the returned stream is going to be read, passed on to
+			the kernel using ``posix_fadvise(2)`` where available:
+			
+			 * ``"sequential"``: From start to end in large chunks (more
+			   aggressive readahead)
+			 * ``"random"``: In small parts at random offsets (no readahead)
+			 * ``"once"``: Like ``"sequential"``, but additionally evicts all
+			   data read from the page cache again, so that bulk reads do not
+			   displace the data of other, latency-sensitive, readers
 
 		Raises
 		------
@@ -764,16 +982,22 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		# Usage of assert here will cause this call to be optimized away in `-O` mode.
 		assert self.verify_key_valid(key)
 		
-		path = self.object_path(key)
 		try:
-			return await FileReader.from_path(path)
-		except FileNotFoundError as exc:
+			return await run_blocking_nointr(self._open_sync, self.relative_object_path(key), access)
+		except (FileNotFoundError, NotADirectoryError) as exc:
 			raise KeyError(key) from exc
 		except IsADirectoryError as exc:
 			# Should hopefully only happen if `object_extension` is `""`
 			raise RuntimeError(f"Key '{key}' names a subtree, not a value") from exc
 	
 	
+	def _read_all_sync(self, relpath: pathlib.PurePath) -> bytes:
+		def read_at(dir_fd: typing.Optional[int], path: str) -> bytes:
+			with open(os.open(path, os.O_RDONLY, dir_fd=dir_fd), "rb") as file:
+				return file.read()
+		return self._run_at_sync(relpath, read_at)
+	
+	
 	async def get_all(self, key: datastore.Key) -> bytes:
 		"""Returns all the data named by `key` at once or raises `KeyError`
 		   otherwise
@@ -799,10 +1023,9 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		# Usage of assert here will cause this call to be optimized away in `-O` mode.
 		assert self.verify_key_valid(key)
 		
-		path = trio.Path(self.object_path(key))
 		try:
-			return typing.cast(bytes, await path.read_bytes())
-		except FileNotFoundError as exc:
+			return await run_blocking_intr(self._read_all_sync, self.relative_object_path(key))
+		except (FileNotFoundError, NotADirectoryError) as exc:
 			raise KeyError(key) from exc
 		except IsADirectoryError as exc:
 			# Should hopefully only happen if `object_extension` is `""`
@@ -812,27 +1035,34 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 	def _put_replace_sync(
 			self,
 			source: typing.Union[os_PathLike_str, str],
-			target: typing.Union[os_PathLike_str, str]
+			target: typing.Union[os_PathLike_str, str], *,
+			dir_fd: typing.Optional[int] = None
 	) -> None:
-		source = pathlib.Path(source)
-		target = pathlib.Path(target)
+		"""Moves *source* into the place of *target* while accounting for the
+		size of the replaced file
+		
+		If *dir_fd* is given both paths are relative to that directory file
+		descriptor.
+		"""
+		source = os.fspath(source)
+		target = os.fspath(target)
 		if self._stats is None:
-			source.replace(target)
+			os.replace(source, target, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
 			return
 		
 		assert self._stats_lock.locked()
 		
-		target_dir    = target.parent
-		target_prefix = f".tmp-{target.name}-"
+		target_dir    = os.path.dirname(target)
+		target_prefix = f".tmp-{os.path.basename(target)}-"
 		try:
 			# Atomically exchange temporary and production file
 			# (only works on Linux and macOS, but not *BSD and Windows, unfortunately)
-			exchange.exchange(source, target)
+			exchange.exchange(source, target, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
 			
 			# Do bookkeeping of the source file (now the former target file) that
 			# we're going to remove
-			self._stats.disk_usage -= os.stat(source).st_size
-			os.unlink(source)
+			self._stats.disk_usage -= os.stat(source, dir_fd=dir_fd).st_size
+			os.unlink(source, dir_fd=dir_fd)
 		except (FileNotFoundError, AttributeError, NotImplementedError):
 			# Fallback code in case atomic exchange is not available or the target
 			# file was removed in the meantime
@@ -840,18 +1070,20 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 			while True:
 				try:
 					# Move target file to temporary location
-					temp_path = move_to_tempfile_sync(target, dir=target_dir, prefix=target_prefix)
+					temp_path = move_to_tempfile_sync(target, dir=target_dir, prefix=target_prefix,
+					                                  src_dir_fd=dir_fd, dir_fd=dir_fd)
 				except FileNotFoundError:
 					pass
 				else:
 					# Do bookkeeping of this file before removing it
-					self._stats.disk_usage -= temp_path.stat().st_size
-					temp_path.unlink()
+					self._stats.disk_usage -= os.stat(temp_path, dir_fd=dir_fd).st_size
+					os.unlink(temp_path, dir_fd=dir_fd)
 				
 				try:
 					# Move created temporary file with our data to
 					# production file location
-					rename_noreplace.rename_noreplace(source, target)
+					rename_noreplace.rename_noreplace(source, target,
+					                                  src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
 					
 					break
 				except FileExistsError:
@@ -860,9 +1092,10 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 	async def _put_replace(
 			self,
 			source: typing.Union[os_PathLike_str, str, trio.Path],
-			target: typing.Union[os_PathLike_str, str, trio.Path]
+			target: typing.Union[os_PathLike_str, str, trio.Path], *,
+			dir_fd: typing.Optional[int] = None
 	) -> None:
-		await run_blocking_nointr(self._put_replace_sync, source, target)
+		await run_blocking_nointr(self._put_replace_sync, source, target, dir_fd=dir_fd)
 	
 	async def _receive_and_write(self, file: 'trio._file_io.AsyncIOWrapper',
 	                             value: datastore.abc.ReceiveStream) -> None:
@@ -877,6 +1110,46 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 			
 			chunk = await value.receive_some(DEFAULT_BUFFER_SIZE)
 	
+	async def _preallocate(self, file: 'trio._file_io.AsyncIOWrapper', key: datastore.Key,
+	                       size: typing.Optional[int]) -> int:
+		"""Reserves disk space for *size* bytes of data in *file* if the
+		size is known, so that large files are not fragmented while they
+		grow and lack of space is reported before any data is written
+		
+		Returns the number of bytes preallocated.
+		"""
+		if not size or not hasattr(os, "posix_fallocate"):
+			return 0
+		
+		try:
+			await run_blocking_nointr(os.posix_fallocate, file.fileno(), 0, size)
+		except OSError as exc:
+			if exc.errno == errno.ENOSPC:
+				raise OSError(errno.ENOSPC, f"Not enough space left on device to store "
+				                            f"{size} bytes at key '{key}'") from exc
+			elif exc.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+				return 0  # Not supported by the filesystem, just write without it
+			raise
+		return size
+	
+	async def _write_value(self, file: 'trio._file_io.AsyncIOWrapper',
+	                       value: datastore.abc.ReceiveStream, preallocated: int) -> None:
+		try:
+			await self._receive_and_write(file, value)
+		finally:
+			# Drop any preallocated space not used in the end (or any previous
+			# contents of special files that are being overwritten)
+			if preallocated > 0 or "+" in file.mode:
+				with trio.CancelScope(shield=True):
+					await file.truncate(await file.tell())
+	
+	async def _unlink_at(self, dir_ref: dircache.DirectoryRef, name: str) -> None:
+		with trio.CancelScope(shield=True):
+			try:
+				await run_blocking_nointr(os.unlink, dir_ref.join(name), dir_fd=dir_ref.fd)
+			except FileNotFoundError:
+				pass
+	
 	async def _put(self, key: datastore.Key,  # type: ignore[override]
 	               value: datastore.abc.ReceiveStream, *, create: bool, replace: bool) -> None:
 		"""Stores or replaces the data named by `key` with `value`
@@ -909,10 +1182,9 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		# Usage of assert here will cause this call to be optimized away in `-O` mode.
 		assert self.verify_key_valid(key)
 		
-		path = trio.Path(self.object_path(key))
-		path_dir    = path.parent
-		path_prefix = f".tmp-{path.name}-"
-		is_special  = path.name.startswith(".")
+		relpath = self.relative_object_path(key)
+		path_prefix = f".tmp-{relpath.name}-"
+		is_special  = relpath.name.startswith(".")
 		
 		if is_special and not replace:
 			# Cannot create special files, so there is nothing that this method
@@ -928,62 +1200,78 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 			# so that the exception generated by violating this constraint
 			# is raised when opening the file, rather then when closing it
 			await self.delete(key)
-		elif not is_special:
-			# Ensure containing directory exists – unless its a special dot-file as those are never
-			# actually created
-			try:
-				await path_dir.mkdir(parents=True, exist_ok=True)
-			except FileExistsError as exc:
-				# Should hopefully only happen if `object_extension` is `""`
-				raise RuntimeError(f"Key '{key}' requires containing directory "
-				                   f"'{path_dir}' to not be a value") from exc
 		
+		# Attempt to create the target file – except for special dot-files
+		#
+		# If stats are enabled, this only creates the target file if it does not
+		# exist (for non-special files) but doesn't write to it to ensure that
+		# we don't end up with broken accounting if a concurrent process
+		# deletes/replaces it while we are still writing its contents. For
+		# special files this is instead used to ensure that the target *does*
+		# exist.
+		#
+		# The containing directory is also created, unless its a special
+		# dot-file as those are never actually created.
+		flags: typing.Optional[int] = None
+		if self._stats is None or not replace or is_special:
+			flags = os.O_RDWR if is_special else (os.O_WRONLY | os.O_CREAT | os.O_EXCL)
 		
 		try:
-			# Attempt to create the target file – again, except for special dot-files
-			mode = "xb" if not is_special else "r+b"
-			
-			if self._stats is None:
-				# Since accounting doesn't matter in this case, there is no
-				# issue with getting the stats wrong (see next section) and
-				# we can directly write to the target file if it does not
-				# exist; if it does exist however there is the risk of the
-				# file being opened twice by two different processes, likely
-				# corrupting its contents, so we still need to use a temporary
-				# file to avoid this in that case.
-				async with await path.open(mode) as file:
-					await self._receive_and_write(file, value)
-				return
-			elif not replace or is_special:
-				# Create target file if it does not exist (for non-special files),
-				# but don't write to it to ensure that we don't end up with broken
-				# accounting if a concurrent process deletes/replaces it while we
-				# are still writing its contents.
-				#
-				# For special files this is instead used to ensure that the target
-				# *does* exist.
-				async with await path.open(mode) as file:
-					pass
+			dir_ref, file_sync = await run_blocking_nointr(
+				self._open_at_sync, relpath, flags, "r+b" if is_special else "wb",
+				create_dir=not is_special
+			)
 		except IsADirectoryError as exc:
 			# Should only happen if `object_extension` is `""`
 			raise RuntimeError(f"Key \"{key}\" names a subtree, not a value") from exc
 		except FileNotFoundError as exc:
 			# Attempted to create a special file
 			raise RuntimeError(f"Key \"{key}\" names a special dot-file that cannot be created") from exc
-		except FileExistsError as exc:
-			# Error out if the target file already exists …
-			if not replace:
-				raise KeyError(key) from exc
+		except NotADirectoryError as exc:
+			# Should hopefully only happen if `object_extension` is `""`
+			raise RuntimeError(f"Key '{key}' requires containing directory "
+			                   f"'{relpath.parent}' to not be a value") from exc
 		
-		# … unless `replace` is True, then write to a temporary file instead
-		#   and later move it into place, overriding the previous file
-		async with make_named_tempfile(
-			mode="wb", dir=path_dir, prefix=path_prefix, delete=False
-		) as temp_file:
-			await self._receive_and_write(temp_file, value)
+		try:
+			if file_sync is not None:
+				async with trio.wrap_file(file_sync) as file:
+					if self._stats is None:
+						# Since accounting doesn't matter in this case, there is no
+						# issue with getting the stats wrong (see above) and we can
+						# directly write to the target file if it does not exist; if
+						# it does exist however there is the risk of the file being
+						# opened twice by two different processes, likely corrupting
+						# its contents, so we still need to use a temporary file to
+						# avoid this in that case.
+						try:
+							preallocated = await self._preallocate(file, key, value.size)
+						except BaseException:
+							if not is_special:
+								await self._unlink_at(dir_ref, relpath.name)
+							raise
+						await self._write_value(file, value, preallocated)
+						return
+			elif flags is not None and not replace:
+				# Error out if the target file already exists …
+				raise KeyError(key)
+			
+			# … unless `replace` is True, then write to a temporary file instead
+			#   and later move it into place, overriding the previous file
+			temp_name, temp_file_sync = await run_blocking_nointr(
+				self._mkstemp_at_sync, dir_ref, path_prefix
+			)
+			async with trio.wrap_file(temp_file_sync) as temp_file:
+				try:
+					preallocated = await self._preallocate(temp_file, key, value.size)
+				except BaseException:
+					await self._unlink_at(dir_ref, temp_name)
+					raise
+				await self._write_value(temp_file, value, preallocated)
 		
-		async with self._stats_lock:  # type: ignore[union-attr]
-			await self._put_replace(temp_file.name, path)
+			async with self._stats_lock:  # type: ignore[union-attr]
+				await self._put_replace(temp_name, dir_ref.join(relpath.name), dir_fd=dir_ref.fd)
+		finally:
+			dir_ref.release()
 	
 	
 	async def _put_new_indirect(self, prefix: datastore.Key  # type: ignore[override]
@@ -1055,26 +1343,33 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		return prefix.child(pathlib.Path(target_file.name).name[:-len(self.object_extension)]), callback
 	
 	
-	def _delete_sync(self, path: typing.Union[os_PathLike_str, str]) -> None:
-		path = pathlib.Path(path)
-		if self._stats is None:
-			path.unlink()
-			return
+	def _delete_sync(self, relpath: pathlib.PurePath) -> None:
+		def delete_at(dir_fd: typing.Optional[int], path: str) -> None:
+			if self._stats is None:
+				os.unlink(path, dir_fd=dir_fd)
+				return
 		
-		assert self._stats_lock.locked()
+			assert self._stats_lock.locked()
 		
-		path_dir    = path.parent
-		path_prefix = f".tmp-{path.name}-"
+			path_dir    = os.path.dirname(path)
+			path_prefix = f".tmp-{os.path.basename(path)}-"
 		
-		try:
-			temp_path = move_to_tempfile_sync(path, dir=path_dir, prefix=path_prefix)
-		except FileNotFoundError:
-			raise  # Let this propagate to signal that the file didn't exist
-		else:
-			self._stats.disk_usage -= temp_path.stat().st_size
-			temp_path.unlink()
+			try:
+				temp_path = move_to_tempfile_sync(path, dir=path_dir, prefix=path_prefix,
+				                                  src_dir_fd=dir_fd, dir_fd=dir_fd)
+			except FileNotFoundError:
+				raise  # Let this propagate to signal that the file didn't exist
+			else:
+				self._stats.disk_usage -= os.stat(temp_path, dir_fd=dir_fd).st_size
+				os.unlink(temp_path, dir_fd=dir_fd)
+		self._run_at_sync(relpath, delete_at)
 	
 
+	def _rmdir_sync(self, relpath: pathlib.PurePath) -> None:
+		self._run_at_sync(relpath, lambda dir_fd, path: os.rmdir(path, dir_fd=dir_fd))
+		self._dirs.invalidate(relpath)
+	
+	
 	async def delete(self, key: datastore.Key) -> None:
 		"""Removes the data named by `key`
 		
@@ -1093,35 +1388,32 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		# Usage of assert here will cause this call to be optimized away in `-O` mode.
 		assert self.verify_key_valid(key)
 		
-		path = trio.Path(self.object_path(key))
+		relpath = self.relative_object_path(key)
 		
 		try:
 			async with self._stats_lock:  # type: ignore[union-attr]
-				await run_blocking_nointr(self._delete_sync, path)
-		except FileNotFoundError as exc:
+				await run_blocking_nointr(self._delete_sync, relpath)
+		except (FileNotFoundError, NotADirectoryError) as exc:
 			raise KeyError(key) from exc
 		
 		# Try to remove parent directories if they are empty
 		if self.remove_empty:
 			try:
-				parent = path.parent
+				parent = relpath.parent
 				# Attempt to remove all parent directories as long as the
-				# parent directory is:
-				#  * … a sub-directory of `self.root_path` – checking whether
-				#    the path of that directory starts with `{self.root_path}/`.
-				#  * … not the same directory again – to ensure that pathlib's
-				#    special `Path(".").parent == Path(".")` behaviour doesn't
-				#    bite us. (This check may be unnecessary / overly pedantic…)
+				# parent directory is a sub-directory of `self.root_path` –
+				# that is, until pathlib's special `PurePath(".").parent ==
+				# PurePath(".")` is reached.
 				# The loop is stopped when we either reach the root directory
 				# or receive an `ENOTEMPTY` error indicating that we tried to
-				# remove a directory that wasn't actually empty.
-				while str(parent).startswith(str(self.root_path) + os.path.sep) \
-				      and parent.parent != parent:
-					await parent.rmdir()
+				# remove a directory that wasn't actually empty (or `ENOENT`
+				# if somebody else already removed it).
+				while parent != parent.parent:
+					await run_blocking_nointr(self._rmdir_sync, parent)
 					
 					parent = parent.parent
 			except OSError as exc:
-				if exc.errno == errno.ENOTEMPTY:
+				if exc.errno in (errno.ENOTEMPTY, errno.ENOENT):
 					return
 				raise
 	
@@ -1129,24 +1421,50 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 	def _rename_replace_sync(
 			self,
 			source: typing.Union[os_PathLike_str, str],
-			target: typing.Union[os_PathLike_str, str]
+			target: typing.Union[os_PathLike_str, str], *,
+			src_dir_fd: typing.Optional[int] = None,
+			dst_dir_fd: typing.Optional[int] = None
 	) -> None:
-		source = pathlib.Path(source)
-		target = pathlib.Path(target)
+		source = os.fspath(source)
+		target = os.fspath(target)
 		if self._stats is None:
-			source.replace(target)
+			os.replace(source, target, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
 			return
 		
 		assert self._stats_lock.locked()
 		
-		temp_dir    = target.parent
-		temp_prefix = f".tmp-{target.name}-"
+		temp_dir    = os.path.dirname(target)
+		temp_prefix = f".tmp-{os.path.basename(target)}-"
 		
 		# Move target file to temporary location (frees source file)
-		temp_path = move_to_tempfile_sync(source, dir=temp_dir, prefix=temp_prefix)
+		temp_path = move_to_tempfile_sync(source, dir=temp_dir, prefix=temp_prefix,
+		                                  src_dir_fd=src_dir_fd, dir_fd=dst_dir_fd)
 		
 		# Exchange temporary file with target, like in :meth:`put`
-		self._put_replace_sync(temp_path, target)
+		self._put_replace_sync(temp_path, target, dir_fd=dst_dir_fd)
+	
+	
+	def _rename_sync(self, relpath1: pathlib.PurePath, relpath2: pathlib.PurePath,
+	                 replace: bool) -> None:
+		while True:
+			with self._dirs.acquire(relpath1.parent) as ref1, \
+			     self._dirs.acquire(relpath2.parent) as ref2:
+				path1 = ref1.join(relpath1.name)
+				path2 = ref2.join(relpath2.name)
+				try:
+					if not replace:
+						rename_noreplace.rename_noreplace(
+							path1, path2, src_dir_fd=ref1.fd, dst_dir_fd=ref2.fd
+						)
+					else:
+						self._rename_replace_sync(
+							path1, path2, src_dir_fd=ref1.fd, dst_dir_fd=ref2.fd
+						)
+					return
+				except FileNotFoundError:
+					# Check both directory references (no short-circuiting)
+					if not any([ref1.is_stale(), ref2.is_stale()]):
+						raise
 	
 	
 	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
@@ -1174,8 +1492,8 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		assert self.verify_key_valid(key1)
 		assert self.verify_key_valid(key2, False)
 		
-		path1 = trio.Path(self.object_path(key1))
-		path2 = trio.Path(self.object_path(key2))
+		relpath1 = self.relative_object_path(key1)
+		relpath2 = self.relative_object_path(key2)
 		
 		if not replace:
 			# Just do the replace and fail if it didn't succeed
@@ -1183,7 +1501,7 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 			# No weird accounting stuff here since this operation never changes the
 			# size of datastore.
 			try:
-				await run_blocking_nointr(rename_noreplace.rename_noreplace, path1, path2)
+				await run_blocking_nointr(self._rename_sync, relpath1, relpath2, False)
 			except FileNotFoundError as exc:
 				raise KeyError(key1) from exc
 			except FileExistsError as exc:
@@ -1191,7 +1509,7 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		else:
 			try:
 				async with self._stats_lock:  # type: ignore[union-attr]
-					await run_blocking_nointr(self._rename_replace_sync, path1, path2)
+					await run_blocking_nointr(self._rename_sync, relpath1, relpath2, True)
 			except FileNotFoundError as exc:
 				raise KeyError(key1) from exc
 	
@@ -1216,16 +1534,164 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 		# Usage of assert here will cause this call to be optimized away in `-O` mode.
 		assert self.verify_key_valid(key)
 		
-		path = self.object_path(key)
+		stat = await run_blocking_intr(self._stat_sync, self.relative_object_path(key))
+		if stat is None:
+			raise KeyError(key)
+		if stat_.S_ISDIR(stat.st_mode):
+			# Should hopefully only happen if `object_extension` is `""`
+			raise RuntimeError(f"Key '{key}' names a subtree, not a value")
+		
+		return datastore.util.StreamMetadata(**FileReader.stat_result_to_kwargs(stat))
+	
+	
+	def _stat_sync(self, relpath: pathlib.PurePath,
+	               buffer: typing.Optional[statx.struct_statx] = None
+	) -> typing.Optional[stat_result_t]:
+		"""Returns the stat data of the file at *relpath* or ``None`` if it
+		does not exist"""
 		try:
-			stat = await run_blocking_intr(statx.stat, path)
-			if stat_.S_ISDIR(stat.st_mode):
+			return self._run_at_sync(
+				relpath, lambda dir_fd, path: statx.stat(path, dir_fd=dir_fd, buffer=buffer)
+			)
+		except (FileNotFoundError, NotADirectoryError):
+			return None
+	
+	
+	def _stat_many_sync(self, relpaths: typing.List[pathlib.PurePath]) \
+	    -> typing.List[typing.Optional[stat_result_t]]:
+		buffer = statx.struct_statx()
+		return [self._stat_sync(relpath, buffer) for relpath in relpaths]
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by `key` exists
+		
+		Unlike the default implementation this does not open the file, but
+		only performs a single ``statx(2)`` call.
+		
+		Arguments
+		---------
+		key
+			Key naming the object to check.
+		"""
+		# Validate that the key is well-formed
+		#
+		# Usage of assert here will cause this call to be optimized away in `-O` mode.
+		assert self.verify_key_valid(key)
+		
+		stat = await run_blocking_intr(self._stat_sync, self.relative_object_path(key))
+		return stat is not None and not stat_.S_ISDIR(stat.st_mode)
+	
+	
+	async def stat_many(self, keys: typing.Iterable[datastore.Key]) \
+	      -> typing.List[typing.Optional[datastore.util.StreamMetadata]]:
+		"""Returns the metadata of the data named by each of the given keys
+		
+		All keys are checked during a single context switch to a worker
+		thread, making this much cheaper than calling :meth:`stat` for each
+		key individually.
+		
+		Arguments
+		---------
+		keys
+			Keys naming the data to retrieve the metadata of
+		
+		Returns
+		-------
+			A list with one item for each key in *keys*, being either the
+			metadata of the respective data or ``None`` if it did not exist
+		
+		Raises
+		------
+		RuntimeError
+			One of the given keys names a subtree, not a value
+		"""
+		keys = list(keys)
+		
+		# Validate that the keys are well-formed
+		#
+		# Usage of assert here will cause this call to be optimized away in `-O` mode.
+		assert all(self.verify_key_valid(key) for key in keys)
+		
+		stats = await run_blocking_intr(
+			self._stat_many_sync, [self.relative_object_path(key) for key in keys]
+		)
+		
+		result: typing.List[typing.Optional[datastore.util.StreamMetadata]] = []
+		for key, stat in zip(keys, stats):
+			if stat is None:
+				result.append(None)
+			elif stat_.S_ISDIR(stat.st_mode):
 				# Should hopefully only happen if `object_extension` is `""`
 				raise RuntimeError(f"Key '{key}' names a subtree, not a value")
+			else:
+				result.append(datastore.util.StreamMetadata(**FileReader.stat_result_to_kwargs(stat)))
+		return result
+	
+	
+	async def contains_many(self, keys: typing.Iterable[datastore.Key]) -> typing.List[bool]:
+		"""Returns whether any data named by each of the given keys exists
+		
+		Like :meth:`stat_many` all keys are checked during a single context
+		switch to a worker thread.
+		
+		Arguments
+		---------
+		keys
+			Keys naming the objects to check
+		"""
+		keys = list(keys)
+		
+		# Validate that the keys are well-formed
+		#
+		# Usage of assert here will cause this call to be optimized away in `-O` mode.
+		assert all(self.verify_key_valid(key) for key in keys)
+		
+		stats = await run_blocking_intr(
+			self._stat_many_sync, [self.relative_object_path(key) for key in keys]
+		)
+		return [stat is not None and not stat_.S_ISDIR(stat.st_mode) for stat in stats]
+	
+	
+	def _list_dir_sync(self, relpath: pathlib.PurePath) -> typing.List[typing.Tuple[str, bool]]:
+		with os.scandir(self.root_path / relpath) as scanner:
+			return [(dent.name, dent.is_dir(follow_symlinks=False)) for dent in scanner]
+	
+	
+	async def keys(self, prefix: datastore.Key = datastore.Key("/")) \
+	      -> typing.AsyncIterator[datastore.Key]:
+		"""Yields the keys of all values stored below *prefix*, in no
+		particular order
+		
+		Values added or removed while iterating may or may not be reported.
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		"""
+		assert self.verify_key_valid(prefix, False)
+		
+		stats_relpath = self.relative_object_path(self.stats_key) if self._stats is not None else None
+		
+		pending = [self.relative_path(prefix)]
+		while pending:
+			relpath = pending.pop()
+			try:
+				entries = await run_blocking_intr(self._list_dir_sync, relpath)
+			except (FileNotFoundError, NotADirectoryError):
+				continue
 			
-			return datastore.util.StreamMetadata(**FileReader.stat_result_to_kwargs(stat))
-		except FileNotFoundError as exc:
-			raise KeyError(key) from exc
+			for name, is_dir in entries:
+				# Skip temporary and other special files
+				if name.startswith(".") and not name.startswith(".new-"):
+					continue
+				
+				if is_dir:
+					pending.append(relpath / name)
+				elif name.endswith(self.object_extension) and relpath / name != stats_relpath:
+					name = name[:(len(name) - len(self.object_extension))]
+					yield datastore.Key("/" + (relpath / name).as_posix())
 	
 	
 	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
@@ -1246,3 +1712,22 @@ class FileSystemDatastore(datastore.abc.BinaryDatastore):
 			size = self._stats.disk_usage,
 			size_accuracy = ACCURACY_INTERAL_TO_METADATA[self._stats.accuracy],
 		)
+	
+	
+	@datastore.util.awaitable_to_context_manager
+	async def watch(self) -> 'watch_.FileSystemWatcher':
+		"""Returns a channel of the keys changed in this datastore by any process
+		
+		Use this to invalidate caches layered on top of a datastore whose
+		directory is shared with other processes. See
+		:class:`~datastore.filesystem.watch.FileSystemWatcher` for details.
+		
+		Raises
+		------
+		NotImplementedError
+			The current platform does not support ``inotify(7)`` (Linux only)
+		"""
+		ignore = [self.relative_object_path(self.stats_key)] if self._stats is not None else []
+		return await watch_.FileSystemWatcher.create(
+			self.root_path, object_extension=self.object_extension, ignore=ignore
+		)
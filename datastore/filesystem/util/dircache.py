@@ -0,0 +1,289 @@
+"""A least-recently-used cache of open directory file descriptors
+
+Passing a directory file descriptor together with a single path component to
+the ``*at()`` family of system calls (``openat(2)``, ``statx(2)``,
+``unlinkat(2)``, ``renameat2(2)``, …) saves the kernel from resolving all of
+the leading path components again on every access, which adds up quickly for
+deeply nested directory trees.
+
+On platforms that do not support passing directory file descriptors to
+:func:`os.open` (or if the cache size is set to zero) the cache transparently
+degrades to handing out plain paths instead.
+"""
+import collections
+import os
+import pathlib
+import threading
+import typing
+
+__all__ = (
+	"DirectoryRef",
+	"DirectoryFDCache",
+)
+
+
+# Use `O_PATH` where available, since we never read from the directory
+# descriptors ourselves and it skips the read permission check
+_OPEN_FLAGS: int = getattr(os, "O_PATH", os.O_RDONLY) \
+                   | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+
+
+class _Entry:
+	__slots__ = ("fd", "refs", "evicted")
+	
+	fd: int
+	refs: int
+	evicted: bool
+	
+	def __init__(self, fd: int):
+		self.fd      = fd
+		self.refs    = 0
+		self.evicted = False
+
+
+class DirectoryRef:
+	"""A reference to a directory acquired from :class:`DirectoryFDCache`
+	
+	Names within the directory must be resolved using :meth:`join` and passed
+	to the standard library together with ``dir_fd=ref.fd``; if :attr:`fd` is
+	``None`` :meth:`join` will return a full path instead.
+	
+	The reference must be released using :meth:`release` (or by using it as
+	a context manager) once it is not used anymore.
+	"""
+	__slots__ = ("_cache", "_entry", "fd", "path", "relpath")
+	
+	_cache: typing.Optional['DirectoryFDCache']
+	_entry: typing.Optional[_Entry]
+	fd: typing.Optional[int]
+	path: str
+	relpath: pathlib.PurePath
+	
+	
+	def __init__(self, cache: typing.Optional['DirectoryFDCache'], entry: typing.Optional[_Entry],
+	             path: str, relpath: pathlib.PurePath):
+		self._cache  = cache
+		self._entry  = entry
+		self.fd      = entry.fd if entry is not None else None
+		self.path    = path
+		self.relpath = relpath
+	
+	
+	def join(self, name: str) -> str:
+		"""Returns the path to pass along with :attr:`fd` to access *name*"""
+		if self.fd is not None:
+			return name
+		return os.path.join(self.path, name)
+	
+	
+	def is_stale(self) -> bool:
+		"""Checks whether the referenced directory has been removed from the
+		filesystem since it was opened
+		
+		If it was, the directory is also dropped from the cache, so that the
+		next :meth:`DirectoryFDCache.acquire` call will open it again.
+		"""
+		if self._cache is None or self._entry is None:
+			return False
+		return self._cache._is_stale(self._entry, self.relpath)
+	
+	
+	def release(self) -> None:
+		"""Returns the reference to the cache it was acquired from"""
+		if self._cache is not None and self._entry is not None:
+			self._cache._release(self._entry)
+		self._cache = None
+		self._entry = None
+	
+	
+	def __enter__(self) -> 'DirectoryRef':
+		return self
+	
+	
+	def __exit__(self, *args: typing.Any) -> None:
+		self.release()
+
+
+class DirectoryFDCache:
+	"""A thread-safe LRU cache mapping directory paths (relative to some
+	root directory) to open file descriptors of these directories
+	
+	Directories missing from the cache are opened relative to their closest
+	ancestor that is cached, so that even cache misses only have to resolve
+	the path components that aren't cached yet. Descriptors evicted while
+	still in use by some thread are closed once their last reference is
+	released.
+	
+	All methods of this class perform blocking system calls and should be run
+	from a worker thread.
+	"""
+	__slots__ = ("_closed", "_entries", "_lock", "_root_fd", "root_path", "size")
+	
+	_closed: bool
+	_entries: 'collections.OrderedDict[pathlib.PurePath, _Entry]'
+	_lock: threading.Lock
+	_root_fd: typing.Optional[int]
+	root_path: pathlib.PurePath
+	size: int
+	
+	
+	def __init__(self, root: typing.Union[str, os.PathLike], size: int = 128):
+		"""
+		Arguments
+		---------
+		root
+			The directory to resolve all relative paths against
+		size
+			The maximum number of directory file descriptors to keep open
+			(not counting the root directory); ``0`` disables caching and
+			always hands out full paths
+		"""
+		self._closed    = False
+		self._entries   = collections.OrderedDict()
+		self._lock      = threading.Lock()
+		self._root_fd   = None
+		self.root_path  = pathlib.PurePath(root)
+		self.size       = max(size, 0)
+		
+		if self.size > 0 and os.open in os.supports_dir_fd and os.stat in os.supports_dir_fd \
+		   and os.unlink in os.supports_dir_fd:
+			self._root_fd = os.open(root, _OPEN_FLAGS)
+	
+	
+	@property
+	def enabled(self) -> bool:
+		"""Whether this cache actually hands out directory file descriptors"""
+		return self._root_fd is not None
+	
+	
+	def acquire(self, relpath: typing.Union[str, pathlib.PurePath]) -> DirectoryRef:
+		"""Returns a reference to the directory at *relpath* below the root
+		directory
+		
+		Raises
+		------
+		FileNotFoundError
+			The given directory does not exist
+		NotADirectoryError
+			The given path or one of its parents is not a directory
+		"""
+		relpath = pathlib.PurePath(relpath)
+		if self._root_fd is None:
+			return DirectoryRef(None, None, str(self.root_path / relpath), relpath)
+		
+		if self._closed:
+			raise ValueError("I/O operation on closed directory cache")
+		
+		# The root directory itself is never evicted
+		if relpath == pathlib.PurePath():
+			return DirectoryRef(None, _Entry(self._root_fd), str(self.root_path), relpath)
+		
+		while True:
+			# Look for the directory itself or its closest cached ancestor
+			base_entry: typing.Optional[_Entry] = None
+			base_path = pathlib.PurePath()
+			with self._lock:
+				entry = self._entries.get(relpath)
+				if entry is not None:
+					self._entries.move_to_end(relpath)
+					entry.refs += 1
+					return DirectoryRef(self, entry, str(self.root_path / relpath), relpath)
+				
+				for parent in relpath.parents:
+					base_entry = self._entries.get(parent)
+					if base_entry is not None:
+						base_entry.refs += 1
+						base_path = parent
+						break
+			
+			# Open the directory relative to the ancestor found (without holding the lock)
+			try:
+				base_fd = base_entry.fd if base_entry is not None else self._root_fd
+				fd = os.open(relpath.relative_to(base_path), _OPEN_FLAGS, dir_fd=base_fd)
+			except FileNotFoundError:
+				# Retry from the root directory if the ancestor was removed
+				# since it was cached
+				if base_entry is None or not self._is_stale(base_entry, base_path):
+					raise
+				continue
+			finally:
+				if base_entry is not None:
+					self._release(base_entry)
+			
+			with self._lock:
+				entry = self._entries.get(relpath)
+				if entry is not None:
+					# Somebody else opened the same directory in the meantime
+					os.close(fd)
+					self._entries.move_to_end(relpath)
+				else:
+					entry = _Entry(fd)
+					self._entries[relpath] = entry
+					self._evict_locked()
+				entry.refs += 1
+			return DirectoryRef(self, entry, str(self.root_path / relpath), relpath)
+	
+	
+	def invalidate(self, relpath: typing.Union[str, pathlib.PurePath]) -> None:
+		"""Drops the directory at *relpath* and all its cached sub-directories
+		from the cache
+		
+		Call this after removing or renaming a directory.
+		"""
+		relpath = pathlib.PurePath(relpath)
+		if self._root_fd is None or relpath == pathlib.PurePath():
+			return
+		
+		with self._lock:
+			for path in list(self._entries.keys()):
+				if path == relpath or relpath in path.parents:
+					self._drop_locked(path)
+	
+	
+	def close(self) -> None:
+		"""Closes all directory file descriptors held by this cache"""
+		with self._lock:
+			if self._closed:
+				return
+			self._closed = True
+			
+			for path in list(self._entries.keys()):
+				self._drop_locked(path)
+			
+			if self._root_fd is not None:
+				os.close(self._root_fd)
+	
+	
+	def __len__(self) -> int:
+		return len(self._entries)
+	
+	
+	def _is_stale(self, entry: _Entry, relpath: pathlib.PurePath) -> bool:
+		try:
+			if os.fstat(entry.fd).st_nlink > 0:
+				return False
+		except OSError:
+			pass
+		
+		self.invalidate(relpath)
+		return True
+	
+	
+	def _release(self, entry: _Entry) -> None:
+		with self._lock:
+			entry.refs -= 1
+			if entry.refs == 0 and entry.evicted:
+				os.close(entry.fd)
+	
+	
+	def _drop_locked(self, path: pathlib.PurePath) -> None:
+		entry = self._entries.pop(path)
+		entry.evicted = True
+		if entry.refs == 0:
+			os.close(entry.fd)
+	
+	
+	def _evict_locked(self) -> None:
+		while len(self._entries) > self.size:
+			path = next(iter(self._entries))
+			self._drop_locked(path)
@@ -0,0 +1,149 @@
+"""Minimal wrapper around the Linux ``inotify(7)`` file system event API
+
+Only the three system calls ``inotify_init1(2)``, ``inotify_add_watch(2)`` and
+``inotify_rm_watch(2)`` are wrapped, reading and decoding events is left to
+the caller (see :func:`parse_events`). On other platforms all functions raise
+:exc:`NotImplementedError`.
+"""
+import ctypes
+import enum
+import errno
+import os
+import struct
+import sys
+import typing
+
+__all__ = (
+	"Mask",
+	"InitFlags",
+	"Event",
+	
+	"init1",
+	"add_watch",
+	"rm_watch",
+	"parse_events",
+)
+
+
+class Mask(enum.IntFlag):
+	# Events that may be watched for
+	ACCESS        = 0x00000001  # File was accessed
+	MODIFY        = 0x00000002  # File was modified
+	ATTRIB        = 0x00000004  # Metadata changed
+	CLOSE_WRITE   = 0x00000008  # Writable file was closed
+	CLOSE_NOWRITE = 0x00000010  # Unwritable file closed
+	OPEN          = 0x00000020  # File was opened
+	MOVED_FROM    = 0x00000040  # File was moved from X
+	MOVED_TO      = 0x00000080  # File was moved to Y
+	CREATE        = 0x00000100  # Subfile was created
+	DELETE        = 0x00000200  # Subfile was deleted
+	DELETE_SELF   = 0x00000400  # Self was deleted
+	MOVE_SELF     = 0x00000800  # Self was moved
+	
+	# Events sent by the kernel
+	UNMOUNT       = 0x00002000  # Backing filesystem was unmounted
+	Q_OVERFLOW    = 0x00004000  # Event queue overflowed
+	IGNORED       = 0x00008000  # Watch was removed
+	
+	# Special flags
+	ONLYDIR       = 0x01000000  # Only watch the path if it is a directory
+	DONT_FOLLOW   = 0x02000000  # Do not follow a symbolic link
+	EXCL_UNLINK   = 0x04000000  # Exclude events on unlinked objects
+	MASK_ADD      = 0x20000000  # Add to the mask of an already existing watch
+	ISDIR         = 0x40000000  # Event occurred against directory
+	ONESHOT       = 0x80000000  # Only send event once
+
+
+class InitFlags(enum.IntFlag):
+	NONBLOCK = os.O_NONBLOCK
+	CLOEXEC  = getattr(os, "O_CLOEXEC", 0)
+
+
+class Event(typing.NamedTuple):
+	wd: int
+	mask: Mask
+	cookie: int
+	name: bytes
+
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+if sys.platform == "linux":
+	_error: typing.Optional[NotImplementedError] = None
+	_libc: typing.Optional[ctypes.CDLL] = None
+	
+	try:
+		# Try glibc first, falling back to any C library returned by `ldconfig`
+		try:
+			_libc = ctypes.CDLL("libc.so.6", use_errno=True)
+		except OSError:
+			import ctypes.util
+			_libc_name = ctypes.util.find_library("c")
+			if _libc_name is not None:
+				_libc = ctypes.CDLL(_libc_name, use_errno=True)
+			else:
+				raise FileNotFoundError()
+		
+		try:
+			_libc.inotify_init1.argtypes = (ctypes.c_int,)
+			_libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+			_libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+		except AttributeError:
+			_error = NotImplementedError("inotify: C library does not expose inotify symbols")
+	except OSError:
+		_error = NotImplementedError("inotify: No C library found at name 'libc.so.6'")
+else:
+	_error = NotImplementedError("inotify: Only available on Linux")
+	_libc = None
+
+
+def _check(result: int) -> int:
+	if result < 0:
+		code = ctypes.get_errno()
+		raise OSError(code, os.strerror(code))
+	return result
+
+
+def init1(flags: InitFlags = InitFlags.NONBLOCK | InitFlags.CLOEXEC) -> int:
+	"""Low-level wrapper around the ``inotify_init1(2)`` Linux system call"""
+	if _error:
+		raise _error
+	assert _libc
+	
+	return _check(_libc.inotify_init1(flags))
+
+
+def add_watch(fd: int, path: typing.Union[str, bytes, 'os.PathLike[str]'], mask: Mask) -> int:
+	"""Low-level wrapper around the ``inotify_add_watch(2)`` Linux system call"""
+	if _error:
+		raise _error
+	assert _libc
+	
+	return _check(_libc.inotify_add_watch(fd, os.fsencode(path), mask))
+
+
+def rm_watch(fd: int, wd: int) -> None:
+	"""Low-level wrapper around the ``inotify_rm_watch(2)`` Linux system call"""
+	if _error:
+		raise _error
+	assert _libc
+	
+	try:
+		_check(_libc.inotify_rm_watch(fd, wd))
+	except OSError as exc:
+		# Watch was already removed by the kernel
+		if exc.errno != errno.EINVAL:
+			raise
+
+
+def parse_events(buf: bytes) -> typing.Iterator[Event]:
+	"""Decodes the ``struct inotify_event`` records read from an inotify
+	file descriptor"""
+	offset = 0
+	while offset + _EVENT_HEADER.size <= len(buf):
+		wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+		offset += _EVENT_HEADER.size
+		name = buf[offset:(offset + length)].rstrip(b"\0")
+		offset += length
+		yield Event(wd, Mask(mask), cookie, name)
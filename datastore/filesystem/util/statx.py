@@ -182,15 +182,19 @@ if sys.platform == "linux":
 			dirfd: int      = AT_FDCWD,
 			pathname: bytes = b"",
 			flags: int      = AT_STATX_SYNC_AS_STAT,
-			mask: Mask      = Mask.BASIC_STATS
+			mask: Mask      = Mask.BASIC_STATS,
+			buffer: typing.Optional[struct_statx] = None
 	) -> struct_statx:
-		"""Low-level wrapper around the ``statx(2)`` Linux system call"""
+		"""Low-level wrapper around the ``statx(2)`` Linux system call
+		
+		If *buffer* is given, the result is written to and returned in that
+		structure, rather than allocating a new one."""
 		global _error
 		if _error:
 			raise _error
 		assert _func
 		
-		statx_data = struct_statx()
+		statx_data = buffer if buffer is not None else struct_statx()
 		
 		result = _func(dirfd, pathname, flags, mask, ctypes.byref(statx_data))
 		if result < 0:
@@ -259,9 +263,13 @@ else:
 _statx_available = "statx" in globals()
 
 
-def stat(path: path_t, *, dir_fd: int = None, follow_symlinks: bool = True) -> stat_result_t:
+def stat(path: path_t, *, dir_fd: int = None, follow_symlinks: bool = True,
+         buffer: typing.Optional[struct_statx] = None) -> stat_result_t:
 	"""High-level wrapper around the ``statx(2)`` system call, that delegates
-	to :func:`os.stat` on other platforms, but provides `st_birthtime` on Linux."""
+	to :func:`os.stat` on other platforms, but provides `st_birthtime` on Linux.
+	
+	Pass the same *buffer* to repeated calls to avoid allocating a new
+	:class:`struct_statx` each time (ignored if ``statx(2)`` is not used)."""
 	def ts_to_nstime(ts: struct_statx_timestamp) -> int:
 		return ts.tv_sec * 1000_000_000 + ts.tv_nsec
 	
@@ -281,7 +289,7 @@ def stat(path: path_t, *, dir_fd: int = None, follow_symlinks: bool = True) -> s
 			if not follow_symlinks:
 				stx_flags |= AT_SYMLINK_NOFOLLOW
 			
-			stx_result = statx(stx_dirfd, stx_path, stx_flags, Mask.BASIC_STATS | Mask.BTIME)
+			stx_result = statx(stx_dirfd, stx_path, stx_flags, Mask.BASIC_STATS | Mask.BTIME, buffer)
 			assert (~stx_result.stx_mask & (Mask.BASIC_STATS & ~Mask.BLOCKS)) == 0
 			
 			st_blocks       = None
@@ -0,0 +1,219 @@
+"""Reports changes made to a filesystem datastore by other processes
+
+Uses Linux's ``inotify(7)`` API to turn files being created, written, moved
+and removed below the datastore root into a stream of changed keys, so that
+caches layered on top of a :class:`~datastore.filesystem.FileSystemDatastore`
+shared with other processes know which of their entries to invalidate.
+"""
+import collections
+import os
+import pathlib
+import typing
+
+import trio
+
+import datastore
+import datastore.util
+
+from .util import inotify
+
+__all__ = ("FileSystemWatcher",)
+
+
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+
+# Events on directories that we need to follow to keep track of the tree
+_WATCH_MASK = inotify.Mask.CLOSE_WRITE | inotify.Mask.MOVED_FROM | inotify.Mask.MOVED_TO \
+              | inotify.Mask.CREATE | inotify.Mask.DELETE | inotify.Mask.ONLYDIR \
+              | inotify.Mask.EXCL_UNLINK
+
+# Events signaling that the value of a file has changed or has been removed
+_FILE_MASK = inotify.Mask.CLOSE_WRITE | inotify.Mask.MOVED_FROM | inotify.Mask.MOVED_TO \
+             | inotify.Mask.DELETE
+
+# Large enough to hold at least 16 events with maximum length names
+_READ_SIZE = 16 * (16 + 256)
+
+
+class FileSystemWatcher(trio.abc.ReceiveChannel[datastore.Key]):
+	"""Channel of keys whose values were changed below some filesystem
+	datastore root
+	
+	Every key is reported at least once after the file backing it has been
+	written, replaced, renamed or removed, but several changes of the same
+	key that happen before the key is received will be merged into one. Some
+	events are reported using the key naming the entire affected subtree
+	instead:
+	
+	 * When a directory is moved out of the datastore (or renamed within it)
+	   the key of its previous location is reported.
+	 * When the kernel's event queue overflowed, the root key ``/`` is
+	   reported, meaning that any key may have changed.
+	
+	Since paths are mapped back to keys, namespace delimiters (``:``) are
+	reported as regular path separators (``/``) and, unless the datastore is
+	case-sensitive, keys are reported in lower case only.
+	
+	Note that changes made by the current process are reported as well.
+	"""
+	__slots__ = ("_fd", "_ignore", "_pending", "_wds", "object_extension", "root_path")
+	
+	_fd: int
+	_ignore: typing.FrozenSet[pathlib.PurePath]
+	_pending: 'collections.OrderedDict[datastore.Key, None]'
+	_wds: typing.Dict[int, pathlib.PurePath]
+	object_extension: str
+	root_path: pathlib.PurePath
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, root: typing.Union[os_PathLike_str, str], *,
+	                 object_extension: str = ".data",
+	                 ignore: typing.Iterable[pathlib.PurePath] = ()) -> 'FileSystemWatcher':
+		"""Starts watching the directory tree at *root* for changes
+		
+		Arguments
+		---------
+		root
+			The datastore root directory to watch
+		object_extension
+			The file extension of the files that store values; all other
+			files are ignored
+		ignore
+			Paths of object files (relative to *root*) that should not be
+			reported, such as the datastore's stats file
+		
+		Raises
+		------
+		NotImplementedError
+			The current platform does not support ``inotify(7)``
+		"""
+		self = cls(_create_call=True)
+		self.root_path        = pathlib.PurePath(root)
+		self.object_extension = object_extension
+		self._ignore          = frozenset(ignore)
+		self._pending         = collections.OrderedDict()
+		self._wds             = {}
+		
+		self._fd = inotify.init1()
+		try:
+			await trio.to_thread.run_sync(self._add_tree_sync, pathlib.PurePath(), False)
+		except BaseException:
+			os.close(self._fd)
+			raise
+		return self
+	
+	
+	def __init__(self, *, _create_call: bool = False):
+		assert _create_call, "Use `await FileSystemWatcher.create(…)` to create instances"
+		self._fd = -1
+	
+	
+	def _add_tree_sync(self, relpath: pathlib.PurePath, report: bool) -> None:
+		"""Starts watching the directory at *relpath* and all its
+		sub-directories, optionally reporting all values found within them
+		
+		Watches must be added before listing the directory to not miss any
+		files created while scanning it.
+		"""
+		for dirpath, dirnames, filenames in os.walk(self.root_path / relpath):
+			dir_relpath = pathlib.PurePath(dirpath).relative_to(self.root_path)
+			try:
+				wd = inotify.add_watch(self._fd, dirpath, _WATCH_MASK)
+			except (FileNotFoundError, NotADirectoryError):
+				dirnames.clear()  # Removed while walking the tree
+				continue
+			self._wds[wd] = dir_relpath
+			
+			if report:
+				for filename in filenames:
+					self._report(dir_relpath / filename)
+	
+	
+	def _drop_tree(self, relpath: pathlib.PurePath) -> None:
+		"""Stops watching the directory at *relpath* and all its
+		sub-directories after it has been moved away"""
+		for wd, path in list(self._wds.items()):
+			if path == relpath or relpath in path.parents:
+				inotify.rm_watch(self._fd, wd)
+				del self._wds[wd]
+	
+	
+	def _report(self, relpath: pathlib.PurePath, *, subtree: bool = False) -> None:
+		if not subtree:
+			if not relpath.name.endswith(self.object_extension) or relpath in self._ignore:
+				return
+			
+			# Temporary files used while writing values are never reported
+			if relpath.name.startswith(".") and not relpath.name.startswith(".new-"):
+				return
+			
+			name_len = len(relpath.name) - len(self.object_extension)
+			relpath = relpath.with_name(relpath.name[:name_len])
+		
+		key = datastore.Key("/" + relpath.as_posix()) if relpath.parts else datastore.Key("/")
+		self._pending.pop(key, None)
+		self._pending[key] = None
+	
+	
+	async def _process_events(self, events: typing.List[inotify.Event]) -> None:
+		for event in events:
+			if event.mask & inotify.Mask.Q_OVERFLOW:
+				self._report(pathlib.PurePath(), subtree=True)
+				continue
+			
+			dir_relpath = self._wds.get(event.wd)
+			if dir_relpath is None:
+				continue  # Watch was removed in the meantime
+			
+			if event.mask & inotify.Mask.IGNORED:
+				del self._wds[event.wd]
+				continue
+			
+			relpath = dir_relpath / os.fsdecode(event.name)
+			if event.mask & inotify.Mask.ISDIR:
+				if event.mask & (inotify.Mask.CREATE | inotify.Mask.MOVED_TO):
+					await trio.to_thread.run_sync(self._add_tree_sync, relpath, True)
+				elif event.mask & inotify.Mask.MOVED_FROM:
+					self._drop_tree(relpath)
+					self._report(relpath, subtree=True)
+			elif event.mask & _FILE_MASK:
+				self._report(relpath)
+	
+	
+	async def receive(self) -> datastore.Key:
+		"""Waits for the next changed key to become available
+		
+		Raises
+		------
+		trio.ClosedResourceError
+			This watcher was closed
+		"""
+		while not self._pending:
+			if self._fd < 0:
+				raise trio.ClosedResourceError()
+			
+			await trio.lowlevel.wait_readable(self._fd)
+			try:
+				buf = os.read(self._fd, _READ_SIZE)
+			except BlockingIOError:
+				continue
+			await self._process_events(list(inotify.parse_events(buf)))
+		
+		key, _ = self._pending.popitem(last=False)
+		return key
+	
+	
+	async def aclose(self) -> None:
+		if self._fd < 0:
+			return
+		
+		fd, self._fd = self._fd, -1
+		trio.lowlevel.notify_closing(fd)
+		os.close(fd)
+		await trio.lowlevel.checkpoint()
@@ -0,0 +1,8 @@
+"""Log-structured merge-tree datastore implementation"""
+__version__ = "1.0"
+__author__ = "Juan Batiz-Benet, Alexander Schlarb"
+__email__ = "juan@benet.ai, alexander@ninetailed.ninja"
+
+__all__ = ("LSMDatastore",)
+
+from .lsm import LSMDatastore
@@ -0,0 +1,1378 @@
+import bisect
+import copy
+import heapq
+import itertools
+import json
+import os
+import pathlib
+import struct
+import typing
+import uuid
+import zlib
+
+import trio
+
+import datastore
+import datastore.abc
+import datastore.util
+from datastore.core.util.bloom import CountingBloomFilter
+from datastore.core.util.fileio import fdatasync, fsync_dir, pwrite_all, run_blocking_nointr
+
+try:
+	import fcntl
+except ImportError:  #PY: Windows
+	fcntl = None  # type: ignore[assignment]
+
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+
+DEFAULT_MEMTABLE_SIZE = 4 * 1024 * 1024
+DEFAULT_SEGMENT_SIZE  = 4 * 1024 * 1024
+DEFAULT_BLOCK_SIZE    = 4 * 1024
+DEFAULT_LEVEL0_LIMIT  = 4
+DEFAULT_LEVEL_SIZE    = 16 * 1024 * 1024
+DEFAULT_LEVEL_RATIO   = 10
+
+# Number of frozen memtables that may wait for being written out before
+# writes are blocked
+MAX_IMMUTABLE_MEMTABLES = 2
+
+# False positive rate of the Bloom filter stored with each segment file
+BLOOM_ERROR_RATE = 0.01
+
+LOCK_NAME     = "LOCK"
+MANIFEST_NAME = "MANIFEST"
+
+# Write-ahead log records consist of this header, followed by the key and
+# the value:
+#  * CRC32 of everything following the CRC field itself
+#  * value size (`TOMBSTONE` for records marking the key as deleted)
+#  * key size
+_WAL_RECORD = struct.Struct("<IIH")
+
+# Segment files are made of blocks of entries sorted by key, each entry
+# consisting of this header followed by the key and the value:
+#  * value size (`TOMBSTONE` for records marking the key as deleted)
+#  * key size
+#
+# Each block is followed by a CRC32 of the block.
+_ENTRY = struct.Struct("<IH")
+_BLOCK_CRC = struct.Struct("<I")
+
+# The blocks are followed by the sparse index, starting with the size and
+# contents of the last key of the segment, then listing the offset, length
+# and first key size of each block (followed by the key)
+_LAST_KEY = struct.Struct("<H")
+_INDEX_ENTRY = struct.Struct("<QIH")
+
+# The sparse index is followed by the serialized Bloom filter of all keys
+# and finally this footer:
+#  * offset of the sparse index
+#  * size of the sparse index
+#  * size of the Bloom filter
+#  * CRC32 of the sparse index and the Bloom filter
+#  * magic
+_FOOTER = struct.Struct("<QQQI8s")
+_MAGIC = b"\x89DSLSM\r\n"
+
+TOMBSTONE = 0xFFFFFFFF
+MAX_KEY_SIZE   = 0xFFFF
+MAX_VALUE_SIZE = TOMBSTONE - 1
+
+
+
+def encode_key(key: datastore.Key) -> bytes:
+	"""Returns the on-disk representation of *key*
+	
+	Namespace separators are replaced by NUL bytes, so that comparing the
+	encoded keys bytewise yields the same order as comparing the keys
+	themselves (:class:`datastore.Key` compares its list of namespaces).
+	"""
+	return str(key).replace("/", "\x00").encode("utf-8")
+
+
+def decode_key(data: bytes) -> datastore.Key:
+	"""Returns the key represented by the on-disk *data*"""
+	return datastore.Key(data.decode("utf-8").replace("\x00", "/"))
+
+
+def key_range(prefix: datastore.Key, start: typing.Optional[datastore.Key],
+              stop: typing.Optional[datastore.Key]) -> typing.Tuple[bytes, bytes]:
+	"""Returns the range of encoded keys below *prefix* that are at least
+	*start* and less than *stop*"""
+	if str(prefix) == "/":
+		lower, upper = b"", b"\xff"
+	else:
+		lower = encode_key(prefix) + b"\x00"
+		upper = encode_key(prefix) + b"\x01"
+	if start is not None:
+		lower = max(lower, encode_key(start))
+	if stop is not None:
+		upper = min(upper, encode_key(stop))
+	return lower, upper
+
+
+def parse_block(data: bytes) -> typing.List[typing.Tuple[bytes, typing.Optional[bytes]]]:
+	"""Returns the ``(key, value)`` entries of the given block
+	
+	Raises
+	------
+	RuntimeError
+		The block was found to be corrupted
+	"""
+	end = len(data) - _BLOCK_CRC.size
+	if end < 0 or zlib.crc32(memoryview(data)[:end]) != _BLOCK_CRC.unpack_from(data, end)[0]:
+		raise RuntimeError("Segment file block is corrupted")
+	
+	entries: typing.List[typing.Tuple[bytes, typing.Optional[bytes]]] = []
+	pos = 0
+	while pos < end:
+		size, key_size = _ENTRY.unpack_from(data, pos)
+		pos += _ENTRY.size
+		key = data[pos:(pos + key_size)]
+		pos += key_size
+		if size == TOMBSTONE:
+			entries.append((key, None))
+		else:
+			entries.append((key, data[pos:(pos + size)]))
+			pos += size
+	return entries
+
+
+class _Aborted(Exception):
+	"""Raised when the datastore is closed during compaction"""
+
+
+class _Memtable:
+	"""Sorted in-memory table of the latest writes and the write-ahead log
+	files that hold them"""
+	__slots__ = ("items", "keys", "size", "wal_ids", "wal_fd", "wal_size")
+	
+	items: typing.Dict[bytes, typing.Optional[bytes]]
+	keys: typing.List[bytes]
+	size: int
+	wal_ids: typing.List[int]
+	wal_fd: typing.Optional[int]
+	wal_size: int
+	
+	def __init__(self) -> None:
+		self.items    = {}
+		self.keys     = []
+		self.size     = 0
+		self.wal_ids  = []
+		self.wal_fd   = None
+		self.wal_size = 0
+	
+	def apply(self, key: bytes, value: typing.Optional[bytes]) -> None:
+		if key not in self.items:
+			bisect.insort(self.keys, key)
+		self.items[key] = value
+	
+	def range(self, lower: bytes, upper: bytes) \
+	    -> typing.List[typing.Tuple[bytes, typing.Optional[bytes]]]:
+		"""Returns a snapshot of all entries in the given key range"""
+		keys = self.keys[bisect.bisect_left(self.keys, lower):bisect.bisect_left(self.keys, upper)]
+		return [(key, self.items[key]) for key in keys]
+
+
+class _Segment:
+	"""An open, immutable segment file with its sparse index and Bloom filter"""
+	__slots__ = ("id", "fd", "size", "first_keys", "blocks", "last_key", "bloom",
+	             "refs", "retired")
+	
+	id: int
+	fd: int
+	size: int
+	first_keys: typing.List[bytes]
+	blocks: typing.List[typing.Tuple[int, int]]
+	last_key: bytes
+	bloom: CountingBloomFilter
+	refs: int
+	retired: bool
+	
+	def __init__(self, id: int, fd: int, size: int, first_keys: typing.List[bytes],
+	             blocks: typing.List[typing.Tuple[int, int]], last_key: bytes,
+	             bloom: CountingBloomFilter) -> None:
+		self.id         = id
+		self.fd         = fd
+		self.size       = size
+		self.first_keys = first_keys
+		self.blocks     = blocks
+		self.last_key   = last_key
+		self.bloom      = bloom
+		self.refs       = 0
+		self.retired    = False
+	
+	@classmethod
+	def open(cls, path: str, id: int) -> '_Segment':
+		"""Opens the segment file at *path* and reads its sparse index and
+		Bloom filter
+		
+		Raises
+		------
+		RuntimeError
+			The segment file is damaged
+		"""
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			size = os.fstat(fd).st_size
+			if size < _FOOTER.size:
+				raise RuntimeError(f"Segment file {path} is truncated")
+			index_offset, index_size, bloom_size, crc, magic = \
+				_FOOTER.unpack(os.pread(fd, _FOOTER.size, size - _FOOTER.size))
+			meta = os.pread(fd, index_size + bloom_size, index_offset)
+			if magic != _MAGIC or len(meta) != index_size + bloom_size or zlib.crc32(meta) != crc:
+				raise RuntimeError(f"Segment file {path} is damaged")
+			
+			key_size, = _LAST_KEY.unpack_from(meta, 0)
+			last_key = meta[_LAST_KEY.size:(_LAST_KEY.size + key_size)]
+			
+			first_keys: typing.List[bytes] = []
+			blocks: typing.List[typing.Tuple[int, int]] = []
+			pos = _LAST_KEY.size + key_size
+			while pos < index_size:
+				offset, length, key_size = _INDEX_ENTRY.unpack_from(meta, pos)
+				pos += _INDEX_ENTRY.size
+				first_keys.append(meta[pos:(pos + key_size)])
+				blocks.append((offset, length))
+				pos += key_size
+			
+			bloom = CountingBloomFilter.from_bytes(meta[index_size:])
+			return cls(id, fd, size, first_keys, blocks, last_key, bloom)
+		except BaseException:
+			os.close(fd)
+			raise
+	
+	def block_for(self, key: bytes) -> typing.Optional[int]:
+		"""Returns the index of the only block that may contain *key*"""
+		if not self.first_keys or key < self.first_keys[0] or key > self.last_key:
+			return None
+		return bisect.bisect_right(self.first_keys, key) - 1
+	
+	def overlaps(self, lower: bytes, upper: bytes) -> bool:
+		"""Returns whether this segment may contain keys between *lower* and
+		*upper* (inclusive)"""
+		return bool(self.first_keys) and self.first_keys[0] <= upper and lower <= self.last_key
+	
+	def read_block_sync(self, idx: int) -> typing.List[typing.Tuple[bytes, typing.Optional[bytes]]]:
+		offset, length = self.blocks[idx]
+		return parse_block(os.pread(self.fd, length, offset))
+	
+	def iter_sync(self) -> typing.Iterator[typing.Tuple[bytes, typing.Optional[bytes]]]:
+		for idx in range(len(self.blocks)):
+			yield from self.read_block_sync(idx)
+
+
+class _SegmentWriter:
+	"""Writes sorted entries to a new segment file"""
+	__slots__ = ("path", "block_size", "file", "block", "keys", "first_keys", "index", "offset")
+	
+	path: str
+	block_size: int
+	file: typing.BinaryIO
+	block: bytearray
+	keys: typing.List[bytes]
+	first_keys: typing.List[bytes]
+	index: bytearray
+	offset: int
+	
+	def __init__(self, path: str, block_size: int) -> None:
+		self.path       = path
+		self.block_size = block_size
+		self.file       = open(path + ".tmp", "xb")
+		self.block      = bytearray()
+		self.keys       = []
+		self.first_keys = []
+		self.index      = bytearray()
+		self.offset     = 0
+	
+	def add(self, key: bytes, value: typing.Optional[bytes]) -> None:
+		if not self.block:
+			self.first_keys.append(key)
+		self.block += _ENTRY.pack(len(value) if value is not None else TOMBSTONE, len(key))
+		self.block += key
+		if value is not None:
+			self.block += value
+		self.keys.append(key)
+		
+		if len(self.block) >= self.block_size:
+			self._write_block()
+	
+	def _write_block(self) -> None:
+		self.block += _BLOCK_CRC.pack(zlib.crc32(self.block))
+		self.file.write(self.block)
+		self.index += _INDEX_ENTRY.pack(self.offset, len(self.block), len(self.first_keys[-1]))
+		self.index += self.first_keys[-1]
+		self.offset += len(self.block)
+		self.block.clear()
+	
+	def finish(self) -> None:
+		"""Writes the sparse index, the Bloom filter and the footer and moves
+		the segment file into place"""
+		if self.block:
+			self._write_block()
+		self.index[0:0] = _LAST_KEY.pack(len(self.keys[-1])) + self.keys[-1]
+		
+		bloom = CountingBloomFilter(len(self.keys), BLOOM_ERROR_RATE)
+		for key in self.keys:
+			bloom.add(key)
+		meta = bytes(self.index) + bloom.to_bytes()
+		
+		self.file.write(meta)
+		self.file.write(_FOOTER.pack(self.offset, len(self.index), len(meta) - len(self.index),
+		                             zlib.crc32(meta), _MAGIC))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.file.close()
+		os.rename(self.path + ".tmp", self.path)
+	
+	def abort(self) -> None:
+		self.file.close()
+		os.unlink(self.path + ".tmp")
+
+
+class _Write:
+	"""A single put, delete or rename waiting to be logged"""
+	__slots__ = ("key", "value", "source", "create", "replace", "done", "error")
+	
+	key: datastore.Key
+	value: typing.Optional[bytes]
+	source: typing.Optional[datastore.Key]
+	create: bool
+	replace: bool
+	done: bool
+	error: typing.Optional[BaseException]
+	
+	def __init__(self, key: datastore.Key, value: typing.Optional[bytes], *,
+	             source: typing.Optional[datastore.Key] = None,
+	             create: bool = True, replace: bool = True) -> None:
+		self.key     = key
+		self.value   = value
+		self.source  = source
+		self.create  = create
+		self.replace = replace
+		self.done    = False
+		self.error   = None
+
+
+class LSMDatastore(datastore.abc.BinaryDatastore):
+	"""Log-structured merge-tree datastore with ordered range scans
+	
+	Writes are appended to a write-ahead log below *root* and applied to a
+	sorted in-memory table (“memtable”). Once the memtable exceeds
+	*memtable_size* it is frozen and written out in the background as an
+	immutable segment file of sorted blocks, followed by a sparse index
+	(listing the first key of each block) and a Bloom filter of all keys, so
+	that looking up a key reads at most one block of each segment file that
+	may contain it.
+	
+	Segment files are organized in levels: freshly written ones are placed in
+	level 0, where their key ranges may overlap. Once level 0 holds
+	*level0_limit* segment files, they are merged with the overlapping
+	segment files of level 1 in the background. Each deeper level holds
+	non-overlapping segment files of about *segment_size* bytes and may grow
+	to *level_ratio* times the size of the previous one (*level_size* bytes
+	for level 1), after which one of its segment files is merged into the
+	next level. Deletions are recorded as tombstones that are only dropped
+	once they reach the deepest level.
+	
+	Keys are stored so that sorting them bytewise yields :class:`datastore.Key`
+	order, which allows :meth:`keys` and :meth:`items` to efficiently list the
+	values below some prefix (optionally restricted to some range of keys) in
+	order, by lazily merging the memtables and segment files.
+	
+	Which segment files belong to which level is recorded in a manifest file,
+	which is replaced atomically each time it changes. Writes are only
+	guaranteed to be durable after :meth:`flush` or if *sync* is enabled.
+	"""
+	
+	root_path: pathlib.PurePath
+	memtable_size: int
+	segment_size: int
+	block_size: int
+	level0_limit: int
+	level_size: int
+	level_ratio: int
+	sync: bool
+	
+	_memtable: _Memtable
+	_immutable: typing.List[_Memtable]
+	_levels: typing.List[typing.List[_Segment]]
+	_compact_pointers: typing.Dict[int, bytes]
+	_flushed_wal: int
+	_ids: typing.Iterator[int]
+	_lock_fd: typing.Optional[int]
+	
+	_queue: typing.List[_Write]
+	_write_lock: trio.Lock
+	_manifest_lock: trio.Lock
+	_flush_lock: trio.Lock
+	_compact_lock: trio.Lock
+	_flushed: trio.Event
+	_flushing: bool
+	_compacting: bool
+	_background_error: typing.Optional[BaseException]
+	_closed: bool
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, root: typing.Union[os_PathLike_str, str], *,
+	                 memtable_size: int = DEFAULT_MEMTABLE_SIZE,
+	                 segment_size: int = DEFAULT_SEGMENT_SIZE,
+	                 block_size: int = DEFAULT_BLOCK_SIZE,
+	                 level0_limit: int = DEFAULT_LEVEL0_LIMIT,
+	                 level_size: int = DEFAULT_LEVEL_SIZE,
+	                 level_ratio: int = DEFAULT_LEVEL_RATIO,
+	                 sync: bool = False) -> 'LSMDatastore':
+		"""Opens the datastore stored in the directory *root*, creating it if
+		it does not exist yet
+		
+		Arguments
+		---------
+		root
+			A path at which to store the files of this datastore
+		memtable_size
+			The size (in bytes of log records) after which the memtable is
+			written out to a segment file
+		segment_size
+			The size at which segment files created by compaction are split
+		block_size
+			The size of the blocks of a segment file, the unit in which values
+			are read and indexed
+		level0_limit
+			The number of segment files in level 0 at which they are merged
+			into level 1
+		level_size
+			The maximum total size of the segment files of level 1
+		level_ratio
+			The factor by which the maximum size of each following level grows
+		sync
+			Call ``fdatasync(2)`` after each write to the write-ahead log, so
+			that values are durable once :meth:`put` returns
+		
+		Raises
+		------
+		RuntimeError
+			The datastore at *root* is already opened by another process or
+			one of its segment files is damaged
+		"""
+		if not root:
+			raise ValueError('root path must not be empty (use \'.\' for current directory)')
+		
+		# Ensure target directory exists
+		await trio.Path(root).mkdir(parents=True, exist_ok=True)
+		
+		# Create instance
+		self = cls(_create_call=True)
+		
+		# Do the usual constructor stuff
+		self.root_path     = pathlib.PurePath(root)
+		self.memtable_size = memtable_size
+		self.segment_size  = segment_size
+		self.block_size    = block_size
+		self.level0_limit  = level0_limit
+		self.level_size    = level_size
+		self.level_ratio   = level_ratio
+		self.sync          = bool(sync)
+		
+		self._immutable        = []
+		self._levels           = [[]]
+		self._compact_pointers = {}
+		self._flushed_wal      = -1
+		self._lock_fd          = None
+		
+		self._queue            = []
+		self._write_lock       = trio.Lock()
+		self._manifest_lock    = trio.Lock()
+		self._flush_lock       = trio.Lock()
+		self._compact_lock     = trio.Lock()
+		self._flushed          = trio.Event()
+		self._flushing         = False
+		self._compacting       = False
+		self._background_error = None
+		self._closed           = False
+		
+		try:
+			await run_blocking_nointr(self._load_sync)
+		except BaseException:
+			self._close_sync()
+			raise
+		
+		self._maybe_compact()
+		return self
+	
+	
+	def __init__(self, *, _create_call: bool = False):
+		assert _create_call, "Use LSMDatastore.create(…) for instance creation"
+	
+	
+	# files
+	
+	
+	def _path(self, id: int, suffix: str) -> str:
+		return os.fspath(self.root_path / f"{id:016x}{suffix}")
+	
+	
+	def _load_sync(self) -> None:
+		"""Locks the datastore directory, opens the segment files listed in
+		the manifest and replays the write-ahead logs"""
+		self._lock_fd = os.open(self.root_path / LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o666)
+		if fcntl is not None:
+			try:
+				fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError as exc:
+				raise RuntimeError(f"Datastore at \"{self.root_path}\" is already in use") from exc
+		
+		levels: typing.List[typing.List[int]] = [[]]
+		try:
+			with open(self.root_path / MANIFEST_NAME, "rb") as file:
+				manifest = json.loads(file.read())
+			levels = manifest["levels"]
+			self._flushed_wal = manifest["flushed_wal"]
+		except FileNotFoundError:
+			pass
+		
+		# Remove files left behind by interrupted flushes and compactions
+		live = set(itertools.chain.from_iterable(levels))
+		wal_ids: typing.List[int] = []
+		max_id = self._flushed_wal
+		for name in os.listdir(self.root_path):
+			if name.endswith(".tmp"):
+				os.unlink(self.root_path / name)
+			elif name.endswith(".sst") or name.endswith(".wal"):
+				id = int(name[:-4], 16)
+				max_id = max(max_id, id)
+				if name.endswith(".sst") and id not in live:
+					os.unlink(self.root_path / name)
+				elif name.endswith(".wal"):
+					if id <= self._flushed_wal:
+						os.unlink(self.root_path / name)
+					else:
+						wal_ids.append(id)
+		self._ids = itertools.count(max_id + 1)
+		
+		self._levels = [[_Segment.open(self._path(id, ".sst"), id) for id in level] for level in levels]
+		
+		# Replay the write-ahead logs of all memtables that were not written out
+		self._memtable = _Memtable()
+		for id in sorted(wal_ids):
+			with open(self._path(id, ".wal"), "rb") as file:
+				data = file.read()
+			pos = 0
+			while pos + _WAL_RECORD.size <= len(data):
+				crc, size, key_size = _WAL_RECORD.unpack_from(data, pos)
+				end = pos + _WAL_RECORD.size + key_size + (size if size != TOMBSTONE else 0)
+				if end > len(data) or zlib.crc32(data[(pos + 4):end]) != crc:
+					break  # Interrupted append
+				key = data[(pos + _WAL_RECORD.size):(pos + _WAL_RECORD.size + key_size)]
+				value = data[(end - size):end] if size != TOMBSTONE else None
+				self._memtable.apply(key, value)
+				pos = end
+			self._memtable.size += pos
+			self._memtable.wal_ids.append(id)
+		self._open_wal_sync(self._memtable)
+	
+	
+	def _open_wal_sync(self, memtable: _Memtable) -> None:
+		id = next(self._ids)
+		memtable.wal_fd = os.open(self._path(id, ".wal"), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+		memtable.wal_ids.append(id)
+	
+	
+	def _manifest(self) -> bytes:
+		return json.dumps({
+			"levels": [[segment.id for segment in level] for level in self._levels],
+			"flushed_wal": self._flushed_wal,
+		}).encode("utf-8")
+	
+	
+	def _write_manifest_sync(self, data: bytes) -> None:
+		path = self.root_path / MANIFEST_NAME
+		with open(os.fspath(path) + ".tmp", "wb") as file:
+			file.write(data)
+			file.flush()
+			os.fsync(file.fileno())
+		os.replace(os.fspath(path) + ".tmp", path)
+		
+		fsync_dir(self.root_path)
+	
+	
+	async def _update_manifest(self, update: typing.Callable[[], None]) -> None:
+		"""Applies *update* to the in-memory state and persists the result"""
+		async with self._manifest_lock:
+			update()
+			data = self._manifest()
+			with trio.CancelScope(shield=True):
+				await run_blocking_nointr(self._write_manifest_sync, data)
+	
+	
+	def _remove_files_sync(self, paths: typing.List[str]) -> None:
+		for path in paths:
+			try:
+				os.unlink(path)
+			except FileNotFoundError:
+				pass
+	
+	
+	def _close_sync(self) -> None:
+		for memtable in itertools.chain([getattr(self, "_memtable", None)], self._immutable):
+			if memtable is not None and memtable.wal_fd is not None:
+				os.close(memtable.wal_fd)
+				memtable.wal_fd = None
+		for segment in itertools.chain.from_iterable(self._levels):
+			os.close(segment.fd)
+		self._levels = [[]]
+		if self._lock_fd is not None:
+			os.close(self._lock_fd)
+			self._lock_fd = None
+	
+	
+	def _acquire(self, segments: typing.Iterable[_Segment]) -> typing.List[_Segment]:
+		segments = list(segments)
+		for segment in segments:
+			segment.refs += 1
+		return segments
+	
+	
+	def _release(self, segments: typing.Iterable[_Segment]) -> None:
+		for segment in segments:
+			segment.refs -= 1
+			if segment.retired and segment.refs == 0:
+				os.close(segment.fd)
+	
+	
+	def _retire(self, segments: typing.Iterable[_Segment]) -> None:
+		for segment in segments:
+			segment.retired = True
+			if segment.refs == 0:
+				os.close(segment.fd)
+	
+	
+	# writing
+	
+	
+	def _append_wal_sync(self, memtable: _Memtable,
+	                     records: typing.List[typing.Tuple[bytes, typing.Optional[bytes]]]) -> int:
+		"""Appends the given ``(key, value)`` records to the write-ahead log of
+		*memtable* and returns the number of bytes written"""
+		assert memtable.wal_fd is not None
+		
+		buffer = bytearray()
+		for key, value in records:
+			header = _WAL_RECORD.pack(0, len(value) if value is not None else TOMBSTONE, len(key))
+			crc = zlib.crc32(key, zlib.crc32(header[4:]))
+			if value is not None:
+				crc = zlib.crc32(value, crc)
+			buffer += _BLOCK_CRC.pack(crc) + header[4:] + key
+			if value is not None:
+				buffer += value
+		
+		try:
+			pwrite_all(memtable.wal_fd, buffer, memtable.wal_size)
+			if self.sync:
+				fdatasync(memtable.wal_fd)
+		except BaseException:
+			# Do not leave a partial record behind
+			os.ftruncate(memtable.wal_fd, memtable.wal_size)
+			raise
+		return len(buffer)
+	
+	
+	async def _commit(self, writes: typing.List[_Write]) -> None:
+		"""Logs and applies the given writes, together with those of any other
+		writes queued in the meantime"""
+		self._queue.extend(writes)
+		try:
+			async with self._write_lock:
+				if not writes[0].done:
+					batch, self._queue = self._queue, []
+					await self._write_batch(batch)
+		except BaseException:
+			# Withdraw the writes if they have not been picked up yet
+			if writes[0] in self._queue:
+				self._queue = [write for write in self._queue if write not in writes]
+			raise
+		
+		for write in writes:
+			if write.error is not None:
+				raise write.error
+	
+	
+	async def _write_batch(self, batch: typing.List[_Write]) -> None:
+		"""Logs and applies all given writes that may be applied, setting the
+		error of all others"""
+		try:
+			if self._closed:
+				raise RuntimeError("Datastore has been closed")
+			
+			# Wait for the memtables that are being written out if writes are
+			# coming in faster than they can be written
+			while len(self._immutable) >= MAX_IMMUTABLE_MEMTABLES:
+				if self._closed:
+					raise RuntimeError("Datastore has been closed")
+				if self._background_error is not None:
+					raise copy.copy(self._background_error) from self._background_error
+				await self._flushed.wait()
+			
+			# Decide which writes may be applied (in order) and turn them into records
+			records: typing.List[typing.Tuple[bytes, typing.Optional[bytes]]] = []
+			pending: typing.Dict[bytes, typing.Optional[bytes]] = {}
+			
+			async def lookup(key: bytes) -> typing.Optional[bytes]:
+				if key in pending:
+					return pending[key]
+				return await self._lookup(key)
+			
+			for write in batch:
+				key = encode_key(write.key)
+				if write.source is not None:
+					source = encode_key(write.source)
+					value = await lookup(source)
+					if value is None:
+						write.error = KeyError(write.source)
+						continue
+					if source == key:
+						continue
+					if not write.replace and await lookup(key) is not None:
+						write.error = KeyError(write.key)
+						continue
+					
+					records.append((key, value))
+					records.append((source, None))
+					pending[key]    = value
+					pending[source] = None
+				else:
+					if not write.create or not write.replace:
+						exists = await lookup(key) is not None
+						if (exists and not write.replace) or (not exists and not write.create):
+							write.error = KeyError(write.key)
+							continue
+					
+					records.append((key, write.value))
+					pending[key] = write.value
+			
+			if not records:
+				return
+			
+			memtable = self._memtable
+			written = await run_blocking_nointr(self._append_wal_sync, memtable, records)
+		except Exception as exc:
+			# Raise a copy of the error in each task, since raising the
+			# same exception object from several tasks mangles its traceback
+			for write in batch:
+				if write.error is None:
+					write.error = copy.copy(exc)
+					write.error.__cause__ = exc
+			return
+		finally:
+			for write in batch:
+				write.done = True
+		
+		for key, value in records:
+			memtable.apply(key, value)
+		memtable.wal_size += written
+		memtable.size     += written
+		
+		if memtable.size >= self.memtable_size:
+			await self._freeze_memtable()
+	
+	
+	async def _freeze_memtable(self) -> None:
+		"""Replaces the memtable by a new one and has the old one written out
+		in the background"""
+		memtable = _Memtable()
+		with trio.CancelScope(shield=True):
+			assert self._memtable.wal_fd is not None
+			await run_blocking_nointr(fdatasync, self._memtable.wal_fd)
+			await run_blocking_nointr(self._open_wal_sync, memtable)
+		
+		old_memtable, self._memtable = self._memtable, memtable
+		self._immutable.insert(0, old_memtable)
+		
+		if not self._flushing:
+			self._flushing = True
+			trio.lowlevel.spawn_system_task(self._run_flusher)
+	
+	
+	def _write_segments_sync(
+			self, entries: typing.Iterable[typing.Tuple[bytes, typing.Optional[bytes]]],
+			split_size: typing.Optional[int] = None
+	) -> typing.List[_Segment]:
+		"""Writes the given sorted entries to new segment files, starting a
+		new one each time *split_size* bytes were written, and opens them"""
+		writers: typing.List[typing.Tuple[int, _SegmentWriter]] = []
+		try:
+			for key, value in entries:
+				if self._closed:
+					raise _Aborted()
+				if not writers or (split_size is not None and writers[-1][1].offset >= split_size):
+					if writers:
+						writers[-1][1].finish()
+					id = next(self._ids)
+					writers.append((id, _SegmentWriter(self._path(id, ".sst"), self.block_size)))
+				writers[-1][1].add(key, value)
+			if writers:
+				writers[-1][1].finish()
+			return [_Segment.open(self._path(id, ".sst"), id) for id, _ in writers]
+		except BaseException:
+			for id, writer in writers:
+				if not writer.file.closed:
+					writer.abort()
+				else:
+					self._remove_files_sync([self._path(id, ".sst")])
+			raise
+	
+	
+	async def _run_flusher(self) -> None:
+		try:
+			async with self._flush_lock:
+				while self._immutable and not self._closed:
+					await self._flush_memtable(self._immutable[-1])
+		except _Aborted:
+			pass
+		except Exception as exc:
+			# The error is raised from writes blocking on the flush and from `aclose`
+			self._background_error = exc
+		finally:
+			self._flushing = False
+			self._flushed.set()
+			self._flushed = trio.Event()
+	
+	
+	async def _flush_memtable(self, memtable: _Memtable) -> None:
+		"""Writes out the given immutable memtable as a new level 0 segment
+		file and removes its write-ahead logs"""
+		assert memtable.wal_fd is not None
+		os.close(memtable.wal_fd)
+		memtable.wal_fd = None
+		
+		entries = [(key, memtable.items[key]) for key in memtable.keys]
+		segments = await run_blocking_nointr(self._write_segments_sync, entries)
+		
+		def update() -> None:
+			self._levels[0][0:0] = segments
+			self._immutable.remove(memtable)
+			self._flushed_wal = max(memtable.wal_ids)
+		await self._update_manifest(update)
+		
+		with trio.CancelScope(shield=True):
+			await run_blocking_nointr(
+				self._remove_files_sync, [self._path(id, ".wal") for id in memtable.wal_ids]
+			)
+		
+		self._flushed.set()
+		self._flushed = trio.Event()
+		self._maybe_compact()
+	
+	
+	async def flush(self) -> None:
+		"""Waits for all values written so far to be durably stored on disk
+		
+		This does not write out the memtable, the values are recovered from
+		the write-ahead log when the datastore is opened again. (The logs of
+		frozen memtables are synced when they are frozen.)
+		"""
+		async with self._write_lock:
+			if self._memtable.wal_fd is not None:
+				await run_blocking_nointr(fdatasync, self._memtable.wal_fd)
+	
+	
+	# compaction
+	
+	
+	def _level_limit(self, level: int) -> int:
+		return self.level_size * self.level_ratio ** (level - 1)
+	
+	
+	def _pick_compaction(self) \
+	    -> typing.Optional[typing.Tuple[typing.List[_Segment], int]]:
+		"""Returns the segments to merge and the level to place the result in,
+		if any level exceeds its limit"""
+		if len(self._levels[0]) >= self.level0_limit:
+			sources = list(self._levels[0])
+			lower = min(segment.first_keys[0] for segment in sources)
+			upper = max(segment.last_key for segment in sources)
+			if len(self._levels) > 1:
+				sources += [segment for segment in self._levels[1] if segment.overlaps(lower, upper)]
+			return sources, 1
+		
+		for level in range(1, len(self._levels)):
+			segments = self._levels[level]
+			if sum(segment.size for segment in segments) <= self._level_limit(level):
+				continue
+			
+			# Pick the segments to merge into the next level round-robin, so
+			# that all keys of the level get their turn eventually
+			pointer = self._compact_pointers.get(level, b"")
+			segment = next((segment for segment in segments if segment.first_keys[0] > pointer), segments[0])
+			self._compact_pointers[level] = segment.last_key
+			
+			sources = [segment]
+			if len(self._levels) > level + 1:
+				sources += [
+					other for other in self._levels[level + 1]
+					if other.overlaps(segment.first_keys[0], segment.last_key)
+				]
+			return sources, level + 1
+		return None
+	
+	
+	def _maybe_compact(self) -> None:
+		if self._compacting or self._closed or self._background_error is not None:
+			return
+		if self._pick_compaction() is None:
+			return
+		
+		self._compacting = True
+		trio.lowlevel.spawn_system_task(self._run_compaction)
+	
+	
+	async def _run_compaction(self) -> None:
+		try:
+			while not self._closed and await self.compact():
+				pass
+		except _Aborted:
+			pass
+		except Exception as exc:
+			# Do not retry automatically, the error is raised from `aclose`
+			self._background_error = exc
+		finally:
+			self._compacting = False
+	
+	
+	def _merge_sync(self, sources: typing.List[_Segment], drop_tombstones: bool) \
+	    -> typing.List[_Segment]:
+		"""Merges the given segments (ordered from newest to oldest) into new
+		segment files"""
+		def ranked(segment: _Segment, rank: int) \
+		    -> typing.Iterator[typing.Tuple[bytes, int, typing.Optional[bytes]]]:
+			for key, value in segment.iter_sync():
+				yield key, rank, value
+		
+		def entries() -> typing.Iterator[typing.Tuple[bytes, typing.Optional[bytes]]]:
+			merged = heapq.merge(*(ranked(segment, rank) for rank, segment in enumerate(sources)))
+			for key, group in itertools.groupby(merged, key=lambda entry: entry[0]):
+				_, _, value = next(group)  # Entry of the newest segment
+				if value is not None or not drop_tombstones:
+					yield key, value
+		
+		return self._write_segments_sync(entries(), self.segment_size)
+	
+	
+	async def compact(self) -> bool:
+		"""Merges the segment files of the first level that exceeds its limit
+		into the next level
+		
+		This runs automatically in the background after segment files were
+		added.
+		
+		Returns whether there was anything to compact.
+		
+		Raises
+		------
+		RuntimeError
+			A segment file was found to be corrupted
+		"""
+		async with self._compact_lock:
+			if self._closed:
+				return False
+			
+			picked = self._pick_compaction()
+			if picked is None:
+				return False
+			sources, target = picked
+			
+			# The sources are ordered from newest to oldest: level 0 segments
+			# are kept in that order and the sources of the target level
+			# follow the others. Since all overlapping segments of the target
+			# level take part, tombstones are only needed to shadow values
+			# of deeper levels.
+			drop_tombstones = not any(self._levels[(target + 1):])
+			
+			self._acquire(sources)
+			try:
+				outputs = await run_blocking_nointr(self._merge_sync, sources, drop_tombstones)
+			finally:
+				self._release(sources)
+			
+			def update() -> None:
+				removed = set(map(id, sources))
+				for level in range(len(self._levels)):
+					self._levels[level] = [segment for segment in self._levels[level]
+					                       if id(segment) not in removed]
+				while len(self._levels) <= target:
+					self._levels.append([])
+				self._levels[target] = sorted(self._levels[target] + outputs,
+				                              key=lambda segment: segment.first_keys[0])
+			await self._update_manifest(update)
+			
+			self._retire(sources)
+			with trio.CancelScope(shield=True):
+				await run_blocking_nointr(
+					self._remove_files_sync, [self._path(segment.id, ".sst") for segment in sources]
+				)
+			return True
+	
+	
+	# reading
+	
+	
+	def _candidates(self, key: bytes) -> typing.List[typing.Tuple[_Segment, int]]:
+		"""Returns the segments (from newest to oldest) and their block that
+		may contain *key*"""
+		candidates: typing.List[typing.Tuple[_Segment, int]] = []
+		for level, segments in enumerate(self._levels):
+			if level > 0:
+				# Deeper levels do not overlap, so at most one segment matters
+				idx = bisect.bisect_right([segment.first_keys[0] for segment in segments], key) - 1
+				segments = segments[idx:(idx + 1)] if idx >= 0 else []
+			for segment in segments:
+				block = segment.block_for(key)
+				if block is not None and key in segment.bloom:
+					candidates.append((segment, block))
+		return candidates
+	
+	
+	async def _lookup(self, key: bytes) -> typing.Optional[bytes]:
+		"""Returns the current value of the encoded *key* or `None` if it does
+		not exist"""
+		for memtable in itertools.chain([self._memtable], self._immutable):
+			if key in memtable.items:
+				return memtable.items[key]
+		
+		candidates = self._candidates(key)
+		segments = self._acquire(segment for segment, _ in candidates)
+		try:
+			for segment, block in candidates:
+				entries = await run_blocking_nointr(segment.read_block_sync, block)
+				idx = bisect.bisect_left(entries, (key,))
+				if idx < len(entries) and entries[idx][0] == key:
+					return entries[idx][1]
+		finally:
+			self._release(segments)
+		return None
+	
+	
+	async def _scan_segment(self, segment: _Segment, lower: bytes, upper: bytes) \
+	      -> typing.AsyncIterator[typing.Tuple[bytes, typing.Optional[bytes]]]:
+		idx = max(bisect.bisect_right(segment.first_keys, lower) - 1, 0)
+		for idx in range(idx, len(segment.blocks)):
+			if segment.first_keys[idx] >= upper:
+				return
+			for key, value in await run_blocking_nointr(segment.read_block_sync, idx):
+				if key >= upper:
+					return
+				if key >= lower:
+					yield key, value
+	
+	
+	async def _scan(self, lower: bytes, upper: bytes) \
+	      -> typing.AsyncIterator[typing.Tuple[bytes, bytes]]:
+		"""Yields the encoded keys and values of all entries between *lower*
+		(inclusive) and *upper* (exclusive) in order"""
+		async def iterate(items: typing.List[typing.Tuple[bytes, typing.Optional[bytes]]]) \
+		      -> typing.AsyncIterator[typing.Tuple[bytes, typing.Optional[bytes]]]:
+			for item in items:
+				yield item
+		
+		# Collect all sources from newest to oldest
+		sources: typing.List[typing.AsyncIterator[typing.Tuple[bytes, typing.Optional[bytes]]]] = []
+		for memtable in itertools.chain([self._memtable], self._immutable):
+			sources.append(iterate(memtable.range(lower, upper)))
+		segments = self._acquire(
+			segment for segment in itertools.chain.from_iterable(self._levels)
+			if segment.overlaps(lower, upper) and lower < upper
+		)
+		sources.extend(self._scan_segment(segment, lower, upper) for segment in segments)
+		
+		try:
+			heap: typing.List[typing.Tuple[bytes, int, typing.Optional[bytes]]] = []
+			for rank, source in enumerate(sources):
+				async for key, value in source:
+					heap.append((key, rank, value))
+					break
+			heapq.heapify(heap)
+			
+			previous: typing.Optional[bytes] = None
+			while heap:
+				key, rank, value = heap[0]
+				async for next_key, next_value in sources[rank]:
+					heapq.heapreplace(heap, (next_key, rank, next_value))
+					break
+				else:
+					heapq.heappop(heap)
+				
+				# Only the entry of the newest source counts for each key
+				if key == previous:
+					continue
+				previous = key
+				if value is not None:
+					yield key, value
+		finally:
+			for source in sources:
+				await source.aclose()  # type: ignore[attr-defined]
+			self._release(segments)
+	
+	
+	# datastore interface
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns the data named by *key* or raises `KeyError` otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		RuntimeError
+			A segment file block was found to be corrupted
+		"""
+		return datastore.util.receive_stream_from(await self.get_all(key))
+	
+	
+	async def get_all(self, key: datastore.Key) -> bytes:
+		"""Returns all the data named by *key* at once or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		RuntimeError
+			A segment file block was found to be corrupted
+		"""
+		value = await self._lookup(encode_key(key))
+		if value is None:
+			raise KeyError(key)
+		return value
+	
+	
+	async def _put(self, key: datastore.Key,  # type: ignore[override]
+	               value: datastore.abc.ReceiveStream, *, create: bool, replace: bool) -> None:
+		"""Stores or replaces the data named by *key* with *value*
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to store at
+		value
+			Some stream yielding the data to store
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		
+		Raises
+		------
+		KeyError
+			The given *key* doesn't exist and *create* is not ``True``.
+		KeyError
+			The given *key* already exists and *replace* is not ``True``.
+		ValueError
+			The given *key* or *value* is too large to be stored
+		"""
+		assert create or replace
+		
+		if len(encode_key(key)) > MAX_KEY_SIZE:
+			raise ValueError(f"Key \"{key}\" is longer than {MAX_KEY_SIZE} bytes")
+		data = await value.collect()
+		if len(data) > MAX_VALUE_SIZE:
+			raise ValueError(f"Value of key \"{key}\" is larger than {MAX_VALUE_SIZE} bytes")
+		
+		await self._commit([_Write(key, data, create=create, replace=replace)])
+	
+	
+	async def put_many(self, items: typing.Iterable[typing.Tuple[datastore.Key, bytes]]) -> None:
+		"""Stores or replaces the data of each of the given ``(key, value)``
+		pairs using a single write to the write-ahead log
+		
+		Arguments
+		---------
+		items
+			The keys and values to store, later items replace earlier ones of
+			the same key
+		
+		Raises
+		------
+		ValueError
+			One of the given keys or values is too large to be stored
+		"""
+		writes = []
+		for key, value in items:
+			if len(encode_key(key)) > MAX_KEY_SIZE:
+				raise ValueError(f"Key \"{key}\" is longer than {MAX_KEY_SIZE} bytes")
+			if len(value) > MAX_VALUE_SIZE:
+				raise ValueError(f"Value of key \"{key}\" is larger than {MAX_VALUE_SIZE} bytes")
+			writes.append(_Write(key, bytes(value)))
+		
+		if writes:
+			await self._commit(writes)
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key  # type: ignore[override]
+	) -> datastore.abc.BinaryDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores the data passed to the returned callback in a new key below *prefix*
+		
+		Arguments
+		---------
+		prefix
+			Key below which to store the given data
+		"""
+		key = prefix.child(str(uuid.uuid4()))
+		
+		async def callback(value: datastore.abc.ReceiveStream) -> None:
+			await self._put(key, value, create=True, replace=False)
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the data named by *key*
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to remove
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		await self._commit([_Write(key, None, create=False)])
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by *key* exists
+		
+		Arguments
+		---------
+		key
+			Key naming the object to check.
+		"""
+		return await self._lookup(encode_key(key)) is not None
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves key *key1* to *key2*
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		
+		Raises
+		------
+		KeyError
+			Key *key1* did not exist in this datastore
+		KeyError
+			Key *key2* already exists in this datastore, but *replace* was not ``True``
+		"""
+		await self._commit([_Write(key2, None, source=key1, replace=replace)])
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the metadata of the data named by *key*, or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		return datastore.util.StreamMetadata(size=len(await self.get_all(key)))
+	
+	
+	async def items(self, prefix: datastore.Key = datastore.Key("/"), *,
+	                start: typing.Optional[datastore.Key] = None,
+	                stop: typing.Optional[datastore.Key] = None) \
+	      -> typing.AsyncIterator[typing.Tuple[datastore.Key, bytes]]:
+		"""Yields the keys and values of all values stored below *prefix* in
+		key order
+		
+		The memtables and segment files are merged lazily, reading one block of
+		each segment file at a time. Values added or removed while iterating
+		may or may not be reported.
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		start
+			Only list keys that sort at or after this key
+		stop
+			Only list keys that sort before this key
+		"""
+		async for key, value in self._scan(*key_range(prefix, start, stop)):
+			yield decode_key(key), value
+	
+	
+	async def keys(self, prefix: datastore.Key = datastore.Key("/"), *,
+	               start: typing.Optional[datastore.Key] = None,
+	               stop: typing.Optional[datastore.Key] = None) \
+	      -> typing.AsyncIterator[datastore.Key]:
+		"""Yields the keys of all values stored below *prefix* in key order
+		
+		See :meth:`items` for details.
+		
+		Arguments
+		---------
+		prefix
+			Key naming the subtree to list
+		start
+			Only list keys that sort at or after this key
+		stop
+			Only list keys that sort before this key
+		"""
+		async for key, _ in self._scan(*key_range(prefix, start, stop)):
+			yield decode_key(key)
+	
+	
+	async def aclose(self) -> None:
+		"""Waits for running writes, flushes and compactions, then closes all
+		files
+		
+		Memtables that were not written out yet are recovered from their
+		write-ahead logs when the datastore is opened again.
+		
+		Raises
+		------
+		RuntimeError
+			The last background flush or compaction failed
+		"""
+		if self._closed:
+			return
+		self._closed = True
+		
+		with trio.CancelScope(shield=True):
+			async with self._write_lock, self._flush_lock, self._compact_lock:
+				if self._memtable.wal_fd is not None:
+					await run_blocking_nointr(fdatasync, self._memtable.wal_fd)
+				self._close_sync()
+		
+		if self._background_error is not None:
+			raise self._background_error
@@ -0,0 +1,8 @@
+"""In-memory datastores persisted to a write-ahead log and snapshots"""
+__version__ = "1.0"
+__author__ = "Juan Batiz-Benet, Alexander Schlarb"
+__email__ = "juan@benet.ai, alexander@ninetailed.ninja"
+
+__all__ = ("PersistentDictDatastore", "PersistentObjectDictDatastore")
+
+from .persistent import PersistentDictDatastore, PersistentObjectDictDatastore
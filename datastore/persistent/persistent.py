@@ -0,0 +1,641 @@
+import mmap
+import os
+import pathlib
+import pickle
+import struct
+import time
+import typing
+import zlib
+
+import trio
+
+import datastore
+import datastore.abc
+import datastore.core.binarystore
+import datastore.core.objectstore
+import datastore.util
+from datastore.core.util.fileio import fdatasync, fsync_dir, run_blocking_nointr, write_all
+
+try:
+	import fcntl
+except ImportError:  #PY: Windows
+	fcntl = None  # type: ignore[assignment]
+
+T = typing.TypeVar("T")
+V = typing.TypeVar("V")
+DS = typing.TypeVar("DS", bound="_Persistence[typing.Any]")
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+	from typing_extensions import Literal as typing_Literal
+else:
+	os_PathLike_str = os.PathLike
+	if hasattr(typing, "Literal"):
+		from typing import Literal as typing_Literal
+	else:
+		from typing import Union as typing_Literal
+
+fsync_t = typing_Literal["always", "interval", "never"]
+
+
+LOCK_NAME = "LOCK"
+SNAPSHOT_NAME = "snapshot"
+LOG_SUFFIX = ".log"
+
+# Log records start with the CRC32 checksum of the rest of the record, the
+# record type and the sizes of the two fields following the header (the key
+# and the value, or the old and the new key)
+_RECORD = struct.Struct("<IBIQ")
+RECORD_PUT    = 1
+RECORD_DELETE = 2
+RECORD_RENAME = 3
+
+# Snapshots start with a header listing the ID of the first log file whose
+# records are not contained in the snapshot and the number of entries, each
+# of which consists of the key size and value size followed by the key and
+# the value; the file ends with the CRC32 checksum of everything before it
+SNAPSHOT_MAGIC = b"\x89DSSNP\r\n"
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<8sIQQ")
+_SNAPSHOT_ENTRY = struct.Struct("<IQ")
+_CHECKSUM = struct.Struct("<I")
+
+# Size of the log buffer at which it is written out without waiting for the
+# next flush interval
+FLUSH_SIZE = 1024 * 1024
+
+# Size of the chunks in which snapshots are written
+SNAPSHOT_BUFFER_SIZE = 1024 * 1024
+
+DEFAULT_FSYNC_INTERVAL = 1.0
+DEFAULT_SNAPSHOT_LOG_SIZE = 64 * 1024 * 1024
+
+
+
+def encode_record(kind: int, field1: bytes, field2: bytes) -> bytes:
+	header = _RECORD.pack(0, kind, len(field1), len(field2))
+	checksum = zlib.crc32(field2, zlib.crc32(field1, zlib.crc32(header[_CHECKSUM.size:])))
+	return _CHECKSUM.pack(checksum) + header[_CHECKSUM.size:] + field1 + field2
+
+
+def iter_records(data: typing.Union[bytes, mmap.mmap]) \
+    -> typing.Iterator[typing.Tuple[int, int, bytes, bytes]]:
+	"""Yields the intact records at the start of *data*, each with the offset
+	at which it ends"""
+	position = 0
+	while position + _RECORD.size <= len(data):
+		checksum, kind, size1, size2 = _RECORD.unpack_from(data, position)
+		start = position + _RECORD.size
+		end = start + size1 + size2
+		if end > len(data):
+			return
+		field1 = data[start:(start + size1)]
+		field2 = data[(start + size1):end]
+		header = data[(position + _CHECKSUM.size):start]
+		if zlib.crc32(field2, zlib.crc32(field1, zlib.crc32(header))) != checksum:
+			return
+		yield end, kind, field1, field2
+		position = end
+
+
+class _Persistence(typing.Generic[V]):
+	"""Write-ahead logging and snapshotting shared by the persistent in-memory
+	datastores
+	
+	Must be mixed into one of the in-memory datastores, whose ``_store`` and
+	``_remove`` methods are extended to log each change.
+	"""
+	
+	root_path: pathlib.PurePath
+	fsync: fsync_t
+	fsync_interval: float
+	snapshot_interval: typing.Optional[float]
+	snapshot_log_size: int
+	
+	_items: typing.Dict[str, V]
+	_lock_fd: typing.Optional[int]
+	_log_id: int
+	_log_fd: typing.Optional[int]
+	_log_size: int
+	_buffer: bytearray
+	_appended: int
+	_written: int
+	_synced: int
+	_last_snapshot: float
+	_flush_lock: trio.Lock
+	_snapshot_lock: trio.Lock
+	_wakeup: trio.Event
+	_background_error: typing.Optional[BaseException]
+	_closed: bool
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls: typing.Type[DS], root: typing.Union[os_PathLike_str, str], *,
+	                 indexed: bool = False,
+	                 fsync: fsync_t = "interval",
+	                 fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+	                 snapshot_interval: typing.Optional[float] = None,
+	                 snapshot_log_size: int = DEFAULT_SNAPSHOT_LOG_SIZE) -> DS:
+		"""Opens the datastore persisted in the directory *root*, creating it if
+		it does not exist yet, and loads all of its values into memory
+		
+		Arguments
+		---------
+		root
+			A path at which to store the snapshot and log files
+		indexed
+			Maintain a sorted index of all keys (see the *indexed* parameter of
+			the in-memory datastores)
+		fsync
+			When to call ``fdatasync(2)`` on the write-ahead log:
+			
+			* ``"always"``: Before each write returns, so that it is durable
+			  once it does (concurrent writes share the same call)
+			* ``"interval"``: Every *fsync_interval* seconds in the background,
+			  so that at most the writes of that interval may be lost
+			* ``"never"``: Leave it to the operating system (the log is still
+			  written every *fsync_interval* seconds)
+		fsync_interval
+			The interval at which the log is written out in the background
+		snapshot_interval
+			The number of seconds after which a new snapshot is written (if
+			anything was logged since the last one)
+		snapshot_log_size
+			The size of the log records written since the last snapshot at which
+			a new snapshot is written
+		
+		Raises
+		------
+		RuntimeError
+			The datastore at *root* is already opened by another process or
+			its snapshot file is damaged
+		"""
+		if not root:
+			raise ValueError('root path must not be empty (use \'.\' for current directory)')
+		if fsync not in ("always", "interval", "never"):
+			raise ValueError(f"Invalid fsync policy: {fsync!r}")
+		
+		# Ensure target directory exists
+		await trio.Path(root).mkdir(parents=True, exist_ok=True)
+		
+		self = cls(indexed=indexed, _create_call=True)  # type: ignore[call-arg]
+		self.root_path         = pathlib.PurePath(root)
+		self.fsync             = fsync
+		self.fsync_interval    = fsync_interval
+		self.snapshot_interval = snapshot_interval
+		self.snapshot_log_size = snapshot_log_size
+		
+		self._lock_fd          = None
+		self._log_fd           = None
+		self._log_size         = 0
+		self._buffer           = bytearray()
+		self._appended         = 0
+		self._written          = 0
+		self._synced           = 0
+		self._last_snapshot    = time.monotonic()
+		self._flush_lock       = trio.Lock()
+		self._snapshot_lock    = trio.Lock()
+		self._wakeup           = trio.Event()
+		self._background_error = None
+		self._closed           = False
+		
+		try:
+			self._set_items(await run_blocking_nointr(self._load_sync))
+		except BaseException:
+			self._close_sync()
+			raise
+		
+		trio.lowlevel.spawn_system_task(self._run_background)
+		return self
+	
+	
+	def _set_items(self, items: typing.Dict[str, V]) -> None:
+		"""Replaces all items of the datastore, updating its counters and index"""
+		raise NotImplementedError()
+	
+	
+	def _encode_value(self, value: V) -> bytes:
+		raise NotImplementedError()
+	
+	
+	def _decode_value(self, data: bytes) -> V:
+		raise NotImplementedError()
+	
+	
+	def _log_path(self, id: int) -> pathlib.PurePath:
+		return self.root_path / f"{id:016x}{LOG_SUFFIX}"
+	
+	
+	def _load_sync(self) -> typing.Dict[str, V]:
+		"""Loads the snapshot, replays the logs written after it and opens a new
+		log file"""
+		self._lock_fd = os.open(self.root_path / LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o666)
+		if fcntl is not None:
+			try:
+				fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError as exc:
+				raise RuntimeError(f"Datastore at \"{self.root_path}\" is already in use") from exc
+		
+		items, first_log = self._read_snapshot_sync()
+		
+		log_ids = sorted(
+			int(name[:-len(LOG_SUFFIX)], 16) for name in os.listdir(self.root_path)
+			if name.endswith(LOG_SUFFIX)
+		)
+		for id in log_ids:
+			if id < first_log:
+				# Left over from a snapshot that was interrupted after being
+				# written
+				os.unlink(self._log_path(id))
+				continue
+			
+			size = self._replay_log_sync(self._log_path(id), items)
+			if size < 1:
+				os.unlink(self._log_path(id))
+			self._log_size += size
+		
+		self._log_id = max(log_ids + [first_log - 1]) + 1
+		self._log_fd = self._open_log_sync(self._log_id)
+		return items
+	
+	
+	def _replay_log_sync(self, path: pathlib.PurePath, items: typing.Dict[str, V]) -> int:
+		"""Applies the records of the log file at *path* to *items* and returns
+		the size of the intact part of the log"""
+		with open(path, "r+b") as file:
+			size = os.fstat(file.fileno()).st_size
+			if size < 1:
+				return 0
+			
+			position = 0
+			with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+				decode = self._decode_value
+				for position, kind, field1, field2 in iter_records(data):
+					if kind == RECORD_PUT:
+						items[field1.decode("utf-8")] = decode(field2)
+					elif kind == RECORD_DELETE:
+						items.pop(field1.decode("utf-8"), None)
+					elif kind == RECORD_RENAME and field1.decode("utf-8") in items:
+						items[field2.decode("utf-8")] = items.pop(field1.decode("utf-8"))
+			
+			if position < size:
+				# Drop partially written records at the end of the log
+				file.truncate(position)
+			return position
+	
+	
+	def _read_snapshot_sync(self) -> typing.Tuple[typing.Dict[str, V], int]:
+		"""Returns the items stored in the snapshot file and the ID of the first
+		log file not contained in it"""
+		try:
+			file = open(self.root_path / SNAPSHOT_NAME, "rb")
+		except FileNotFoundError:
+			return {}, 0
+		
+		with file:
+			size = os.fstat(file.fileno()).st_size
+			if size < _SNAPSHOT_HEADER.size + _CHECKSUM.size:
+				raise RuntimeError(f"Snapshot of datastore at \"{self.root_path}\" is damaged")
+			
+			with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+				magic, version, first_log, count = _SNAPSHOT_HEADER.unpack_from(data)
+				checksum, = _CHECKSUM.unpack_from(data, size - _CHECKSUM.size)
+				with memoryview(data) as view, view[:(size - _CHECKSUM.size)] as body:
+					valid = zlib.crc32(body) == checksum
+				if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or not valid:
+					raise RuntimeError(f"Snapshot of datastore at \"{self.root_path}\" is damaged")
+				
+				items = {}
+				decode = self._decode_value
+				unpack = _SNAPSHOT_ENTRY.unpack_from
+				position = _SNAPSHOT_HEADER.size
+				for _ in range(count):
+					key_size, value_size = unpack(data, position)
+					position += _SNAPSHOT_ENTRY.size
+					key = data[position:(position + key_size)].decode("utf-8")
+					position += key_size
+					items[key] = decode(data[position:(position + value_size)])
+					position += value_size
+				return items, first_log
+	
+	
+	def _open_log_sync(self, id: int) -> int:
+		fd = os.open(self._log_path(id), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o666)
+		fsync_dir(self.root_path)
+		return fd
+	
+	
+	def _close_sync(self) -> None:
+		if self._log_fd is not None:
+			os.close(self._log_fd)
+			self._log_fd = None
+		if self._lock_fd is not None:
+			os.close(self._lock_fd)
+			self._lock_fd = None
+	
+	
+	def _append(self, kind: int, field1: bytes, field2: bytes) -> None:
+		"""Adds a record to the log buffer"""
+		record = encode_record(kind, field1, field2)
+		self._buffer += record
+		self._appended += len(record)
+		if len(self._buffer) >= FLUSH_SIZE:
+			self._wakeup.set()
+	
+	
+	def _store(self, key: str, value: V) -> None:
+		super()._store(key, value)  # type: ignore[misc]
+		self._append(RECORD_PUT, key.encode("utf-8"), self._encode_value(value))
+	
+	
+	def _remove(self, key: str) -> V:
+		value: V = super()._remove(key)  # type: ignore[misc]
+		self._append(RECORD_DELETE, key.encode("utf-8"), b"")
+		return value
+	
+	
+	def _check_open(self) -> None:
+		if self._closed:
+			raise RuntimeError("Datastore has been closed")
+		if self._background_error is not None:
+			raise RuntimeError("Writing the log of the datastore failed") from self._background_error
+	
+	
+	async def _commit(self) -> None:
+		"""Waits for all changes made so far to become durable if required by
+		the fsync policy"""
+		if self.fsync == "always":
+			await self._flush(sync=True)
+	
+	
+	async def _flush(self, *, sync: bool) -> None:
+		"""Writes all buffered log records to the log file, calling
+		``fdatasync(2)`` afterwards if *sync* is set
+		
+		Concurrent callers share the same write.
+		"""
+		target = self._appended
+		async with self._flush_lock:
+			if self._written >= target and (not sync or self._synced >= target):
+				return
+			
+			data, self._buffer = self._buffer, bytearray()
+			end = self._appended
+			assert self._log_fd is not None
+			await run_blocking_nointr(self._write_log_sync, self._log_fd, data, sync)
+			self._written = end
+			if sync:
+				self._synced = end
+			self._log_size += len(data)
+	
+	
+	def _write_log_sync(self, fd: int, data: bytearray, sync: bool) -> None:
+		if data:
+			write_all(fd, data)
+		if sync:
+			fdatasync(fd)
+	
+	
+	async def _run_background(self) -> None:
+		"""Periodically writes out the log buffer and takes snapshots"""
+		try:
+			while not self._closed:
+				with trio.move_on_after(self.fsync_interval):
+					await self._wakeup.wait()
+				self._wakeup = trio.Event()
+				if self._closed:
+					break
+				
+				await self._flush(sync=(self.fsync != "never"))
+				if self._closed:
+					break
+				
+				snapshot_due = self.snapshot_interval is not None and self._log_size > 0 \
+				               and time.monotonic() - self._last_snapshot >= self.snapshot_interval
+				if self._log_size >= self.snapshot_log_size or snapshot_due:
+					await self.snapshot()
+		except Exception as exc:
+			# Do not retry automatically, the error is raised from further
+			# writes and `aclose`
+			self._background_error = exc
+	
+	
+	async def flush(self) -> None:
+		"""Writes out all buffered log records and waits for them to become
+		durable"""
+		self._check_open()
+		await self._flush(sync=True)
+	
+	
+	async def snapshot(self) -> None:
+		"""Writes all values to a new snapshot file, replacing the log files
+		written so far
+		
+		Only the dict of values is copied in the calling task (which does not
+		copy the values themselves), while the snapshot is written on a worker
+		thread. Changes made in the meantime go to a new log file.
+		"""
+		async with self._snapshot_lock:
+			self._check_open()
+			async with self._flush_lock:
+				# Atomically (with regards to other tasks) cut the log and copy
+				# the current state
+				data, self._buffer = self._buffer, bytearray()
+				end = self._appended
+				items = self._items.copy()
+				
+				old_fd, first_log = self._log_fd, self._log_id + 1
+				assert old_fd is not None
+				
+				def rotate() -> int:
+					self._write_log_sync(old_fd, data, True)
+					return self._open_log_sync(first_log)
+				
+				self._log_fd = await run_blocking_nointr(rotate)
+				self._log_id = first_log
+				self._written = self._synced = end
+				self._log_size = 0
+				self._last_snapshot = time.monotonic()
+				os.close(old_fd)
+			
+			await run_blocking_nointr(self._write_snapshot_sync, items, first_log)
+	
+	
+	def _write_snapshot_sync(self, items: typing.Dict[str, V], first_log: int) -> None:
+		tmp_path = self.root_path / (SNAPSHOT_NAME + ".tmp")
+		fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+		try:
+			buffer = bytearray(_SNAPSHOT_HEADER.pack(
+				SNAPSHOT_MAGIC, SNAPSHOT_VERSION, first_log, len(items)
+			))
+			checksum = 0
+			encode = self._encode_value
+			pack = _SNAPSHOT_ENTRY.pack
+			for key, value in items.items():
+				key_bytes = key.encode("utf-8")
+				value_bytes = encode(value)
+				buffer += pack(len(key_bytes), len(value_bytes))
+				buffer += key_bytes
+				buffer += value_bytes
+				if len(buffer) >= SNAPSHOT_BUFFER_SIZE:
+					checksum = zlib.crc32(buffer, checksum)
+					write_all(fd, buffer)
+					buffer.clear()
+			buffer += _CHECKSUM.pack(zlib.crc32(buffer, checksum))
+			write_all(fd, buffer)
+			os.fsync(fd)
+		except BaseException:
+			os.close(fd)
+			os.unlink(tmp_path)
+			raise
+		os.close(fd)
+		
+		os.replace(tmp_path, self.root_path / SNAPSHOT_NAME)
+		fsync_dir(self.root_path)
+		
+		# The logs replaced by the snapshot are no longer needed
+		for name in os.listdir(self.root_path):
+			if name.endswith(LOG_SUFFIX) and int(name[:-len(LOG_SUFFIX)], 16) < first_log:
+				os.unlink(self.root_path / name)
+	
+	
+	async def _put(self, key: datastore.Key, value: typing.Any, *,  # type: ignore[override]
+	               create: bool, replace: bool) -> None:
+		self._check_open()
+		await super()._put(key, value, create=create, replace=replace)  # type: ignore[misc]
+		await self._commit()
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key) -> typing.Any:  # type: ignore[override]
+		self._check_open()
+		key, callback = await super()._put_new_indirect(prefix)  # type: ignore[misc]
+		await self._commit()
+		
+		async def logged_callback(value: typing.Any) -> None:
+			self._check_open()
+			await callback(value)
+			await self._commit()
+		return key, logged_callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		self._check_open()
+		await super().delete(key)  # type: ignore[misc]
+		await self._commit()
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *, replace: bool = True) -> None:
+		"""Moves the value at name *key1* to *key2*, logging only the keys
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		"""
+		self._check_open()
+		if key1 == key2:
+			return
+		
+		key1_str, key2_str = str(key1), str(key2)
+		if key1_str not in self._items:
+			raise KeyError(key1)
+		if not replace and key2_str in self._items:
+			raise KeyError(key2)
+		super()._store(key2_str, super()._remove(key1_str))  # type: ignore[misc]
+		self._append(RECORD_RENAME, key1_str.encode("utf-8"), key2_str.encode("utf-8"))
+		await self._commit()
+	
+	
+	async def aclose(self) -> None:
+		"""Writes out the remaining log records, closes all files and drops the
+		values from memory
+		
+		Raises
+		------
+		RuntimeError
+			Writing the log or a snapshot in the background failed
+		"""
+		if self._closed:
+			return
+		self._closed = True
+		self._wakeup.set()
+		
+		with trio.CancelScope(shield=True):
+			async with self._snapshot_lock:
+				try:
+					if self._background_error is None:
+						await self._flush(sync=True)
+				finally:
+					await run_blocking_nointr(self._close_sync)
+		
+		await super().aclose()  # type: ignore[misc]
+		
+		if self._background_error is not None:
+			raise RuntimeError("Writing the log of the datastore failed") from self._background_error
+
+
+class PersistentDictDatastore(_Persistence[bytes], datastore.core.binarystore.DictDatastore):
+	"""In-memory binary datastore persisted to a write-ahead log and snapshots
+	
+	All values are kept in memory as in :class:`datastore.BinaryDictDatastore`,
+	while each change is also appended to a log file below *root*. Every
+	*snapshot_log_size* bytes of log records (or *snapshot_interval*
+	seconds), the entire contents are written to a compact snapshot file on a
+	worker thread, after which the log files it replaces are removed.
+	
+	On startup, the snapshot is read through a memory mapping and the log
+	records written after it are replayed. How many of the most recent writes
+	may be lost on a crash depends on the *fsync* policy.
+	"""
+	
+	def __init__(self, *, indexed: bool = False, _create_call: bool = False):
+		assert _create_call, "Use PersistentDictDatastore.create(…) for instance creation"
+		super().__init__(indexed=indexed)
+	
+	
+	def _set_items(self, items: typing.Dict[str, bytes]) -> None:
+		self._items = items
+		self._size = sum(map(len, items.values()))
+		if self._index is not None:
+			self._index = datastore.core.util.keyindex.KeyIndex(items)
+	
+	
+	def _encode_value(self, value: bytes) -> bytes:
+		return value
+	
+	
+	def _decode_value(self, data: bytes) -> bytes:
+		return data
+
+
+class PersistentObjectDictDatastore(_Persistence[typing.List[T]],
+                                    datastore.core.objectstore.DictDatastore[T]):
+	"""In-memory object datastore persisted to a write-ahead log and snapshots
+	
+	Works like :class:`PersistentDictDatastore`, with the objects of each
+	value being serialized using :mod:`pickle`. Objects modified in place
+	after being stored are not logged again.
+	"""
+	
+	def __init__(self, *, indexed: bool = False, _create_call: bool = False):
+		assert _create_call, "Use PersistentObjectDictDatastore.create(…) for instance creation"
+		super().__init__(indexed=indexed)
+	
+	
+	def _set_items(self, items: typing.Dict[str, typing.List[T]]) -> None:
+		self._items = items
+		if self._index is not None:
+			self._index = datastore.core.util.keyindex.KeyIndex(items)
+	
+	
+	def _encode_value(self, value: typing.List[T]) -> bytes:
+		return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+	
+	
+	def _decode_value(self, data: bytes) -> typing.List[T]:
+		return typing.cast(typing.List[T], pickle.loads(data))
@@ -0,0 +1,9 @@
+"""Serving datastores to other processes over Unix domain sockets or TCP"""
+__version__ = "1.0"
+__author__ = "Juan Batiz-Benet, Alexander Schlarb"
+__email__ = "juan@benet.ai, alexander@ninetailed.ninja"
+
+__all__ = ("DatastoreServer", "RemoteDatastore")
+
+from .client import RemoteDatastore
+from .server import DatastoreServer
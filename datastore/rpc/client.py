@@ -0,0 +1,539 @@
+import itertools
+import math
+import os
+import typing
+
+import trio
+
+import datastore
+import datastore.abc
+import datastore.util
+
+from . import protocol
+
+__all__ = ("RemoteDatastore",)
+
+
+address_t = typing.Union[str, "os.PathLike[str]", typing.Tuple[str, int]]
+
+DEFAULT_CONNECTIONS = 4
+
+# Maximum payload size of the batch frames sent by `get_many` and `put_many`
+BATCH_SIZE = 1024 * 1024
+
+
+class _Connection:
+	"""A single connection to the server, shared by any number of concurrent
+	requests"""
+	__slots__ = ("stream", "writer", "request_ids", "pending", "error")
+	
+	stream: trio.abc.Stream
+	writer: protocol.FrameWriter
+	request_ids: typing.Iterator[int]
+	pending: typing.Dict[int, trio.MemorySendChannel]
+	error: typing.Optional[BaseException]
+	
+	def __init__(self, stream: trio.abc.Stream):
+		self.stream      = stream
+		self.writer      = protocol.FrameWriter(stream)
+		self.request_ids = itertools.cycle(range(1 << 32))
+		self.pending     = {}
+		self.error       = None
+	
+	
+	def open_request(self) -> typing.Tuple[int, trio.MemoryReceiveChannel]:
+		"""Allocates a request ID and returns it together with the channel
+		that the frames received in response will be delivered to"""
+		if self.error is not None:
+			raise RuntimeError("Connection to datastore server was lost") from self.error
+		
+		request_id = next(self.request_ids)
+		while request_id in self.pending:
+			request_id = next(self.request_ids)
+		
+		# Frames must never be held up by slow consumers, as they would
+		# hold up all other requests sent over the same connection
+		send_channel, receive_channel = trio.open_memory_channel(math.inf)
+		self.pending[request_id] = send_channel
+		return request_id, receive_channel
+	
+	
+	async def cancel_request(self, request_id: int) -> None:
+		"""Stops delivering frames for *request_id* and asks the server to stop
+		processing it"""
+		if self.pending.pop(request_id, None) is not None and self.error is None:
+			try:
+				await self.send(protocol.pack_frame(request_id, protocol.OP_CANCEL))
+			except RuntimeError:
+				pass
+	
+	
+	async def send(self, data: bytes) -> None:
+		try:
+			await self.writer.send(data)
+		except trio.BrokenResourceError as exc:
+			self.fail(exc)
+			raise RuntimeError("Connection to datastore server was lost") from exc
+	
+	
+	async def run_receiver(self) -> None:
+		"""Delivers the frames received from the server to the tasks waiting
+		for them until the connection is closed"""
+		buffer = bytearray()
+		try:
+			while True:
+				frame = await protocol.receive_frame(self.stream, buffer)
+				if frame is None:
+					raise protocol.ProtocolError("Connection closed by datastore server")
+				
+				request_id, code, flags, payload = frame
+				if flags & protocol.FLAG_END:
+					channel = self.pending.pop(request_id, None)
+				else:
+					channel = self.pending.get(request_id)
+				if channel is not None:
+					channel.send_nowait((code, flags, payload))
+		except (protocol.ProtocolError, trio.BrokenResourceError, trio.ClosedResourceError) as exc:
+			self.fail(exc)
+	
+	
+	def fail(self, exc: BaseException) -> None:
+		if self.error is None:
+			self.error = exc
+		for channel in self.pending.values():
+			channel.close()
+		self.pending.clear()
+
+
+class _RemoteStream(datastore.abc.ReceiveStream):
+	"""Receives the body of a value sent by the server"""
+	__slots__ = ("_conn", "_request_id", "_frames", "_buffer", "_done")
+	
+	_conn: _Connection
+	_request_id: int
+	_frames: trio.MemoryReceiveChannel
+	_buffer: bytes
+	_done: bool
+	
+	def __init__(self, conn: _Connection, request_id: int, frames: trio.MemoryReceiveChannel,
+	             **kwargs: typing.Any):
+		self._conn       = conn
+		self._request_id = request_id
+		self._frames     = frames
+		self._buffer     = b""
+		self._done       = False
+		super().__init__(**kwargs)
+	
+	
+	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
+		if not self._buffer:
+			if self._done:
+				await trio.lowlevel.checkpoint()
+				return b""
+			
+			code, flags, payload = await _receive_response(self._conn, self._frames)
+			if code != protocol.OP_DATA:
+				self._done = True
+				_raise_for_status(code, payload, None)
+			self._buffer = payload
+			self._done = bool(flags & protocol.FLAG_END)
+		
+		if max_bytes is None or max_bytes >= len(self._buffer):
+			data, self._buffer = self._buffer, b""
+		else:
+			data, self._buffer = self._buffer[:max_bytes], self._buffer[max_bytes:]
+		return data
+	
+	
+	async def aclose(self) -> None:
+		if not self._done:
+			self._done = True
+			self._buffer = b""
+			await self._conn.cancel_request(self._request_id)
+		await trio.lowlevel.checkpoint()
+
+
+async def _receive_response(conn: _Connection, frames: trio.MemoryReceiveChannel) \
+      -> typing.Tuple[int, int, bytes]:
+	try:
+		return typing.cast(typing.Tuple[int, int, bytes], await frames.receive())
+	except trio.EndOfChannel:
+		raise RuntimeError("Connection to datastore server was lost") from conn.error
+
+
+def _raise_for_status(status: int, payload: bytes, key: typing.Optional[datastore.Key]) -> None:
+	if status == protocol.STATUS_OK:
+		return
+	elif status == protocol.STATUS_KEY_ERROR:
+		raise KeyError(key)
+	elif status == protocol.STATUS_NOT_IMPLEMENTED:
+		raise NotImplementedError()
+	elif status == protocol.STATUS_ERROR:
+		raise RuntimeError(f"Datastore server error: {payload.decode('utf-8', 'replace')}")
+	raise RuntimeError(f"Unexpected response status {status} from datastore server")
+
+
+class RemoteDatastore(datastore.abc.BinaryDatastore):
+	"""Accesses a binary datastore served by :class:`~datastore.rpc.DatastoreServer`
+	in another process
+	
+	Requests are spread over a pool of connections, each of which may carry
+	any number of concurrent requests: Requests are sent without waiting for
+	the responses to earlier ones (pipelining), and the chunks of large values
+	sent and received for different requests are interleaved (multiplexing).
+	Connections that fail are replaced on their next use, while requests in
+	progress on them fail with `RuntimeError`.
+	
+	Since :meth:`datastore_stats` cannot wait for the server, it returns the
+	statistics retrieved when connecting or by the last call to
+	:meth:`refresh_stats`.
+	"""
+	__slots__ = ("address", "_closed", "_connect_lock", "_connections", "_next", "_stats")
+	
+	address: address_t
+	
+	_closed: bool
+	_connections: typing.List[typing.Optional[_Connection]]
+	_connect_lock: trio.Lock
+	_next: int
+	_stats: datastore.util.DatastoreMetadata
+	
+	def __init__(self, address: address_t, *, connections: int = DEFAULT_CONNECTIONS,
+	             _create_call: bool = False):
+		assert _create_call, "Use RemoteDatastore.create(…) for instance creation"
+		if connections < 1:
+			raise ValueError("At least one connection is required")
+		
+		self.address       = address
+		self._closed       = False
+		self._connections  = [None] * connections
+		self._connect_lock = trio.Lock()
+		self._next         = 0
+		self._stats        = datastore.util.DatastoreMetadata()
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, address: address_t, *,
+	                 connections: int = DEFAULT_CONNECTIONS) -> 'RemoteDatastore':
+		"""Connects to the datastore server at *address*
+		
+		Arguments
+		---------
+		address
+			The path of the server's Unix domain socket or a tuple of its host
+			and TCP port
+		connections
+			The number of connections to open
+		
+		Raises
+		------
+		OSError
+			Connecting to the server failed
+		"""
+		self = cls(address, connections=connections, _create_call=True)
+		try:
+			for idx in range(connections):
+				self._connections[idx] = await self._connect()
+			await self.refresh_stats()
+		except BaseException:
+			await self.aclose()
+			raise
+		return self
+	
+	
+	async def _connect(self) -> _Connection:
+		stream: trio.abc.Stream
+		if isinstance(self.address, tuple):
+			stream = await trio.open_tcp_stream(*self.address)
+			stream.setsockopt(trio.socket.IPPROTO_TCP, trio.socket.TCP_NODELAY, True)
+		else:
+			stream = await trio.open_unix_socket(os.fspath(self.address))
+		
+		conn = _Connection(stream)
+		trio.lowlevel.spawn_system_task(conn.run_receiver)
+		return conn
+	
+	
+	async def _connection(self) -> _Connection:
+		"""Returns the next connection of the pool (in round-robin order),
+		reconnecting if it failed"""
+		if self._closed:
+			raise RuntimeError("Datastore has been closed")
+		
+		idx = self._next
+		self._next = (idx + 1) % len(self._connections)
+		
+		conn = self._connections[idx]
+		if conn is None or conn.error is not None:
+			async with self._connect_lock:
+				conn = self._connections[idx]
+				if conn is None or conn.error is not None:
+					if conn is not None:
+						await conn.stream.aclose()
+					conn = self._connections[idx] = await self._connect()
+		return conn
+	
+	
+	async def _request(self, code: int, payload: bytes) \
+	      -> typing.Tuple[_Connection, int, trio.MemoryReceiveChannel]:
+		conn = await self._connection()
+		request_id, frames = conn.open_request()
+		await conn.send(protocol.pack_frame(request_id, code, payload))
+		return conn, request_id, frames
+	
+	
+	async def _call(self, code: int, payload: bytes,
+	                key: typing.Optional[datastore.Key] = None) -> bytes:
+		"""Sends a request and waits for its single-frame response, raising
+		the error reported by the server if any"""
+		conn, request_id, frames = await self._request(code, payload)
+		try:
+			status, _, result = await _receive_response(conn, frames)
+		except BaseException:
+			await conn.cancel_request(request_id)
+			raise
+		_raise_for_status(status, result, key)
+		return result
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns a stream of the value named by `key` as sent by the server or
+		raises `KeyError`
+		
+		Arguments
+		---------
+		key
+			Key naming the value to retrieve
+		"""
+		conn, request_id, frames = await self._request(protocol.OP_GET, protocol.pack_key(key))
+		try:
+			status, _, payload = await _receive_response(conn, frames)
+		except BaseException:
+			await conn.cancel_request(request_id)
+			raise
+		_raise_for_status(status, payload, key)
+		return _RemoteStream(conn, request_id, frames, size=protocol.Reader(payload).size())
+	
+	
+	async def _put(self, key: datastore.Key, value: datastore.abc.ReceiveStream, *,
+	               create: bool, replace: bool) -> None:
+		"""Sends `value` to the server to be stored under the name `key`
+		
+		Arguments
+		---------
+		key
+			Key naming `value`
+		value
+			The value to store
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		"""
+		flags = (protocol.PUT_CREATE if create else 0) | (protocol.PUT_REPLACE if replace else 0)
+		await self._send_value(protocol.OP_PUT, bytes([flags]) + protocol.pack_key(key), value, key)
+	
+	
+	async def _put_new(self, prefix: datastore.Key, value: datastore.abc.ReceiveStream,
+	                   **kwargs: typing.Any) -> datastore.Key:
+		"""Sends `value` to the server to be stored at a new key below *prefix*
+		
+		Arguments
+		---------
+		prefix
+			The key prefix under which to create the target key
+		value
+			The value to store
+		"""
+		result = await self._send_value(protocol.OP_PUT_NEW, protocol.pack_key(prefix), value, prefix)
+		return protocol.Reader(result).key()
+	
+	
+	async def _send_value(self, code: int, payload: bytes, value: datastore.abc.ReceiveStream,
+	                      key: datastore.Key) -> bytes:
+		conn = await self._connection()
+		request_id, frames = conn.open_request()
+		try:
+			async with value:
+				# Read one chunk ahead, so that the last chunk can be marked as
+				# such and small values are sent together with the request
+				data = [protocol.pack_frame(request_id, code, payload)]
+				chunk = await value.receive_some(protocol.CHUNK_SIZE)
+				while True:
+					next_chunk = await value.receive_some(protocol.CHUNK_SIZE) if chunk else b""
+					if not next_chunk:
+						data.append(protocol.pack_frame(request_id, protocol.OP_DATA, chunk,
+						                                protocol.FLAG_END))
+						await conn.send(b"".join(data))
+						break
+					data.append(protocol.pack_frame(request_id, protocol.OP_DATA, chunk))
+					await conn.send(b"".join(data))
+					data.clear()
+					chunk = next_chunk
+			
+			status, _, result = await _receive_response(conn, frames)
+		except BaseException:
+			await conn.cancel_request(request_id)
+			raise
+		_raise_for_status(status, result, key)
+		return result
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the value named by `key` or raises `KeyError` if it did not
+		exist
+		
+		Arguments
+		---------
+		key
+			Key naming the value to remove
+		"""
+		await self._call(protocol.OP_DELETE, protocol.pack_key(key), key)
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether the value named by `key` exists
+		
+		Arguments
+		---------
+		key
+			Key naming the value to check
+		"""
+		return bool((await self._call(protocol.OP_CONTAINS, protocol.pack_key(key), key))[0])
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the size of the value named by `key` or raises `KeyError`
+		
+		Arguments
+		---------
+		key
+			Key naming the value to check
+		"""
+		result = await self._call(protocol.OP_STAT, protocol.pack_key(key), key)
+		return datastore.util.StreamMetadata(size=protocol.Reader(result).size())
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves the value at name *key1* to *key2*
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		"""
+		payload = bytes([replace]) + protocol.pack_key(key1) + protocol.pack_key(key2)
+		try:
+			await self._call(protocol.OP_RENAME, payload)
+		except KeyError:
+			raise KeyError(key1) from None
+	
+	
+	async def _batch(self, ops: typing.Iterable[typing.Tuple[int, datastore.Key, bytes]]) \
+	      -> typing.List[typing.Tuple[int, bytes]]:
+		"""Runs the given operations on the server using as few batch frames as
+		possible, sending all frames before waiting for the results"""
+		payloads: typing.List[bytes] = []
+		parts: typing.List[bytes] = []
+		size = 0
+		for op, key, value in ops:
+			part = bytes([op]) + protocol.pack_key(key) + protocol.pack_bytes(value)
+			if parts and size + len(part) > BATCH_SIZE:
+				payloads.append(b"".join(parts))
+				parts.clear()
+				size = 0
+			parts.append(part)
+			size += len(part)
+		if parts:
+			payloads.append(b"".join(parts))
+		
+		async def run(payload: bytes, results: typing.List[typing.Tuple[int, bytes]]) -> None:
+			reader = protocol.Reader(await self._call(protocol.OP_BATCH, payload))
+			while not reader.at_end():
+				results.append((reader.u8(), reader.bytes()))
+		
+		batch_results: typing.List[typing.List[typing.Tuple[int, bytes]]] = [[] for _ in payloads]
+		async with trio.open_nursery() as nursery:
+			for payload, results in zip(payloads, batch_results):
+				nursery.start_soon(run, payload, results)
+		return [result for results in batch_results for result in results]
+	
+	
+	async def get_many(self, keys: typing.Iterable[datastore.Key]) \
+	      -> typing.List[typing.Optional[bytes]]:
+		"""Retrieves the values of all given keys using batch requests
+		
+		Returns the values in the order of the given keys, with `None` in place
+		of values that do not exist.
+		
+		Arguments
+		---------
+		keys
+			The keys naming the values to retrieve
+		"""
+		results = []
+		for status, value in await self._batch((protocol.OP_GET, key, b"") for key in keys):
+			if status == protocol.STATUS_KEY_ERROR:
+				results.append(None)
+			else:
+				_raise_for_status(status, value, None)
+				results.append(value)
+		return results
+	
+	
+	async def put_many(self, items: typing.Iterable[typing.Tuple[datastore.Key, bytes]]) -> None:
+		"""Stores all given values using batch requests
+		
+		Arguments
+		---------
+		items
+			Pairs of keys and the values to store under them
+		"""
+		items = list(items)
+		for (key, _), (status, value) in zip(items, await self._batch(
+			(protocol.OP_PUT, key, value) for key, value in items
+		)):
+			_raise_for_status(status, value, key)
+	
+	
+	async def refresh_stats(self) -> datastore.util.DatastoreMetadata:
+		"""Retrieves the current statistics of the served datastore, which are
+		returned by :meth:`datastore_stats` from then on"""
+		reader = protocol.Reader(await self._call(protocol.OP_STATS, b""))
+		size = reader.size()
+		accuracy = reader.bytes().decode("utf-8")
+		self._stats = datastore.util.DatastoreMetadata(
+			size          = size,
+			size_accuracy = "approximate" if accuracy == "exact" else accuracy,  # type: ignore[arg-type]
+		)
+		return self._stats
+	
+	
+	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
+	    -> datastore.util.DatastoreMetadata:
+		"""Returns the statistics of the served datastore as last retrieved from
+		the server (see :meth:`refresh_stats`)
+		
+		Arguments
+		---------
+		selector
+			Ignored by backing datastores
+		"""
+		return self._stats
+	
+	
+	async def aclose(self) -> None:
+		"""Closes all connections, failing any requests still in progress"""
+		self._closed = True
+		connections, self._connections = self._connections, [None] * len(self._connections)
+		for conn in connections:
+			if conn is not None:
+				conn.fail(trio.ClosedResourceError())
+				await conn.stream.aclose()
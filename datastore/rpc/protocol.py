@@ -0,0 +1,228 @@
+"""Wire format shared by :class:`~datastore.rpc.DatastoreServer` and
+:class:`~datastore.rpc.RemoteDatastore`
+
+Every message is a frame consisting of a fixed-size header followed by a
+payload of the length given in the header::
+
+	u32 payload length | u32 request ID | u8 opcode or status | u8 flags | payload
+
+The client numbers its requests per connection, which allows it to send any
+number of requests without waiting for their responses (pipelining) and to
+interleave the frames of several requests (multiplexing). All frames sent in
+response to a request carry its ID.
+
+Request and response bodies of arbitrary length are sent as a sequence of
+`OP_DATA` frames following the initial frame, the last of which has the
+`FLAG_END` flag set. Integers are little-endian, keys and strings are
+UTF-8 encoded and prefixed by their length as u32.
+"""
+import struct
+import typing
+
+import trio
+
+import datastore
+
+_FRAME = struct.Struct("<IIBB")
+_U8    = struct.Struct("<B")
+_U32   = struct.Struct("<I")
+_U64   = struct.Struct("<Q")
+
+# Frames larger than this are rejected to bound the memory used per
+# connection (bodies are split into several frames instead)
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# Size of the body chunks sent in each data frame
+CHUNK_SIZE = 64 * 1024
+
+# Amount of data queued for sending at which senders wait for it to be
+# written
+SEND_BUFFER_SIZE = 1024 * 1024
+
+# Request opcodes
+OP_GET      = 1   # key → OK (u64 size + 1, 0 if unknown), body
+OP_PUT      = 2   # u8 flags, key, body → OK
+OP_PUT_NEW  = 3   # prefix, body → OK (key)
+OP_DELETE   = 4   # key → OK
+OP_CONTAINS = 5   # key → OK (u8 result)
+OP_STAT     = 6   # key → OK (u64 size + 1, 0 if unknown)
+OP_RENAME   = 7   # u8 replace, key, key → OK
+OP_STATS    = 8   # → OK (u64 size + 1, 0 if unknown, accuracy string)
+OP_BATCH    = 9   # list of (u8 opcode, key, value) → OK (list of (u8 status, value))
+OP_CANCEL   = 10  # → (no response)
+OP_DATA     = 11  # body chunk of the request or response with the same ID
+
+# Response statuses
+STATUS_OK              = 0
+STATUS_KEY_ERROR       = 1
+STATUS_NOT_IMPLEMENTED = 2
+STATUS_ERROR           = 3
+
+# Frame flags
+FLAG_END = 0x01  # Last frame of a body
+
+# Flags of `OP_PUT`
+PUT_CREATE  = 0x01
+PUT_REPLACE = 0x02
+
+
+class ProtocolError(RuntimeError):
+	"""The peer sent a malformed frame or closed the connection unexpectedly"""
+
+
+class FrameWriter:
+	"""Sends the frames of concurrent tasks over a stream, coalescing frames
+	queued while a write is in progress into a single write
+	
+	The first task sending a frame writes it right away and keeps writing
+	whatever other tasks have queued in the meantime, so that a busy
+	connection needs far fewer writes than it sends frames.
+	"""
+	__slots__ = ("_stream", "_buffer", "_writing", "_written", "error")
+	
+	_stream: trio.abc.SendStream
+	_buffer: bytearray
+	_writing: bool
+	_written: trio.Event
+	error: typing.Optional[BaseException]
+	
+	def __init__(self, stream: trio.abc.SendStream):
+		self._stream  = stream
+		self._buffer  = bytearray()
+		self._writing = False
+		self._written = trio.Event()
+		self.error    = None
+	
+	
+	async def send(self, data: bytes) -> None:
+		"""Queues *data* for sending, only waiting for it to be written if the
+		queue is full
+		
+		Raises
+		------
+		trio.BrokenResourceError
+			Writing to the stream failed (now or when writing previously
+			queued data)
+		"""
+		if self.error is not None:
+			raise trio.BrokenResourceError("Writing to connection failed") from self.error
+		
+		self._buffer += data
+		if self._writing:
+			if len(self._buffer) >= SEND_BUFFER_SIZE:
+				await self._written.wait()
+				if self.error is not None:
+					raise trio.BrokenResourceError("Writing to connection failed") from self.error
+			else:
+				await trio.lowlevel.checkpoint()
+			return
+		
+		# Interrupting a write would leave a partial frame on the stream, so
+		# frames are never cancelled once queued
+		self._writing = True
+		try:
+			with trio.CancelScope(shield=True):
+				while self._buffer:
+					data, self._buffer = self._buffer, bytearray()
+					await self._stream.send_all(data)
+					self._written.set()
+					self._written = trio.Event()
+		except (trio.BrokenResourceError, trio.ClosedResourceError) as exc:
+			self.error = exc
+			self._written.set()
+			raise trio.BrokenResourceError("Writing to connection failed") from exc
+		finally:
+			self._writing = False
+
+
+def pack_frame(request_id: int, code: int, payload: bytes = b"", flags: int = 0) -> bytes:
+	return _FRAME.pack(len(payload), request_id, code, flags) + payload
+
+
+async def receive_frame(stream: trio.abc.ReceiveStream, buffer: bytearray) \
+    -> typing.Optional[typing.Tuple[int, int, int, bytes]]:
+	"""Receives the next frame from *stream*, returning its request ID,
+	opcode or status, flags and payload, or `None` at the end of the stream
+	
+	*buffer* holds data already received beyond the previous frame.
+	"""
+	while len(buffer) < _FRAME.size:
+		data = await stream.receive_some()
+		if not data:
+			if buffer:
+				raise ProtocolError("Connection closed in the middle of a frame")
+			return None
+		buffer += data
+	
+	length, request_id, code, flags = _FRAME.unpack_from(buffer)
+	if length > MAX_FRAME_SIZE:
+		raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE} bytes")
+	
+	end = _FRAME.size + length
+	while len(buffer) < end:
+		data = await stream.receive_some()
+		if not data:
+			raise ProtocolError("Connection closed in the middle of a frame")
+		buffer += data
+	
+	payload = bytes(buffer[_FRAME.size:end])
+	del buffer[:end]
+	return request_id, code, flags, payload
+
+
+def pack_key(key: datastore.Key) -> bytes:
+	return pack_bytes(str(key).encode("utf-8"))
+
+
+def pack_bytes(data: bytes) -> bytes:
+	return _U32.pack(len(data)) + data
+
+
+def pack_size(size: typing.Optional[int]) -> bytes:
+	return _U64.pack(size + 1 if size is not None else 0)
+
+
+class Reader:
+	"""Decodes the fields of a frame payload in order"""
+	__slots__ = ("_data", "_position")
+	
+	_data: bytes
+	_position: int
+	
+	def __init__(self, data: bytes):
+		self._data     = data
+		self._position = 0
+	
+	
+	def _unpack(self, fmt: struct.Struct) -> int:
+		if self._position + fmt.size > len(self._data):
+			raise ProtocolError("Truncated frame payload")
+		value, = fmt.unpack_from(self._data, self._position)
+		self._position += fmt.size
+		return typing.cast(int, value)
+	
+	
+	def u8(self) -> int:
+		return self._unpack(_U8)
+	
+	
+	def size(self) -> typing.Optional[int]:
+		value = self._unpack(_U64)
+		return value - 1 if value > 0 else None
+	
+	
+	def bytes(self) -> bytes:
+		length = self._unpack(_U32)
+		if self._position + length > len(self._data):
+			raise ProtocolError("Truncated frame payload")
+		value = self._data[self._position:(self._position + length)]
+		self._position += length
+		return value
+	
+	
+	def key(self) -> datastore.Key:
+		return datastore.Key(self.bytes().decode("utf-8"))
+	
+	
+	def at_end(self) -> bool:
+		return self._position >= len(self._data)
@@ -0,0 +1,310 @@
+import errno
+import os
+import typing
+
+import trio
+
+import datastore
+import datastore.abc
+
+from . import protocol
+
+__all__ = ("DatastoreServer",)
+
+
+# Number of request body chunks buffered per request before the connection
+# stops being read (applying backpressure to the client)
+BODY_BUFFER_SIZE = 16
+
+
+class _Request:
+	__slots__ = ("cancel_scope", "body")
+	
+	cancel_scope: trio.CancelScope
+	body: typing.Optional[trio.MemorySendChannel]
+	
+	def __init__(self, body: typing.Optional[trio.MemorySendChannel]):
+		self.cancel_scope = trio.CancelScope()
+		self.body         = body
+
+
+class _Connection:
+	__slots__ = ("stream", "writer", "requests")
+	
+	stream: trio.abc.Stream
+	writer: protocol.FrameWriter
+	requests: typing.Dict[int, _Request]
+	
+	def __init__(self, stream: trio.abc.Stream):
+		self.stream   = stream
+		self.writer   = protocol.FrameWriter(stream)
+		self.requests = {}
+	
+	
+	async def send(self, data: bytes) -> None:
+		try:
+			await self.writer.send(data)
+		except trio.BrokenResourceError:
+			# The client is gone, which the reading task will notice as well
+			pass
+
+
+class DatastoreServer:
+	"""Serves a binary datastore to :class:`~datastore.rpc.RemoteDatastore`
+	clients in other processes
+	
+	The served datastore may be any composition of adapters and backends.
+	Each connection is handled by its own task, which runs every request in a
+	separate task as well, so that slow requests do not hold up others sent
+	over the same connection.
+	
+	Example::
+	
+		async with datastore.BinaryDictDatastore() as ds:
+			server = datastore.rpc.DatastoreServer(ds)
+			await server.serve_unix("/run/app/datastore.sock")
+	"""
+	__slots__ = ("datastore",)
+	
+	datastore: datastore.abc.BinaryDatastore
+	
+	def __init__(self, datastore: datastore.abc.BinaryDatastore):
+		"""
+		Arguments
+		---------
+		datastore
+			The datastore to serve (it is not closed by the server)
+		"""
+		self.datastore = datastore
+	
+	
+	async def serve_tcp(self, port: int, *, host: str = "127.0.0.1",
+	                    task_status: 'trio._core._run._TaskStatus' = trio.TASK_STATUS_IGNORED) -> None:
+		"""Accepts connections on the given TCP port until cancelled
+		
+		Arguments
+		---------
+		port
+			The port to listen on (use 0 to pick any free port, then retrieve
+			it from the listeners passed to ``task_status.started()``)
+		host
+			The address to listen on (the protocol is not authenticated, so
+			never make the port reachable from untrusted networks)
+		"""
+		await trio.serve_tcp(self.handle_stream, port, host=host, task_status=task_status)
+	
+	
+	async def serve_unix(self, path: typing.Union[str, os.PathLike],
+	                     task_status: 'trio._core._run._TaskStatus' = trio.TASK_STATUS_IGNORED) \
+	      -> None:
+		"""Accepts connections on a Unix domain socket at *path* until
+		cancelled, replacing any stale socket file at that path
+		
+		Arguments
+		---------
+		path
+			The filesystem path of the socket
+		"""
+		sock = trio.socket.socket(trio.socket.AF_UNIX, trio.socket.SOCK_STREAM)
+		try:
+			try:
+				os.unlink(path)
+			except OSError as exc:
+				if exc.errno != errno.ENOENT:
+					raise
+			await sock.bind(os.fspath(path))
+			sock.listen()
+		except BaseException:
+			sock.close()
+			raise
+		
+		await trio.serve_listeners(self.handle_stream, [trio.SocketListener(sock)],
+		                           task_status=task_status)
+	
+	
+	async def handle_stream(self, stream: trio.abc.Stream) -> None:
+		"""Serves requests received over *stream* until the client closes it
+		
+		Requests still running at that point are cancelled.
+		"""
+		conn = _Connection(stream)
+		async with stream, trio.open_nursery() as nursery:
+			buffer = bytearray()
+			try:
+				while True:
+					frame = await protocol.receive_frame(stream, buffer)
+					if frame is None:
+						break
+					request_id, code, flags, payload = frame
+					
+					request = conn.requests.get(request_id)
+					if code == protocol.OP_DATA:
+						# Chunks of requests that failed already are dropped
+						if request is not None and request.body is not None:
+							try:
+								await request.body.send((payload, flags))
+							except trio.BrokenResourceError:
+								pass
+					elif code == protocol.OP_CANCEL:
+						if request is not None:
+							request.cancel_scope.cancel()
+					elif request is None:
+						body_send: typing.Optional[trio.MemorySendChannel] = None
+						body_receive: typing.Optional[trio.MemoryReceiveChannel] = None
+						if code in (protocol.OP_PUT, protocol.OP_PUT_NEW):
+							body_send, body_receive = trio.open_memory_channel(BODY_BUFFER_SIZE)
+						conn.requests[request_id] = _Request(body_send)
+						nursery.start_soon(self._run_request, conn, request_id, code, payload,
+						                   body_receive)
+					else:
+						raise protocol.ProtocolError(f"Request ID {request_id} is already in use")
+			except (protocol.ProtocolError, trio.BrokenResourceError, trio.ClosedResourceError):
+				pass
+			finally:
+				nursery.cancel_scope.cancel()
+	
+	
+	async def _run_request(self, conn: _Connection, request_id: int, code: int, payload: bytes,
+	                       body: typing.Optional[trio.MemoryReceiveChannel]) -> None:
+		request = conn.requests[request_id]
+		try:
+			with request.cancel_scope:
+				try:
+					reader = protocol.Reader(payload)
+					if code == protocol.OP_GET:
+						await self._get(conn, request_id, reader.key())
+						return
+					elif code in (protocol.OP_PUT, protocol.OP_PUT_NEW):
+						assert body is not None
+						async with body:
+							result = await self._put(code, reader, body)
+					else:
+						result = await self._dispatch(code, reader)
+				except KeyError:
+					await conn.send(protocol.pack_frame(request_id, protocol.STATUS_KEY_ERROR,
+					                                    flags=protocol.FLAG_END))
+				except NotImplementedError:
+					await conn.send(protocol.pack_frame(request_id, protocol.STATUS_NOT_IMPLEMENTED,
+					                                    flags=protocol.FLAG_END))
+				except Exception as exc:
+					await conn.send(protocol.pack_frame(request_id, protocol.STATUS_ERROR,
+					                                    _describe(exc), protocol.FLAG_END))
+				else:
+					await conn.send(protocol.pack_frame(request_id, protocol.STATUS_OK, result,
+					                                    protocol.FLAG_END))
+		finally:
+			del conn.requests[request_id]
+	
+	
+	async def _get(self, conn: _Connection, request_id: int, key: datastore.Key) -> None:
+		async with await self.datastore.get(key) as stream:
+			data = [protocol.pack_frame(request_id, protocol.STATUS_OK, protocol.pack_size(stream.size))]
+			try:
+				# Read one chunk ahead, so that the last chunk can be marked as
+				# such and small values are sent together with the response
+				# header in a single write
+				chunk = await stream.receive_some(protocol.CHUNK_SIZE)
+				while True:
+					next_chunk = await stream.receive_some(protocol.CHUNK_SIZE) if chunk else b""
+					if not next_chunk:
+						data.append(protocol.pack_frame(request_id, protocol.OP_DATA, chunk,
+						                                protocol.FLAG_END))
+						await conn.send(b"".join(data))
+						return
+					data.append(protocol.pack_frame(request_id, protocol.OP_DATA, chunk))
+					await conn.send(b"".join(data))
+					data.clear()
+					chunk = next_chunk
+			except Exception as exc:
+				# The response may have been started already, so the error can
+				# only be reported in place of the remaining body
+				data.append(protocol.pack_frame(request_id, protocol.STATUS_ERROR,
+				                                _describe(exc), protocol.FLAG_END))
+				await conn.send(b"".join(data))
+	
+	
+	async def _put(self, code: int, reader: protocol.Reader,
+	               body: trio.MemoryReceiveChannel) -> bytes:
+		async def receive_body() -> typing.AsyncIterator[bytes]:
+			async for chunk, flags in body:
+				if chunk:
+					yield chunk
+				if flags & protocol.FLAG_END:
+					return
+		
+		if code == protocol.OP_PUT:
+			flags = reader.u8()
+			await self.datastore.put(reader.key(), receive_body(),
+			                         create=bool(flags & protocol.PUT_CREATE),
+			                         replace=bool(flags & protocol.PUT_REPLACE))
+			return b""
+		else:
+			key = await self.datastore.put_new(reader.key(), receive_body())
+			return protocol.pack_key(key)
+	
+	
+	async def _dispatch(self, code: int, reader: protocol.Reader) -> bytes:
+		if code == protocol.OP_DELETE:
+			await self.datastore.delete(reader.key())
+			return b""
+		elif code == protocol.OP_CONTAINS:
+			return bytes([await self.datastore.contains(reader.key())])
+		elif code == protocol.OP_STAT:
+			return protocol.pack_size((await self.datastore.stat(reader.key())).size)
+		elif code == protocol.OP_RENAME:
+			replace = bool(reader.u8())
+			await self.datastore.rename(reader.key(), reader.key(), replace=replace)
+			return b""
+		elif code == protocol.OP_STATS:
+			stats = self.datastore.datastore_stats()
+			return protocol.pack_size(stats.size) + protocol.pack_bytes(stats.size_accuracy.encode())
+		elif code == protocol.OP_BATCH:
+			return await self._batch(reader)
+		raise protocol.ProtocolError(f"Unknown opcode {code}")
+	
+	
+	async def _batch(self, reader: protocol.Reader) -> bytes:
+		ops = []
+		while not reader.at_end():
+			ops.append((reader.u8(), reader.key(), reader.bytes()))
+		
+		# Pass batches of new values on in one go if supported (see the
+		# `writebehind` adapter)
+		put_many = getattr(self.datastore, "put_many", None)
+		if ops and put_many is not None and all(op == protocol.OP_PUT for op, _, _ in ops):
+			await put_many([(key, value) for _, key, value in ops])
+			return b"".join(_OK_EMPTY for _ in ops)
+		
+		results = []
+		for op, key, value in ops:
+			try:
+				if op == protocol.OP_GET:
+					result = await self.datastore.get_all(key)
+				elif op == protocol.OP_PUT:
+					await self.datastore.put(key, value)
+					result = b""
+				elif op == protocol.OP_DELETE:
+					await self.datastore.delete(key)
+					result = b""
+				elif op == protocol.OP_CONTAINS:
+					result = bytes([await self.datastore.contains(key)])
+				else:
+					raise protocol.ProtocolError(f"Opcode {op} cannot be batched")
+			except KeyError:
+				results.append(bytes([protocol.STATUS_KEY_ERROR]) + protocol.pack_bytes(b""))
+			except NotImplementedError:
+				results.append(bytes([protocol.STATUS_NOT_IMPLEMENTED]) + protocol.pack_bytes(b""))
+			except protocol.ProtocolError:
+				raise
+			except Exception as exc:
+				results.append(bytes([protocol.STATUS_ERROR]) + protocol.pack_bytes(_describe(exc)))
+			else:
+				results.append(bytes([protocol.STATUS_OK]) + protocol.pack_bytes(result))
+		return b"".join(results)
+
+
+_OK_EMPTY = bytes([protocol.STATUS_OK]) + protocol.pack_bytes(b"")
+
+
+def _describe(exc: BaseException) -> bytes:
+	return f"{type(exc).__name__}: {exc}".encode("utf-8", "replace")
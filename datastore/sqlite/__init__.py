@@ -0,0 +1,9 @@
+"""SQLite datastore implementation"""
+__version__ = "1.0"
+__author__ = "Juan Batiz-Benet, Alexander Schlarb"
+__email__ = "juan@benet.ai, alexander@ninetailed.ninja"
+
+__all__ = ("SQLiteDatastore", "SQLiteObjectDatastore")
+
+from .sqlite import SQLiteDatastore
+from .sqlite import SQLiteObjectDatastore
@@ -0,0 +1,1210 @@
+import contextlib
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+import typing
+import uuid
+
+import trio
+
+import datastore
+import datastore.abc
+import datastore.util
+from datastore.core import query as query_
+
+T = typing.TypeVar("T")
+if typing.TYPE_CHECKING:
+	os_PathLike_str = os.PathLike[str]
+else:
+	os_PathLike_str = os.PathLike
+
+
+DEFAULT_MAX_THREADS = 4
+
+# Number of prepared statements kept around by each connection: all statements
+# issued by this module use parameters (except for the JSON paths of queries)
+# so that they only need to be prepared once
+STATEMENT_CACHE_SIZE = 256
+
+# Time to wait for other processes holding a lock on the database
+BUSY_TIMEOUT = 30.0
+
+# Values larger than this are streamed from and to the database in chunks of
+# this size using incremental BLOB I/O (if supported by the `sqlite3` module)
+BLOB_CHUNK_SIZE = 64 * 1024
+HAS_BLOB_IO = hasattr(sqlite3.Connection, "blobopen")  #PY311+
+
+# Python values that may be compared with JSON fields inside SQLite
+JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+SQL_OPERATORS = {"<": "<", "<=": "<=", "=": "=", "!=": "IS NOT", ">=": ">=", ">": ">"}
+
+# JSON types of field values that `datastore.Filter` compares with filter
+# values of each type without converting them first, and hence the same way
+# as SQLite (JSON booleans are extracted as integers)
+JSON_FILTER_TYPES = {
+	str:   ("text",),
+	int:   ("integer", "true", "false"),
+	float: ("real",),
+	bool:  ("true", "false"),
+}
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+compiled_query_t = typing.Tuple[str, typing.List[typing.Any], typing.List[str], bool]
+
+
+@contextlib.contextmanager
+def transaction(connection: sqlite3.Connection, mode: str = "IMMEDIATE") -> typing.Iterator[None]:
+	"""Runs the enclosed statements in a transaction, which is rolled back if
+	an exception is raised"""
+	connection.execute(f"BEGIN {mode}")
+	try:
+		yield
+	except BaseException:
+		connection.execute("ROLLBACK")
+		raise
+	else:
+		connection.execute("COMMIT")
+
+
+def json_field(field: str, function: str = "json_extract") -> typing.Optional[str]:
+	"""Returns the SQL expression extracting the given top-level field of the
+	JSON objects of the ``objects`` table (or applying another JSON function
+	to it, such as ``json_type``), or `None` if the field name cannot be
+	expressed as JSON path"""
+	if not isinstance(field, str) or "\"" in field or "\\" in field:
+		return None
+	path = "$.\"" + field.replace("'", "''") + "\""
+	return f"{function}(value, '{path}')"
+
+
+class _BlobReader(datastore.abc.ReceiveStream):
+	"""Streams a value out of the database using incremental BLOB I/O
+	
+	The BLOB is read within its own read transaction on a dedicated connection,
+	so the value is not affected by concurrent writes.
+	"""
+	__slots__ = ("_store", "_connection", "_blob")
+	
+	_store: '_Database'
+	_connection: typing.Optional[sqlite3.Connection]
+	_blob: typing.Any  # sqlite3.Blob
+	
+	def __init__(self, store: '_Database', connection: sqlite3.Connection, blob: typing.Any,
+	             **kwargs: typing.Any):
+		self._store      = store
+		self._connection = connection
+		self._blob       = blob
+		
+		super().__init__(**kwargs)
+	
+	
+	async def receive_some(self, max_bytes: typing.Optional[int] = None) -> bytes:
+		if self._connection is None:
+			return b""
+		
+		buf = typing.cast(bytes, await self._store._run_sync(
+			self._blob.read, max_bytes or BLOB_CHUNK_SIZE
+		))
+		if len(buf) == 0:
+			await self.aclose()
+		return buf
+	
+	
+	async def aclose(self) -> None:
+		if self._connection is not None:
+			connection, self._connection = self._connection, None
+			with trio.CancelScope(shield=True):
+				await trio.to_thread.run_sync(self._store._disconnect, connection)
+
+
+class _Database:
+	"""Connection and thread handling shared by the SQLite datastores
+	
+	Each worker thread running statements for a datastore gets its own
+	connection to the database (SQLite connections cannot be used from
+	several threads at once), while writes are serialized by a lock to avoid
+	contending for the database's write lock within the same process.
+	"""
+	
+	SCHEMA: str = ""
+	
+	path: pathlib.PurePath
+	sync: bool
+	
+	_local: threading.local
+	_connections: typing.Dict[typing.Optional[threading.Thread], typing.List[sqlite3.Connection]]
+	_connections_lock: threading.Lock
+	_limiter: trio.CapacityLimiter
+	_write_lock: trio.Lock
+	_count: int
+	_closed: bool
+	
+	
+	def _init(self, path: typing.Union[os_PathLike_str, str], *,
+	          max_threads: int, sync: bool) -> None:
+		self.path = pathlib.PurePath(path)
+		self.sync = bool(sync)
+		
+		self._local            = threading.local()
+		self._connections      = {}
+		self._connections_lock = threading.Lock()
+		self._limiter          = trio.CapacityLimiter(max_threads)
+		self._write_lock       = trio.Lock()
+		self._count            = 0
+		self._closed           = False
+	
+	
+	def _connect(self, thread: typing.Optional[threading.Thread] = None) -> sqlite3.Connection:
+		"""Opens a new connection to the database, owned by *thread* (if any)"""
+		connection = sqlite3.connect(
+			os.fspath(self.path), timeout=BUSY_TIMEOUT, isolation_level=None,
+			check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+		)
+		try:
+			connection.execute(f"PRAGMA synchronous = {'FULL' if self.sync else 'NORMAL'}")
+			with self._connections_lock:
+				if self._closed:
+					raise RuntimeError("Datastore has been closed")
+				
+				# Drop the connections of worker threads that have exited
+				for other in [other for other in self._connections
+				              if other is not None and not other.is_alive()]:
+					for stale in self._connections.pop(other):
+						stale.close()
+				
+				self._connections.setdefault(thread, []).append(connection)
+		except BaseException:
+			connection.close()
+			raise
+		return connection
+	
+	
+	def _disconnect(self, connection: sqlite3.Connection) -> None:
+		"""Closes a connection that was opened without owning thread"""
+		with self._connections_lock:
+			if connection in self._connections.get(None, []):
+				self._connections[None].remove(connection)
+		connection.close()
+	
+	
+	def _connection(self) -> sqlite3.Connection:
+		"""Returns the connection of the current worker thread"""
+		connection: typing.Optional[sqlite3.Connection] = getattr(self._local, "connection", None)
+		if connection is None:
+			connection = self._local.connection = self._connect(threading.current_thread())
+		return connection
+	
+	
+	async def _run_sync(self, func: typing.Callable[..., T], *args: typing.Any) -> T:
+		"""Runs *func* in a worker thread"""
+		if self._closed:
+			raise RuntimeError("Datastore has been closed")
+		return typing.cast(T, await trio.to_thread.run_sync(
+			func, *args, cancellable=False, limiter=self._limiter
+		))
+	
+	
+	async def _run(self, func: typing.Callable[..., T], *args: typing.Any) -> T:
+		"""Runs *func* in a worker thread, passing it the worker thread's
+		database connection as first argument"""
+		def run() -> T:
+			return func(self._connection(), *args)
+		return await self._run_sync(run)
+	
+	
+	def _setup_sync(self, connection: sqlite3.Connection) -> None:
+		# Let readers proceed while values are being written
+		connection.execute("PRAGMA journal_mode = WAL")
+		connection.executescript(self.SCHEMA)
+	
+	
+	def __len__(self) -> int:
+		return self._count
+	
+	
+	async def aclose(self) -> None:
+		"""Waits for running writes, then closes all connections to the database"""
+		if self._closed:
+			return
+		
+		with trio.CancelScope(shield=True):
+			async with self._write_lock:
+				with self._connections_lock:
+					self._closed = True
+					connections, self._connections = self._connections, {}
+				for connection in (c for cs in connections.values() for c in cs):
+					connection.close()
+
+
+
+class SQLiteDatastore(_Database, datastore.abc.BinaryDatastore):
+	"""Binary datastore storing its values in an SQLite database
+	
+	The database is operated in write-ahead log mode, so that reads are not
+	blocked by writes. Statements are run on a pool of at most *max_threads*
+	worker threads, each with its own connection and cache of prepared
+	statements. Values larger than `BLOB_CHUNK_SIZE` are streamed from and
+	to the database using incremental BLOB I/O when available (Python 3.11+).
+	
+	The number and total size of the stored values are only tracked exactly
+	as long as the database is not modified by another process at the same
+	time.
+	"""
+	
+	SCHEMA = """
+		CREATE TABLE IF NOT EXISTS data (
+			key   TEXT NOT NULL UNIQUE,
+			value BLOB NOT NULL,
+			mtime REAL NOT NULL
+		);
+	"""
+	
+	_size: int
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, path: typing.Union[os_PathLike_str, str], *,
+	                 max_threads: int = DEFAULT_MAX_THREADS,
+	                 sync: bool = False) -> 'SQLiteDatastore':
+		"""Opens the SQLite database at *path*, creating it if it does not
+		exist yet
+		
+		Arguments
+		---------
+		path
+			The path of the database file
+		max_threads
+			The maximum number of statements run concurrently (each on its own
+			thread and connection)
+		sync
+			Wait for each transaction to be durably stored on disk, rather than
+			only guarding against corruption on power loss
+		"""
+		self = cls(_create_call=True)
+		self._init(path, max_threads=max_threads, sync=sync)
+		try:
+			self._count, self._size = await self._run(self._setup_sync)
+		except BaseException:
+			await self.aclose()
+			raise
+		return self
+	
+	
+	def __init__(self, *, _create_call: bool = False):
+		assert _create_call, "Use SQLiteDatastore.create(…) for instance creation"
+	
+	
+	def _setup_sync(self, connection: sqlite3.Connection) \
+	    -> typing.Tuple[int, int]:  # type: ignore[override]
+		super()._setup_sync(connection)
+		count, size = connection.execute("SELECT count(*), total(length(value)) FROM data").fetchone()
+		return count, int(size)
+	
+	
+	def _get_sync(self, connection: sqlite3.Connection, key: datastore.Key) \
+	    -> typing.Tuple[typing.Optional[bytes], int, float]:
+		"""Returns the value (unless it should be streamed), size and
+		modification time of *key*"""
+		threshold = BLOB_CHUNK_SIZE if HAS_BLOB_IO else sys.maxsize
+		row = connection.execute(
+			"SELECT CASE WHEN length(value) <= ? THEN value END, length(value), mtime "
+			"FROM data WHERE key = ?", (threshold, str(key))
+		).fetchone()
+		if row is None:
+			raise KeyError(key)
+		return row
+	
+	
+	def _open_blob_sync(self, key: datastore.Key) -> _BlobReader:
+		connection = self._connect()
+		try:
+			connection.execute("BEGIN")
+			row = connection.execute(
+				"SELECT rowid, length(value), mtime FROM data WHERE key = ?", (str(key),)
+			).fetchone()
+			if row is None:
+				raise KeyError(key)
+			blob = connection.blobopen("data", "value", row[0], readonly=True)  # type: ignore[attr-defined]
+			return _BlobReader(self, connection, blob, size=row[1], mtime=row[2])
+		except BaseException:
+			self._disconnect(connection)
+			raise
+	
+	
+	def _put_sync(self, connection: sqlite3.Connection,
+	              items: typing.List[typing.Tuple[datastore.Key, bytes]],
+	              create: bool, replace: bool) -> typing.Tuple[int, int]:
+		"""Stores the given values in a single transaction and returns the
+		change in number and size of the stored values"""
+		count = size = 0
+		mtime = time.time()
+		with transaction(connection):
+			for key, value in items:
+				row = connection.execute(
+					"SELECT length(value) FROM data WHERE key = ?", (str(key),)
+				).fetchone()
+				if (row is None and not create) or (row is not None and not replace):
+					raise KeyError(key)
+				connection.execute(
+					"INSERT INTO data (key, value, mtime) VALUES (?, ?, ?) "
+					"ON CONFLICT (key) DO UPDATE SET value = excluded.value, mtime = excluded.mtime",
+					(str(key), value, mtime)
+				)
+				count += row is None
+				size  += len(value) - (row[0] if row is not None else 0)
+		return count, size
+	
+	
+	def _begin_put_blob_sync(self, connection: sqlite3.Connection, key: datastore.Key,
+	                         length: int, create: bool, replace: bool) \
+	    -> typing.Tuple[typing.Any, int, int]:
+		"""Starts a transaction that stores a zero-filled value of *length*
+		bytes at *key* and returns a BLOB handle for writing the actual data,
+		as well as the change in number and size of the stored values"""
+		connection.execute("BEGIN IMMEDIATE")
+		row = connection.execute("SELECT length(value) FROM data WHERE key = ?", (str(key),)).fetchone()
+		if (row is None and not create) or (row is not None and not replace):
+			raise KeyError(key)
+		connection.execute(
+			"INSERT INTO data (key, value, mtime) VALUES (?, zeroblob(?), ?) "
+			"ON CONFLICT (key) DO UPDATE SET value = excluded.value, mtime = excluded.mtime",
+			(str(key), length, time.time())
+		)
+		rowid, = connection.execute("SELECT rowid FROM data WHERE key = ?", (str(key),)).fetchone()
+		blob = connection.blobopen("data", "value", rowid)  # type: ignore[attr-defined]
+		return blob, int(row is None), length - (row[0] if row is not None else 0)
+	
+	
+	def _commit_blob_sync(self, connection: sqlite3.Connection, blob: typing.Any) -> None:
+		blob.close()
+		connection.execute("COMMIT")
+	
+	
+	async def _put_blob(self, key: datastore.Key, value: datastore.abc.ReceiveStream,
+	                    length: int, create: bool, replace: bool) -> None:
+		"""Streams *value* of the announced *length* into the database using
+		incremental BLOB I/O"""
+		connection = await self._run_sync(self._connect)
+		try:
+			blob, count, size = await self._run_sync(
+				self._begin_put_blob_sync, connection, key, length, create, replace
+			)
+			
+			written = 0
+			async with value:
+				while True:
+					chunk = await value.receive_some(BLOB_CHUNK_SIZE)
+					if len(chunk) < 1:
+						break
+					if written + len(chunk) > length:
+						raise ValueError(f"Value of key \"{key}\" is larger than its announced size")
+					await self._run_sync(blob.write, chunk)
+					written += len(chunk)
+			if written != length:
+				raise ValueError(f"Value of key \"{key}\" is smaller than its announced size")
+			
+			await self._run_sync(self._commit_blob_sync, connection, blob)
+			self._count += count
+			self._size  += size
+		finally:
+			# Closing the connection rolls back the transaction if it failed
+			with trio.CancelScope(shield=True):
+				await trio.to_thread.run_sync(self._disconnect, connection)
+	
+	
+	def _delete_sync(self, connection: sqlite3.Connection, key: datastore.Key) -> int:
+		with transaction(connection):
+			row = connection.execute("SELECT length(value) FROM data WHERE key = ?", (str(key),)).fetchone()
+			if row is None:
+				raise KeyError(key)
+			connection.execute("DELETE FROM data WHERE key = ?", (str(key),))
+		return typing.cast(int, row[0])
+	
+	
+	def _rename_sync(self, connection: sqlite3.Connection, key1: datastore.Key,
+	                 key2: datastore.Key, replace: bool) -> typing.Tuple[int, int]:
+		with transaction(connection):
+			if connection.execute("SELECT 1 FROM data WHERE key = ?", (str(key1),)).fetchone() is None:
+				raise KeyError(key1)
+			if key1 == key2:
+				return 0, 0
+			
+			row = connection.execute("SELECT length(value) FROM data WHERE key = ?", (str(key2),)).fetchone()
+			if row is not None:
+				if not replace:
+					raise KeyError(key2)
+				connection.execute("DELETE FROM data WHERE key = ?", (str(key2),))
+			connection.execute("UPDATE data SET key = ? WHERE key = ?", (str(key2), str(key1)))
+		return (-1, -row[0]) if row is not None else (0, 0)
+	
+	
+	def _stat_sync(self, connection: sqlite3.Connection, key: datastore.Key) \
+	    -> datastore.util.StreamMetadata:
+		row = connection.execute(
+			"SELECT length(value), mtime FROM data WHERE key = ?", (str(key),)
+		).fetchone()
+		if row is None:
+			raise KeyError(key)
+		return datastore.util.StreamMetadata(size=row[0], mtime=row[1])
+	
+	
+	def _contains_sync(self, connection: sqlite3.Connection, key: datastore.Key) -> bool:
+		return connection.execute("SELECT 1 FROM data WHERE key = ?", (str(key),)).fetchone() is not None
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveStream:
+		"""Returns the data named by *key* or raises `KeyError` otherwise
+		
+		Large values are streamed from the database in chunks.
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		value, size, mtime = await self._run(self._get_sync, key)
+		if value is None:
+			return await self._run_sync(self._open_blob_sync, key)
+		return datastore.util.receive_stream_from(value)
+	
+	
+	async def get_all(self, key: datastore.Key) -> bytes:
+		"""Returns all the data named by *key* at once or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		value, size, mtime = await self._run(self._get_sync, key)
+		if value is None:
+			return await (await self._run_sync(self._open_blob_sync, key)).collect()
+		return typing.cast(bytes, value)
+	
+	
+	async def _put(self, key: datastore.Key,  # type: ignore[override]
+	               value: datastore.abc.ReceiveStream, *, create: bool, replace: bool) -> None:
+		"""Stores or replaces the data named by *key* with *value*
+		
+		Values of known size larger than `BLOB_CHUNK_SIZE` are streamed into
+		the database in chunks, while holding the write lock.
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to store at
+		value
+			Some stream yielding the data to store
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		
+		Raises
+		------
+		KeyError
+			The given *key* doesn't exist and *create* is not ``True``.
+		KeyError
+			The given *key* already exists and *replace* is not ``True``.
+		ValueError
+			The size of *value* did not match its announced size
+		"""
+		assert create or replace
+		
+		length = getattr(value, "size", None)
+		if HAS_BLOB_IO and length is not None and length > BLOB_CHUNK_SIZE:
+			async with self._write_lock:
+				await self._put_blob(key, value, length, create, replace)
+			return
+		
+		data = await value.collect()
+		async with self._write_lock:
+			count, size = await self._run(self._put_sync, [(key, data)], create, replace)
+			self._count += count
+			self._size  += size
+	
+	
+	async def put_many(self, items: typing.Iterable[typing.Tuple[datastore.Key, bytes]]) -> None:
+		"""Stores or replaces the data of each of the given ``(key, value)``
+		pairs in a single transaction
+		
+		Arguments
+		---------
+		items
+			The keys and values to store, later items replace earlier ones of
+			the same key
+		"""
+		values = [(key, bytes(value)) for key, value in items]
+		if not values:
+			return
+		
+		async with self._write_lock:
+			count, size = await self._run(self._put_sync, values, True, True)
+			self._count += count
+			self._size  += size
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key  # type: ignore[override]
+	) -> datastore.abc.BinaryDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores the data passed to the returned callback in a new key below *prefix*
+		
+		Arguments
+		---------
+		prefix
+			Key below which to store the given data
+		"""
+		key = prefix.child(str(uuid.uuid4()))
+		
+		async def callback(value: datastore.abc.ReceiveStream) -> None:
+			await self._put(key, value, create=True, replace=False)
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the data named by *key*
+		
+		Arguments
+		---------
+		key
+			Key naming the binary data slot to remove
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		async with self._write_lock:
+			size = await self._run(self._delete_sync, key)
+			self._count -= 1
+			self._size  -= size
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any data named by *key* exists
+		
+		Arguments
+		---------
+		key
+			Key naming the object to check.
+		"""
+		return await self._run(self._contains_sync, key)
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves key *key1* to *key2*
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		
+		Raises
+		------
+		KeyError
+			Key *key1* did not exist in this datastore
+		KeyError
+			Key *key2* already exists in this datastore, but *replace* was not ``True``
+		"""
+		async with self._write_lock:
+			count, size = await self._run(self._rename_sync, key1, key2, replace)
+			self._count += count
+			self._size  += size
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.StreamMetadata:
+		"""Returns the size and modification time of the data named by *key*,
+		or raises `KeyError` otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the data to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		return await self._run(self._stat_sync, key)
+	
+	
+	def datastore_stats(self, selector: datastore.Key = None, *, _seen: typing.Set[int] = None) \
+	    -> datastore.util.DatastoreMetadata:
+		"""Returns the total size of all values stored in the database
+		
+		Arguments
+		---------
+		selector
+			Ignored by backing datastores
+		"""
+		return datastore.util.DatastoreMetadata(size=self._size, size_accuracy="exact")
+
+
+
+class SQLiteObjectDatastore(_Database, datastore.abc.ObjectDatastore):
+	"""Object datastore storing JSON-serializable objects in an SQLite database
+	
+	Each object is stored as JSON text in a row of its own, so that
+	:meth:`query` can translate the filters and orders of a
+	:class:`~datastore.Query` into SQL using ``json_extract``. Indexes on
+	frequently queried fields can be created using *indexes* or
+	:meth:`create_index`, which are used by SQLite for filtering and ordering
+	of matching queries. Paging through results using
+	:attr:`~datastore.Query.offset_key` is done by seeking to the position of
+	that key in the result order, rather than skipping over all results before
+	it.
+	
+	See :class:`SQLiteDatastore` for details on the handling of the database.
+	"""
+	
+	SCHEMA = """
+		CREATE TABLE IF NOT EXISTS entries (
+			key   TEXT NOT NULL PRIMARY KEY,
+			mtime REAL NOT NULL
+		) WITHOUT ROWID;
+		
+		CREATE TABLE IF NOT EXISTS objects (
+			key   TEXT NOT NULL,
+			idx   INTEGER NOT NULL,
+			path  TEXT NOT NULL,
+			value TEXT NOT NULL,
+			PRIMARY KEY (key, idx)
+		) WITHOUT ROWID;
+		
+		CREATE INDEX IF NOT EXISTS objects_path ON objects (path, key);
+	"""
+	
+	
+	@classmethod
+	@datastore.util.awaitable_to_context_manager
+	async def create(cls, path: typing.Union[os_PathLike_str, str], *,
+	                 indexes: typing.Iterable[str] = (),
+	                 max_threads: int = DEFAULT_MAX_THREADS,
+	                 sync: bool = False) -> 'SQLiteObjectDatastore':
+		"""Opens the SQLite database at *path*, creating it if it does not
+		exist yet
+		
+		Arguments
+		---------
+		path
+			The path of the database file
+		indexes
+			Names of object fields to create indexes for (see :meth:`create_index`)
+		max_threads
+			The maximum number of statements run concurrently (each on its own
+			thread and connection)
+		sync
+			Wait for each transaction to be durably stored on disk, rather than
+			only guarding against corruption on power loss
+		"""
+		self = cls(_create_call=True)
+		self._init(path, max_threads=max_threads, sync=sync)
+		try:
+			self._count = await self._run(self._setup_sync)
+			for field in indexes:
+				await self.create_index(field)
+		except BaseException:
+			await self.aclose()
+			raise
+		return self
+	
+	
+	def __init__(self, *, _create_call: bool = False):
+		assert _create_call, "Use SQLiteObjectDatastore.create(…) for instance creation"
+	
+	
+	def _setup_sync(self, connection: sqlite3.Connection) -> int:  # type: ignore[override]
+		super()._setup_sync(connection)
+		return typing.cast(int, connection.execute("SELECT count(*) FROM entries").fetchone()[0])
+	
+	
+	@staticmethod
+	def _encode(objects: typing.Iterable[typing.Any]) -> typing.List[str]:
+		return [json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+		        for obj in objects]
+	
+	
+	def _get_sync(self, connection: sqlite3.Connection, key: datastore.Key) \
+	    -> typing.Tuple[typing.List[typing.Any], float]:
+		with transaction(connection, "DEFERRED"):
+			row = connection.execute("SELECT mtime FROM entries WHERE key = ?", (str(key),)).fetchone()
+			if row is None:
+				raise KeyError(key)
+			values = connection.execute(
+				"SELECT value FROM objects WHERE key = ? ORDER BY idx", (str(key),)
+			).fetchall()
+		return [json.loads(value) for value, in values], row[0]
+	
+	
+	def _put_sync(self, connection: sqlite3.Connection,
+	              items: typing.List[typing.Tuple[datastore.Key, typing.List[str]]],
+	              create: bool, replace: bool) -> int:
+		"""Stores the given objects in a single transaction and returns the
+		change in the number of keys"""
+		count = 0
+		mtime = time.time()
+		with transaction(connection):
+			for key, values in items:
+				exists = connection.execute(
+					"SELECT 1 FROM entries WHERE key = ?", (str(key),)
+				).fetchone() is not None
+				if (not exists and not create) or (exists and not replace):
+					raise KeyError(key)
+				
+				connection.execute(
+					"INSERT INTO entries (key, mtime) VALUES (?, ?) "
+					"ON CONFLICT (key) DO UPDATE SET mtime = excluded.mtime", (str(key), mtime)
+				)
+				connection.execute("DELETE FROM objects WHERE key = ?", (str(key),))
+				connection.executemany(
+					"INSERT INTO objects (key, idx, path, value) VALUES (?, ?, ?, ?)",
+					((str(key), idx, str(key.path), value) for idx, value in enumerate(values))
+				)
+				count += not exists
+		return count
+	
+	
+	def _delete_sync(self, connection: sqlite3.Connection, key: datastore.Key) -> None:
+		with transaction(connection):
+			if connection.execute("DELETE FROM entries WHERE key = ?", (str(key),)).rowcount < 1:
+				raise KeyError(key)
+			connection.execute("DELETE FROM objects WHERE key = ?", (str(key),))
+	
+	
+	def _rename_sync(self, connection: sqlite3.Connection, key1: datastore.Key,
+	                 key2: datastore.Key, replace: bool) -> int:
+		with transaction(connection):
+			if connection.execute("SELECT 1 FROM entries WHERE key = ?", (str(key1),)).fetchone() is None:
+				raise KeyError(key1)
+			if key1 == key2:
+				return 0
+			
+			exists = connection.execute(
+				"SELECT 1 FROM entries WHERE key = ?", (str(key2),)
+			).fetchone() is not None
+			if exists:
+				if not replace:
+					raise KeyError(key2)
+				connection.execute("DELETE FROM entries WHERE key = ?", (str(key2),))
+				connection.execute("DELETE FROM objects WHERE key = ?", (str(key2),))
+			connection.execute("UPDATE entries SET key = ? WHERE key = ?", (str(key2), str(key1)))
+			connection.execute(
+				"UPDATE objects SET key = ?, path = ? WHERE key = ?",
+				(str(key2), str(key2.path), str(key1))
+			)
+		return -1 if exists else 0
+	
+	
+	def _stat_sync(self, connection: sqlite3.Connection, key: datastore.Key) \
+	    -> datastore.util.ChannelMetadata:
+		row = connection.execute(
+			"SELECT mtime, (SELECT count(*) FROM objects WHERE key = entries.key) "
+			"FROM entries WHERE key = ?", (str(key),)
+		).fetchone()
+		if row is None:
+			raise KeyError(key)
+		return datastore.util.ChannelMetadata(mtime=row[0], count=row[1])
+	
+	
+	def _contains_sync(self, connection: sqlite3.Connection, key: datastore.Key) -> bool:
+		row = connection.execute("SELECT 1 FROM entries WHERE key = ?", (str(key),)).fetchone()
+		return row is not None
+	
+	
+	def _create_index_sync(self, connection: sqlite3.Connection, name: str, expr: str) -> None:
+		connection.execute(f"CREATE INDEX IF NOT EXISTS \"{name}\" ON objects (path, {expr})")
+	
+	
+	def _compile_query(self, query: datastore.Query) -> typing.Optional[compiled_query_t]:
+		"""Translates the filters and orders of *query* into the ``WHERE`` and
+		``ORDER BY`` clauses of an SQL statement
+		
+		Returns the SQL statement (lacking the keyset condition and the
+		``LIMIT`` clause), its parameters, the expressions of the result order
+		and whether the returned objects must still be checked against the
+		filters, or `None` if the query cannot be expressed in SQL.
+		
+		`datastore.Filter` converts field values to the type of the filter
+		value before comparing them, which SQLite does not do. Comparisons are
+		therefore only evaluated by SQLite for field values of the types that
+		are not converted, while objects whose field has any other type are
+		returned as well and checked by the filter itself.
+		"""
+		# Custom attribute getters may map fields to anything
+		if query.object_getattr is not query_._object_getattr:
+			return None
+		
+		conditions = ["path = ?"]
+		params: typing.List[typing.Any] = [str(query.key)]
+		recheck = False
+		for filter in query.filters:
+			expr = json_field(filter.field)
+			if expr is None or filter.object_getattr is not query_._object_getattr \
+			   or not isinstance(filter.value, JSON_SCALAR_TYPES):
+				return None
+			
+			if filter.value is None:
+				if filter.op not in ("=", "!="):
+					return None  # Comparing against `None` raises in Python
+				conditions.append(f"{expr} IS {'NOT ' if filter.op == '!=' else ''}NULL")
+				continue
+			
+			types = JSON_FILTER_TYPES.get(type(filter.value))
+			if types is None:
+				return None
+			if isinstance(filter.value, int) and not INT64_MIN <= filter.value <= INT64_MAX:
+				return None  # Does not fit into SQLite's integer type
+			type_expr = json_field(filter.field, "json_type")
+			conditions.append(
+				f"(CASE WHEN {type_expr} IN ({', '.join(repr(t) for t in types)}) "
+				f"THEN {expr} {SQL_OPERATORS[filter.op]} ? ELSE 1 END)"
+			)
+			params.append(filter.value)
+			recheck = True
+		
+		order_exprs: typing.List[str] = []
+		order_terms: typing.List[str] = []
+		for order in query.orders:
+			expr = json_field(order.field)
+			if expr is None or order.object_getattr is not query_._object_getattr:
+				return None
+			order_exprs.append(expr)
+			order_terms.append(f"{expr} {'ASC' if order.is_ascending() else 'DESC'}")
+		
+		sql = (f"SELECT {', '.join(['key', 'value'] + order_exprs)} FROM objects "
+		       f"WHERE {' AND '.join(conditions)} ")
+		sql_order = f"ORDER BY {', '.join(order_terms + ['key ASC', 'idx ASC'])}"
+		return sql + "{keyset}" + sql_order, params, order_exprs, recheck
+	
+	
+	def _query_sync(self, connection: sqlite3.Connection, query: datastore.Query,
+	                compiled: compiled_query_t) -> typing.Tuple[typing.List[typing.Any], int]:
+		"""Runs the compiled query and returns the matching objects and the
+		number of objects skipped due to the query's offset"""
+		sql, params, order_exprs, recheck = compiled
+		params = list(params)
+		with transaction(connection, "DEFERRED"):
+			keyset = ""
+			if query.offset_key is not None:
+				# Continue right after the position of the given key in the
+				# result order: All previous order terms equal and the current
+				# one after that of the given key (`NULL` sorts first)
+				offset_key = str(query.offset_key)
+				values = [offset_key]
+				if order_exprs:
+					row = connection.execute(
+						f"SELECT {', '.join(order_exprs)} FROM objects "
+						f"WHERE key = ? ORDER BY idx LIMIT 1", (offset_key,)
+					).fetchone()
+					if row is None:
+						raise KeyError(query.offset_key)
+					values = list(row) + values
+				
+				ascending = [order.is_ascending() for order in query.orders] + [True]
+				alternatives = []
+				for idx, expr in enumerate(order_exprs + ["key"]):
+					terms = [f"{prev} IS ?" for prev in (order_exprs + ["key"])[:idx]]
+					params.extend(values[:idx])
+					if ascending[idx]:
+						terms.append(f"((? IS NULL AND {expr} IS NOT NULL) OR {expr} > ?)")
+					else:
+						terms.append(f"(({expr} IS NULL AND ? IS NOT NULL) OR {expr} < ?)")
+					params.extend((values[idx], values[idx]))
+					alternatives.append(f"({' AND '.join(terms)})")
+				keyset = f"AND ({' OR '.join(alternatives)}) "
+			
+			# The offset is skipped here rather than by SQLite to count the
+			# skipped objects, and the limit can only be left to SQLite if no
+			# objects are dropped by the filters afterwards
+			sql = sql.format(keyset=keyset)
+			if query.limit is not None and not recheck:
+				sql += " LIMIT ?"
+				params.append(query.offset + query.limit)
+			
+			objects: typing.List[typing.Any] = []
+			skipped = 0
+			if query.limit == 0:
+				return objects, skipped
+			for row in connection.execute(sql, params):
+				obj = json.loads(row[1])
+				if recheck and not all(filter(obj) for filter in query.filters):
+					continue
+				if skipped < query.offset:
+					skipped += 1
+					continue
+				objects.append(obj)
+				if len(objects) == query.limit:
+					break
+			return objects, skipped
+	
+	
+	def _query_all_sync(self, connection: sqlite3.Connection, path: str) -> typing.List[typing.Any]:
+		return [json.loads(value) for value, in connection.execute(
+			"SELECT value FROM objects WHERE path = ? ORDER BY key, idx", (path,)
+		)]
+	
+	
+	async def get(self, key: datastore.Key) -> datastore.abc.ReceiveChannel:
+		"""Returns the objects named by *key* or raises `KeyError` otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the objects to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		objects, mtime = await self._run(self._get_sync, key)
+		return datastore.util.receive_channel_from(objects)
+	
+	
+	async def get_all(self, key: datastore.Key) -> typing.List[typing.Any]:
+		"""Returns all the objects named by *key* at once or raises `KeyError`
+		otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the objects to retrieve
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		objects, mtime = await self._run(self._get_sync, key)
+		return objects
+	
+	
+	async def _put(self, key: datastore.Key,  # type: ignore[override]
+	               value: datastore.abc.ReceiveChannel, *, create: bool, replace: bool) -> None:
+		"""Stores or replaces the objects named by *key* with *value*
+		
+		Arguments
+		---------
+		key
+			Key naming the objects to store
+		value
+			The objects to store
+		create
+			Create the given key if it does not exist?
+		replace
+			Replace the given key if it does exist?
+		
+		Raises
+		------
+		KeyError
+			The given *key* doesn't exist and *create* is not ``True``.
+		KeyError
+			The given *key* already exists and *replace* is not ``True``.
+		TypeError
+			One of the given objects is not JSON-serializable
+		"""
+		assert create or replace
+		
+		values = self._encode(await value.collect())
+		async with self._write_lock:
+			self._count += await self._run(self._put_sync, [(key, values)], create, replace)
+	
+	
+	async def put_many(self, items: typing.Iterable[
+		typing.Tuple[datastore.Key, typing.List[typing.Any]]
+	]) -> None:
+		"""Stores or replaces the objects of each of the given ``(key, objects)``
+		pairs in a single transaction
+		
+		Arguments
+		---------
+		items
+			The keys and object lists to store, later items replace earlier
+			ones of the same key
+		
+		Raises
+		------
+		TypeError
+			One of the given objects is not JSON-serializable
+		"""
+		values = [(key, self._encode(objects)) for key, objects in items]
+		if not values:
+			return
+		
+		async with self._write_lock:
+			self._count += await self._run(self._put_sync, values, True, True)
+	
+	
+	async def _put_new_indirect(self, prefix: datastore.Key  # type: ignore[override]
+	) -> datastore.abc.ObjectDatastore._PUT_NEW_INDIRECT_RT:
+		"""Stores the objects passed to the returned callback in a new key below *prefix*
+		
+		The new key is reserved with an empty object list right away.
+		
+		Arguments
+		---------
+		prefix
+			Key below which to store the given objects
+		"""
+		key = prefix.child(str(uuid.uuid4()))
+		async with self._write_lock:
+			self._count += await self._run(self._put_sync, [(key, [])], True, False)
+		
+		async def callback(value: datastore.abc.ReceiveChannel) -> None:
+			await self._put(key, value, create=True, replace=True)
+		return key, callback
+	
+	
+	async def delete(self, key: datastore.Key) -> None:
+		"""Removes the objects named by *key*
+		
+		Arguments
+		---------
+		key
+			Key naming the objects to remove
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		async with self._write_lock:
+			await self._run(self._delete_sync, key)
+			self._count -= 1
+	
+	
+	async def contains(self, key: datastore.Key) -> bool:
+		"""Returns whether any objects named by *key* exist
+		
+		Arguments
+		---------
+		key
+			Key naming the objects to check.
+		"""
+		return await self._run(self._contains_sync, key)
+	
+	
+	async def rename(self, key1: datastore.Key, key2: datastore.Key, *,
+	                 replace: bool = True) -> None:
+		"""Moves key *key1* to *key2*
+		
+		Arguments
+		---------
+		key1
+			The key to rename, must exist
+		key2
+			The new name of the key; if *replace* is ``False``, a key of the
+			same name may not already exist
+		replace
+			Should an existing key at name *key2* be replaced?
+		
+		Raises
+		------
+		KeyError
+			Key *key1* did not exist in this datastore
+		KeyError
+			Key *key2* already exists in this datastore, but *replace* was not ``True``
+		"""
+		async with self._write_lock:
+			self._count += await self._run(self._rename_sync, key1, key2, replace)
+	
+	
+	async def stat(self, key: datastore.Key) -> datastore.util.ChannelMetadata:
+		"""Returns the number of objects and modification time of the objects
+		named by *key*, or raises `KeyError` otherwise
+		
+		Arguments
+		---------
+		key
+			Key naming the objects to check
+		
+		Raises
+		------
+		KeyError
+			The given object was not present in this datastore
+		"""
+		return await self._run(self._stat_sync, key)
+	
+	
+	async def create_index(self, field: str) -> None:
+		"""Creates an index on the given top-level field of the stored objects
+		
+		The index is used by queries filtering or ordering by *field* within
+		a collection.
+		
+		Arguments
+		---------
+		field
+			Name of the object field to index
+		
+		Raises
+		------
+		ValueError
+			The field name cannot be expressed as JSON path
+		"""
+		expr = json_field(field)
+		if expr is None:
+			raise ValueError(f"Cannot index field {field!r}")
+		
+		name = "objects_field_" + field.encode("utf-8").hex()
+		async with self._write_lock:
+			await self._run(self._create_index_sync, name, expr)
+	
+	
+	async def query(self, query: datastore.Query) -> datastore.Cursor:
+		"""Returns an iterable of objects matching criteria expressed in `query`
+		
+		Queries the objects of keys within the namespaced collection
+		corresponding to ``query.key``. Filters, orders, offset and limit are
+		evaluated by SQLite, unless the query uses a custom attribute getter
+		or compares against non-JSON values, in which case all objects of the
+		collection are loaded and the query is applied naively (ignoring
+		:attr:`~datastore.Query.offset_key`). Filters match the same objects
+		either way, while values of different types are ordered according to
+		SQLite's type rules.
+		
+		Arguments
+		---------
+		query
+			Query object describing the objects to return.
+		
+		Raises
+		------
+		KeyError
+			The key given as :attr:`~datastore.Query.offset_key` does not exist
+			and the query is ordered
+		"""
+		compiled = self._compile_query(query)
+		if compiled is None:
+			objects = await self._run(self._query_all_sync, str(query.key))
+			return query(objects)  # type: ignore[no-any-return]
+		
+		objects, skipped = await self._run(self._query_sync, query, compiled)
+		cursor = datastore.Cursor(query, objects)
+		cursor.skipped = skipped
+		return cursor
@@ -4,6 +4,8 @@ __all__ = (
 	"ChannelMetadata",
 	"StreamMetadata",
 	"DatastoreMetadata",
+	"CacheMetadata",
+	"LogMetadata",
 	
 	"receive_channel_from",
 	"receive_stream_from"
@@ -14,6 +16,8 @@ from .core.util.decorator import awaitable_to_context_manager
 from .core.util.metadata import ChannelMetadata
 from .core.util.metadata import StreamMetadata
 from .core.util.metadata import DatastoreMetadata
+from .core.util.metadata import CacheMetadata
+from .core.util.metadata import LogMetadata
 
 from .core.util.stream import receive_channel_from
 from .core.util.stream import receive_stream_from
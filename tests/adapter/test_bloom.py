@@ -0,0 +1,104 @@
+import os.path
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.bloom
+import datastore.core.util.bloom
+from datastore.filesystem import FileSystemDatastore
+from tests.adapter.conftest import make_datastore_test_params
+
+
+def test_counting_bloom_filter():
+	bf = datastore.core.util.bloom.CountingBloomFilter(1000)
+	for idx in range(1000):
+		bf.add(f"/key/{idx}")
+	assert all(f"/key/{idx}" in bf for idx in range(1000))
+	
+	# Should be around 1%
+	false_positives = sum(f"/other/{idx}" in bf for idx in range(10000))
+	assert false_positives < 200
+	
+	for idx in range(500):
+		bf.remove(f"/key/{idx}")
+	assert all(f"/key/{idx}" in bf for idx in range(500, 1000))
+	assert sum(f"/key/{idx}" in bf for idx in range(500)) < 20
+	
+	bf2 = datastore.core.util.bloom.CountingBloomFilter.from_bytes(bf.to_bytes())
+	assert all(f"/key/{idx}" in bf2 for idx in range(500, 1000))
+	
+	with pytest.raises(ValueError):
+		datastore.core.util.bloom.CountingBloomFilter.from_bytes(bf.to_bytes()[:-1])
+
+
+@pytest.mark.parametrize(*make_datastore_test_params("bloom"))
+@trio.testing.trio_test
+async def test_bloom_simple(DatastoreTests, Adapter, DictDatastore, encode_fn):
+	async with Adapter(DictDatastore()) as bs:
+		await DatastoreTests([bs]).subtest_simple()
+
+
+@pytest.mark.parametrize(*make_datastore_test_params("bloom"))
+@trio.testing.trio_test
+async def test_bloom_short_circuit(Adapter, DictDatastore, encode_fn):
+	child = DictDatastore()
+	await child.put(datastore.Key("/a"), encode_fn("a"))
+	
+	async with Adapter.create(child, keys=[datastore.Key("/a")]) as bs:
+		assert await bs.get_all(datastore.Key("/a")) == encode_fn("a")
+		
+		# Values added behind the adapter's back are invisible to it
+		await child.put(datastore.Key("/b"), encode_fn("b"))
+		assert not await bs.contains(datastore.Key("/b"))
+		with pytest.raises(KeyError):
+			await bs.get(datastore.Key("/b"))
+		with pytest.raises(KeyError):
+			await bs.stat(datastore.Key("/b"))
+		
+		await bs.rebuild([datastore.Key("/a"), datastore.Key("/b")])
+		assert await bs.contains(datastore.Key("/b"))
+		
+		await bs.rename(datastore.Key("/b"), datastore.Key("/c"))
+		assert not await bs.contains(datastore.Key("/b"))
+		assert await bs.get_all(datastore.Key("/c")) == encode_fn("b")
+		
+		await bs.delete(datastore.Key("/a"))
+		assert not await child.contains(datastore.Key("/a"))
+		assert str(datastore.Key("/a")) not in bs.filter
+		
+		# The keys of the wrapped datastore are listed if not given
+		await bs.rebuild()
+		assert str(datastore.Key("/c")) in bs.filter
+
+
+@trio.testing.trio_test
+async def test_bloom_persist():
+	with tempfile.TemporaryDirectory() as temp_path:
+		data_path  = os.path.join(temp_path, "data")
+		bloom_path = os.path.join(data_path, ".bloom")
+		
+		# Filter is rebuilt from the datastore listing
+		async with FileSystemDatastore.create(data_path) as fs:
+			await fs.put(datastore.Key("/a/b"), b"1")
+		fs = await FileSystemDatastore.create(data_path)
+		async with datastore.adapter.bloom.BinaryAdapter.create(fs, persist_path=bloom_path) as bs:
+			assert await bs.contains(datastore.Key("/a/b"))
+			assert not await bs.contains(datastore.Key("/a/c"))
+			await bs.put(datastore.Key("/a/c"), b"2")
+		assert os.path.exists(bloom_path)
+		
+		# Filter is loaded from the persisted file (and not from the listing)
+		fs = await FileSystemDatastore.create(data_path)
+		await fs.put(datastore.Key("/d"), b"3")
+		async with datastore.adapter.bloom.BinaryAdapter.create(fs, persist_path=bloom_path) as bs:
+			assert not os.path.exists(bloom_path)
+			assert await bs.contains(datastore.Key("/a/b"))
+			assert await bs.contains(datastore.Key("/a/c"))
+			assert not await bs.contains(datastore.Key("/d"))
+		
+		fs = await FileSystemDatastore.create(data_path)
+		assert sorted([key async for key in fs.keys()]) \
+		       == [datastore.Key("/a/b"), datastore.Key("/a/c"), datastore.Key("/d")]
+		await fs.aclose()
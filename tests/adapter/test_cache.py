@@ -0,0 +1,127 @@
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.cache
+import datastore.adapter.tiered
+
+
+@pytest.mark.parametrize("policy", ["lru", "lfu", "tinylfu"])
+@trio.testing.trio_test
+async def test_cache_simple(DatastoreTests, policy):
+	async with datastore.adapter.cache.BinaryDatastore(1 << 20, policy=policy) as s1, \
+	           datastore.adapter.cache.ObjectDatastore(1000, policy=policy) as s2:
+		await DatastoreTests([s1]).subtest_simple()
+		await DatastoreTests([s2]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_cache_lru():
+	async with datastore.adapter.cache.BinaryDatastore(30, policy="lru") as cache:
+		for name in "abc":
+			await cache.put(datastore.Key(name), b"x" * 10)
+		
+		await cache.get_all(datastore.Key("a"))
+		await cache.put(datastore.Key("d"), b"x" * 10)
+		assert not await cache.contains(datastore.Key("b"))
+		assert await cache.contains(datastore.Key("a"))
+		
+		# Larger value evicts several entries
+		await cache.put(datastore.Key("e"), b"x" * 20)
+		assert [await cache.contains(datastore.Key(name)) for name in "acde"] \
+		       == [False, False, True, True]
+		
+		# Values larger than the entire cache are not cached at all
+		await cache.put(datastore.Key("d"), b"x" * 31)
+		assert not await cache.contains(datastore.Key("d"))
+		assert await cache.contains(datastore.Key("e"))
+		
+		stats = cache.datastore_stats()
+		assert isinstance(stats, datastore.util.CacheMetadata)
+		assert (stats.size, stats.hits, stats.misses, stats.evictions) == (20, 1, 0, 3)
+
+
+@trio.testing.trio_test
+async def test_cache_lfu():
+	async with datastore.adapter.cache.ObjectDatastore(3, policy="lfu") as cache:
+		for name in "abc":
+			await cache.put(datastore.Key(name), [name])
+		
+		for name in "aacb":
+			await cache.get_all(datastore.Key(name))
+		await cache.put(datastore.Key("d"), ["d"])
+		assert [await cache.contains(datastore.Key(name)) for name in "abcd"] \
+		       == [True, True, False, True]
+		
+		# The least-recently used of the least-frequently used entries goes first
+		await cache.put(datastore.Key("e"), ["e"])
+		assert [await cache.contains(datastore.Key(name)) for name in "abde"] \
+		       == [True, True, False, True]
+		
+		with pytest.raises(KeyError):
+			await cache.get(datastore.Key("c"))
+		
+		stats = cache.datastore_stats()
+		assert (stats.size, stats.hits, stats.misses, stats.evictions) == (None, 4, 1, 2)
+
+
+@trio.testing.trio_test
+async def test_cache_tinylfu():
+	async with datastore.adapter.cache.ObjectDatastore(100, policy="tinylfu") as cache:
+		popular = [datastore.Key(f"/popular/{idx}") for idx in range(50)]
+		for key in popular:
+			await cache.put(key, [1])
+			for _ in range(3):
+				await cache.get_all(key)
+		
+		# A scan of keys that are only ever requested once must not be able
+		# to displace the frequently requested keys
+		for idx in range(1000):
+			await cache.put(datastore.Key(f"/scan/{idx}"), [1])
+		
+		assert len(cache) == 100
+		assert all([await cache.contains(key) for key in popular])
+		assert cache.datastore_stats().evictions == 950
+
+
+@trio.testing.trio_test
+async def test_cache_weight():
+	async with datastore.adapter.cache.ObjectDatastore(
+			10, max_weight=5, weigher=lambda value: sum(value)
+	) as cache:
+		await cache.put(datastore.Key("a"), [1, 2])
+		await cache.put(datastore.Key("b"), [3])
+		await cache.put(datastore.Key("c"), [1])
+		assert not await cache.contains(datastore.Key("a"))
+		assert (await cache.stat(datastore.Key("b"))).count == 1
+	
+	with pytest.raises(ValueError):
+		datastore.adapter.cache.ObjectDatastore()
+
+
+@trio.testing.trio_test
+async def test_cache_tiered():
+	cache = datastore.adapter.cache.BinaryDatastore(10)
+	backing = datastore.BinaryDictDatastore()
+	async with datastore.adapter.tiered.BinaryAdapter([cache, backing]) as ts:
+		for name in "abc":
+			await ts.put(datastore.Key(name), name.encode() * 5)
+		assert len(cache) == 2
+		assert len(backing) == 3
+		
+		# Evicted values are still available from the backing datastore and
+		# are cached again on access
+		assert await ts.get_all(datastore.Key("a")) == b"aaaaa"
+		assert await cache.contains(datastore.Key("a"))
+		assert not await cache.contains(datastore.Key("b"))
+		
+		stats = cache.datastore_stats()
+		assert (stats.hits, stats.misses, stats.evictions) == (0, 1, 2)
+		
+		# The counters are kept when adding up the statistics of all tiers
+		stats = ts.datastore_stats()
+		assert (stats.hits, stats.misses, stats.evictions) == (0, 1, 2)
+		assert stats.size == cache.datastore_stats().size + backing.datastore_stats().size
+		
+		stats = datastore.util.CacheMetadata(hits=1) + datastore.util.CacheMetadata(hits=2)
+		assert stats.hits == 3
@@ -0,0 +1,67 @@
+import random
+
+import trio.testing
+
+import datastore
+import datastore.adapter.chunk
+
+
+def make_adapter(child):
+	return datastore.adapter.chunk.BinaryAdapter(
+		child, min_size=1024, avg_size=2048, max_size=4096
+	)
+
+
+@trio.testing.trio_test
+async def test_chunk_simple(DatastoreTests):
+	async with make_adapter(datastore.BinaryDictDatastore()) as cs:
+		await DatastoreTests([cs]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_chunk():
+	puts = []
+	
+	class CountingDictDatastore(datastore.BinaryDictDatastore):
+		async def _put(self, key, value, **kwargs):
+			puts.append(key)
+			await super()._put(key, value, **kwargs)
+	
+	def chunk_puts():
+		return [key for key in puts if key.is_descendant_of(cs.prefix.child("chunks"))]
+	
+	value = random.Random(0).getrandbits(8 * 100 * 1024).to_bytes(100 * 1024, "little")
+	child = CountingDictDatastore()
+	async with make_adapter(child) as cs:
+		await cs.put(datastore.Key("/a"), value)
+		chunk_count = len(chunk_puts())
+		assert 100 // 4 <= chunk_count <= 100
+		assert await cs.get_all(datastore.Key("/a")) == value
+		assert (await cs.stat(datastore.Key("/a"))).size == len(value)
+		
+		# Ranged reads
+		async with await cs.get(datastore.Key("/a"), offset=50000, length=20000) as stream:
+			assert stream.size == 20000
+			assert await stream.collect() == value[50000:70000]
+		async with await cs.get(datastore.Key("/a"), offset=len(value) - 10) as stream:
+			assert await stream.collect() == value[-10:]
+		
+		# Inserting some bytes only rewrites the chunks around the edit
+		puts.clear()
+		value2 = value[:30000] + b"inserted" + value[30000:]
+		await cs.put(datastore.Key("/a"), value2)
+		assert 1 <= len(chunk_puts()) <= 3
+		assert await cs.get_all(datastore.Key("/a")) == value2
+		
+		# Identical values share their chunks
+		puts.clear()
+		await cs.put(datastore.Key("/b"), value2)
+		assert chunk_puts() == []
+		await cs.rename(datastore.Key("/b"), datastore.Key("/a"))
+		await cs.delete(datastore.Key("/a"))
+		stored = [key async for key in child.keys()]
+		assert stored == []
+		
+		# Values stored without the adapter are passed through
+		await child.put(datastore.Key("/c"), b"plain")
+		assert await cs.get_all(datastore.Key("/c")) == b"plain"
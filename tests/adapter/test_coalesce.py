@@ -0,0 +1,105 @@
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.coalesce
+import datastore.adapter.tiered
+from tests.adapter.conftest import make_datastore_test_params
+
+
+@pytest.mark.parametrize(*make_datastore_test_params("coalesce"))
+@trio.testing.trio_test
+async def test_coalesce_simple(DatastoreTests, Adapter, DictDatastore, encode_fn):
+	async with Adapter(DictDatastore()) as cs:
+		await DatastoreTests([cs]).subtest_simple()
+
+
+@pytest.mark.parametrize(*make_datastore_test_params("coalesce"))
+@trio.testing.trio_test
+async def test_coalesce(Adapter, DictDatastore, encode_fn):
+	calls = []
+	
+	class SlowDictDatastore(DictDatastore):
+		async def get_all(self, key):
+			calls.append(key)
+			try:
+				return await super().get_all(key)
+			finally:
+				await trio.sleep(0.1)
+	
+	async with Adapter(SlowDictDatastore()) as cs:
+		await cs.put(datastore.Key("/a"), encode_fn("a"))
+		
+		results = []
+		async def get_all(key):
+			try:
+				results.append(await cs.get_all(key))
+			except KeyError:
+				results.append(None)
+		
+		async def get(key):
+			async with await cs.get(key) as stream:
+				results.append(await stream.collect())
+		
+		async with trio.open_nursery() as nursery:
+			for _ in range(5):
+				nursery.start_soon(get_all, datastore.Key("/a"))
+				nursery.start_soon(get, datastore.Key("/a"))
+				nursery.start_soon(get_all, datastore.Key("/b"))
+		assert sorted(calls) == [datastore.Key("/a"), datastore.Key("/b")]
+		assert sorted(results, key=repr) == [None] * 5 + [encode_fn("a")] * 10
+		
+		# Lookups started after a change are never shared with earlier ones
+		calls.clear()
+		results.clear()
+		async with trio.open_nursery() as nursery:
+			nursery.start_soon(get_all, datastore.Key("/a"))
+			await trio.sleep(0.05)
+			await cs.put(datastore.Key("/a"), encode_fn("b"))
+			nursery.start_soon(get_all, datastore.Key("/a"))
+		assert calls == [datastore.Key("/a"), datastore.Key("/a")]
+		assert results == [encode_fn("a"), encode_fn("b")]
+		
+		# Cancelling the first caller does not fail the others
+		calls.clear()
+		results.clear()
+		async with trio.open_nursery() as nursery:
+			with trio.move_on_after(0.05):
+				async with trio.open_nursery() as nursery2:
+					nursery2.start_soon(get_all, datastore.Key("/a"))
+					await trio.sleep(0.01)
+					nursery.start_soon(get_all, datastore.Key("/a"))
+		assert calls == [datastore.Key("/a"), datastore.Key("/a")]
+		assert results == [encode_fn("b")]
+
+
+@trio.testing.trio_test
+async def test_coalesce_tiered():
+	puts = []
+	
+	class SlowDictDatastore(datastore.BinaryDictDatastore):
+		async def get(self, key):
+			await trio.sleep(0.1)
+			return await super().get(key)
+	
+	class CountingDictDatastore(datastore.BinaryDictDatastore):
+		async def _put(self, key, value, **kwargs):
+			puts.append(key)
+			await super()._put(key, value, **kwargs)
+	
+	s1 = CountingDictDatastore()
+	s2 = SlowDictDatastore()
+	await s2.put(datastore.Key("/a"), b"value")
+	async with datastore.adapter.coalesce.BinaryAdapter(
+			datastore.adapter.tiered.BinaryAdapter([s1, s2])
+	) as cs:
+		async def get_all():
+			assert await cs.get_all(datastore.Key("/a")) == b"value"
+		
+		async with trio.open_nursery() as nursery:
+			for _ in range(10):
+				nursery.start_soon(get_all)
+		
+		# The value was only copied to the upper tier once
+		assert puts == [datastore.Key("/a")]
+		assert await s1.get_all(datastore.Key("/a")) == b"value"
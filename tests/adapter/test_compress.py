@@ -0,0 +1,59 @@
+import os
+
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.compress
+
+
+@pytest.mark.parametrize("codec", ["zlib", "bz2", "lzma"])
+@trio.testing.trio_test
+async def test_compress_simple(DatastoreTests, codec):
+	async with datastore.adapter.compress.BinaryAdapter(
+			datastore.BinaryDictDatastore(), codec=codec
+	) as cs:
+		await DatastoreTests([cs]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_compress():
+	child = datastore.BinaryDictDatastore()
+	async with datastore.adapter.compress.BinaryAdapter(child, frame_size=1000) as cs:
+		value = b"".join(b"%d," % idx for idx in range(2000))
+		await cs.put(datastore.Key("/a"), value)
+		assert len(await child.get_all(datastore.Key("/a"))) < len(value) // 2
+		assert await cs.get_all(datastore.Key("/a")) == value
+		assert (await cs.stat(datastore.Key("/a"))).size == len(value)
+		
+		# Ranged reads
+		async with await cs.get(datastore.Key("/a"), offset=2500, length=1000) as stream:
+			assert stream.size == 1000
+			assert await stream.collect() == value[2500:3500]
+		async with await cs.get(datastore.Key("/a"), offset=len(value) - 10) as stream:
+			assert await stream.collect() == value[-10:]
+		
+		# Values of unknown size
+		async def generate():
+			for idx in range(0, len(value), 700):
+				yield value[idx:(idx + 700)]
+		await cs.put(datastore.Key("/b"), generate())
+		assert await cs.get_all(datastore.Key("/b")) == value
+		assert (await cs.stat(datastore.Key("/b"))).size == len(value)
+		
+		# Incompressible data is stored as-is after sampling it
+		random = os.urandom(100 * 1000)
+		await cs.put(datastore.Key("/c"), random)
+		assert len(await child.get_all(datastore.Key("/c"))) == len(random) + 100 * 9 + 16
+		assert await cs.get_all(datastore.Key("/c")) == random
+		
+		# Values stored without the adapter are passed through
+		await child.put(datastore.Key("/d"), b"uncompressed")
+		assert await cs.get_all(datastore.Key("/d")) == b"uncompressed"
+		async with await cs.get(datastore.Key("/d"), offset=2, length=8) as stream:
+			assert await stream.collect() == b"compress"
+		
+		# Truncated values are detected
+		await child.put(datastore.Key("/e"), (await child.get_all(datastore.Key("/a")))[:-1])
+		with pytest.raises(RuntimeError):
+			await cs.get_all(datastore.Key("/e"))
@@ -0,0 +1,58 @@
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.dedup
+
+
+@trio.testing.trio_test
+async def test_dedup_simple(DatastoreTests):
+	async with datastore.adapter.dedup.BinaryAdapter(datastore.BinaryDictDatastore()) as ds:
+		await DatastoreTests([ds]).subtest_simple()
+
+
+@pytest.mark.parametrize("size", [1000, 100 * 1024])
+@trio.testing.trio_test
+async def test_dedup(size):
+	puts = []
+	
+	class CountingDictDatastore(datastore.BinaryDictDatastore):
+		async def _put(self, key, value, **kwargs):
+			puts.append(key)
+			await super()._put(key, value, **kwargs)
+	
+	child = CountingDictDatastore()
+	async with datastore.adapter.dedup.BinaryAdapter(child) as ds:
+		value1 = b"1" * size
+		value2 = b"2" * size
+		
+		async def generate(value):
+			for idx in range(0, len(value), 1000):
+				yield value[idx:(idx + 1000)]
+		
+		for name in "abc":
+			await ds.put(datastore.Key(f"/{name}"), generate(value1))
+		assert await ds.get_all(datastore.Key("/b")) == value1
+		assert (await ds.stat(datastore.Key("/c"))).size == size
+		
+		# The content was only stored once (and small values were only
+		# written once as well)
+		stored = child.datastore_stats().size
+		assert size <= stored < 2 * size
+		if size <= ds.spool_size:
+			assert len([key for key in puts if key.is_descendant_of(ds.prefix)]) == 4
+		
+		# Replacing and deleting references releases the content once unused
+		await ds.put(datastore.Key("/a"), value2)
+		await ds.rename(datastore.Key("/b"), datastore.Key("/a"))
+		assert await ds.get_all(datastore.Key("/a")) == value1
+		await ds.delete(datastore.Key("/a"))
+		assert await ds.get_all(datastore.Key("/c")) == value1
+		await ds.delete(datastore.Key("/c"))
+		
+		assert [key async for key in child.keys()] == []
+		
+		# Values stored without the adapter are passed through
+		await child.put(datastore.Key("/d"), b"plain")
+		assert await ds.get_all(datastore.Key("/d")) == b"plain"
+		await ds.delete(datastore.Key("/d"))
@@ -0,0 +1,82 @@
+import functools
+import os
+import signal
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.processsharded
+import datastore.filesystem
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+def open_dict_shard(index):
+	return datastore.BinaryDictDatastore()
+
+
+async def open_filesystem_shard(root, index):
+	path = os.path.join(root, str(index))
+	os.makedirs(path, exist_ok=True)
+	return await datastore.filesystem.FileSystemDatastore.create(path, stats=True)
+
+
+def open_broken_shard(index):
+	if index == 1:
+		raise ValueError(f"Shard {index} is broken")
+	return datastore.BinaryDictDatastore()
+
+
+@trio.testing.trio_test
+async def test_processsharded_simple(DatastoreTests):
+	async with datastore.adapter.processsharded.BinaryAdapter.create(open_dict_shard, 3) as ds:
+		await DatastoreTests([ds], test_put_new=False, test_rename=False).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_processsharded_batch(temp_path):
+	factory = functools.partial(open_filesystem_shard, temp_path)
+	async with datastore.adapter.processsharded.BinaryAdapter.create(factory, 3) as ds:
+		items = [(datastore.Key(f"/{idx}"), str(idx).encode() * 100) for idx in range(100)]
+		await ds.put_many(items)
+		
+		# Values end up in the worker of the shard selected by `shard()`
+		for key, value in items:
+			assert await ds.get_datastore_at(ds.shard(key)).get_all(key) == value
+		
+		keys = [key for key, _ in items] + [datastore.Key("/missing")]
+		assert await ds.get_many(keys) == [value for _, value in items] + [None]
+		
+		assert (await ds.refresh_stats()).size == sum(len(value) for _, value in items)
+		assert ds.datastore_stats().size == sum(len(value) for _, value in items)
+
+
+@trio.testing.trio_test
+async def test_processsharded_restart(temp_path):
+	factory = functools.partial(open_filesystem_shard, temp_path)
+	async with datastore.adapter.processsharded.BinaryAdapter.create(factory, 2) as ds:
+		key = datastore.Key("/a")
+		await ds.put(key, b"value")
+		
+		store = ds.get_datastore_at(ds.shard(key))
+		os.kill(store._process.pid, signal.SIGKILL)
+		
+		# Requests sent while the worker is down wait for it to be restarted
+		with trio.fail_after(30):
+			while ds.restarts < 1:
+				await trio.sleep(0.01)
+			assert await ds.get_all(key) == b"value"
+		assert ds.restarts == 1
+
+
+@trio.testing.trio_test
+async def test_processsharded_startup_failure():
+	with pytest.raises(RuntimeError, match="Shard 1 is broken"):
+		async with datastore.adapter.processsharded.BinaryAdapter.create(open_broken_shard, 2):
+			pass
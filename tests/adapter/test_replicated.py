@@ -0,0 +1,146 @@
+import os
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.replicated
+import datastore.filesystem
+from tests.adapter.conftest import make_datastore_test_params
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+class FailingDatastore(datastore.BinaryDictDatastore):
+	async def _put(self, key, value, **kwargs):
+		raise RuntimeError("Disk full")
+
+
+class SlowDatastore(datastore.BinaryDictDatastore):
+	slow = False
+	
+	async def get(self, key):
+		if self.slow:
+			await trio.sleep(10)
+		return await super().get(key)
+
+
+class GatedFileSystemDatastore(datastore.filesystem.FileSystemDatastore):
+	gate = None
+	
+	async def _put(self, key, value, **kwargs):
+		# Only the first write after setting the gate waits for it
+		gate, self.gate = self.gate, None
+		if gate is not None:
+			await gate.wait()
+		return await super()._put(key, value, **kwargs)
+
+
+@pytest.mark.parametrize(*make_datastore_test_params("replicated"))
+@trio.testing.trio_test
+async def test_replicated_simple(DatastoreTests, Adapter, DictDatastore, encode_fn):
+	async with Adapter([DictDatastore() for _ in range(3)]) as ds1, \
+	           Adapter([DictDatastore() for _ in range(3)], write_quorum=3, read_quorum=1) as ds2:
+		await DatastoreTests([ds1, ds2], test_put_new=False).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_replicated_read_repair(temp_path):
+	replicas = []
+	for idx in range(3):
+		os.mkdir(os.path.join(temp_path, str(idx)))
+		replicas.append(await datastore.filesystem.FileSystemDatastore.create(
+			os.path.join(temp_path, str(idx))
+		))
+	
+	async with datastore.adapter.replicated.BinaryAdapter(replicas, read_quorum=3) as ds:
+		key = datastore.Key("/a")
+		await ds.put(key, b"old")
+		await ds.wait_idle()
+		
+		# One replica received a newer value, another lost the value
+		await trio.sleep(0.01)
+		await replicas[1].put(key, b"new")
+		await replicas[2].delete(key)
+		
+		assert await ds.get_all(key) == b"new"
+		await ds.wait_idle()
+		for replica in replicas:
+			assert await replica.get_all(key) == b"new"
+		
+		await ds.delete(key)
+		await ds.wait_idle()
+		assert not await ds.contains(key)
+		with pytest.raises(KeyError):
+			await ds.delete(key)
+
+
+@trio.testing.trio_test
+async def test_replicated_read_repair_delayed(temp_path):
+	replicas = []
+	for idx, cls in enumerate([datastore.filesystem.FileSystemDatastore, GatedFileSystemDatastore,
+	                           datastore.filesystem.FileSystemDatastore]):
+		os.mkdir(os.path.join(temp_path, str(idx)))
+		replicas.append(await cls.create(os.path.join(temp_path, str(idx))))
+	
+	async with datastore.adapter.replicated.BinaryAdapter(replicas, write_quorum=2,
+	                                                      read_quorum=2) as ds:
+		key = datastore.Key("/a")
+		await ds.put(key, b"v1")
+		await ds.wait_idle()
+		
+		# The read repair of a replica that missed the value is delayed until
+		# after a newer value has been written
+		await replicas[1].delete(key)
+		gate = replicas[1].gate = trio.Event()
+		assert await ds.get_all(key) == b"v1"
+		await trio.testing.wait_all_tasks_blocked()
+		
+		await trio.sleep(0.01)
+		await ds.put(key, b"v3")
+		gate.set()
+		await ds.wait_idle()
+		for replica in replicas:
+			assert await replica.get_all(key) == b"v3"
+
+
+@trio.testing.trio_test
+async def test_replicated_write_quorum():
+	replicas = [datastore.BinaryDictDatastore(), datastore.BinaryDictDatastore(), FailingDatastore()]
+	async with datastore.adapter.replicated.BinaryAdapter(replicas, write_quorum=2) as ds:
+		await ds.put(datastore.Key("/a"), b"value")
+		assert await replicas[0].get_all(datastore.Key("/a")) == b"value"
+		assert await replicas[1].get_all(datastore.Key("/a")) == b"value"
+		
+		with pytest.raises(KeyError):
+			await ds.put(datastore.Key("/b"), b"value", create=False)
+	
+	replicas = [datastore.BinaryDictDatastore(), FailingDatastore(), FailingDatastore()]
+	async with datastore.adapter.replicated.BinaryAdapter(replicas, write_quorum=2) as ds:
+		with pytest.raises(RuntimeError, match="quorum"):
+			await ds.put(datastore.Key("/a"), b"value")
+	
+	with pytest.raises(ValueError):
+		datastore.adapter.replicated.BinaryAdapter(replicas, read_quorum=4)
+
+
+@trio.testing.trio_test
+async def test_replicated_hedging():
+	replicas = [SlowDatastore(), SlowDatastore()]
+	async with datastore.adapter.replicated.BinaryAdapter(replicas, write_quorum=2, read_quorum=1,
+	                                                      hedge_percentile=0.9) as ds:
+		key = datastore.Key("/a")
+		await ds.put(key, b"value")
+		for _ in range(50):
+			assert await ds.get_all(key) == b"value"
+		
+		# Reads sent to the slow replica are answered by the other one
+		replicas[0].slow = True
+		with trio.fail_after(5):
+			for _ in range(4):
+				assert await ds.get_all(key) == b"value"
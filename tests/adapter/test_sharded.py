@@ -2,9 +2,10 @@ import logging
 import typing
 
 import pytest
-import trio
+import trio.testing
 
 import datastore
+import datastore.adapter.sharded
 from tests.adapter.conftest import make_datastore_test_params
 
 
@@ -151,3 +152,101 @@ async def test_sharded(DatastoreTests, Adapter, DictDatastore, encode_fn):
 	
 	# Datastores should have been cleaned up by aexit
 	assert len(sharded._stores) == 0
+
+
+def test_sharded_jump_hash():
+	hashes = [hash(datastore.Key(f"/{idx}")) for idx in range(10000)]
+	
+	before = [datastore.adapter.sharded.jump_hash(h, 10) for h in hashes]
+	after  = [datastore.adapter.sharded.jump_hash(h, 11) for h in hashes]
+	assert set(before) == set(range(10))
+	
+	# Keys only move to the new bucket
+	moved = [new for old, new in zip(before, after) if old != new]
+	assert set(moved) == {10}
+	assert 700 < len(moved) < 1100
+
+
+def test_sharded_rendezvous_hash():
+	hashes = [hash(datastore.Key(f"/{idx}")) for idx in range(10000)]
+	nodes = [(node_id, 1.0) for node_id in range(5)]
+	
+	before = [nodes[datastore.adapter.sharded.rendezvous_hash(h, nodes)][0] for h in hashes]
+	
+	# Removing a node only moves its own keys
+	removed = nodes[:2] + nodes[3:]
+	after = [removed[datastore.adapter.sharded.rendezvous_hash(h, removed)][0] for h in hashes]
+	assert all(old == new for old, new in zip(before, after) if old != 2)
+	
+	# Weights determine the share of keys assigned to each node
+	weighted = [(0, 3.0), (1, 1.0)]
+	selected = [datastore.adapter.sharded.rendezvous_hash(h, weighted) for h in hashes]
+	assert 7200 < selected.count(0) < 7800
+
+
+@pytest.mark.parametrize("placement", ["jump", "rendezvous"])
+@pytest.mark.parametrize(*make_datastore_test_params("sharded"))
+@trio.testing.trio_test
+async def test_sharded_rebalance(Adapter, DictDatastore, encode_fn, placement):
+	stores = [DictDatastore() for _ in range(4)]
+	keys = [datastore.Key(f"/key/{idx}") for idx in range(500)]
+	
+	async with Adapter(stores, placement=placement, rebalance=True) as sharded:
+		for idx, key in enumerate(keys):
+			await sharded.put(key, encode_fn(idx))
+		
+		new_store = DictDatastore()
+		sharded.append_datastore(new_store)
+		assert sharded.rebalancing
+		with pytest.raises(RuntimeError):
+			sharded.append_datastore(DictDatastore())
+		
+		# Keys can be read and modified while being moved
+		await sharded.put(keys[0], encode_fn("new"))
+		await sharded.delete(keys[1])
+		for idx, key in enumerate(keys[2:], 2):
+			assert await sharded.get_all(key) == encode_fn(idx)
+		
+		await sharded.wait_rebalanced()
+		assert not sharded.rebalancing
+		
+		# Only the keys assigned to the new shard were moved
+		assert 50 < len(new_store) < 150
+		assert sum(len(store) for store in sharded._stores) == len(keys) - 1
+		for key in keys[2:]:
+			assert await sharded.get_datastore_at(sharded.shard(key)).contains(key)
+		assert await sharded.get_all(keys[0]) == encode_fn("new")
+		assert not await sharded.contains(keys[1])
+
+
+@trio.testing.trio_test
+async def test_sharded_query():
+	stores = [datastore.ObjectDictDatastore() for _ in range(4)]
+	pkey = datastore.Key("/people")
+	ages = list(range(100))
+	
+	def getattr_fn(obj, field):
+		return obj[0][field]
+	
+	async with datastore.adapter.sharded.ObjectAdapter(stores) as sharded:
+		for age in ages:
+			await sharded.put(pkey.child(str(age)), [{"age": age}])
+		
+		async def query_ages(**kwargs):
+			query = datastore.Query(pkey, object_getattr=getattr_fn, **kwargs)
+			return [item[0]["age"] for item in await sharded.query(query.order("-age"))]
+		
+		# Results of all shards are merged in order
+		assert await query_ages() == ages[::-1]
+		assert await query_ages(limit=10) == ages[::-1][:10]
+		assert await query_ages(offset=95) == ages[::-1][95:]
+		assert await query_ages(offset=30, limit=20) == ages[::-1][30:50]
+		
+		# Filters are applied by each shard
+		query = datastore.Query(pkey, object_getattr=getattr_fn).filter("age", "<", 10)
+		assert sorted(item[0]["age"] for item in await sharded.query(query)) == ages[:10]
+		
+		cursor = await sharded.query(datastore.Query(pkey, offset=10, limit=5))
+		assert len(list(cursor)) == 5
+		assert cursor.skipped == 10
+		assert cursor.returned == 5
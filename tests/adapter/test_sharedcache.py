@@ -0,0 +1,111 @@
+import multiprocessing
+import uuid
+
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.sharedcache
+import datastore.adapter.tiered
+
+
+@pytest.fixture
+def cache_name():
+	name = f"test-{uuid.uuid4().hex[:12]}"
+	yield name
+	try:
+		cache = datastore.adapter.sharedcache.BinaryDatastore(name, 1 << 16)
+	except ValueError:
+		return
+	cache.unlink()
+	trio.run(cache.aclose)
+
+
+def put_in_child(name, key, value):
+	async def main():
+		async with datastore.adapter.sharedcache.BinaryDatastore(name, 1 << 20) as cache:
+			await cache.put(datastore.Key(key), value)
+	trio.run(main)
+
+
+@trio.testing.trio_test
+async def test_sharedcache_simple(DatastoreTests, cache_name):
+	async with datastore.adapter.sharedcache.BinaryDatastore(cache_name, 1 << 20) as cache:
+		await DatastoreTests([cache]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_sharedcache_eviction(cache_name):
+	async with datastore.adapter.sharedcache.BinaryDatastore(cache_name, 64 * 256, stripes=1) as cache:
+		# Values spanning several slabs
+		await cache.put(datastore.Key("/large"), bytes(range(256)) * 20)
+		assert await cache.get_all(datastore.Key("/large")) == bytes(range(256)) * 20
+		assert (await cache.stat(datastore.Key("/large"))).size == 5120
+		
+		for idx in range(300):
+			await cache.put(datastore.Key(f"/{idx}"), b"x" * 100)
+			# Keep one entry in use, so that CLOCK never evicts it
+			assert await cache.get_all(datastore.Key("/0")) == b"x" * 100
+		
+		assert await cache.contains(datastore.Key("/0"))
+		assert await cache.contains(datastore.Key("/299"))
+		assert not await cache.contains(datastore.Key("/large"))
+		assert len(cache) == 64
+		
+		# Values larger than a stripe are not cached and drop the old value
+		await cache.put(datastore.Key("/0"), b"x" * (64 * 256))
+		assert not await cache.contains(datastore.Key("/0"))
+		
+		# All remaining entries can still be found after evictions and
+		# deletions moved them around in the hash table
+		names = [f"/{idx}" for idx in range(300) if await cache.contains(datastore.Key(f"/{idx}"))]
+		for name in names[::2]:
+			await cache.delete(datastore.Key(name))
+		for name in names[1::2]:
+			assert await cache.get_all(datastore.Key(name)) == b"x" * 100
+		
+		stats = cache.datastore_stats()
+		assert isinstance(stats, datastore.util.CacheMetadata)
+		assert stats.size == len(names[1::2]) * 100
+		assert stats.evictions == 1 + 300 - 64
+		
+		with pytest.raises(KeyError):
+			await cache.delete(datastore.Key("/large"))
+
+
+@trio.testing.trio_test
+async def test_sharedcache_processes(cache_name):
+	async with datastore.adapter.sharedcache.BinaryDatastore(cache_name, 1 << 20) as cache1, \
+	           datastore.adapter.sharedcache.BinaryDatastore(cache_name, 1 << 20) as cache2:
+		await cache1.put(datastore.Key("/a"), b"a")
+		assert await cache2.get_all(datastore.Key("/a")) == b"a"
+		
+		process = multiprocessing.get_context("spawn").Process(
+			target=put_in_child, args=(cache_name, "/b", b"b")
+		)
+		process.start()
+		await trio.to_thread.run_sync(process.join)
+		assert process.exitcode == 0
+		
+		assert await cache1.get_all(datastore.Key("/b")) == b"b"
+		assert len(cache2) == 2
+		
+		# A process dying while modifying a stripe causes it to be cleared
+		_, _, stripe, _ = cache1._locate(datastore.Key("/a"))
+		offset = datastore.adapter.sharedcache._HEADER.size \
+		         + stripe * datastore.adapter.sharedcache._STRIPE.size
+		datastore.adapter.sharedcache._STRIPE_SEQ.pack_into(cache1._buf, offset, 1)
+		assert not await cache2.contains(datastore.Key("/a"))
+		await cache2.put(datastore.Key("/a"), b"a2")
+		assert await cache1.get_all(datastore.Key("/a")) == b"a2"
+
+
+@trio.testing.trio_test
+async def test_sharedcache_tiered(cache_name):
+	async with datastore.adapter.sharedcache.BinaryDatastore(cache_name, 1 << 20) as cache, \
+	           datastore.BinaryDictDatastore() as store, \
+	           datastore.adapter.tiered.BinaryAdapter([cache, store]) as ts:
+		await store.put(datastore.Key("/a"), b"value")
+		assert await ts.get_all(datastore.Key("/a")) == b"value"
+		await trio.testing.wait_all_tasks_blocked()
+		assert await cache.get_all(datastore.Key("/a")) == b"value"
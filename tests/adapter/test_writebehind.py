@@ -0,0 +1,116 @@
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.writebehind
+from tests.adapter.conftest import make_datastore_test_params
+
+
+@pytest.mark.parametrize(*make_datastore_test_params("writebehind"))
+@trio.testing.trio_test
+async def test_writebehind_simple(DatastoreTests, Adapter, DictDatastore, encode_fn):
+	async with Adapter(DictDatastore()) as ws:
+		await DatastoreTests([ws]).subtest_simple()
+
+
+@pytest.mark.parametrize(*make_datastore_test_params("writebehind"))
+@trio.testing.trio_test
+async def test_writebehind(Adapter, DictDatastore, encode_fn):
+	puts = []
+	
+	class CountingDictDatastore(DictDatastore):
+		async def _put(self, key, value, **kwargs):
+			puts.append(key)
+			await super()._put(key, value, **kwargs)
+	
+	child = CountingDictDatastore()
+	async with Adapter(child, flush_interval=60) as ws:
+		# Values are visible through the adapter right away, but not written yet
+		for idx in range(3):
+			await ws.put(datastore.Key("/a"), encode_fn(idx))
+		await ws.put(datastore.Key("/b"), encode_fn("b"))
+		assert await ws.get_all(datastore.Key("/a")) == encode_fn(2)
+		assert await ws.contains(datastore.Key("/b"))
+		assert await ws.stat(datastore.Key("/b")) is not None
+		assert not await child.contains(datastore.Key("/a"))
+		
+		# Repeated writes to the same key were collapsed
+		await ws.flush()
+		assert sorted(puts) == [datastore.Key("/a"), datastore.Key("/b")]
+		assert await child.get_all(datastore.Key("/a")) == encode_fn(2)
+		
+		# Buffered values are flushed before deleting
+		await ws.put(datastore.Key("/b"), encode_fn("c"))
+		await ws.delete(datastore.Key("/b"))
+		assert not await ws.contains(datastore.Key("/b"))
+		assert not await child.contains(datastore.Key("/b"))
+		
+		await ws.put(datastore.Key("/c"), encode_fn("c"))
+	
+	# Closing drains the buffer
+	assert puts[-1] == datastore.Key("/c")
+
+
+@trio.testing.trio_test
+async def test_writebehind_thresholds():
+	batches = []
+	
+	class BatchingDictDatastore(datastore.BinaryDictDatastore):
+		async def put_many(self, items):
+			batches.append(sorted(key for key, _ in items))
+			await trio.sleep(0.05)
+			for key, value in items:
+				await self.put(key, value)
+	
+	child = BatchingDictDatastore()
+	async with datastore.adapter.writebehind.BinaryAdapter(
+			child, max_size=30, flush_size=20, flush_interval=0.1
+	) as ws:
+		# Written after the flush interval has passed
+		await ws.put(datastore.Key("/a"), b"x" * 5)
+		await trio.sleep(0.05)
+		assert batches == []
+		await trio.sleep(0.1)
+		assert batches == [[datastore.Key("/a")]]
+		
+		# Written right away once the flush size is reached
+		await ws.put(datastore.Key("/b"), b"x" * 10)
+		await ws.put(datastore.Key("/c"), b"x" * 10)
+		await trio.sleep(0.01)
+		assert batches[1:] == [[datastore.Key("/b"), datastore.Key("/c")]]
+		
+		# Blocks until there is space in the buffer again
+		await ws.put(datastore.Key("/d"), b"x" * 15)
+		with trio.move_on_after(0.01) as cancel_scope:
+			await ws.put(datastore.Key("/e"), b"x" * 16)
+		assert cancel_scope.cancelled_caught
+		await ws.put(datastore.Key("/e"), b"x" * 16)
+		assert await child.contains(datastore.Key("/d"))
+		
+		# Values larger than the buffer are written directly
+		await ws.put(datastore.Key("/f"), b"x" * 31)
+		assert await child.contains(datastore.Key("/f"))
+		assert await child.contains(datastore.Key("/e"))
+
+
+@trio.testing.trio_test
+async def test_writebehind_error():
+	fail = True
+	
+	class FailingDictDatastore(datastore.BinaryDictDatastore):
+		async def _put(self, key, value, **kwargs):
+			if fail:
+				raise RuntimeError("Write failed")
+			await super()._put(key, value, **kwargs)
+	
+	child = FailingDictDatastore()
+	async with datastore.adapter.writebehind.BinaryAdapter(child, flush_interval=0.05) as ws:
+		await ws.put(datastore.Key("/a"), b"a")
+		with pytest.raises(RuntimeError):
+			await ws.flush()
+		
+		# The value stays buffered and is retried later
+		assert await ws.get_all(datastore.Key("/a")) == b"a"
+		fail = False
+		await trio.sleep(0.1)
+		assert await child.get_all(datastore.Key("/a")) == b"a"
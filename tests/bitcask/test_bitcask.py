@@ -0,0 +1,152 @@
+import os
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+from datastore.bitcask import BitcaskDatastore
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+@trio.testing.trio_test
+async def test_bitcask_simple(DatastoreTests, temp_path):
+	async with BitcaskDatastore.create(os.path.join(temp_path, "a")) as bs1, \
+	           BitcaskDatastore.create(os.path.join(temp_path, "b"), max_segment_size=200) as bs2:
+		await DatastoreTests([bs1, bs2]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_bitcask_reopen(temp_path):
+	async with BitcaskDatastore.create(temp_path, max_segment_size=200, compact_ratio=None) as bs:
+		await bs.put_many((datastore.Key(f"/a/{idx}"), b"%d" % idx) for idx in range(20))
+		await bs.delete(datastore.Key("/a/3"))
+		await bs.rename(datastore.Key("/a/4"), datastore.Key("/b"))
+		await bs.put(datastore.Key("/a/5"), b"five")
+		await bs.put(datastore.Key("/a/6"), b"")
+		stats = bs.datastore_stats()
+	
+	# The datastore is locked while in use
+	async with BitcaskDatastore.create(temp_path) as bs:
+		with pytest.raises(RuntimeError):
+			await BitcaskDatastore.create(temp_path)
+	
+	# Index is rebuilt from the hint files, or from the segment files
+	# themselves if they are missing
+	for remove_hints in (False, True):
+		if remove_hints:
+			for name in os.listdir(temp_path):
+				if name.endswith(".hint"):
+					os.unlink(os.path.join(temp_path, name))
+		
+		async with BitcaskDatastore.create(temp_path, compact_ratio=None) as bs:
+			assert len(bs) == 19
+			assert not await bs.contains(datastore.Key("/a/3"))
+			assert not await bs.contains(datastore.Key("/a/4"))
+			assert await bs.get_all(datastore.Key("/b")) == b"4"
+			assert await bs.get_all(datastore.Key("/a/5")) == b"five"
+			assert await bs.get_all(datastore.Key("/a/6")) == b""
+			assert await bs.get_all(datastore.Key("/a/19")) == b"19"
+			assert bs.datastore_stats() == stats
+	
+	# Partially written records are discarded
+	last = max(name for name in os.listdir(temp_path) if name.endswith(".log"))
+	with open(os.path.join(temp_path, last), "ab") as file:
+		file.write(b"\x00" * 10)
+	os.unlink(os.path.join(temp_path, last[:-len(".log")] + ".hint"))
+	async with BitcaskDatastore.create(temp_path, compact_ratio=None) as bs:
+		assert len(bs) == 19
+		assert bs.datastore_stats() == stats
+		await bs.put(datastore.Key("/c"), b"c")
+		assert await bs.get_all(datastore.Key("/c")) == b"c"
+
+
+@trio.testing.trio_test
+async def test_bitcask_compact(temp_path):
+	async with BitcaskDatastore.create(temp_path, max_segment_size=1000, compact_ratio=None) as bs:
+		for round in range(10):
+			await bs.put_many((datastore.Key(f"/{idx}"), b"%d" % round * 10) for idx in range(10))
+		await bs.delete(datastore.Key("/0"))
+		
+		# Sizes of live and dead records are exact
+		stats = bs.datastore_stats()
+		record_size = 26 + len("/1") + 10
+		assert stats.size == 9 * record_size
+		assert stats.size_accuracy == "exact"
+		assert stats.dead_size == 91 * record_size + 26 + len("/0")
+		segments = len([name for name in os.listdir(temp_path) if name.endswith(".log")])
+		
+		await bs.compact()
+		
+		stats = bs.datastore_stats()
+		assert stats.size == 9 * record_size
+		assert stats.dead_size < 1000
+		assert len([name for name in os.listdir(temp_path) if name.endswith(".log")]) < segments
+		for idx in range(1, 10):
+			assert await bs.get_all(datastore.Key(f"/{idx}")) == b"9" * 10
+	
+	async with BitcaskDatastore.create(temp_path, compact_ratio=None) as bs:
+		assert len(bs) == 9
+		assert bs.datastore_stats() == stats
+		for idx in range(1, 10):
+			assert await bs.get_all(datastore.Key(f"/{idx}")) == b"9" * 10
+
+
+@trio.testing.trio_test
+async def test_bitcask_background_compact(temp_path):
+	async with BitcaskDatastore.create(temp_path, max_segment_size=500) as bs:
+		for round in range(20):
+			await bs.put(datastore.Key("/a"), b"%d" % round * 50)
+			await trio.sleep(0.01)
+		await trio.sleep(0.1)
+		
+		# Only the latest record and those of the active segment remain
+		assert bs.datastore_stats().dead_size < 500
+		assert await bs.get_all(datastore.Key("/a")) == b"19" * 50
+
+
+@trio.testing.trio_test
+async def test_bitcask_group_commit(temp_path):
+	appends = []
+	
+	async def put(key, value, replace):
+		try:
+			await bs.put(key, value, replace=replace)
+		except KeyError:
+			assert not replace
+	
+	async with BitcaskDatastore.create(temp_path) as bs:
+		append_sync = bs._append_sync
+		def count_append_sync(segment, offset, records):
+			appends.append(len(records))
+			append_sync(segment, offset, records)
+		bs._append_sync = count_append_sync
+		
+		# Concurrent writes are appended together, but still applied in order
+		async with trio.open_nursery() as nursery:
+			for idx in range(50):
+				nursery.start_soon(put, datastore.Key(f"/{idx}"), b"%d" % idx, True)
+				nursery.start_soon(put, datastore.Key(f"/{idx}"), b"x", False)
+		assert len(bs) == 50
+		assert len(appends) < 50
+		for idx in range(50):
+			assert await bs.get_all(datastore.Key(f"/{idx}")) == b"%d" % idx
+
+
+@trio.testing.trio_test
+async def test_bitcask_keys(temp_path):
+	async with BitcaskDatastore.create(temp_path) as bs:
+		await bs.put(datastore.Key("/a/b"), b"1")
+		await bs.put(datastore.Key("/a/c/d"), b"2")
+		await bs.put(datastore.Key("/e"), b"3")
+		
+		assert sorted([key async for key in bs.keys()]) \
+		       == [datastore.Key("/a/b"), datastore.Key("/a/c/d"), datastore.Key("/e")]
+		assert sorted([key async for key in bs.keys(datastore.Key("/a"))]) \
+		       == [datastore.Key("/a/b"), datastore.Key("/a/c/d")]
+		assert [key async for key in bs.keys(datastore.Key("/f"))] == []
@@ -0,0 +1,128 @@
+import os
+import random
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+from datastore.btree import BTreeDatastore
+from datastore.btree import btree
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+@trio.testing.trio_test
+async def test_btree_simple(DatastoreTests, temp_path):
+	async with BTreeDatastore.create(os.path.join(temp_path, "a.db")) as bs1, \
+	           BTreeDatastore.create(os.path.join(temp_path, "b.db"), sync=False) as bs2:
+		await DatastoreTests([bs1, bs2]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_btree_ordered(temp_path):
+	path = os.path.join(temp_path, "test.db")
+	rng = random.Random(0)
+	expected = {}
+	
+	async with BTreeDatastore.create(path, sync=False) as bs:
+		# Enough values to split pages over several levels of the tree
+		indexes = list(range(3000))
+		rng.shuffle(indexes)
+		for idx in indexes:
+			key = datastore.Key(f"/{idx % 3}/{idx:05}")
+			value = b"%d" % idx * rng.randrange(50)
+			await bs.put(key, value)
+			expected[key] = value
+		
+		# Deleting most values merges the pages that became sparse
+		for idx in indexes[:2500]:
+			key = datastore.Key(f"/{idx % 3}/{idx:05}")
+			await bs.delete(key)
+			del expected[key]
+		
+		assert len(bs) == len(expected)
+		assert bs.datastore_stats().size == sum(map(len, expected.values()))
+		assert [key async for key in bs.keys()] == sorted(expected)
+		assert [item async for item in bs.items(datastore.Key("/1"))] \
+		       == sorted((key, value) for key, value in expected.items() if key.parent == datastore.Key("/1"))
+		assert [key async for key in bs.keys(datastore.Key("/2"), start=datastore.Key("/2/01000"),
+		                                     stop=datastore.Key("/2/02000"))] \
+		       == sorted(key for key in expected if key.parent == datastore.Key("/2")
+		                 and "01000" <= key.name < "02000")
+	
+	async with BTreeDatastore.create(path) as bs:
+		assert len(bs) == len(expected)
+		for key, value in expected.items():
+			assert await bs.get_all(key) == value
+
+
+@trio.testing.trio_test
+async def test_btree_overflow(temp_path):
+	path = os.path.join(temp_path, "test.db")
+	large = os.urandom(btree.STREAM_CHUNK_SIZE * 2 + 5)
+	
+	async with BTreeDatastore.create(path) as bs:
+		await bs.put(datastore.Key("/large"), large)
+		await bs.put(datastore.Key("/small"), b"small")
+		assert (await bs.stat(datastore.Key("/large"))).size == len(large)
+		
+		# Streams keep reading the value they were opened for
+		stream = await bs.get(datastore.Key("/large"))
+		assert stream.size == len(large)
+		assert len(await stream.receive_some()) == btree.STREAM_CHUNK_SIZE
+		await bs.put(datastore.Key("/large"), b"replaced")
+		for idx in range(20):
+			await bs.put(datastore.Key(f"/other/{idx}"), os.urandom(10000))
+		assert await stream.receive_some() + await stream.receive_some() \
+		       == large[btree.STREAM_CHUNK_SIZE:]
+		assert await stream.receive_some() == b""
+		
+		# Overflow pages are moved along when renaming
+		await bs.rename(datastore.Key("/other/0"), datastore.Key("/moved"))
+		value = await bs.get_all(datastore.Key("/moved"))
+		with pytest.raises(KeyError):
+			await bs.rename(datastore.Key("/moved"), datastore.Key("/small"), replace=False)
+		
+		# Pages no longer in use are reused
+		size = os.path.getsize(path)
+		for _ in range(50):
+			await bs.put(datastore.Key("/other/1"), os.urandom(50000))
+		assert os.path.getsize(path) == size
+	
+	# The datastore is locked while in use
+	async with BTreeDatastore.create(path) as bs:
+		with pytest.raises(RuntimeError):
+			await BTreeDatastore.create(path)
+		assert await bs.get_all(datastore.Key("/moved")) == value
+		assert await bs.get_all(datastore.Key("/large")) == b"replaced"
+		assert not await bs.contains(datastore.Key("/other/0"))
+
+
+@trio.testing.trio_test
+async def test_btree_recovery(temp_path):
+	path = os.path.join(temp_path, "test.db")
+	
+	async with BTreeDatastore.create(path) as bs:
+		await bs.put(datastore.Key("/a"), b"1")
+		await bs.put(datastore.Key("/a"), b"2")
+	
+	# A damaged meta page (as by a torn write) falls back to the previous commit
+	with open(path, "r+b") as file:
+		file.seek(btree.PAGE_SIZE * 0 + 20)
+		file.write(b"\xff")
+	async with BTreeDatastore.create(path) as bs:
+		assert await bs.get_all(datastore.Key("/a")) == b"1"
+		await bs.put(datastore.Key("/b"), b"3")
+	async with BTreeDatastore.create(path) as bs:
+		assert await bs.get_all(datastore.Key("/a")) == b"1"
+		assert await bs.get_all(datastore.Key("/b")) == b"3"
+	
+	with open(path, "wb") as file:
+		file.write(b"garbage")
+	with pytest.raises(RuntimeError):
+		await BTreeDatastore.create(path)
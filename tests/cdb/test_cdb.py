@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+import datastore.adapter.mount
+from datastore.cdb import CDBDatastore, CDBWriter
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+@trio.testing.trio_test
+async def test_cdb_lookup(temp_path):
+	path = os.path.join(temp_path, "test.cdb")
+	with CDBWriter(path) as writer:
+		for idx in range(1000):
+			writer.add(datastore.Key(f"/{idx % 7}/{idx}"), b"%d" % idx * (idx % 5))
+	
+	async with CDBDatastore.create(path) as cs:
+		assert len(cs) == 1000
+		for idx in range(1000):
+			key = datastore.Key(f"/{idx % 7}/{idx}")
+			assert await cs.contains(key)
+			assert await cs.get_all(key) == b"%d" % idx * (idx % 5)
+			assert await (await cs.get(key)).collect() == b"%d" % idx * (idx % 5)
+			assert (await cs.stat(key)).size == len(b"%d" % idx) * (idx % 5)
+		
+		for key in (datastore.Key("/0/1"), datastore.Key("/1"), datastore.Key("/")):
+			assert not await cs.contains(key)
+			with pytest.raises(KeyError):
+				await cs.get_all(key)
+			with pytest.raises(KeyError):
+				await cs.stat(key)
+		
+		assert [key async for key in cs.keys(datastore.Key("/3"))] \
+		       == [datastore.Key(f"/3/{idx}") for idx in range(3, 1000, 7)]
+		
+		# The datastore is read-only
+		with pytest.raises(NotImplementedError):
+			await cs.put(datastore.Key("/0/0"), b"value")
+		with pytest.raises(NotImplementedError):
+			await cs.delete(datastore.Key("/0/0"))
+	
+	# Empty databases are valid as well
+	with CDBWriter(path):
+		pass
+	async with CDBDatastore.create(path) as cs:
+		assert len(cs) == 0
+		assert not await cs.contains(datastore.Key("/0/0"))
+	
+	with open(path, "wb") as file:
+		file.write(b"garbage")
+	with pytest.raises(RuntimeError):
+		await CDBDatastore.create(path)
+
+
+@trio.testing.trio_test
+async def test_cdb_mount(temp_path):
+	path = os.path.join(temp_path, "test.cdb")
+	
+	async with datastore.BinaryDictDatastore() as source:
+		keys = [datastore.Key(f"/{idx}") for idx in range(10)]
+		for key in keys:
+			await source.put(key, str(key).encode())
+		await CDBDatastore.build_from(path, source, keys)
+	
+	async with CDBDatastore.create(path) as cs, \
+	           datastore.BinaryDictDatastore() as ds, \
+	           datastore.adapter.mount.BinaryAdapter() as ms:
+		ms.mount(datastore.Key("/static"), cs)
+		ms.mount(datastore.Key("/data"), ds)
+		
+		await ms.put(datastore.Key("/data/a"), b"a")
+		assert await ms.get_all(datastore.Key("/data/a")) == b"a"
+		assert await ms.get_all(datastore.Key("/static/3")) == b"/3"
+		assert await ms.contains(datastore.Key("/static/9"))
+		assert not await ms.contains(datastore.Key("/static/10"))
+		with pytest.raises(NotImplementedError):
+			await ms.put(datastore.Key("/static/3"), b"value")
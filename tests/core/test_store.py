@@ -65,3 +65,39 @@ async def test_dictionary_size():
 	await ds.delete(datastore.Key("/blab"))
 	assert ds.datastore_stats().size == 0
 	assert ds.datastore_stats().size_accuracy == "exact"
+
+
+@pytest.mark.parametrize("DictDatastore", [BinaryDictDatastore, ObjectDictDatastore])
+@pytest.mark.parametrize("indexed", [False, True])
+@trio.testing.trio_test
+async def test_dictionary_flat(DatastoreTests, DictDatastore, indexed):
+	ds = DictDatastore(indexed=indexed)
+	await DatastoreTests([ds]).subtest_simple()
+	
+	value = (lambda name: name.encode()) if DictDatastore is BinaryDictDatastore else (lambda name: [name])
+	for name in ("/b/2", "/a", "/b/1", "/b/1/x", "/bc", "/b:t"):
+		await ds.put(Key(name), value(name))
+	
+	# Looking up missing keys does not create anything
+	for name in ("/c", "/b/3", "/b/1/y"):
+		assert not await ds.contains(Key(name))
+		with pytest.raises(KeyError):
+			await ds.get_all(Key(name))
+	assert len(ds._items) == len(ds) == 6
+	
+	keys = [str(key) async for key in ds.keys(Key("/b"))]
+	assert sorted(keys) == ["/b/1", "/b/1/x", "/b/2"]
+	if indexed:
+		assert keys == sorted(keys)
+	
+	await ds.rename(Key("/b/1"), Key("/c"))
+	await ds.delete(Key("/b/1/x"))
+	assert sorted([str(key) async for key in ds.keys()]) == ["/a", "/b/2", "/b:t", "/bc", "/c"]
+	if DictDatastore is BinaryDictDatastore:
+		assert ds.datastore_stats().size == len(b"/a/b/2/b:t/bc/b/1")
+	else:
+		assert sorted(await ds.query(Query(Key("/b")))) == [["/b/2"], ["/b:t"]]
+		assert sorted(await ds.query(Query(Key("/")))) == [["/a"], ["/b/1"], ["/bc"]]
+	
+	await ds.aclose()
+	assert len(ds) == 0
@@ -1,7 +1,10 @@
 import contextlib
+import errno
 import json
 import os.path
 import queue as queue_
+import shutil
+import sys
 import tempfile
 import traceback
 
@@ -45,6 +48,196 @@ async def test_datastore(temp_path):
 				assert os.listdir(fs.root_path) == []
 
 
+@trio.testing.trio_test
+async def test_dir_cache(temp_path):
+	dirs = map(str, range(0, 3))
+	dirs = map(lambda d: os.path.join(temp_path, d), dirs)
+	async with contextlib.AsyncExitStack() as stack:
+		fses = [
+			stack.push_async_exit(await FileSystemDatastore.create(next(dirs), dir_cache_size=0)),
+			stack.push_async_exit(await FileSystemDatastore.create(next(dirs), dir_cache_size=1)),
+			stack.push_async_exit(await FileSystemDatastore.create(next(dirs), dir_cache_size=1,
+			                                                       stats=True)),
+		]
+		
+		await DatastoreTests(fses).subtest_simple()
+	
+	# Directories removed and recreated behind our back must not confuse the cache
+	async with FileSystemDatastore.create(temp_path, dir_cache_size=16) as fs:
+		key = datastore.Key("/dir/subdir/value")
+		
+		await fs.put(key, b"old")
+		assert await fs.get_all(key) == b"old"
+		
+		shutil.rmtree(os.path.join(temp_path, "dir"))
+		os.makedirs(os.path.join(temp_path, "dir", "subdir"))
+		with open(os.path.join(temp_path, "dir", "subdir", "value.data"), "wb") as file:
+			file.write(b"new")
+		
+		assert await fs.get_all(key) == b"new"
+		assert (await fs.stat(key)).size == 3
+		async with await fs.get(key) as stream:
+			assert await stream.collect() == b"new"
+		
+		shutil.rmtree(os.path.join(temp_path, "dir"))
+		
+		with pytest.raises(KeyError):
+			await fs.get_all(key)
+		
+		await fs.put(key, b"newer")
+		assert await fs.get_all(key) == b"newer"
+		
+		# Removing the value also removes the (now empty) parent directories
+		await fs.delete(key)
+		assert not os.path.exists(os.path.join(temp_path, "dir"))
+		
+		await fs.put(key, b"newest")
+		assert await fs.get_all(key) == b"newest"
+		
+		# Same thing, but with only an ancestor of the accessed directory cached
+		await fs.put(datastore.Key("/a/x"), b"x")
+		
+		shutil.rmtree(os.path.join(temp_path, "a"))
+		os.makedirs(os.path.join(temp_path, "a", "b"))
+		with open(os.path.join(temp_path, "a", "b", "y.data"), "wb") as file:
+			file.write(b"y")
+		
+		assert await fs.get_all(datastore.Key("/a/b/y")) == b"y"
+		
+		shutil.rmtree(os.path.join(temp_path, "a"))
+		os.makedirs(os.path.join(temp_path, "a"))
+		
+		await fs.put(datastore.Key("/a/c/z"), b"z")
+		assert await fs.get_all(datastore.Key("/a/c/z")) == b"z"
+
+
+@trio.testing.trio_test
+async def test_stat_many(temp_path):
+	async with FileSystemDatastore.create(temp_path) as fs:
+		keys = [datastore.Key("/a"), datastore.Key("/b/c"), datastore.Key("/d/e/f")]
+		await fs.put(keys[0], b"1234")
+		await fs.put(keys[2], b"Hallo Welt")
+		
+		assert await fs.contains(keys[0])
+		assert not await fs.contains(keys[1])
+		assert not await fs.contains(datastore.Key("/d/e"))  # Subtree, not a value
+		
+		assert await fs.contains_many(keys) == [True, False, True]
+		assert await fs.contains_many([]) == []
+		
+		stats = await fs.stat_many(keys)
+		assert stats[0].size == 4
+		assert stats[1] is None
+		assert stats[2].size == 10
+		assert stats[2] == await fs.stat(keys[2])
+
+
+@pytest.mark.parametrize("access", [None, "sequential", "random", "once"])
+@trio.testing.trio_test
+async def test_get_access(temp_path, access):
+	value = bytes(range(256)) * 4096  # 1 MiB
+	async with FileSystemDatastore.create(temp_path) as fs:
+		await fs.put(datastore.Key("/a"), value)
+		
+		async with await fs.get(datastore.Key("/a"), access=access) as stream:
+			assert stream.size == len(value)
+			assert await stream.collect() == value
+		
+		stream = await fs.get(datastore.Key("/a"), access=access)
+		chunks = []
+		chunk = await stream.receive_some()
+		while chunk:
+			chunks.append(chunk)
+			chunk = await stream.receive_some()
+		assert b"".join(chunks) == value
+
+
+@trio.testing.trio_test
+async def test_put_preallocate(temp_path, monkeypatch):
+	async with FileSystemDatastore.create(temp_path) as fs:
+		# Size known in advance
+		await fs.put(datastore.Key("/a"), b"Hallo Welt" * 1000)
+		assert (await fs.stat(datastore.Key("/a"))).size == 10000
+		assert await fs.get_all(datastore.Key("/a")) == b"Hallo Welt" * 1000
+		
+		# Replacing with shorter content
+		await fs.put(datastore.Key("/a"), b"1234")
+		assert await fs.get_all(datastore.Key("/a")) == b"1234"
+		
+		# Overwriting a special file with shorter content must not leave any
+		# of the previous content behind
+		key_new = await fs.put_new(datastore.Key("/"), b"Hallo Welt")
+		await fs.put(key_new, b"TC")
+		assert await fs.get_all(key_new) == b"TC"
+		
+		# Stream yielding less data than announced
+		class ShortStream(datastore.abc.ReceiveStream):
+			def __init__(self):
+				super().__init__(size=100)
+				self._data = [b"abc"]
+			
+			async def receive_some(self, max_bytes=None):
+				return self._data.pop() if self._data else b""
+			
+			async def aclose(self):
+				pass
+		
+		await fs.put(datastore.Key("/b"), ShortStream())
+		assert await fs.get_all(datastore.Key("/b")) == b"abc"
+		
+		# Running out of disk space is reported before writing anything
+		def posix_fallocate(fd, offset, length):
+			raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+		monkeypatch.setattr(os, "posix_fallocate", posix_fallocate, raising=False)
+		
+		with pytest.raises(OSError, match="/c") as excinfo:
+			await fs.put(datastore.Key("/c"), b"1234")
+		assert excinfo.value.errno == errno.ENOSPC
+		assert not await fs.contains(datastore.Key("/c"))
+		assert sorted(os.listdir(temp_path)) == sorted(["a.data", "b.data", key_new.name + ".data"])
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="inotify is only available on Linux")
+@trio.testing.trio_test
+async def test_watch(temp_path):
+	async with FileSystemDatastore.create(temp_path, stats=True) as fs:
+		await fs.put(datastore.Key("/a"), b"1")
+		
+		async with fs.watch() as watcher:
+			async def receive_keys(count):
+				with trio.fail_after(5):
+					return {await watcher.receive() for _ in range(count)}
+			
+			# Changes made through the datastore (the stats file is never reported)
+			await fs.put(datastore.Key("/a"), b"2")
+			await fs.put(datastore.Key("/b/c"), b"3")
+			await fs.flush()
+			assert await receive_keys(2) == {datastore.Key("/a"), datastore.Key("/b/c")}
+			
+			await fs.rename(datastore.Key("/a"), datastore.Key("/b/d"))
+			assert await receive_keys(2) == {datastore.Key("/a"), datastore.Key("/b/d")}
+			
+			await fs.delete(datastore.Key("/b/c"))
+			assert await receive_keys(1) == {datastore.Key("/b/c")}
+			
+			# Changes made by some other process
+			os.makedirs(os.path.join(temp_path, "e", "f"))
+			with open(os.path.join(temp_path, "e", "f", "g.data"), "wb") as file:
+				file.write(b"4")
+			with open(os.path.join(temp_path, "e", "ignored.txt"), "wb") as file:
+				file.write(b"5")
+			assert await receive_keys(1) == {datastore.Key("/e/f/g")}
+			
+			os.rename(os.path.join(temp_path, "b"), os.path.join(temp_path, "h"))
+			assert await receive_keys(2) == {datastore.Key("/b"), datastore.Key("/h/d")}
+			
+			os.rename(os.path.join(temp_path, "h", "d.data"), os.path.join(temp_path, "h", "i.data"))
+			assert await receive_keys(2) == {datastore.Key("/h/d"), datastore.Key("/h/i")}
+		
+		with pytest.raises(trio.ClosedResourceError):
+			await watcher.receive()
+
+
 async def concurrent_datastore(temp_path, queue):
 	# Mark "start" task as done
 	queue.get()
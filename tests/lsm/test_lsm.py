@@ -0,0 +1,120 @@
+import os
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+from datastore.lsm import LSMDatastore
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+def segment_count(path):
+	return len([name for name in os.listdir(path) if name.endswith(".sst")])
+
+
+@trio.testing.trio_test
+async def test_lsm_simple(DatastoreTests, temp_path):
+	async with LSMDatastore.create(os.path.join(temp_path, "a")) as ls1, \
+	           LSMDatastore.create(os.path.join(temp_path, "b"), memtable_size=300,
+	                               block_size=64, segment_size=256) as ls2:
+		await DatastoreTests([ls1, ls2]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_lsm_reopen(temp_path):
+	async with LSMDatastore.create(temp_path, memtable_size=200, block_size=64) as ls:
+		await ls.put_many((datastore.Key(f"/a/{idx}"), b"%d" % idx) for idx in range(20))
+		await ls.delete(datastore.Key("/a/3"))
+		await ls.rename(datastore.Key("/a/4"), datastore.Key("/b"))
+		await ls.put(datastore.Key("/a/5"), b"five")
+		await ls.put(datastore.Key("/a/6"), b"")
+		await trio.sleep(0.1)
+		assert segment_count(temp_path) > 0
+	
+	# The datastore is locked while in use
+	async with LSMDatastore.create(temp_path) as ls:
+		with pytest.raises(RuntimeError):
+			await LSMDatastore.create(temp_path)
+	
+	# Values are recovered from the segment files and the write-ahead log,
+	# discarding partially written records
+	last = max(name for name in os.listdir(temp_path) if name.endswith(".wal"))
+	with open(os.path.join(temp_path, last), "ab") as file:
+		file.write(b"\x00" * 10)
+	for _ in range(2):
+		async with LSMDatastore.create(temp_path) as ls:
+			assert not await ls.contains(datastore.Key("/a/3"))
+			assert not await ls.contains(datastore.Key("/a/4"))
+			assert await ls.get_all(datastore.Key("/b")) == b"4"
+			assert await ls.get_all(datastore.Key("/a/5")) == b"five"
+			assert await ls.get_all(datastore.Key("/a/6")) == b""
+			assert await ls.get_all(datastore.Key("/a/19")) == b"19"
+			assert len([key async for key in ls.keys()]) == 19
+
+
+@trio.testing.trio_test
+async def test_lsm_scan(temp_path):
+	async with LSMDatastore.create(temp_path, memtable_size=300, block_size=64,
+	                               level0_limit=100) as ls:
+		expected = {}
+		for round in range(3):
+			for idx in range(round, 30, 2):
+				key = datastore.Key(f"/{idx % 3}/{idx}")
+				await ls.put(key, b"%d-%d" % (round, idx))
+				expected[key] = b"%d-%d" % (round, idx)
+		for idx in range(0, 30, 7):
+			key = datastore.Key(f"/{idx % 3}/{idx}")
+			if key in expected:
+				await ls.delete(key)
+				del expected[key]
+		await trio.sleep(0.1)
+		
+		# Values are spread across several segment files and the memtable
+		assert segment_count(temp_path) > 1
+		
+		# Listings are merged in key order, with the latest value of each key
+		assert [item async for item in ls.items()] == sorted(expected.items())
+		for prefix in ("/0", "/1", "/2", "/3"):
+			prefix = datastore.Key(prefix)
+			assert [key async for key in ls.keys(prefix)] \
+			       == sorted(key for key in expected if prefix.is_ancestor_of(key))
+		
+		start, stop = datastore.Key("/1/13"), datastore.Key("/1/25")
+		assert [key async for key in ls.keys(datastore.Key("/1"), start=start, stop=stop)] \
+		       == sorted(key for key in expected
+		                 if datastore.Key("/1").is_ancestor_of(key) and start <= key < stop)
+
+
+@trio.testing.trio_test
+async def test_lsm_compact(temp_path):
+	async with LSMDatastore.create(temp_path, memtable_size=500, block_size=128,
+	                               segment_size=400, level0_limit=2, level_size=1000,
+	                               level_ratio=2) as ls:
+		for round in range(10):
+			await ls.put_many((datastore.Key(f"/{idx:02}"), b"%d" % round * 10) for idx in range(40))
+			await trio.sleep(0.01)
+		for idx in range(0, 40, 2):
+			await ls.delete(datastore.Key(f"/{idx:02}"))
+		while await ls.compact():
+			pass
+		
+		# Overwritten values were merged away into deeper levels
+		assert len(ls._levels[0]) < 2
+		assert len(ls._levels) > 2
+		assert sum(segment.size for level in ls._levels for segment in level) < 10 * 40 * 20
+		
+		for idx in range(40):
+			if idx % 2:
+				assert await ls.get_all(datastore.Key(f"/{idx:02}")) == b"9" * 10
+			else:
+				assert not await ls.contains(datastore.Key(f"/{idx:02}"))
+		assert [key async for key in ls.keys()] == [datastore.Key(f"/{idx:02}") for idx in range(1, 40, 2)]
+	
+	async with LSMDatastore.create(temp_path) as ls:
+		assert [key async for key in ls.keys()] == [datastore.Key(f"/{idx:02}") for idx in range(1, 40, 2)]
@@ -0,0 +1,137 @@
+import os
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+from datastore.persistent import PersistentDictDatastore, PersistentObjectDictDatastore
+from datastore.persistent import persistent
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+def log_files(path):
+	return sorted(name for name in os.listdir(path) if name.endswith(persistent.LOG_SUFFIX))
+
+
+@trio.testing.trio_test
+async def test_persistent_simple(DatastoreTests, temp_path):
+	async with PersistentDictDatastore.create(os.path.join(temp_path, "a")) as ps1, \
+	           PersistentDictDatastore.create(os.path.join(temp_path, "b"), indexed=True,
+	                                          fsync="always") as ps2:
+		await DatastoreTests([ps1, ps2]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_persistent_replay(temp_path):
+	async with PersistentDictDatastore.create(temp_path, fsync="never") as ps:
+		for idx in range(100):
+			await ps.put(datastore.Key(f"/{idx}"), b"%d" % idx)
+		await ps.delete(datastore.Key("/3"))
+		await ps.rename(datastore.Key("/4"), datastore.Key("/a/4"))
+		await ps.put(datastore.Key("/5"), b"five")
+		key = await ps.put_new(datastore.Key("/new"), b"new")
+	
+	# Only the log is written unless a snapshot is requested
+	assert not os.path.exists(os.path.join(temp_path, persistent.SNAPSHOT_NAME))
+	
+	async with PersistentDictDatastore.create(temp_path, indexed=True) as ps:
+		assert len(ps) == 100
+		assert ps.datastore_stats().size == sum(len(b"%d" % idx) for idx in range(100)) \
+		                                    - len(b"3") - len(b"5") + len(b"five") + len(b"new")
+		assert not await ps.contains(datastore.Key("/3"))
+		assert not await ps.contains(datastore.Key("/4"))
+		assert await ps.get_all(datastore.Key("/a/4")) == b"4"
+		assert await ps.get_all(datastore.Key("/5")) == b"five"
+		assert await ps.get_all(key) == b"new"
+		assert [k async for k in ps.keys(datastore.Key("/a"))] == [datastore.Key("/a/4")]
+
+
+@trio.testing.trio_test
+async def test_persistent_snapshot(temp_path):
+	async with PersistentDictDatastore.create(temp_path) as ps:
+		for idx in range(100):
+			await ps.put(datastore.Key(f"/{idx}"), b"%d" % idx)
+		await ps.snapshot()
+		
+		# Logs replaced by the snapshot are removed
+		assert log_files(temp_path) == ["0000000000000001.log"]
+		
+		await ps.delete(datastore.Key("/0"))
+		await ps.put(datastore.Key("/1"), b"one")
+	
+	async with PersistentDictDatastore.create(temp_path) as ps:
+		assert len(ps) == 99
+		assert not await ps.contains(datastore.Key("/0"))
+		assert await ps.get_all(datastore.Key("/1")) == b"one"
+		assert await ps.get_all(datastore.Key("/99")) == b"99"
+	
+	# Snapshots are also taken automatically once enough has been logged
+	async with PersistentDictDatastore.create(temp_path, fsync_interval=0.01,
+	                                          snapshot_log_size=1000) as ps:
+		for idx in range(100):
+			await ps.put(datastore.Key(f"/{idx}"), b"x" * 100)
+		await trio.sleep(0.5)
+		assert "0000000000000002.log" not in log_files(temp_path)
+	
+	async with PersistentDictDatastore.create(temp_path) as ps:
+		assert len(ps) == 100
+		assert await ps.get_all(datastore.Key("/0")) == b"x" * 100
+	
+	with open(os.path.join(temp_path, persistent.SNAPSHOT_NAME), "r+b") as file:
+		file.seek(persistent._SNAPSHOT_HEADER.size + 2)
+		file.write(b"garbage")
+	with pytest.raises(RuntimeError):
+		await PersistentDictDatastore.create(temp_path)
+
+
+@trio.testing.trio_test
+async def test_persistent_torn_log(temp_path):
+	async with PersistentDictDatastore.create(temp_path, fsync="always") as ps:
+		await ps.put(datastore.Key("/a"), b"a")
+		await ps.put(datastore.Key("/b"), b"b")
+	
+	# Simulate a crash while appending the last record
+	path = os.path.join(temp_path, log_files(temp_path)[0])
+	os.truncate(path, os.path.getsize(path) - 1)
+	
+	async with PersistentDictDatastore.create(temp_path) as ps:
+		assert await ps.get_all(datastore.Key("/a")) == b"a"
+		assert not await ps.contains(datastore.Key("/b"))
+		await ps.put(datastore.Key("/c"), b"c")
+	
+	async with PersistentDictDatastore.create(temp_path) as ps:
+		assert [k async for k in ps.keys()] == [datastore.Key("/a"), datastore.Key("/c")]
+
+
+@trio.testing.trio_test
+async def test_persistent_locking(temp_path):
+	async with PersistentDictDatastore.create(temp_path) as ps:
+		with pytest.raises(RuntimeError):
+			await PersistentDictDatastore.create(temp_path)
+		await ps.put(datastore.Key("/a"), b"a")
+	
+	with pytest.raises(RuntimeError):
+		await ps.put(datastore.Key("/b"), b"b")
+
+
+@trio.testing.trio_test
+async def test_persistent_objects(DatastoreTests, temp_path):
+	async with PersistentObjectDictDatastore.create(os.path.join(temp_path, "a")) as ps:
+		await DatastoreTests([ps]).subtest_simple()
+	
+	async with PersistentObjectDictDatastore.create(temp_path) as ps:
+		await ps.put(datastore.Key("/a"), [1, "two", {3: 4}])
+		await ps.put(datastore.Key("/b"), [])
+		await ps.snapshot()
+		await ps.put(datastore.Key("/c"), [5])
+	
+	async with PersistentObjectDictDatastore.create(temp_path) as ps:
+		assert await ps.get_all(datastore.Key("/a")) == [1, "two", {3: 4}]
+		assert await ps.get_all(datastore.Key("/b")) == []
+		assert await ps.get_all(datastore.Key("/c")) == [5]
@@ -0,0 +1,117 @@
+import os
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+from datastore.rpc import DatastoreServer, RemoteDatastore
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+@trio.testing.trio_test
+async def test_rpc_simple(DatastoreTests, temp_path):
+	path = os.path.join(temp_path, "socket")
+	async with datastore.BinaryDictDatastore() as ds, trio.open_nursery() as nursery:
+		await nursery.start(DatastoreServer(ds).serve_unix, path)
+		
+		async with RemoteDatastore.create(path) as rs1, \
+		           RemoteDatastore.create(path, connections=1) as rs2:
+			await DatastoreTests([rs1]).subtest_simple()
+			await DatastoreTests([rs2]).subtest_simple()
+		nursery.cancel_scope.cancel()
+
+
+@trio.testing.trio_test
+async def test_rpc_streaming(temp_path):
+	path = os.path.join(temp_path, "socket")
+	async with datastore.BinaryDictDatastore() as ds, trio.open_nursery() as nursery:
+		await nursery.start(DatastoreServer(ds).serve_unix, path)
+		
+		async with RemoteDatastore.create(path, connections=2) as rs:
+			values = {datastore.Key(f"/{idx}"): os.urandom(idx * 50_000) for idx in range(10)}
+			
+			# Values spanning several chunks are sent and received concurrently
+			# over the same connections
+			async with trio.open_nursery() as nursery2:
+				for key, value in values.items():
+					nursery2.start_soon(rs.put, key, value)
+			async def check(key, value):
+				assert await rs.get_all(key) == value
+				assert (await rs.stat(key)).size == len(value)
+			async with trio.open_nursery() as nursery2:
+				for key, value in values.items():
+					nursery2.start_soon(check, key, value)
+			
+			# Closing a stream early cancels the rest of the response
+			stream = await rs.get(datastore.Key("/9"))
+			assert len(await stream.receive_some(1000)) == 1000
+			await stream.aclose()
+			assert await rs.get_all(datastore.Key("/1")) == values[datastore.Key("/1")]
+			
+			key = await rs.put_new(datastore.Key("/new"), [b"a", b"b"])
+			assert key.parent == datastore.Key("/new")
+			assert await ds.get_all(key) == b"ab"
+			
+			await rs.put_many([(datastore.Key(f"/batch/{idx}"), b"%d" % idx) for idx in range(10_000)])
+			assert await ds.get_all(datastore.Key("/batch/9999")) == b"9999"
+			assert await rs.get_many([datastore.Key("/batch/1"), datastore.Key("/missing"),
+			                          datastore.Key("/batch/2")]) == [b"1", None, b"2"]
+			
+			assert rs.datastore_stats().size == 0
+			stats = await rs.refresh_stats()
+			assert stats.size == ds.datastore_stats().size
+			assert stats.size_accuracy == "approximate"
+		nursery.cancel_scope.cancel()
+
+
+@trio.testing.trio_test
+async def test_rpc_errors(temp_path):
+	path = os.path.join(temp_path, "socket")
+	async with datastore.BinaryDictDatastore() as ds, trio.open_nursery() as nursery:
+		server_scope = await nursery.start(serve_until_cancelled, DatastoreServer(ds), path)
+		
+		async with RemoteDatastore.create(path, connections=1) as rs:
+			with pytest.raises(KeyError):
+				await rs.get(datastore.Key("/missing"))
+			with pytest.raises(KeyError):
+				await rs.rename(datastore.Key("/missing"), datastore.Key("/other"))
+			with pytest.raises(KeyError):
+				await rs.delete(datastore.Key("/missing"))
+			
+			await rs.put(datastore.Key("/a"), b"a")
+			with pytest.raises(KeyError):
+				await rs.put(datastore.Key("/a"), b"b", replace=False)
+			
+			# Requests fail while the server is gone, but the connection is
+			# reestablished once it is back
+			server_scope.cancel()
+			await trio.testing.wait_all_tasks_blocked()
+			with pytest.raises((RuntimeError, OSError)):
+				await rs.get_all(datastore.Key("/a"))
+			await nursery.start(serve_until_cancelled, DatastoreServer(ds), path)
+			assert await rs.get_all(datastore.Key("/a")) == b"a"
+		
+		await rs.aclose()
+		with pytest.raises(RuntimeError):
+			await rs.get_all(datastore.Key("/a"))
+		
+		# Operations not supported by the served datastore
+		null_path = os.path.join(temp_path, "null")
+		await nursery.start(DatastoreServer(datastore.BinaryNullDatastore()).serve_unix, null_path)
+		async with RemoteDatastore.create(null_path) as rs:
+			with pytest.raises(NotImplementedError):
+				await rs.put_new(datastore.Key("/"), b"value")
+		nursery.cancel_scope.cancel()
+
+
+async def serve_until_cancelled(server, path, *, task_status=trio.TASK_STATUS_IGNORED):
+	with trio.CancelScope() as scope:
+		async with trio.open_nursery() as nursery:
+			await nursery.start(server.serve_unix, path)
+			task_status.started(scope)
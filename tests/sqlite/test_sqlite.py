@@ -0,0 +1,142 @@
+import os
+import tempfile
+
+import pytest
+import trio.testing
+
+import datastore
+from datastore.sqlite import SQLiteDatastore, SQLiteObjectDatastore
+from datastore.sqlite import sqlite
+
+
+@pytest.fixture
+def temp_path():
+	with tempfile.TemporaryDirectory() as temp_path:
+		yield temp_path
+
+
+@trio.testing.trio_test
+async def test_sqlite_simple(DatastoreTests, temp_path):
+	async with SQLiteDatastore.create(os.path.join(temp_path, "a.db")) as ss1, \
+	           SQLiteObjectDatastore.create(os.path.join(temp_path, "b.db")) as ss2:
+		await DatastoreTests([ss1]).subtest_simple()
+		await DatastoreTests([ss2]).subtest_simple()
+
+
+@trio.testing.trio_test
+async def test_sqlite_binary(temp_path):
+	path = os.path.join(temp_path, "test.db")
+	large = os.urandom(sqlite.BLOB_CHUNK_SIZE * 3 + 5)
+	
+	async with SQLiteDatastore.create(path) as ss:
+		await ss.put_many((datastore.Key(f"/a/{idx}"), b"%d" % idx) for idx in range(20))
+		await ss.put(datastore.Key("/large"), large)
+		await ss.rename(datastore.Key("/a/1"), datastore.Key("/a/2"))
+		await ss.delete(datastore.Key("/a/3"))
+		with pytest.raises(KeyError):
+			await ss.rename(datastore.Key("/a/4"), datastore.Key("/a/5"), replace=False)
+		
+		# Large values are streamed in chunks
+		stream = await ss.get(datastore.Key("/large"))
+		assert stream.size == len(large)
+		assert len(await stream.receive_some()) <= sqlite.BLOB_CHUNK_SIZE
+		await stream.aclose()
+		
+		# Streamed values are not affected by later writes
+		stream = await ss.get(datastore.Key("/large"))
+		await ss.put(datastore.Key("/large"), b"small")
+		assert await stream.collect() == large
+		await ss.put(datastore.Key("/large"), datastore.util.receive_stream_from(large))
+		
+		stats = ss.datastore_stats()
+		assert stats.size == len(large) + sum(len(b"%d" % idx) for idx in range(20) if idx not in (2, 3))
+		assert (await ss.stat(datastore.Key("/large"))).size == len(large)
+	
+	async with SQLiteDatastore.create(path) as ss:
+		assert len(ss) == 19
+		assert ss.datastore_stats() == stats
+		assert await ss.get_all(datastore.Key("/large")) == large
+		assert await ss.get_all(datastore.Key("/a/2")) == b"1"
+		assert not await ss.contains(datastore.Key("/a/1"))
+		assert not await ss.contains(datastore.Key("/a/3"))
+
+
+@trio.testing.trio_test
+async def test_sqlite_query(temp_path):
+	people = [
+		{"name": "John",   "age": 40, "city": "London"},
+		{"name": "Eric",   "age": 35, "city": "London"},
+		{"name": "Graham", "age": 48},
+		{"name": "Terry",  "age": 35, "city": "Oxford"},
+		{"name": "Carol",  "age": 28, "city": "London"},
+	]
+	
+	async with SQLiteObjectDatastore.create(os.path.join(temp_path, "test.db"), indexes=["age"]) as ss:
+		await ss.put_many((datastore.Key(f"/people/{person['name']}"), [person]) for person in people)
+		await ss.put(datastore.Key("/other/x"), [{"name": "x", "age": 1}])
+		
+		async def names(query):
+			return [person["name"] for person in await ss.query(query)]
+		
+		pkey = datastore.Key("/people")
+		assert await names(datastore.Query(pkey)) == ["Carol", "Eric", "Graham", "John", "Terry"]
+		assert await names(datastore.Query(pkey).filter("age", ">=", 35).order("-age")) \
+		       == ["Graham", "John", "Eric", "Terry"]
+		assert await names(datastore.Query(pkey).filter("city", "=", "London").filter("age", "<", 40)) \
+		       == ["Carol", "Eric"]
+		assert await names(datastore.Query(pkey).filter("city", "!=", "London")) == ["Graham", "Terry"]
+		assert await names(datastore.Query(pkey).filter("city", "=", None)) == ["Graham"]
+		assert await names(datastore.Query(pkey, limit=2, offset=1).order("+age")) == ["Eric", "Terry"]
+		
+		# Keyset pagination continues after the position of the given key
+		query = datastore.Query(pkey, limit=2).order("-city").order("age")
+		pages = []
+		while True:
+			page = await names(query)
+			if not page:
+				break
+			pages.append(page)
+			query = query.copy()
+			query.offset_key = pkey.child(page[-1])
+		assert pages == [["Terry", "Carol"], ["Eric", "John"], ["Graham"]]
+		
+		query = datastore.Query(pkey, offset_key=pkey.child("Eric"))
+		assert await names(query) == ["Graham", "John", "Terry"]
+		
+		# Queries that cannot be translated are applied naively
+		query = datastore.Query(pkey, object_getattr=lambda obj, field: obj[field].lower())
+		assert await names(query.filter("name", ">", "f")) == ["Graham", "John", "Terry"]
+		
+		# Filtering and ordering by indexed fields uses the index
+		sql, params, _, _ = ss._compile_query(datastore.Query(pkey).filter("age", ">", 30).order("age"))
+		plan = await ss._run(lambda conn: conn.execute(
+			"EXPLAIN QUERY PLAN " + sql.format(keyset=""), params
+		).fetchall())
+		assert "objects_field_" + "age".encode().hex() in str(plan)
+
+
+@trio.testing.trio_test
+async def test_sqlite_query_mixed_types(temp_path):
+	objects = [{"n": 5}, {"n": "5"}, {"n": 5.5}, {"n": True}, {"n": None}, {"m": 1}, {"n": 7}]
+	
+	async with SQLiteObjectDatastore.create(os.path.join(temp_path, "test.db")) as ss:
+		pkey = datastore.Key("/values")
+		for idx, obj in enumerate(objects):
+			await ss.put(pkey.child(str(idx)), [obj])
+		
+		# Filters convert field values to the type of the filter value, so
+		# pushed down queries must match the same objects as naive ones
+		for query in (
+			datastore.Query(pkey).filter("n", "=", 5),
+			datastore.Query(pkey).filter("n", "!=", 5),
+			datastore.Query(pkey).filter("n", "=", 5.0),
+			datastore.Query(pkey).filter("n", "=", "5"),
+			datastore.Query(pkey).filter("n", "=", True),
+			datastore.Query(pkey).filter("n", "=", None),
+			datastore.Query(pkey, offset=1, limit=1).filter("n", "!=", 5),
+			datastore.Query(pkey, offset=2),
+		):
+			cursor = await ss.query(query)
+			naive = query(objects)
+			assert list(cursor) == list(naive)
+			assert cursor.skipped == naive.skipped